@@ -1,12 +1,17 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+import functools
 from typing import Dict
 from iib.workers.config import get_worker_config
 
 
+@functools.lru_cache(maxsize=None)
 def get_binary_versions() -> Dict:
     """
     Return string containing version of binary files used by IIB.
 
+    The versions are only looked up on the first call of the process, which runs the binaries,
+    so that importing the tasks doesn't start any process.
+
     :return: Dictionary with all binary used and their version
     :rtype: dict
     """
@@ -5,6 +5,9 @@
 The OpenTelemetry Collector is configured to receive traces via OTLP over HTTP.
 The OTLP exporter is configured to use the environment variables defined in the ansible playbook.
 
+The OpenTelemetry SDK and exporter are only imported when the tracing is enabled, so that the
+processes which don't trace, such as the celery CLI, start faster.
+
 Usage:
     @instrument_tracing()
       def func():
@@ -17,23 +20,17 @@ import functools
 import getpass
 import logging
 import socket
+import sys
 from copy import deepcopy
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Union
 
 
-from flask import Response
 from opentelemetry import trace
 from opentelemetry.trace import SpanKind, Status, StatusCode
-from opentelemetry.sdk.resources import Resource, SERVICE_NAME
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import (
-    BatchSpanProcessor,
-)
 from opentelemetry.propagate import set_global_textmap
 from opentelemetry.trace.propagation import (
     set_span_in_context,
 )
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
 from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
 from opentelemetry.util.types import Attributes
 
@@ -57,6 +54,19 @@ def normalize_data_for_span(data: Dict[str, Any]) -> Attributes:
     return span_data
 
 
+def _is_flask_response(value: Any) -> bool:
+    """
+    Check if the value is a Flask response without importing Flask in the workers.
+
+    :param Any value: the value to check
+    :return: ``True`` if the value is a Flask response
+    :rtype: bool
+    """
+    # A Flask response can only have been created if Flask was already imported
+    flask = sys.modules.get('flask')
+    return flask is not None and isinstance(value, flask.Response)
+
+
 class TracingWrapper:
     """Wrapper class that will wrap all methods of calls with the instrument_tracing decorator."""
 
@@ -68,6 +78,11 @@ class TracingWrapper:
             return None
 
         if TracingWrapper.__instance is None:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            from opentelemetry.sdk.resources import Resource, SERVICE_NAME
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
             log.info('Creating TracingWrapper instance')
             cls.__instance = super().__new__(cls)
             otlp_exporter = OTLPSpanExporter(
@@ -86,13 +101,14 @@ class TracingWrapper:
 
 def instrument_tracing(
     span_name: str = '',
-    attributes: Dict = {},
+    attributes: Union[Dict, Callable[[], Dict]] = {},
 ):
     """
     Instrument tracing for a function.
 
     :param span_name: The name of the span to be created.
-    :param attributes: The attributes to be added to the span.
+    :param attributes: The attributes to be added to the span, or a function returning them
+        which is only called when the span is created.
     :return: The decorated function or class.
     """
 
@@ -118,8 +134,9 @@ def instrument_tracing(
             with tracer.start_as_current_span(
                 span_name or func.__name__, kind=SpanKind.SERVER
             ) as span:
-                for attr in attributes:
-                    span.set_attribute(attr, attributes[attr])
+                span_attributes = attributes() if callable(attributes) else attributes
+                for attr in span_attributes:
+                    span.set_attribute(attr, span_attributes[attr])
                 span.set_attribute('host', socket.getfqdn())
                 span.set_attribute('user', getpass.getuser())
 
@@ -130,7 +147,7 @@ def instrument_tracing(
                     result = func(*args, **kwargs)
                     if isinstance(result, dict):
                         span_result = normalize_data_for_span(result)
-                    elif isinstance(result, tuple) and isinstance(result[0], Response):
+                    elif isinstance(result, tuple) and _is_flask_response(result[0]):
                         response = json.dumps(result[0].json)
                         code = result[1]
                         span_result = {'response': response, 'http_code': code}
@@ -27,3 +27,15 @@ class ExternalServiceError(BaseException):
 
 class FinalStateOverwriteError(BaseException):
     """Unable to update state if current state is "complete" or "failed"."""
+
+
+class RegistryAvailabilityError(IIBError):
+    """The container registry failed with a server error, throttled the call or was unreachable."""
+
+
+class RegistryAuthenticationError(IIBError):
+    """The container registry denied the call because of missing or invalid credentials."""
+
+
+class RegistryUnavailableError(IIBError):
+    """The container registry is considered unavailable after repeated failures."""
@@ -0,0 +1,386 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+from collections import Counter
+from contextlib import contextmanager
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, Generator, Optional, Tuple
+
+from iib.workers.config import get_worker_config
+
+log = logging.getLogger(__name__)
+
+# The FICLONE ioctl request from linux/fs.h which makes the destination file share the data
+# blocks of the source file
+_FICLONE = 0x40049409
+_ENTRIES_DIR = 'entries'
+_LOCK_FILE = '.lock'
+_METADATA_FILE = 'metadata.json'
+_CONTENT_DIR = 'content'
+
+# The temporary entries left behind by the worker processes which were killed are removed after
+# a day
+_TEMP_ENTRY_MAX_AGE = 24 * 60 * 60
+
+_stats: Counter = Counter()
+_stats_lock = threading.Lock()
+# The temporary entries with the files retained from the build context of the index image of the
+# request, mapped to the paths within the image and their sizes, see retain_files
+_retained_entries: Dict[str, Tuple[str, int]] = {}
+
+
+def _record(event: str, count: int = 1) -> None:
+    with _stats_lock:
+        _stats[event] += count
+
+
+def get_artifact_cache_stats() -> Dict[str, int]:
+    """
+    Get the number of artifact cache hits, misses and evictions since the worker started.
+
+    :return: a dictionary with the ``hits``, ``misses`` and ``evictions`` counters
+    :rtype: dict
+    """
+    with _stats_lock:
+        return {event: _stats[event] for event in ('hits', 'misses', 'evictions')}
+
+
+def _get_image_digest(pull_spec: str) -> Optional[str]:
+    """
+    Get the digest from the pull specification of a container image.
+
+    :param str pull_spec: the pull specification of the container image
+    :return: the digest or ``None`` if the image is not referenced by digest
+    :rtype: str or None
+    """
+    if '@sha256:' not in pull_spec:
+        return None
+    return pull_spec.rsplit('@', 1)[1]
+
+
+def _get_entry_dir(cache_dir: str, digest: str, src_path: str) -> str:
+    key = hashlib.sha256(f'{digest}|{os.path.normpath(src_path)}'.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, _ENTRIES_DIR, key)
+
+
+def get_copy_destination(src_path: str, dest_path: str) -> str:
+    """
+    Get the path on the local host that ``podman cp`` copies the file from the image to.
+
+    :param str src_path: the full path within the container image to copy from
+    :param str dest_path: the full path on the local host to copy into
+    :return: ``dest_path`` when it doesn't exist, otherwise the path within ``dest_path`` named
+        after the copied file
+    :rtype: str
+    """
+    if os.path.isdir(dest_path):
+        return os.path.join(dest_path, os.path.basename(os.path.normpath(src_path)))
+    return dest_path
+
+
+@contextmanager
+def _cache_lock(cache_dir: str, exclusive: bool) -> Generator[None, None, None]:
+    """
+    Lock the cache directory which is shared by all the worker processes on the host.
+
+    Entries are read while holding a shared lock and evicted while holding an exclusive lock.
+
+    :param str cache_dir: the path to the cache directory
+    :param bool exclusive: if ``True``, the lock can't be held by others at the same time
+    """
+    os.makedirs(os.path.join(cache_dir, _ENTRIES_DIR), exist_ok=True)
+    with open(os.path.join(cache_dir, _LOCK_FILE), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Hardlinks are not used to materialize the cached files because IIB modifies the extracted files
+# in place, for example the index.db file, which would also modify the cached files
+def _clone_file(src: str, dest: str) -> None:
+    """
+    Copy the file as a reflink when the file system supports it and as a regular copy otherwise.
+
+    :param str src: the path to the file to copy
+    :param str dest: the path to copy the file to
+    """
+    try:
+        with open(src, 'rb') as src_file, open(dest, 'wb') as dest_file:
+            fcntl.ioctl(dest_file.fileno(), _FICLONE, src_file.fileno())
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL):
+            raise
+        shutil.copyfile(src, dest)
+    shutil.copystat(src, dest)
+
+
+def _clone(src: str, dest: str) -> None:
+    if os.path.isdir(src) and not os.path.islink(src):
+        shutil.copytree(src, dest, symlinks=True, copy_function=_clone_file)
+    elif os.path.islink(src):
+        os.symlink(os.readlink(src), dest)
+    else:
+        _clone_file(src, dest)
+
+
+def _get_size(path: str) -> int:
+    if not os.path.isdir(path) or os.path.islink(path):
+        return os.lstat(path).st_size
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+
+def copy_from_cache(image: str, src_path: str, dest_path: str) -> bool:
+    """
+    Copy the file previously extracted from the container image out of the cache.
+
+    Only images referenced by digest are cached since their content never changes.
+
+    :param str image: the pull specification of the container image
+    :param str src_path: the full path within the container image to copy from
+    :param str dest_path: the full path on the local host to copy into, following the semantics
+        of ``podman cp``
+    :return: ``True`` if the file was copied from the cache, ``False`` otherwise
+    :rtype: bool
+    """
+    cache_dir = get_worker_config().iib_artifact_cache_dir
+    digest = _get_image_digest(image)
+    if not cache_dir or not digest:
+        return False
+
+    entry_dir = _get_entry_dir(cache_dir, digest, src_path)
+    destination = get_copy_destination(src_path, dest_path)
+    with _cache_lock(cache_dir, exclusive=False):
+        content_path = os.path.join(entry_dir, _CONTENT_DIR)
+        if not os.path.lexists(content_path):
+            _record('misses')
+            return False
+        log.info('Copying %s of %s from the artifact cache to %s', src_path, image, destination)
+        try:
+            _clone(content_path, destination)
+        except OSError:
+            log.exception('Failed to copy %s of %s from the artifact cache', src_path, image)
+            if os.path.isdir(destination) and not os.path.islink(destination):
+                shutil.rmtree(destination, ignore_errors=True)
+            elif os.path.lexists(destination):
+                os.remove(destination)
+            _record('misses')
+            return False
+        # The modification time of the entry directory determines the eviction order
+        os.utime(entry_dir)
+
+    _record('hits')
+    return True
+
+
+def _create_entry(cache_dir: str, local_path: str) -> str:
+    """
+    Create a temporary entry of the cache with a copy of the file.
+
+    Entries are filled in a temporary directory first so that other worker processes never see an
+    incomplete entry, see ``_store_entry``.
+
+    :param str cache_dir: the path to the cache directory
+    :param str local_path: the path to the file on the local host
+    :return: the path to the temporary entry
+    :rtype: str
+    :raises OSError: if the file can't be copied
+    """
+    os.makedirs(os.path.join(cache_dir, _ENTRIES_DIR), exist_ok=True)
+    temp_entry_dir = tempfile.mkdtemp(prefix='.tmp-', dir=os.path.join(cache_dir, _ENTRIES_DIR))
+    try:
+        _clone(local_path, os.path.join(temp_entry_dir, _CONTENT_DIR))
+    except OSError:
+        shutil.rmtree(temp_entry_dir, ignore_errors=True)
+        raise
+    return temp_entry_dir
+
+
+def _store_entry(
+    cache_dir: str, max_size: int, temp_entry_dir: str, image: str, src_path: str, size: int
+) -> None:
+    """
+    Store the temporary entry in the cache as the file of the container image.
+
+    :param str cache_dir: the path to the cache directory
+    :param int max_size: the maximum size of the cache in bytes
+    :param str temp_entry_dir: the path to the temporary entry, see ``_create_entry``
+    :param str image: the pull specification of the container image referenced by digest
+    :param str src_path: the full path of the file within the container image
+    :param int size: the size of the file in bytes
+    :raises OSError: if the entry can't be stored
+    """
+    entry_dir = _get_entry_dir(cache_dir, _get_image_digest(image) or '', src_path)
+    try:
+        with open(os.path.join(temp_entry_dir, _METADATA_FILE), 'w') as f:
+            json.dump({'image': image, 'path': src_path, 'size': size}, f)
+        with _cache_lock(cache_dir, exclusive=True):
+            try:
+                os.rename(temp_entry_dir, entry_dir)
+            except OSError as e:
+                # Another worker process stored the same entry in the meantime
+                if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                    raise
+            _evict(cache_dir, max_size)
+    finally:
+        shutil.rmtree(temp_entry_dir, ignore_errors=True)
+
+
+def add_to_cache(image: str, src_path: str, dest_path: str) -> None:
+    """
+    Store the file extracted from the container image in the cache.
+
+    Failing to store the file is logged but doesn't raise an exception since the cache is only an
+    optimization.
+
+    :param str image: the pull specification of the container image
+    :param str src_path: the full path within the container image the file was copied from
+    :param str dest_path: the path on the local host the file was copied to by ``podman cp``
+    """
+    conf = get_worker_config()
+    cache_dir = conf.iib_artifact_cache_dir
+    digest = _get_image_digest(image)
+    if not cache_dir or not digest:
+        return
+
+    try:
+        size = _get_size(dest_path)
+        if size > conf.iib_artifact_cache_max_size:
+            log.debug('Not caching %s of %s since it is larger than the cache', src_path, image)
+            return
+
+        temp_entry_dir = _create_entry(cache_dir, dest_path)
+        _store_entry(
+            cache_dir, conf.iib_artifact_cache_max_size, temp_entry_dir, image, src_path, size
+        )
+    except OSError:
+        log.exception('Failed to store %s of %s in the artifact cache', src_path, image)
+
+
+def retain_files(files: Dict[str, str]) -> None:
+    """
+    Retain the files of a container image which is being built until its digest is known.
+
+    This is used to store the files of the build context of an index image in the cache once the
+    index image is pushed, see ``add_retained_files_to_cache``. The next requests based on that
+    index image then copy the files out of the cache instead of extracting them. The previously
+    retained files are discarded.
+
+    :param dict files: the full paths within the container image mapped to the paths to the files
+        on the local host which are copied there
+    """
+    discard_retained_files()
+    conf = get_worker_config()
+    cache_dir = conf.iib_artifact_cache_dir
+    if not cache_dir:
+        return
+
+    for src_path, local_path in files.items():
+        try:
+            size = _get_size(local_path)
+            if size > conf.iib_artifact_cache_max_size:
+                log.debug('Not retaining %s since it is larger than the cache', local_path)
+                continue
+            _retained_entries[src_path] = (_create_entry(cache_dir, local_path), size)
+        except OSError:
+            log.exception('Failed to retain %s in the artifact cache', local_path)
+
+
+def add_retained_files_to_cache(image: str) -> None:
+    """
+    Store the retained files in the cache as the files of the pushed container image.
+
+    :param str image: the pull specification of the pushed container image referenced by digest
+    """
+    conf = get_worker_config()
+    try:
+        if not conf.iib_artifact_cache_dir or not _get_image_digest(image):
+            return
+        for src_path, (temp_entry_dir, size) in _retained_entries.items():
+            log.debug('Storing the retained %s of %s in the artifact cache', src_path, image)
+            try:
+                _store_entry(
+                    conf.iib_artifact_cache_dir,
+                    conf.iib_artifact_cache_max_size,
+                    temp_entry_dir,
+                    image,
+                    src_path,
+                    size,
+                )
+            except OSError:
+                log.exception('Failed to store %s of %s in the artifact cache', src_path, image)
+    finally:
+        discard_retained_files()
+
+
+def has_retained_files() -> bool:
+    """
+    Determine if files are retained for a container image which is being built.
+
+    :return: ``True`` if files are retained, ``False`` otherwise
+    :rtype: bool
+    """
+    return bool(_retained_entries)
+
+
+def discard_retained_files() -> None:
+    """Discard the files retained for a container image which wasn't pushed."""
+    for temp_entry_dir, _ in _retained_entries.values():
+        shutil.rmtree(temp_entry_dir, ignore_errors=True)
+    _retained_entries.clear()
+
+
+def _evict(cache_dir: str, max_size: int) -> None:
+    """
+    Remove the least recently used entries until the cache fits in the maximum size.
+
+    The caller must hold the exclusive lock of the cache directory.
+
+    :param str cache_dir: the path to the cache directory
+    :param int max_size: the maximum size of the cache in bytes
+    """
+    entries_dir = os.path.join(cache_dir, _ENTRIES_DIR)
+    entries = []
+    total_size = 0
+    for name in os.listdir(entries_dir):
+        entry_dir = os.path.join(entries_dir, name)
+        if name.startswith('.tmp-'):
+            try:
+                if time.time() - os.stat(entry_dir).st_mtime > _TEMP_ENTRY_MAX_AGE:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(os.path.join(entry_dir, _METADATA_FILE)) as f:
+                size = json.load(f)['size']
+            entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+        except (OSError, ValueError, KeyError):
+            # Remove the entries which can't be read so that they don't take space forever
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            continue
+        total_size += size
+
+    evicted = 0
+    for _, size, entry_dir in sorted(entries):
+        if total_size <= max_size:
+            break
+        log.debug('Evicting %s from the artifact cache', entry_dir)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= size
+        evicted += 1
+
+    if evicted:
+        _record('evictions', evicted)
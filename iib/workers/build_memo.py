@@ -0,0 +1,234 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from iib.workers.config import get_worker_config
+
+log = logging.getLogger(__name__)
+
+
+class MemoizedBuild(NamedTuple):
+    """An index image built from the inputs with a fingerprint."""
+
+    # The pull specification of the manifest list of the index image referenced by digest
+    index_image: str
+    # The operator packages removed from the catalog of the from_index image by the build
+    rm_operators: List[str]
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def get_build_fingerprint(build_inputs: Dict[str, Any]) -> str:
+    """
+    Get the canonical fingerprint of the resolved inputs of an index image build.
+
+    The fingerprint doesn't depend on the order of the keys and of the items of sets.
+
+    :param dict build_inputs: the resolved inputs which determine the content of the index image
+    :return: the hexadecimal SHA-256 digest of the canonical form of the inputs
+    :rtype: str
+    """
+    canonical = json.dumps(
+        build_inputs, default=_json_default, separators=(',', ':'), sort_keys=True
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _get_entry_path(memo_dir: str, fingerprint: str) -> str:
+    return os.path.join(memo_dir, f'{fingerprint}.json')
+
+
+def _is_expired(path: str, max_age: int) -> bool:
+    return time.time() - os.stat(path).st_mtime > max_age
+
+
+def _remove_entry(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _write_entry(memo_dir: str, path: str, entry: Dict[str, Any]) -> None:
+    os.makedirs(memo_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        'w', dir=memo_dir, prefix='.', suffix='.tmp', delete=False
+    ) as f:
+        json.dump(entry, f)
+    os.replace(f.name, path)
+
+
+def _remove_expired_entries(memo_dir: str, max_age: int) -> None:
+    for entry in os.scandir(memo_dir):
+        try:
+            if entry.name.endswith('.json') and _is_expired(entry.path, max_age):
+                os.remove(entry.path)
+        except FileNotFoundError:
+            # Another worker process removed the entry in the meantime
+            pass
+
+
+def forget_build(fingerprint: str) -> None:
+    """
+    Remove the index image built from the inputs with the fingerprint from the build memo.
+
+    :param str fingerprint: the fingerprint of the build inputs
+    """
+    memo_dir = get_worker_config().iib_build_memo_dir
+    if not memo_dir:
+        return
+    _remove_entry(_get_entry_path(memo_dir, fingerprint))
+
+
+def get_memoized_build(fingerprint: str) -> Optional[MemoizedBuild]:
+    """
+    Get the index image which was built from the inputs with the fingerprint.
+
+    :param str fingerprint: the fingerprint of the build inputs
+    :return: the memoized build, or ``None`` if the build memo is disabled or the inputs weren't
+        built recently
+    :rtype: MemoizedBuild or None
+    """
+    conf = get_worker_config()
+    if not conf.iib_build_memo_dir:
+        return None
+
+    path = _get_entry_path(conf.iib_build_memo_dir, fingerprint)
+    try:
+        if _is_expired(path, conf.iib_build_memo_max_age):
+            forget_build(fingerprint)
+            return None
+        with open(path, 'r') as f:
+            entry = json.load(f)
+        return MemoizedBuild(entry['index_image'], list(entry['rm_operators']))
+    except FileNotFoundError:
+        return None
+    except (KeyError, TypeError, ValueError):
+        log.warning('Removing the invalid build memo entry %s', path)
+        forget_build(fingerprint)
+        return None
+
+
+def memoize_build(
+    fingerprint: str, index_image: str, rm_operators: Optional[List[str]] = None
+) -> None:
+    """
+    Record the index image which was built from the inputs with the fingerprint.
+
+    The entry is written atomically so that the worker processes sharing the build memo never read
+    a partial entry. The expired entries are removed at the same time. Failing to write the entry
+    is logged and ignored.
+
+    :param str fingerprint: the fingerprint of the build inputs
+    :param str index_image: the pull specification of the manifest list of the index image
+        referenced by digest
+    :param list rm_operators: the operator packages removed from the catalog of the
+        ``from_index`` image by the build
+    """
+    conf = get_worker_config()
+    memo_dir = conf.iib_build_memo_dir
+    if not memo_dir:
+        return
+
+    try:
+        _write_entry(
+            memo_dir,
+            _get_entry_path(memo_dir, fingerprint),
+            {'index_image': index_image, 'rm_operators': rm_operators or []},
+        )
+    except OSError:
+        # The index image was built successfully, so failing to memoize it isn't fatal
+        log.exception('Failed to memoize the index image %s', index_image)
+        return
+    log.debug('Memoized the index image %s built from the inputs %s', index_image, fingerprint)
+    _remove_expired_entries(memo_dir, conf.iib_build_memo_max_age)
+
+
+def _get_validated_packages_path(memo_dir: str, index_image: str, opm_version: str) -> str:
+    # The entry only depends on the digest, so it's shared by the repositories of the index image
+    digest = index_image.rsplit('@', 1)[1]
+    key = get_build_fingerprint({'index_image_digest': digest, 'opm_version': opm_version})
+    return os.path.join(memo_dir, f'validated-packages-{key}.json')
+
+
+def get_validated_packages(index_image: str, opm_version: str) -> Dict[str, List[str]]:
+    """
+    Get the packages of the catalog of an index image which were validated when it was built.
+
+    The packages are only recorded by the workers, see ``memoize_validated_packages``, so the
+    content of the index image is never trusted.
+
+    :param str index_image: the pull specification of the index image referenced by digest
+    :param str opm_version: the version of the opm binary which validated the packages
+    :return: the names of the packages which the declarative config blobs of each validated
+        package belong to, mapped to the digests of the packages, see
+        ``get_catalog_package_digests``
+    :rtype: dict
+    """
+    conf = get_worker_config()
+    if not conf.iib_build_memo_dir or '@sha256:' not in index_image:
+        return {}
+
+    path = _get_validated_packages_path(conf.iib_build_memo_dir, index_image, opm_version)
+    try:
+        if _is_expired(path, conf.iib_build_memo_max_age):
+            _remove_entry(path)
+            return {}
+        with open(path, 'r') as f:
+            entry = json.load(f)
+        return {
+            digest: [str(name) for name in names]
+            for digest, names in entry['validated_packages'].items()
+        }
+    except FileNotFoundError:
+        return {}
+    except (AttributeError, KeyError, TypeError, ValueError):
+        log.warning('Removing the invalid validated packages entry %s', path)
+        _remove_entry(path)
+        return {}
+
+
+def memoize_validated_packages(
+    index_image: str, opm_version: str, validated_packages: Dict[str, List[str]]
+) -> None:
+    """
+    Record the packages of the catalog of an index image which were validated when it was built.
+
+    The requests based on the index image then only validate the packages they change. Failing to
+    write the entry is logged and ignored.
+
+    :param str index_image: the pull specification of the pushed index image referenced by digest
+    :param str opm_version: the version of the opm binary which validated the packages
+    :param dict validated_packages: the names of the packages which the declarative config blobs
+        of each validated package belong to, mapped to the digests of the packages
+    """
+    conf = get_worker_config()
+    memo_dir = conf.iib_build_memo_dir
+    if not memo_dir or '@sha256:' not in index_image:
+        return
+
+    try:
+        _write_entry(
+            memo_dir,
+            _get_validated_packages_path(memo_dir, index_image, opm_version),
+            {'validated_packages': validated_packages},
+        )
+    except OSError:
+        log.exception('Failed to memoize the validated packages of %s', index_image)
+        return
+    log.debug(
+        'Memoized %d packages validated by opm %s for %s',
+        len(validated_packages),
+        opm_version,
+        index_image,
+    )
+    _remove_expired_entries(memo_dir, conf.iib_build_memo_max_age)
@@ -0,0 +1,185 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, NamedTuple, Optional
+
+from iib.workers.config import get_worker_config
+
+log = logging.getLogger(__name__)
+
+# The build context of the index image is prepared, see ``get_checkpoint_context_dir``
+PHASE_CONTEXT_PREPARED = 'context_prepared'
+# The single arch index images are pushed to the registry
+PHASE_IMAGES_PUSHED = 'images_pushed'
+# The manifest list of the index image is pushed to the registry
+PHASE_MANIFEST_LIST_PUSHED = 'manifest_list_pushed'
+
+_CHECKPOINT_FILE = 'checkpoint.json'
+_CONTEXT_DIR = 'context'
+
+
+class Checkpoint(NamedTuple):
+    """The last phase of a request which was completed."""
+
+    # The name of the completed phase
+    phase: str
+    # The fingerprint of the resolved inputs of the request when the phase was completed
+    fingerprint: str
+    # The data required to resume the request after the phase
+    data: Dict[str, Any]
+
+
+def _get_request_dir(checkpoint_dir: str, request_id: int) -> str:
+    return os.path.join(checkpoint_dir, str(request_id))
+
+
+def _is_expired(path: str, max_age: int) -> bool:
+    return time.time() - os.stat(path).st_mtime > max_age
+
+
+def _link_or_copy(src: str, dst: str) -> str:
+    # Hard links make saving the build context cheap when it's on the same file system
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def get_checkpoint_context_dir(request_id: int) -> Optional[str]:
+    """
+    Get the directory holding the build context saved with the checkpoint of the request.
+
+    :param int request_id: the ID of the IIB request
+    :return: the path to the directory, or ``None`` if the checkpoints are disabled
+    :rtype: str or None
+    """
+    checkpoint_dir = get_worker_config().iib_request_checkpoint_dir
+    if not checkpoint_dir:
+        return None
+    return os.path.join(_get_request_dir(checkpoint_dir, request_id), _CONTEXT_DIR)
+
+
+def remove_checkpoint(request_id: int) -> None:
+    """
+    Remove the checkpoint of the request and the artifacts saved with it.
+
+    :param int request_id: the ID of the IIB request
+    """
+    checkpoint_dir = get_worker_config().iib_request_checkpoint_dir
+    if not checkpoint_dir:
+        return
+    shutil.rmtree(_get_request_dir(checkpoint_dir, request_id), ignore_errors=True)
+
+
+def get_checkpoint(request_id: int, fingerprint: str) -> Optional[Checkpoint]:
+    """
+    Get the checkpoint saved by a previous attempt of the request.
+
+    The checkpoint is only returned if it was saved recently for the same resolved inputs.
+    Otherwise, it's removed since resuming the request would build an outdated index image.
+
+    :param int request_id: the ID of the IIB request
+    :param str fingerprint: the fingerprint of the resolved inputs of the request
+    :return: the checkpoint, or ``None`` if the checkpoints are disabled or the request can't be
+        resumed
+    :rtype: Checkpoint or None
+    """
+    conf = get_worker_config()
+    if not conf.iib_request_checkpoint_dir:
+        return None
+
+    path = os.path.join(
+        _get_request_dir(conf.iib_request_checkpoint_dir, request_id), _CHECKPOINT_FILE
+    )
+    try:
+        if _is_expired(path, conf.iib_request_checkpoint_max_age):
+            log.info('Removing the expired checkpoint of the request %d', request_id)
+            remove_checkpoint(request_id)
+            return None
+        with open(path, 'r') as f:
+            entry = json.load(f)
+        checkpoint = Checkpoint(entry['phase'], entry['fingerprint'], dict(entry['data']))
+    except FileNotFoundError:
+        return None
+    except (KeyError, TypeError, ValueError):
+        log.warning('Removing the invalid checkpoint %s', path)
+        remove_checkpoint(request_id)
+        return None
+
+    if checkpoint.fingerprint != fingerprint:
+        log.info(
+            'Removing the checkpoint of the request %d since its resolved inputs changed',
+            request_id,
+        )
+        remove_checkpoint(request_id)
+        return None
+    return checkpoint
+
+
+def save_checkpoint(
+    request_id: int,
+    fingerprint: str,
+    phase: str,
+    data: Optional[Dict[str, Any]] = None,
+    context_dir: Optional[str] = None,
+) -> Checkpoint:
+    """
+    Record that the phase of the request was completed.
+
+    The checkpoint is written atomically after the artifacts saved with it, so that an attempt
+    which is interrupted never leaves a checkpoint without its artifacts. The expired checkpoints
+    of the other requests are removed at the same time. Failing to save the checkpoint is logged
+    and ignored.
+
+    :param int request_id: the ID of the IIB request
+    :param str fingerprint: the fingerprint of the resolved inputs of the request
+    :param str phase: the name of the completed phase
+    :param dict data: the JSON serializable data required to resume the request after the phase
+    :param str context_dir: the path to the build context of the index image to save with the
+        checkpoint, see ``get_checkpoint_context_dir``
+    :return: the checkpoint, which is returned even if the checkpoints are disabled
+    :rtype: Checkpoint
+    """
+    checkpoint = Checkpoint(phase, fingerprint, data or {})
+    conf = get_worker_config()
+    if not conf.iib_request_checkpoint_dir:
+        return checkpoint
+
+    request_dir = _get_request_dir(conf.iib_request_checkpoint_dir, request_id)
+    try:
+        os.makedirs(request_dir, exist_ok=True)
+        if context_dir:
+            saved_context_dir = os.path.join(request_dir, _CONTEXT_DIR)
+            shutil.rmtree(saved_context_dir, ignore_errors=True)
+            shutil.copytree(
+                context_dir, saved_context_dir, symlinks=True, copy_function=_link_or_copy
+            )
+        with tempfile.NamedTemporaryFile(
+            'w', dir=request_dir, prefix='.', suffix='.tmp', delete=False
+        ) as f:
+            json.dump(checkpoint._asdict(), f)
+        os.replace(f.name, os.path.join(request_dir, _CHECKPOINT_FILE))
+    except (OSError, shutil.Error):
+        # The phase was completed successfully, so failing to save the checkpoint isn't fatal
+        log.exception('Failed to save the checkpoint %s of the request %d', phase, request_id)
+        # Don't leave the checkpoint of a previous phase with partially replaced artifacts
+        remove_checkpoint(request_id)
+        return checkpoint
+    log.debug('Saved the checkpoint %s of the request %d', phase, request_id)
+
+    for entry in os.scandir(conf.iib_request_checkpoint_dir):
+        if entry.name == str(request_id):
+            continue
+        try:
+            # Replacing the checkpoint file updates the modification time of its directory
+            if _is_expired(entry.path, conf.iib_request_checkpoint_max_age):
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            # The checkpoint was removed by another worker process in the meantime
+            pass
+    return checkpoint
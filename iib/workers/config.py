@@ -19,6 +19,17 @@ from iib.workers.tasks.iib_static_types import (
     iib_organization_customizations_type,
 )
 
+# The types of the requests which build container images
+BUILD_REQUEST_TYPES = (
+    'add',
+    'add-deprecations',
+    'create-empty-index',
+    'fbc-operations',
+    'merge-index-image',
+    'regenerate-bundle',
+    'rm',
+)
+
 
 class Config(object):
     """The base IIB Celery configuration."""
@@ -65,11 +76,81 @@ class Config(object):
     iib_dogpile_backend: str = 'dogpile.cache.null'
     iib_dogpile_expiration_time: int = 600
     iib_dogpile_arguments: Dict[str, List[str]] = {'url': ['127.0.0.1']}
+    # The maximum number of cached results kept in the memory of each worker process in front of
+    # the dogpile.cache backend. Set it to 0 to disable the in-process cache.
+    iib_dogpile_local_cache_size: int = 1024
+    # The number of seconds the results of looking up images by tag, including failed lookups,
+    # are kept in the memory of each worker process. Set it to 0 to disable this cache.
+    iib_dogpile_tag_expiration_time: int = 30
     iib_skopeo_timeout: str = '300s'
     iib_total_attempts: int = 5
     iib_retry_delay: int = 10
     iib_retry_jitter: int = 10
     iib_retry_multiplier: int = 5
+    # The failure rate of the calls to a container registry in the last minute from which its
+    # circuit breaker opens. The calls to the registry then fail without being attempted.
+    iib_registry_circuit_breaker_failure_rate: float = 0.5
+    # The minimum number of calls to a container registry in the last minute before its circuit
+    # breaker can open
+    iib_registry_circuit_breaker_min_calls: int = 10
+    # The number of seconds the circuit breaker of a container registry stays open before a trial
+    # call is let through to the registry
+    iib_registry_circuit_breaker_reset_timeout: int = 60
+    # The maximum number of retries per minute of the calls to a container registry, shared by
+    # all the calls of the worker process
+    iib_registry_retry_budget: int = 20
+    # The directory where the files extracted from container images referenced by digest are
+    # cached and shared by all the worker processes on the host. The cache is disabled if unset.
+    iib_artifact_cache_dir: Optional[str] = None
+    # The maximum size of the artifact cache in bytes
+    iib_artifact_cache_max_size: int = 10 * 1024**3
+    # The directory where the index images built for the fingerprints of their resolved inputs
+    # are recorded, shared by all the worker processes on the host. Requests with the same inputs
+    # reuse the recorded index image instead of building it again. The packages of the catalogs
+    # validated by opm are recorded for the digests of the index images too. The memo is disabled
+    # if unset.
+    iib_build_memo_dir: Optional[str] = None
+    # The number of seconds an index image is reused for requests with the same inputs
+    iib_build_memo_max_age: int = 24 * 60 * 60
+    # The directory where the add and merge-index-image requests save the checkpoints of their
+    # completed phases, so that an attempt of the request run again resumes after the last one.
+    # The checkpoints are disabled if unset.
+    iib_request_checkpoint_dir: Optional[str] = None
+    # The number of seconds a request can be resumed from its last checkpoint
+    iib_request_checkpoint_max_age: int = 24 * 60 * 60
+    # The request types whose images built with buildah reuse the images and the intermediate
+    # layers previously built from the same inputs. The other request types build with --no-cache.
+    iib_image_build_cache_request_types: List[str] = []
+    # The maximum number of architectures of an index image built and pushed concurrently
+    iib_image_build_max_workers: int = 4
+    # How the single arch index images are produced. "assemble" pushes the manifests and configs
+    # referencing the binary image layers and a single layer with the added content directly to
+    # the registry, and "buildah" builds each architecture with "buildah bud".
+    iib_image_build_method: str = 'buildah'
+    # How the container images are removed before and after each request. "all" removes all the
+    # images and "lru" only removes the images of the requests and the least recently used images.
+    iib_image_gc_policy: str = 'all'
+    # The maximum total size in bytes of the container images kept by the "lru" policy
+    iib_image_gc_max_size: int = 50 * 1024**3
+    # The used fraction of the file system holding the container images above which the "lru"
+    # policy removes more images
+    iib_image_gc_high_water_mark: float = 0.8
+    # The number of the most recently used index images kept by the "lru" policy
+    iib_image_gc_recent_from_index: int = 5
+    # The maximum number of image pull specifications resolved concurrently in a single call
+    iib_image_resolution_max_workers: int = 16
+    # The maximum number of concurrent image resolutions against a single registry
+    iib_image_resolution_registry_limit: int = 8
+    # The client used to read image manifests and configs from container registries. "native"
+    # uses the in-process registry client and "skopeo" runs "skopeo inspect" subprocesses.
+    iib_registry_client: str = 'skopeo'
+    # How files are extracted from container images. "stream" reads only the requested paths from
+    # the image layers using the native registry client and "podman" pulls the whole image.
+    iib_image_extraction: str = 'podman'
+    # Registries which the native registry client accesses over plain HTTP
+    iib_registry_client_insecure_registries: List[str] = []
+    iib_registry_client_pool_size: int = 16
+    iib_registry_client_timeout: int = 120
     iib_supported_archs: dict = {
         "amd64": "x86_64",
         "arm64": "aarch64",
@@ -264,6 +345,8 @@ class TestingConfig(DevelopmentConfig):
     iib_request_related_bundles_dir: Optional[str] = None
     # disable dogpile cache for tests
     iib_dogpile_backend: str = 'dogpile.cache.null'
+    iib_dogpile_local_cache_size: int = 0
+    iib_dogpile_tag_expiration_time: int = 0
 
 
 def configure_celery(celery_app: Celery) -> None:
@@ -331,6 +414,54 @@ def validate_celery_config(conf: app.utils.Settings, **kwargs) -> None:
     ):
         raise ConfigError('iib_related_image_registry_replacement must be a dictionary')
 
+    if conf.get('iib_registry_client', 'skopeo') not in ('native', 'skopeo'):
+        raise ConfigError('iib_registry_client must be set to "native" or "skopeo"')
+
+    if conf.get('iib_image_extraction', 'podman') not in ('stream', 'podman'):
+        raise ConfigError('iib_image_extraction must be set to "stream" or "podman"')
+
+    if conf.get('iib_image_build_method', 'buildah') not in ('assemble', 'buildah'):
+        raise ConfigError('iib_image_build_method must be set to "assemble" or "buildah"')
+
+    invalid_request_types = set(conf.get('iib_image_build_cache_request_types', [])) - set(
+        BUILD_REQUEST_TYPES
+    )
+    if invalid_request_types:
+        raise ConfigError(
+            'iib_image_build_cache_request_types contains the invalid request types '
+            f'{", ".join(sorted(invalid_request_types))}'
+        )
+
+    build_memo_max_age = conf.get('iib_build_memo_max_age', 1)
+    if not isinstance(build_memo_max_age, int) or build_memo_max_age <= 0:
+        raise ConfigError('iib_build_memo_max_age must be a positive integer')
+
+    checkpoint_max_age = conf.get('iib_request_checkpoint_max_age', 1)
+    if not isinstance(checkpoint_max_age, int) or checkpoint_max_age <= 0:
+        raise ConfigError('iib_request_checkpoint_max_age must be a positive integer')
+
+    failure_rate = conf.get('iib_registry_circuit_breaker_failure_rate', 1)
+    if not isinstance(failure_rate, (int, float)) or not 0 < failure_rate <= 1:
+        raise ConfigError(
+            'iib_registry_circuit_breaker_failure_rate must be a number greater than 0 and at '
+            'most 1'
+        )
+
+    for option in (
+        'iib_registry_circuit_breaker_min_calls',
+        'iib_registry_circuit_breaker_reset_timeout',
+    ):
+        value = conf.get(option, 1)
+        if not isinstance(value, int) or value <= 0:
+            raise ConfigError(f'{option} must be a positive integer')
+
+    retry_budget = conf.get('iib_registry_retry_budget', 0)
+    if not isinstance(retry_budget, int) or retry_budget < 0:
+        raise ConfigError('iib_registry_retry_budget must be a non-negative integer')
+
+    if conf.get('iib_image_gc_policy', 'all') not in ('all', 'lru'):
+        raise ConfigError('iib_image_gc_policy must be set to "all" or "lru"')
+
     _validate_multiple_opm_mapping(conf['iib_ocp_opm_mapping'])
     _validate_iib_org_customizations(conf['iib_organization_customizations'])
     _validate_konflux_config(conf)
@@ -1,11 +1,18 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+import copy
 import functools
 import hashlib
-from typing import Callable
+import threading
+import time
+from typing import Any, Callable, Dict, Generator, Optional, Tuple
 
 from dogpile.cache import make_region
+from dogpile.cache.api import NO_VALUE
 from dogpile.cache.region import CacheRegion
 
+from iib.exceptions import IIBError, RegistryAuthenticationError
 from iib.workers.config import get_worker_config
 
 
@@ -14,36 +21,252 @@ def skopeo_inspect_should_use_cache(*args, **kwargs) -> bool:
     return any(arg.find('@sha256:') != -1 for arg in args)
 
 
-def dogpile_cache(dogpile_region: CacheRegion, should_use_cache_fn: Callable) -> Callable:
+def skopeo_inspect_should_use_tag_cache(*args, **kwargs) -> bool:
+    """Return true in case this request references an image by tag in a container registry."""
+    return any(arg.startswith('docker://') for arg in args) and not skopeo_inspect_should_use_cache(
+        *args, **kwargs
+    )
+
+
+class _LocalCache:
+    """
+    A bounded in-process cache which evicts the least recently used entries.
+
+    Every entry may have its own expiration time. The values are deep copied when stored and when
+    returned so that callers can't modify the cached values.
+    """
+
+    def __init__(self) -> None:
+        self._entries: OrderedDict[str, Tuple[Optional[float], Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        """
+        Get the value stored under the key.
+
+        :param str key: the cache key
+        :return: a copy of the cached value or ``NO_VALUE`` if it's not cached or it's expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return NO_VALUE
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return NO_VALUE
+            self._entries.move_to_end(key)
+            return copy.deepcopy(value)
+
+    def set(self, key: str, value: Any, max_size: int, expiration_time: Optional[int]) -> None:
+        """
+        Store the value under the key.
+
+        :param str key: the cache key
+        :param value: the value to cache
+        :param int max_size: the maximum number of entries to keep; ``0`` disables the cache
+        :param int expiration_time: the number of seconds the entry is valid for; ``None``
+            means the entry only gets evicted when the cache is full
+        """
+        if max_size <= 0:
+            return
+        expires_at = None if expiration_time is None else time.monotonic() + expiration_time
+        with self._lock:
+            self._entries[key] = (expires_at, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all the entries."""
+        with self._lock:
+            self._entries.clear()
+
+
+class _CachedError:
+    """Wrap an exception so that a failed lookup can be cached like any other value."""
+
+    def __init__(self, error: Exception) -> None:
+        self.error = error
+
+
+class _KeyLocks:
+    """Hand out a lock per cache key so that only one caller fills a given key at a time."""
+
+    def __init__(self) -> None:
+        self._locks: Dict[str, Tuple[threading.Lock, int]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, key: str) -> Generator[None, None, None]:
+        """
+        Hold the lock of the key for the duration of the context manager.
+
+        :param str key: the cache key
+        """
+        with self._lock:
+            key_lock, waiters = self._locks.get(key, (threading.Lock(), 0))
+            self._locks[key] = (key_lock, waiters + 1)
+        try:
+            with key_lock:
+                yield
+        finally:
+            with self._lock:
+                key_lock, waiters = self._locks[key]
+                if waiters == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (key_lock, waiters - 1)
+
+
+_local_cache = _LocalCache()
+_tag_cache = _LocalCache()
+_key_locks = _KeyLocks()
+_stats: Counter = Counter()
+_stats_lock = threading.Lock()
+
+
+def _record(event: str) -> None:
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def get_cache_stats() -> Dict[str, int]:
+    """
+    Get the number of cache hits and misses since the worker started.
+
+    :return: a dictionary with the ``local_hits``, ``shared_hits``, ``tag_hits`` and ``misses``
+        counters
+    :rtype: dict
+    """
+    with _stats_lock:
+        return {
+            event: _stats[event] for event in ('local_hits', 'shared_hits', 'tag_hits', 'misses')
+        }
+
+
+def invalidate_tag_cache() -> None:
+    """
+    Forget the results of all the lookups of images by tag.
+
+    This must be called after pushing to a container registry since the pushed tags may then
+    point to different images, and whenever the Docker configuration changes since the results
+    depend on the credentials in use.
+    """
+    _tag_cache.clear()
+
+
+def clear_local_caches() -> None:
+    """Forget all the results cached in memory of this process."""
+    _local_cache.clear()
+    _tag_cache.clear()
+
+
+def dogpile_cache(
+    dogpile_region: CacheRegion,
+    should_use_cache_fn: Callable,
+    should_use_tag_cache_fn: Optional[Callable] = None,
+) -> Callable:
     """
     Dogpile cache decorator.
 
+    Results which ``should_use_cache_fn`` accepts are looked up in a bounded in-process cache
+    first and then in the shared dogpile region. Results which ``should_use_tag_cache_fn`` accepts
+    are only cached in memory for ``iib_dogpile_tag_expiration_time`` seconds, including the
+    ``IIBError`` raised by the decorated function unless it's a ``RegistryAuthenticationError``
+    since the credentials may change before the next call. In both cases, concurrent callers for
+    the same key wait for the first one to fill the cache instead of calling the function
+    themselves.
+
     :params dogpile_region: Dogpile CacheRegion object
     :params should_use_cache_fn: function which determines if cache should be used
+    :params should_use_tag_cache_fn: function which determines if the short-lived in-process
+        cache should be used
     """
 
     def cache_decorator(func):
         @functools.wraps(func)
         def inner(*args, **kwargs):
-            should_cache = should_use_cache_fn(*args, **kwargs)
-            cache_key = generate_cache_key(func.__name__, *args, **kwargs)
+            if should_use_cache_fn(*args, **kwargs):
+                return _get_or_create_pinned(dogpile_region, func, args, kwargs)
+            if should_use_tag_cache_fn and should_use_tag_cache_fn(*args, **kwargs):
+                return _get_or_create_tag(func, args, kwargs)
+            return func(*args, **kwargs)
+
+        return inner
 
-            if should_cache:
-                # get data from cache
-                output_cache = dogpile_region.get(cache_key)
-                if output_cache:
-                    return output_cache
+    return cache_decorator
 
-            output = func(*args, **kwargs)
 
-            if should_cache:
-                dogpile_region.set(cache_key, output)
+def _get_or_create_pinned(
+    dogpile_region: CacheRegion, func: Callable, args: tuple, kwargs: Dict[str, Any]
+) -> Any:
+    conf = get_worker_config()
+    cache_key = generate_cache_key(func.__name__, *args, **kwargs)
+    output = _local_cache.get(cache_key)
+    if output is not NO_VALUE:
+        _record('local_hits')
+        return output
 
+    with _key_locks.hold(cache_key):
+        # Another caller may have filled the cache while this one was waiting for the lock
+        output = _local_cache.get(cache_key)
+        if output is not NO_VALUE:
+            _record('local_hits')
             return output
 
-        return inner
+        # The backend only provides a mutex when it's configured to lock across processes
+        mutex = dogpile_region.backend.get_mutex(cache_key)
+        if mutex:
+            mutex.acquire()
+        try:
+            # get data from cache
+            output_cache = dogpile_region.get(cache_key)
+            if output_cache:
+                _record('shared_hits')
+                _local_cache.set(cache_key, output_cache, conf.iib_dogpile_local_cache_size, None)
+                return output_cache
 
-    return cache_decorator
+            _record('misses')
+            output = func(*args, **kwargs)
+            dogpile_region.set(cache_key, output)
+        finally:
+            if mutex:
+                mutex.release()
+
+        if output:
+            _local_cache.set(cache_key, output, conf.iib_dogpile_local_cache_size, None)
+        return output
+
+
+def _get_or_create_tag(func: Callable, args: tuple, kwargs: Dict[str, Any]) -> Any:
+    conf = get_worker_config()
+    if conf.iib_dogpile_tag_expiration_time <= 0:
+        return func(*args, **kwargs)
+
+    cache_key = generate_cache_key(func.__name__, *args, **kwargs)
+    with _key_locks.hold(cache_key):
+        output = _tag_cache.get(cache_key)
+        if output is not NO_VALUE:
+            _record('tag_hits')
+        else:
+            _record('misses')
+            try:
+                output = func(*args, **kwargs)
+            except RegistryAuthenticationError:
+                raise
+            except IIBError as e:
+                output = _CachedError(e)
+            _tag_cache.set(
+                cache_key,
+                output,
+                conf.iib_dogpile_local_cache_size,
+                conf.iib_dogpile_tag_expiration_time,
+            )
+
+    if isinstance(output, _CachedError):
+        raise output.error
+    return output
 
 
 def generate_cache_key(fn: str, *args, **kwargs) -> str:
@@ -0,0 +1,444 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+from concurrent.futures import ThreadPoolExecutor
+import copy
+from datetime import datetime, timezone
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shlex
+import tarfile
+import tempfile
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Optional, Tuple
+
+from iib.exceptions import IIBError
+from iib.workers.config import get_worker_config
+from iib.workers.registry_client import (
+    get_registry_client,
+    parse_image_reference,
+    IMAGE_MANIFEST_MEDIA_TYPES,
+    MANIFEST_LIST_MEDIA_TYPES,
+    MEDIA_TYPE_DOCKER_MANIFEST,
+)
+
+log = logging.getLogger(__name__)
+
+MEDIA_TYPE_DOCKER_CONFIG = 'application/vnd.docker.container.image.v1+json'
+MEDIA_TYPE_DOCKER_LAYER = 'application/vnd.docker.image.rootfs.diff.tar.gzip'
+# The media types of the base image layers which can be referenced by a Docker v2s2 manifest
+_GZIP_LAYER_MEDIA_TYPES = (MEDIA_TYPE_DOCKER_LAYER, 'application/vnd.oci.image.layer.v1.tar+gzip')
+
+
+class _UnsupportedBuild(Exception):
+    """The image can't be assembled from the Dockerfile, so buildah must be used instead."""
+
+
+class _Copy(NamedTuple):
+    """An ``ADD`` or ``COPY`` instruction of the Dockerfile."""
+
+    source: str
+    destination: str
+    uid: int
+    gid: int
+
+
+class _Dockerfile(NamedTuple):
+    """The parts of a Dockerfile that an assembled image is made of."""
+
+    base_image: str
+    copies: List[_Copy]
+    labels: Dict[str, str]
+    entrypoint: Optional[List[str]]
+    cmd: Optional[List[str]]
+    instructions: List[str]
+
+
+class _Layer(NamedTuple):
+    """The layer with the content added by the Dockerfile, shared by all the architectures."""
+
+    path: str
+    digest: str
+    diff_id: str
+    size: int
+
+
+class _HashingWriter:
+    """A write-only file object which computes the SHA-256 digest of what is written to it."""
+
+    def __init__(self, fileobj: BinaryIO) -> None:
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self) -> None:
+        self.fileobj.flush()
+
+
+def _parse_dockerfile(dockerfile_path: str) -> _Dockerfile:
+    """
+    Parse the Dockerfile generated by IIB.
+
+    Only the instructions written by IIB and opm for file-based catalogs are supported, which are
+    ``FROM``, ``ADD`` and ``COPY`` of local paths, ``LABEL``, ``ENTRYPOINT`` and ``CMD``.
+
+    :param str dockerfile_path: the path to the Dockerfile
+    :return: the parsed Dockerfile
+    :rtype: _Dockerfile
+    :raises _UnsupportedBuild: if the Dockerfile uses anything else
+    """
+    base_image = None
+    copies = []
+    labels = {}
+    entrypoint = None
+    cmd = None
+    instructions = []
+    with open(dockerfile_path, 'r') as f:
+        lines = [line.strip() for line in f]
+
+    for line in lines:
+        if not line or line.startswith('#'):
+            continue
+        if line.endswith('\\'):
+            raise _UnsupportedBuild('line continuations')
+        instruction, _, arguments = line.partition(' ')
+        instruction = instruction.upper()
+        arguments = arguments.strip()
+        if instruction != 'FROM' and base_image is None:
+            raise _UnsupportedBuild(f'the {instruction} instruction before FROM')
+        instructions.append(f'{instruction} {arguments}')
+
+        if instruction == 'FROM':
+            if base_image is not None or ' ' in arguments:
+                raise _UnsupportedBuild('multi-stage builds')
+            base_image = arguments
+        elif instruction in ('ADD', 'COPY'):
+            parts = shlex.split(arguments)
+            uid = gid = 0
+            if parts and parts[0].startswith('--chown='):
+                owner = parts.pop(0).removeprefix('--chown=')
+                user, _, group = owner.partition(':')
+                if not user.isdigit() or not (group or user).isdigit():
+                    raise _UnsupportedBuild(f'the non-numeric owner {owner}')
+                uid, gid = int(user), int(group or user)
+            if len(parts) != 2 or parts[0].startswith('--'):
+                raise _UnsupportedBuild(f'the {instruction} instruction {arguments}')
+            if '://' in parts[0]:
+                raise _UnsupportedBuild(f'the remote source {parts[0]}')
+            copies.append(_Copy(parts[0], parts[1], uid, gid))
+        elif instruction == 'LABEL':
+            for label in shlex.split(arguments):
+                key, sep, value = label.partition('=')
+                if not sep:
+                    raise _UnsupportedBuild(f'the LABEL instruction {arguments}')
+                labels[key] = value
+        elif instruction in ('ENTRYPOINT', 'CMD'):
+            try:
+                value = json.loads(arguments)
+            except json.JSONDecodeError:
+                raise _UnsupportedBuild(f'the shell form of {instruction}')
+            if instruction == 'ENTRYPOINT':
+                entrypoint = value
+            else:
+                cmd = value
+        else:
+            raise _UnsupportedBuild(f'the {instruction} instruction')
+
+    if not base_image:
+        raise _UnsupportedBuild('a Dockerfile without FROM')
+    return _Dockerfile(base_image, copies, labels, entrypoint, cmd, instructions)
+
+
+def _add_to_layer(layer_tar: tarfile.TarFile, context_dir: str, copy_instruction: _Copy) -> None:
+    """
+    Add the source of the ``ADD`` or ``COPY`` instruction to the layer.
+
+    :param tarfile.TarFile layer_tar: the layer being written
+    :param str context_dir: the directory the sources are relative to
+    :param _Copy copy_instruction: the instruction to add the source of
+    :raises _UnsupportedBuild: if the source would be handled differently by buildah
+    """
+    source = os.path.normpath(os.path.join(context_dir, copy_instruction.source))
+    if (
+        source == context_dir
+        or os.path.commonpath([source, context_dir]) != context_dir
+        or not os.path.lexists(source)
+    ):
+        raise _UnsupportedBuild(f'the source {copy_instruction.source}')
+    if os.path.isfile(source) and tarfile.is_tarfile(source):
+        # ADD extracts local archives
+        raise _UnsupportedBuild(f'the archive {copy_instruction.source}')
+
+    destination = copy_instruction.destination.strip('/')
+    if os.path.isfile(source) and copy_instruction.destination.endswith('/'):
+        destination = f'{destination}/{os.path.basename(source)}'
+
+    def _set_owner(member: tarfile.TarInfo) -> tarfile.TarInfo:
+        member.uid = copy_instruction.uid
+        member.gid = copy_instruction.gid
+        member.uname = member.gname = ''
+        return member
+
+    # A directory source is copied as its contents
+    layer_tar.add(source, arcname=destination, filter=_set_owner)
+
+
+def _create_layer(context_dir: str, dockerfile: _Dockerfile, layer_dir: str) -> _Layer:
+    """
+    Write the content added by the Dockerfile to a single gzipped layer.
+
+    :param str context_dir: the directory the sources are relative to
+    :param _Dockerfile dockerfile: the parsed Dockerfile
+    :param str layer_dir: the directory to write the layer to
+    :return: the written layer
+    :rtype: _Layer
+    :raises _UnsupportedBuild: if any of the sources can't be added
+    """
+    layer_path = os.path.join(layer_dir, 'layer.tar.gz')
+    with open(layer_path, 'wb') as f:
+        compressed = _HashingWriter(f)
+        with gzip.GzipFile(fileobj=compressed, mode='wb', mtime=0) as gzip_file:
+            uncompressed = _HashingWriter(gzip_file)  # type: ignore
+            with tarfile.open(
+                fileobj=uncompressed, mode='w|', format=tarfile.PAX_FORMAT  # type: ignore
+            ) as layer_tar:
+                for copy_instruction in dockerfile.copies:
+                    _add_to_layer(layer_tar, context_dir, copy_instruction)
+
+    return _Layer(
+        layer_path,
+        f'sha256:{compressed.sha256.hexdigest()}',
+        f'sha256:{uncompressed.sha256.hexdigest()}',
+        compressed.size,
+    )
+
+
+def _get_base_image(base_image: str, arch: str) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+    """
+    Get the manifest and the image config of the base image for the architecture.
+
+    :param str base_image: the pull specification of the base image
+    :param str arch: the architecture of the image to assemble
+    :return: the pull specification of the selected image, its manifest and its image config
+    :rtype: tuple
+    :raises _UnsupportedBuild: if the base image can't be referenced by a Docker v2s2 manifest
+    :raises IIBError: if the base image doesn't exist for the architecture
+    """
+    client = get_registry_client()
+    manifest = client.get_manifest(base_image)
+    pull_spec = base_image
+    if manifest.media_type in MANIFEST_LIST_MEDIA_TYPES:
+        for arch_manifest in manifest.json().get('manifests', []):
+            arch_platform = arch_manifest.get('platform', {})
+            if arch_platform.get('os') == 'linux' and arch_platform.get('architecture') == arch:
+                break
+        else:
+            raise IIBError(f'The image {base_image} is not available for the arch {arch}')
+        image = parse_image_reference(base_image)
+        pull_spec = f'{image.registry}/{image.repository}@{arch_manifest["digest"]}'
+        manifest = client.get_manifest(pull_spec)
+    if manifest.media_type not in IMAGE_MANIFEST_MEDIA_TYPES:
+        raise _UnsupportedBuild(f'the base image manifest media type {manifest.media_type}')
+
+    manifest_json = manifest.json()
+    for layer in manifest_json.get('layers', []):
+        if layer.get('mediaType') not in _GZIP_LAYER_MEDIA_TYPES or layer.get('urls'):
+            raise _UnsupportedBuild(f'the base image layer media type {layer.get("mediaType")}')
+    config = json.loads(client.get_blob(pull_spec, manifest_json['config']['digest']))
+    if config.get('architecture') != arch:
+        raise IIBError(
+            f'Wrong arch of the base image {base_image}, expected arch {arch}, '
+            f'found {config.get("architecture")}'
+        )
+    return pull_spec, manifest_json, config
+
+
+def _create_image_config(
+    base_config: Dict[str, Any], dockerfile: _Dockerfile, layer: _Layer, arch: str
+) -> Dict[str, Any]:
+    """
+    Create the image config of the assembled image like ``buildah bud`` would.
+
+    :param dict base_config: the image config of the base image, empty for ``scratch``
+    :param _Dockerfile dockerfile: the parsed Dockerfile
+    :param _Layer layer: the layer added on top of the base image
+    :param str arch: the architecture of the image
+    :return: the image config
+    :rtype: dict
+    """
+    image_config = copy.deepcopy(base_config)
+    created = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    image_config.update({'architecture': arch, 'os': 'linux', 'created': created})
+    container_config = image_config.setdefault('config', {})
+    container_config.setdefault('Labels', {})
+    container_config['Labels'] = dict(container_config['Labels'] or {}, **dockerfile.labels)
+    if dockerfile.entrypoint is not None:
+        container_config['Entrypoint'] = dockerfile.entrypoint
+        # Like docker, the command of the base image doesn't apply to a new entrypoint
+        container_config['Cmd'] = dockerfile.cmd
+    elif dockerfile.cmd is not None:
+        container_config['Cmd'] = dockerfile.cmd
+
+    rootfs = image_config.setdefault('rootfs', {'type': 'layers'})
+    rootfs['diff_ids'] = list(rootfs.get('diff_ids') or []) + [layer.diff_id]
+    history = list(image_config.get('history') or [])
+    for instruction in dockerfile.instructions[1:]:
+        history.append(
+            {
+                'created': created,
+                'created_by': f'/bin/sh -c #(nop) {instruction}',
+                'empty_layer': True,
+            }
+        )
+    history.append({'created': created, 'comment': 'Assembled by IIB'})
+    image_config['history'] = history
+    return image_config
+
+
+def _push_arch_image(dockerfile: _Dockerfile, layer: _Layer, arch: str, destination: str) -> None:
+    """
+    Push the image of the architecture made of the base image layers and the shared layer.
+
+    :param _Dockerfile dockerfile: the parsed Dockerfile
+    :param _Layer layer: the shared layer, which must already be in the destination repository
+    :param str arch: the architecture of the image
+    :param str destination: the pull specification to push the image to
+    :raises _UnsupportedBuild: if the base image can't be used
+    :raises IIBError: if the push fails
+    """
+    client = get_registry_client()
+    base_layers: List[Dict[str, Any]] = []
+    base_config: Dict[str, Any] = {}
+    if dockerfile.base_image != 'scratch':
+        base_pull_spec, base_manifest, base_config = _get_base_image(dockerfile.base_image, arch)
+        base_layers = base_manifest.get('layers', [])
+        for base_layer in base_layers:
+            client.copy_blob(base_pull_spec, destination, base_layer)
+
+    image_config = json.dumps(
+        _create_image_config(base_config, dockerfile, layer, arch), sort_keys=True
+    ).encode('utf-8')
+    config_digest = f'sha256:{hashlib.sha256(image_config).hexdigest()}'
+    if not client.blob_exists(destination, config_digest):
+        client.upload_blob(destination, config_digest, image_config)
+
+    manifest = {
+        'schemaVersion': 2,
+        'mediaType': MEDIA_TYPE_DOCKER_MANIFEST,
+        'config': {
+            'mediaType': MEDIA_TYPE_DOCKER_CONFIG,
+            'size': len(image_config),
+            'digest': config_digest,
+        },
+        'layers': [
+            {'mediaType': MEDIA_TYPE_DOCKER_LAYER, 'size': base['size'], 'digest': base['digest']}
+            for base in base_layers
+        ]
+        + [{'mediaType': MEDIA_TYPE_DOCKER_LAYER, 'size': layer.size, 'digest': layer.digest}],
+    }
+    log.info('Pushing the assembled image for the arch %s to %s', arch, destination)
+    client.put_manifest(
+        destination, json.dumps(manifest, indent=3).encode('utf-8'), MEDIA_TYPE_DOCKER_MANIFEST
+    )
+
+
+def get_index_image_files(dockerfile_path: str) -> Dict[str, str]:
+    """
+    Get the files the Dockerfile adds to the index image which IIB extracts from index images.
+
+    These are the file-based catalog and the database referenced by the labels of the index image,
+    and the hidden database.
+
+    :param str dockerfile_path: the path to the Dockerfile; the sources are relative to its
+        directory
+    :return: the full paths within the index image mapped to the paths to the sources on the
+        local host, or an empty dictionary if the Dockerfile isn't supported, see
+        ``_parse_dockerfile``
+    :rtype: dict
+    """
+    context_dir = os.path.realpath(os.path.dirname(dockerfile_path))
+    try:
+        dockerfile = _parse_dockerfile(dockerfile_path)
+    except _UnsupportedBuild:
+        return {}
+
+    extracted_paths = {
+        os.path.normpath(path)
+        for path in (
+            dockerfile.labels.get('operators.operatorframework.io.index.configs.v1'),
+            dockerfile.labels.get('operators.operatorframework.io.index.database.v1'),
+            get_worker_config()['hidden_index_db_path'],
+        )
+        if path
+    }
+    files = {}
+    for copy_instruction in dockerfile.copies:
+        destination = os.path.normpath(copy_instruction.destination)
+        source = os.path.normpath(os.path.join(context_dir, copy_instruction.source))
+        if (
+            destination not in extracted_paths
+            or os.path.commonpath([source, context_dir]) != context_dir
+            or not os.path.lexists(source)
+            # ADD extracts the archives, so the source isn't the file in the image
+            or (os.path.isfile(source) and tarfile.is_tarfile(source))
+        ):
+            continue
+        files[destination] = source
+    return files
+
+
+def assemble_index_image(dockerfile_path: str, destinations: Dict[str, str]) -> bool:
+    """
+    Push the single arch images described by the Dockerfile without building them.
+
+    The content the Dockerfile adds to the base image, such as the file-based catalog, its cache
+    and the hidden database, is written to a single layer once. The image of each architecture
+    references the layers of the base image for that architecture plus the shared layer, and its
+    manifest and image config are pushed directly to the registry. The shared layer is uploaded
+    once and the base image layers are mounted or copied registry to registry.
+
+    :param str dockerfile_path: the path to the Dockerfile; the sources are relative to its
+        directory
+    :param dict destinations: the architectures mapped to the pull specifications to push their
+        images to; they must all be in the same repository
+    :return: ``True`` if the images were pushed, ``False`` if the images can't be assembled and
+        must be built instead
+    :rtype: bool
+    """
+    context_dir = os.path.realpath(os.path.dirname(dockerfile_path))
+    sorted_arches = sorted(destinations)
+    try:
+        dockerfile = _parse_dockerfile(dockerfile_path)
+        with tempfile.TemporaryDirectory(prefix='.iib-assemble-', dir=context_dir) as layer_dir:
+            layer = _create_layer(context_dir, dockerfile, layer_dir)
+            first_destination = destinations[sorted_arches[0]]
+            client = get_registry_client()
+            if not client.blob_exists(first_destination, layer.digest):
+                log.info('Uploading the layer %s (%d bytes)', layer.digest, layer.size)
+                with open(layer.path, 'rb') as f:
+                    client.upload_blob(first_destination, layer.digest, f, layer.size)
+
+        max_workers = max(
+            1, min(get_worker_config().iib_image_build_max_workers, len(sorted_arches))
+        )
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_push_arch_image, dockerfile, layer, arch, destinations[arch])
+                for arch in sorted_arches
+            ]
+            for future in futures:
+                future.result()
+    except (_UnsupportedBuild, IIBError, OSError) as e:
+        log.warning('Unable to assemble the images (%s), falling back to buildah', e)
+        return False
+
+    log.info(
+        'Assembled and pushed the images for the arches %s without building them',
+        ', '.join(sorted_arches),
+    )
+    return True
@@ -0,0 +1,290 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import logging
+import os
+import posixpath
+import shutil
+import tarfile
+import tempfile
+from typing import Dict, Iterable, List, Set
+
+import requests
+
+from iib.exceptions import IIBError
+from iib.workers.registry_client import get_registry_client, IMAGE_MANIFEST_MEDIA_TYPES
+
+log = logging.getLogger(__name__)
+
+# The media types of the layers which can be read as a stream, mapped to the tarfile mode
+_LAYER_TAR_MODES = {
+    'application/vnd.docker.image.rootfs.diff.tar.gzip': 'r|gz',
+    'application/vnd.oci.image.layer.v1.tar+gzip': 'r|gz',
+    'application/vnd.oci.image.layer.v1.tar': 'r|',
+}
+_WHITEOUT_PREFIX = '.wh.'
+_OPAQUE_WHITEOUT = '.wh..wh..opq'
+
+
+class _UnsupportedImage(Exception):
+    """The files can't be extracted by streaming the layers, so podman must be used instead."""
+
+
+def _normalize_path(path: str) -> str:
+    """
+    Normalize the path of a layer entry to an absolute path.
+
+    :param str path: the path as stored in the layer, for example ``./configs/``
+    :return: the absolute path, for example ``/configs``
+    :rtype: str
+    """
+    # normpath keeps a leading double slash, so strip all the leading slashes first
+    return posixpath.normpath('/' + path.lstrip('/'))
+
+
+def _ancestors(path: str) -> Iterable[str]:
+    """
+    Yield the path and all its parent directories, excluding the root directory.
+
+    :param str path: the normalized absolute path
+    """
+    while path != '/':
+        yield path
+        path = posixpath.dirname(path)
+
+
+class _LayerView:
+    """
+    Track which paths of the lower layers are still visible through the processed upper layers.
+
+    The layers are processed from the top one to the bottom one. A path of a lower layer is hidden
+    when an upper layer contains the same path, a whiteout for the path or one of its parent
+    directories, a non-directory in place of one of its parent directories, or an opaque whiteout
+    in one of its parent directories.
+    """
+
+    def __init__(self) -> None:
+        self.resolved: Set[str] = set()
+        self.non_directories: Set[str] = set()
+        self.whiteouts: Set[str] = set()
+        self.opaque_directories: Set[str] = set()
+
+    def is_hidden(self, path: str) -> bool:
+        """
+        Determine if the path in a lower layer is hidden by the upper layers.
+
+        :param str path: the normalized absolute path in a lower layer
+        :return: ``True`` if the path is hidden, ``False`` otherwise
+        :rtype: bool
+        """
+        for ancestor in _ancestors(path):
+            if ancestor in self.whiteouts or ancestor in self.non_directories:
+                return True
+            if ancestor != path and ancestor in self.opaque_directories:
+                return True
+        return False
+
+    def is_complete(self, path: str) -> bool:
+        """
+        Determine if the lower layers can no longer change the contents of the path.
+
+        :param str path: the normalized absolute path
+        :return: ``True`` if the lower layers don't need to be read, ``False`` otherwise
+        :rtype: bool
+        """
+        return self.is_hidden(path) or path in self.opaque_directories
+
+    def merge(self, layer: '_LayerView') -> None:
+        """
+        Apply the changes of a processed layer to the view of the lower layers.
+
+        :param _LayerView layer: the changes of the processed layer
+        """
+        self.resolved |= layer.resolved
+        self.non_directories |= layer.non_directories
+        self.whiteouts |= layer.whiteouts
+        self.opaque_directories |= layer.opaque_directories
+
+
+def _get_layers(manifest: Dict) -> List[Dict]:
+    """
+    Get the layers of the image manifest from the top one to the bottom one.
+
+    :param dict manifest: the image manifest
+    :return: the layers which can be streamed
+    :rtype: list
+    :raises _UnsupportedImage: if any of the layers can't be streamed
+    """
+    if manifest.get('mediaType', IMAGE_MANIFEST_MEDIA_TYPES[1]) not in IMAGE_MANIFEST_MEDIA_TYPES:
+        raise _UnsupportedImage(f'the manifest media type {manifest.get("mediaType")}')
+    layers = manifest.get('layers')
+    if not layers:
+        raise _UnsupportedImage('the manifest has no layers')
+    for layer in layers:
+        if layer.get('mediaType') not in _LAYER_TAR_MODES or layer.get('urls'):
+            raise _UnsupportedImage(f'the layer media type {layer.get("mediaType")}')
+    return list(reversed(layers))
+
+
+def _extract_member(
+    layer_tar: tarfile.TarFile,
+    member: tarfile.TarInfo,
+    path: str,
+    target: str,
+    staging_dir: str,
+    layer_targets: Dict[str, str],
+) -> None:
+    """
+    Write the tar member to the staging directory.
+
+    :param tarfile.TarFile layer_tar: the tar stream of the layer
+    :param tarfile.TarInfo member: the member to extract
+    :param str path: the normalized absolute path of the member within the image
+    :param str target: the path to write the member to
+    :param str staging_dir: the directory the extracted files must stay within
+    :param dict layer_targets: the extracted paths of the layer, used to resolve hardlinks
+    :raises IIBError: if the member would be written outside of the staging directory
+    :raises _UnsupportedImage: if the member is a hardlink to a file which wasn't extracted
+    """
+    parent = os.path.dirname(target)
+    os.makedirs(parent, exist_ok=True)
+    # A symlink extracted earlier must never redirect the writes outside of the staging directory
+    if os.path.commonpath([os.path.realpath(parent), staging_dir]) != staging_dir:
+        raise IIBError(f'The layer entry {member.name} points outside of the extracted path')
+
+    if os.path.lexists(target) and not (member.isdir() and os.path.isdir(target)):
+        if os.path.isdir(target) and not os.path.islink(target):
+            shutil.rmtree(target)
+        else:
+            os.remove(target)
+
+    if member.isdir():
+        os.makedirs(target, exist_ok=True)
+        os.chmod(target, member.mode | 0o700)
+    elif member.isfile():
+        fileobj = layer_tar.extractfile(member)
+        with open(target, 'wb') as f:
+            shutil.copyfileobj(fileobj, f)  # type: ignore
+        os.chmod(target, member.mode)
+    elif member.issym():
+        os.symlink(member.linkname, target)
+    elif member.islnk():
+        link_source = layer_targets.get(_normalize_path(member.linkname))
+        if not link_source:
+            raise _UnsupportedImage(f'the hardlink {member.name} to {member.linkname}')
+        os.link(link_source, target)
+    else:
+        log.debug('Skipping the special file %s', member.name)
+        return
+    layer_targets[path] = target
+
+
+def _extract_layer(
+    pull_spec: str,
+    layer: Dict,
+    src_path: str,
+    staging_dir: str,
+    view: _LayerView,
+) -> _LayerView:
+    """
+    Extract the entries of the layer under the source path which aren't hidden by upper layers.
+
+    :param str pull_spec: the pull specification of the image the layer belongs to
+    :param dict layer: the layer descriptor from the image manifest
+    :param str src_path: the normalized absolute path within the image to extract
+    :param str staging_dir: the directory to extract the source path into
+    :param _LayerView view: the paths hidden by the upper layers
+    :return: the changes of this layer
+    :rtype: _LayerView
+    :raises _UnsupportedImage: if the layer contents can't be handled
+    """
+    changes = _LayerView()
+    layer_targets: Dict[str, str] = {}
+    content_dir = os.path.join(staging_dir, 'content')
+    rv = get_registry_client().open_blob(pull_spec, layer['digest'])
+    try:
+        # The stream modes are picked from _LAYER_TAR_MODES which mypy sees as plain strings
+        tar_mode = _LAYER_TAR_MODES[layer['mediaType']]
+        with tarfile.open(fileobj=rv.raw, mode=tar_mode) as layer_tar:  # type: ignore
+            for member in layer_tar:
+                path = _normalize_path(member.name)
+                name = posixpath.basename(path)
+                if name == _OPAQUE_WHITEOUT:
+                    changes.opaque_directories.add(posixpath.dirname(path))
+                    continue
+                if name.startswith(_WHITEOUT_PREFIX):
+                    whiteout = posixpath.join(
+                        posixpath.dirname(path), name.removeprefix(_WHITEOUT_PREFIX)
+                    )
+                    changes.whiteouts.add(whiteout)
+                    continue
+
+                if src_path.startswith(f'{path}/'):
+                    # A parent directory of the source path
+                    if member.issym() and not view.is_hidden(path):
+                        raise _UnsupportedImage(f'the parent directory {path} is a symlink')
+                    if not member.isdir() and not view.is_hidden(path):
+                        changes.non_directories.add(path)
+                    continue
+                if path != src_path and not path.startswith(f'{src_path}/'):
+                    continue
+                if view.is_hidden(path) or path in view.resolved:
+                    continue
+
+                relative_path = posixpath.relpath(path, src_path)
+                target = os.path.normpath(os.path.join(content_dir, relative_path))
+                _extract_member(layer_tar, member, path, target, staging_dir, layer_targets)
+                # The layer may not contain an entry for the source directory itself
+                changes.resolved.update((path, src_path))
+                if not member.isdir():
+                    changes.non_directories.add(path)
+    except (tarfile.TarError, OSError, EOFError, requests.RequestException) as e:
+        raise _UnsupportedImage(f'reading the layer {layer["digest"]} failed: {e}')
+    finally:
+        rv.close()
+    return changes
+
+
+def extract_path_from_image(image: str, src_path: str, destination: str) -> bool:
+    """
+    Copy the file from the container image by streaming its layers from the registry.
+
+    The layers are read from the top one to the bottom one and only the entries under
+    ``src_path`` are written to disk. The lower layers are not downloaded once the upper layers
+    fully determine the contents of ``src_path``. Whiteouts and opaque whiteouts are honored.
+
+    :param str image: the pull specification of the container image
+    :param str src_path: the full path within the container image to copy from
+    :param str destination: the path on the local host to copy the file to; it must not exist
+    :return: ``True`` if the file was copied, ``False`` if the image can't be streamed and
+        must be pulled instead
+    :rtype: bool
+    :raises IIBError: if the path doesn't exist in the image
+    """
+    src_path = _normalize_path(src_path)
+    if src_path == '/':
+        return False
+
+    staging_dir = os.path.realpath(
+        tempfile.mkdtemp(prefix='.iib-extract-', dir=os.path.dirname(destination) or '.')
+    )
+    layers_read = 0
+    try:
+        try:
+            pull_spec, manifest = get_registry_client().get_image_manifest(image)
+            view = _LayerView()
+            for layer in _get_layers(manifest):
+                view.merge(_extract_layer(pull_spec, layer, src_path, staging_dir, view))
+                layers_read += 1
+                if view.is_complete(src_path):
+                    break
+        except (_UnsupportedImage, IIBError) as e:
+            log.warning('Unable to stream the layers of %s (%s), falling back to podman', image, e)
+            return False
+
+        if src_path not in view.resolved:
+            raise IIBError(f'Failed to copy the contents of {src_path} from {image}: not found')
+        os.rename(os.path.join(staging_dir, 'content'), destination)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    log.info('Extracted %s from %s by streaming %d layer(s)', src_path, image, layers_read)
+    return True
@@ -0,0 +1,798 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+import threading
+import time
+from typing import (
+    Any,
+    BinaryIO,
+    cast,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
+from urllib.parse import urljoin
+
+import requests
+from operator_manifest.operator import ImageName
+
+from iib.exceptions import IIBError, RegistryAuthenticationError, RegistryAvailabilityError
+from iib.workers.config import get_worker_config
+
+log = logging.getLogger(__name__)
+
+MEDIA_TYPE_DOCKER_MANIFEST = 'application/vnd.docker.distribution.manifest.v2+json'
+MEDIA_TYPE_DOCKER_MANIFEST_LIST = 'application/vnd.docker.distribution.manifest.list.v2+json'
+MEDIA_TYPE_DOCKER_MANIFEST_V1 = 'application/vnd.docker.distribution.manifest.v1+json'
+MEDIA_TYPE_DOCKER_MANIFEST_V1_SIGNED = 'application/vnd.docker.distribution.manifest.v1+prettyjws'
+MEDIA_TYPE_OCI_MANIFEST = 'application/vnd.oci.image.manifest.v1+json'
+MEDIA_TYPE_OCI_INDEX = 'application/vnd.oci.image.index.v1+json'
+MANIFEST_LIST_MEDIA_TYPES = (MEDIA_TYPE_DOCKER_MANIFEST_LIST, MEDIA_TYPE_OCI_INDEX)
+IMAGE_MANIFEST_MEDIA_TYPES = (MEDIA_TYPE_DOCKER_MANIFEST, MEDIA_TYPE_OCI_MANIFEST)
+_MANIFEST_ACCEPT = ', '.join(
+    (
+        MEDIA_TYPE_DOCKER_MANIFEST_LIST,
+        MEDIA_TYPE_OCI_INDEX,
+        MEDIA_TYPE_DOCKER_MANIFEST,
+        MEDIA_TYPE_OCI_MANIFEST,
+        MEDIA_TYPE_DOCKER_MANIFEST_V1_SIGNED,
+        MEDIA_TYPE_DOCKER_MANIFEST_V1,
+    )
+)
+_DOCKER_HUB_REGISTRY = 'registry-1.docker.io'
+# Tokens are renewed slightly before they expire to account for clock skew and slow requests
+_TOKEN_EXPIRATION_MARGIN = 10
+# The token lifetime to assume when the token server doesn't provide one, as per the spec
+_DEFAULT_TOKEN_EXPIRATION = 60
+
+
+class ImageReference(NamedTuple):
+    """A reference to a container image in a registry."""
+
+    registry: str
+    repository: str
+    # Either a tag or a digest
+    reference: str
+
+
+class Manifest(NamedTuple):
+    """A manifest or manifest list as returned by the registry."""
+
+    raw: str
+    media_type: str
+    digest: str
+
+    def json(self) -> Dict[str, Any]:
+        """Return the parsed manifest."""
+        return json.loads(self.raw)
+
+
+class PushedManifest(NamedTuple):
+    """A manifest or manifest list pushed while processing the request."""
+
+    digest: str
+    # The media type and the size are unknown if the push was done by another tool
+    media_type: Optional[str] = None
+    size: Optional[int] = None
+
+
+def parse_image_reference(pull_spec: str) -> ImageReference:
+    """
+    Parse the pull specification into the parts used by the distribution API.
+
+    :param str pull_spec: the pull specification of the container image, optionally prefixed
+        with ``docker://``
+    :return: the parsed image reference
+    :rtype: ImageReference
+    """
+    image_name = ImageName.parse(pull_spec.removeprefix('docker://'))
+    registry = image_name.registry or 'docker.io'
+    repository = '/'.join(part for part in (image_name.namespace, image_name.repo) if part)
+    if registry in ('docker.io', 'index.docker.io'):
+        registry = _DOCKER_HUB_REGISTRY
+        if '/' not in repository:
+            repository = f'library/{repository}'
+    return ImageReference(registry, repository, image_name.tag or 'latest')
+
+
+def _normalize_auth_key(key: str) -> str:
+    """
+    Normalize a key of the ``auths`` section of the Docker config.
+
+    :param str key: the key to normalize
+    :return: the key without the URL scheme and trailing slashes
+    :rtype: str
+    """
+    key = re.sub(r'^https?://', '', key).rstrip('/')
+    if key in ('index.docker.io/v1', 'index.docker.io', 'docker.io'):
+        return _DOCKER_HUB_REGISTRY
+    return key
+
+
+def _get_response_error_class(rv: requests.Response) -> Type[IIBError]:
+    """
+    Get the exception type describing why the registry request was not successful.
+
+    :param requests.Response rv: the unsuccessful response
+    :return: ``RegistryAvailabilityError`` if the registry failed with a server error or throttled
+        the request, ``RegistryAuthenticationError`` if the registry denied the credentials,
+        ``IIBError`` otherwise
+    :rtype: type
+    """
+    if rv.status_code == 429 or rv.status_code >= 500:
+        return RegistryAvailabilityError
+    if rv.status_code in (401, 403):
+        return RegistryAuthenticationError
+    return IIBError
+
+
+def _get_host_arch() -> str:
+    """
+    Get the architecture of the worker in the notation used in manifest lists.
+
+    :return: the architecture, for example ``amd64``
+    :rtype: str
+    """
+    machine = platform.machine()
+    for arch, formal_name in get_worker_config().iib_supported_archs.items():
+        if machine == formal_name:
+            return arch
+    return machine
+
+
+class RegistryClient:
+    """
+    A minimal client of the OCI distribution API for reading image metadata.
+
+    The client keeps a pool of keep-alive connections per registry, caches bearer tokens per
+    registry, repository scope and credentials, and reads the credentials from the same
+    ``~/.docker/config.json`` file that ``set_registry_token`` and ``set_registry_auths`` write.
+    The manifests pushed with ``put_manifest`` or recorded with ``record_pushed_manifest`` are kept
+    until ``forget_pushed_manifests`` is called, so that their digests are known without reading
+    them back. The client is safe to use
+    from multiple threads.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the client."""
+        conf = get_worker_config()
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=conf.iib_registry_client_pool_size,
+            pool_maxsize=conf.iib_registry_client_pool_size,
+        )
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self._authorizations: Dict[Tuple[str, str, str], Tuple[str, float]] = {}
+        self._docker_config_stat: Optional[Tuple[int, int, int]] = None
+        self._docker_auths: Dict[str, Tuple[str, str]] = {}
+        self._pushed_manifests: Dict[str, PushedManifest] = {}
+
+    def _get_base_url(self, registry: str) -> str:
+        """
+        Get the base URL of the registry.
+
+        :param str registry: the registry hostname (and port)
+        :return: the base URL of the registry
+        :rtype: str
+        """
+        if registry in get_worker_config().iib_registry_client_insecure_registries:
+            return f'http://{registry}'
+        return f'https://{registry}'
+
+    def _get_docker_auths(self) -> Dict[str, Tuple[str, str]]:
+        """
+        Get the credentials from the Docker config, reloading it only when it changed.
+
+        :return: a dictionary of normalized ``auths`` keys to the username and password
+        :rtype: dict
+        """
+        docker_config_path = os.path.join(os.path.expanduser('~'), '.docker', 'config.json')
+        try:
+            stat = os.stat(docker_config_path)
+        except FileNotFoundError:
+            self._docker_config_stat = None
+            self._docker_auths = {}
+            return self._docker_auths
+
+        stat_key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if stat_key == self._docker_config_stat:
+            return self._docker_auths
+
+        with open(docker_config_path, 'r') as f:
+            try:
+                docker_config = json.load(f)
+            except json.JSONDecodeError as e:
+                log.error('Invalid JSON file %s; %s', docker_config_path, e.msg)
+                raise IIBError(f'The Docker config at {docker_config_path} is not valid JSON')
+
+        auths = {}
+        for key, entry in docker_config.get('auths', {}).items():
+            if entry.get('auth'):
+                username, _, password = (
+                    base64.b64decode(entry['auth']).decode('utf-8').partition(':')
+                )
+            elif entry.get('username'):
+                username, password = entry['username'], entry.get('password', '')
+            else:
+                continue
+            auths[_normalize_auth_key(key)] = (username, password)
+
+        self._docker_config_stat = stat_key
+        self._docker_auths = auths
+        return auths
+
+    def _get_credentials(self, registry: str, repository: str) -> Optional[Tuple[str, str]]:
+        """
+        Get the credentials for the repository from the most specific ``auths`` entry.
+
+        :param str registry: the registry hostname (and port)
+        :param str repository: the repository in the registry
+        :return: the username and password, or ``None`` if there are no credentials
+        :rtype: tuple or None
+        """
+        with self._lock:
+            auths = self._get_docker_auths()
+        parts = [registry] + repository.split('/')
+        for i in range(len(parts), 0, -1):
+            credentials = auths.get('/'.join(parts[:i]))
+            if credentials:
+                return credentials
+        return None
+
+    def _get_authorization(
+        self,
+        registry: str,
+        scope: str,
+        credentials: Optional[Tuple[str, str]],
+        challenge: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Get the value of the ``Authorization`` header for the registry and scope.
+
+        :param str registry: the registry hostname (and port)
+        :param str scope: the token scope, for example ``repository:ns/repo:pull``; multiple
+            scopes are separated by spaces
+        :param tuple credentials: the username and password, or ``None`` for anonymous access
+        :param str challenge: the ``WWW-Authenticate`` header of the registry response; if not
+            set, only a cached authorization is returned
+        :return: the value of the ``Authorization`` header or ``None``
+        :rtype: str or None
+        :raises IIBError: if the token server rejects the request
+        """
+        credentials_id = hashlib.sha256(repr(credentials).encode('utf-8')).hexdigest()
+        cache_key = (registry, scope, credentials_id)
+        with self._lock:
+            cached = self._authorizations.get(cache_key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        if not challenge:
+            return None
+
+        scheme, _, params_str = challenge.partition(' ')
+        params = dict(re.findall(r'(\w+)="([^"]*)"', params_str))
+        if scheme.lower() == 'basic':
+            if not credentials:
+                return None
+            encoded = base64.b64encode(':'.join(credentials).encode('utf-8')).decode('utf-8')
+            authorization = f'Basic {encoded}'
+            expiration = float('inf')
+        elif scheme.lower() == 'bearer' and params.get('realm'):
+            token_params: Dict[str, Any] = {'scope': scope.split(' ')}
+            if params.get('service'):
+                token_params['service'] = params['service']
+            log.debug('Requesting a token from %s for the scope %s', params['realm'], scope)
+            try:
+                rv = self._session.get(
+                    params['realm'],
+                    params=token_params,
+                    auth=credentials,
+                    timeout=get_worker_config().iib_registry_client_timeout,
+                )
+            except requests.RequestException as e:
+                raise RegistryAvailabilityError(f'Failed to get a token for {registry}: {e}')
+            if not rv.ok:
+                log.error(
+                    'Failed to get a token for the scope %s. The status was %d. The text was:\n%s',
+                    scope,
+                    rv.status_code,
+                    rv.text,
+                )
+                raise _get_response_error_class(rv)(
+                    f'Failed to get a token for {registry} with the scope {scope}'
+                )
+            token_json = rv.json()
+            token = token_json.get('token') or token_json.get('access_token')
+            if not token:
+                raise IIBError(f'The token server of {registry} did not return a token')
+            authorization = f'Bearer {token}'
+            expires_in = token_json.get('expires_in') or _DEFAULT_TOKEN_EXPIRATION
+            expiration = time.monotonic() + max(0, expires_in - _TOKEN_EXPIRATION_MARGIN)
+        else:
+            log.warning('Unsupported authentication challenge from %s: %s', registry, challenge)
+            return None
+
+        with self._lock:
+            self._authorizations[cache_key] = (authorization, expiration)
+        return authorization
+
+    def request(
+        self,
+        method: str,
+        image: ImageReference,
+        path: str,
+        actions: str = 'pull',
+        headers: Optional[Dict[str, str]] = None,
+        extra_scopes: Sequence[str] = (),
+        **kwargs: Any,
+    ) -> requests.Response:
+        """
+        Send an authenticated request to the repository of the image.
+
+        :param str method: the HTTP method
+        :param ImageReference image: the image whose repository the request is for
+        :param str path: the path relative to ``/v2/<repository>/`` or an absolute URL
+        :param str actions: the actions of the token scope, for example ``pull,push``
+        :param dict headers: additional headers of the request
+        :param list extra_scopes: additional token scopes the request needs, for example the
+            scope of the source repository of a cross-repository blob mount
+        :param kwargs: additional keyword arguments passed to ``requests.Session.request``
+        :return: the response; the caller is responsible for checking the status
+        :rtype: requests.Response
+        :raises RegistryAvailabilityError: if the connection to the registry fails
+        """
+        if path.startswith('http://') or path.startswith('https://'):
+            url = path
+        else:
+            url = f'{self._get_base_url(image.registry)}/v2/{image.repository}/{path}'
+        scope = ' '.join([f'repository:{image.repository}:{actions}', *extra_scopes])
+        credentials = self._get_credentials(image.registry, image.repository)
+        request_headers = dict(headers or {})
+        kwargs.setdefault('timeout', get_worker_config().iib_registry_client_timeout)
+
+        try:
+            authorization = self._get_authorization(image.registry, scope, credentials)
+            if authorization:
+                request_headers['Authorization'] = authorization
+            rv = self._session.request(method, url, headers=request_headers, **kwargs)
+            if rv.status_code == 401 and rv.headers.get('WWW-Authenticate'):
+                authorization = self._get_authorization(
+                    image.registry, scope, credentials, rv.headers['WWW-Authenticate']
+                )
+                if authorization:
+                    rv.close()
+                    request_headers['Authorization'] = authorization
+                    rv = self._session.request(method, url, headers=request_headers, **kwargs)
+        except requests.RequestException as e:
+            log.warning('The request to %s failed: %s', url, e)
+            raise RegistryAvailabilityError(f'The connection to {image.registry} failed: {e}')
+
+        return rv
+
+    def _check_response(
+        self, rv: requests.Response, pull_spec: str, exc_msg: Optional[str] = None
+    ) -> None:
+        """
+        Raise an error if the response was not successful.
+
+        :param requests.Response rv: the response to check
+        :param str pull_spec: the pull specification of the image, used in the error message
+        :param str exc_msg: a custom exception message to provide
+        :raises IIBError: if the response was not successful
+        """
+        if rv.ok:
+            return
+        log.error(
+            'The request to %s failed. The status was %d. The text was:\n%s',
+            rv.url,
+            rv.status_code,
+            rv.text,
+        )
+        raise _get_response_error_class(rv)(
+            exc_msg
+            or f'Failed to inspect docker://{pull_spec}. '
+            'Make sure it exists and is accessible to IIB.'
+        )
+
+    def get_manifest(self, pull_spec: str) -> Manifest:
+        """
+        Get the manifest or manifest list of the image.
+
+        :param str pull_spec: the pull specification of the container image
+        :return: the manifest as returned by the registry
+        :rtype: Manifest
+        :raises IIBError: if the manifest can't be retrieved
+        """
+        image = parse_image_reference(pull_spec)
+        rv = self.request(
+            'GET', image, f'manifests/{image.reference}', headers={'Accept': _MANIFEST_ACCEPT}
+        )
+        self._check_response(rv, pull_spec)
+        content = rv.content
+        media_type = rv.headers.get('Content-Type', '').split(';', 1)[0].strip()
+        parsed = json.loads(content)
+        if parsed.get('mediaType'):
+            media_type = parsed['mediaType']
+        digest = f'sha256:{hashlib.sha256(content).hexdigest()}'
+        if media_type in (MEDIA_TYPE_DOCKER_MANIFEST_V1, MEDIA_TYPE_DOCKER_MANIFEST_V1_SIGNED):
+            # The digest of a signed schema 1 manifest excludes the signatures, so rely on the
+            # registry to provide it
+            digest = rv.headers.get('Docker-Content-Digest', digest)
+        return Manifest(content.decode('utf-8'), media_type, digest)
+
+    def get_blob(self, pull_spec: str, digest: str) -> bytes:
+        """
+        Get a blob from the repository of the image.
+
+        :param str pull_spec: the pull specification of the container image
+        :param str digest: the digest of the blob
+        :return: the content of the blob
+        :rtype: bytes
+        :raises IIBError: if the blob can't be retrieved
+        """
+        image = parse_image_reference(pull_spec)
+        rv = self.request('GET', image, f'blobs/{digest}')
+        self._check_response(rv, pull_spec)
+        return rv.content
+
+    def open_blob(self, pull_spec: str, digest: str) -> requests.Response:
+        """
+        Start downloading a blob from the repository of the image without reading its content.
+
+        :param str pull_spec: the pull specification of the container image
+        :param str digest: the digest of the blob
+        :return: the streamed response which the caller must close
+        :rtype: requests.Response
+        :raises IIBError: if the blob can't be retrieved
+        """
+        image = parse_image_reference(pull_spec)
+        rv = self.request('GET', image, f'blobs/{digest}', stream=True)
+        try:
+            self._check_response(rv, pull_spec)
+        except IIBError:
+            rv.close()
+            raise
+        return rv
+
+    def get_image_manifest(self, pull_spec: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Get the manifest of the image for the architecture of the worker.
+
+        If the pull specification refers to a manifest list, the image for the architecture of
+        the worker is used, falling back to the first image in the manifest list.
+
+        :param str pull_spec: the pull specification of the container image
+        :return: the pull specification of the selected image and its manifest
+        :rtype: tuple
+        :raises IIBError: if the manifest can't be retrieved
+        """
+        manifest = self.get_manifest(pull_spec)
+        manifest_json = manifest.json()
+        if manifest.media_type in MANIFEST_LIST_MEDIA_TYPES:
+            selected = select_platform_manifest(manifest_json.get('manifests', []))
+            if not selected:
+                raise IIBError(f'The manifest list of {pull_spec} is empty')
+            image = parse_image_reference(pull_spec)
+            pull_spec = f'{image.registry}/{image.repository}@{selected["digest"]}'
+            manifest_json = self.get_manifest(pull_spec).json()
+        return pull_spec, manifest_json
+
+    def get_image_config(self, pull_spec: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the image config of the image, like ``skopeo inspect --config`` does.
+
+        If the pull specification refers to a manifest list, the image for the architecture of
+        the worker is used, falling back to the first image in the manifest list.
+
+        :param str pull_spec: the pull specification of the container image
+        :return: the image config or ``None`` if the image has no config blob (schema 1)
+        :rtype: dict or None
+        :raises IIBError: if the image config can't be retrieved
+        """
+        pull_spec, manifest_json = self.get_image_manifest(pull_spec)
+        config_digest = manifest_json.get('config', {}).get('digest')
+        if not config_digest:
+            return None
+        return json.loads(self.get_blob(pull_spec, config_digest))
+
+    def blob_exists(self, pull_spec: str, digest: str) -> bool:
+        """
+        Determine if the repository of the image already has the blob.
+
+        :param str pull_spec: the pull specification of the container image
+        :param str digest: the digest of the blob
+        :return: ``True`` if the blob exists, ``False`` otherwise
+        :rtype: bool
+        :raises IIBError: if the registry can't be reached
+        """
+        image = parse_image_reference(pull_spec)
+        rv = self.request('HEAD', image, f'blobs/{digest}', actions='pull,push')
+        return rv.ok
+
+    def mount_blob(self, pull_spec: str, digest: str, from_repository: str) -> bool:
+        """
+        Mount a blob from another repository of the same registry without copying its content.
+
+        :param str pull_spec: the pull specification of the container image to mount the blob to
+        :param str digest: the digest of the blob
+        :param str from_repository: the repository in the same registry which has the blob
+        :return: ``True`` if the blob was mounted, ``False`` if the registry declined the mount
+            and the blob must be uploaded instead
+        :rtype: bool
+        :raises IIBError: if the registry can't be reached
+        """
+        image = parse_image_reference(pull_spec)
+        rv = self.request(
+            'POST',
+            image,
+            'blobs/uploads/',
+            actions='pull,push',
+            params={'mount': digest, 'from': from_repository},
+            extra_scopes=[f'repository:{from_repository}:pull'],
+        )
+        if rv.status_code == 201:
+            log.debug('Mounted the blob %s from %s to %s', digest, from_repository, pull_spec)
+            return True
+        if rv.status_code == 202 and rv.headers.get('Location'):
+            # The registry started a regular upload instead, which is not needed
+            self.request(
+                'DELETE', image, self._get_upload_url(image, rv.headers['Location']), 'pull,push'
+            ).close()
+        return False
+
+    def _get_upload_url(self, image: ImageReference, location: str) -> str:
+        """
+        Get the absolute URL of an upload session from the ``Location`` header of the registry.
+
+        :param ImageReference image: the image whose repository the upload is for
+        :param str location: the value of the ``Location`` header, which may be relative
+        :return: the absolute URL of the upload session
+        :rtype: str
+        """
+        return urljoin(f'{self._get_base_url(image.registry)}/', location)
+
+    def upload_blob(
+        self,
+        pull_spec: str,
+        digest: str,
+        content: Union[bytes, BinaryIO],
+        size: Optional[int] = None,
+    ) -> None:
+        """
+        Upload a blob to the repository of the image in a single request.
+
+        :param str pull_spec: the pull specification of the container image
+        :param str digest: the digest of the blob
+        :param content: the content of the blob or a file object to stream it from
+        :param int size: the size of the blob, required when ``content`` is a file object
+        :raises IIBError: if the upload fails
+        """
+        image = parse_image_reference(pull_spec)
+        exc_msg = f'Failed to upload the blob {digest} to {image.registry}/{image.repository}'
+        rv = self.request('POST', image, 'blobs/uploads/', actions='pull,push')
+        self._check_response(rv, pull_spec, exc_msg)
+        upload_url = self._get_upload_url(image, rv.headers['Location'])
+        if size is None:
+            size = len(content)  # type: ignore
+        rv = self.request(
+            'PUT',
+            image,
+            upload_url,
+            actions='pull,push',
+            headers={'Content-Type': 'application/octet-stream', 'Content-Length': str(size)},
+            params={'digest': digest},
+            data=content,
+        )
+        self._check_response(rv, pull_spec, exc_msg)
+
+    def copy_blob(self, source_pull_spec: str, pull_spec: str, descriptor: Dict[str, Any]) -> None:
+        """
+        Copy a blob to the repository of the image unless it's already there.
+
+        Blobs within the same registry are mounted, other blobs are streamed from the source
+        registry to the destination registry without being stored locally.
+
+        :param str source_pull_spec: the pull specification of the image which has the blob
+        :param str pull_spec: the pull specification of the image to copy the blob to
+        :param dict descriptor: the descriptor of the blob with its ``digest`` and ``size``
+        :raises IIBError: if the blob can't be copied
+        """
+        digest = descriptor['digest']
+        if self.blob_exists(pull_spec, digest):
+            return
+        source = parse_image_reference(source_pull_spec)
+        destination = parse_image_reference(pull_spec)
+        if source.registry == destination.registry and self.mount_blob(
+            pull_spec, digest, source.repository
+        ):
+            return
+        log.debug('Copying the blob %s from %s to %s', digest, source_pull_spec, pull_spec)
+        rv = self.open_blob(source_pull_spec, digest)
+        try:
+            # The raw response is a file-like object streaming the undecoded content
+            self.upload_blob(pull_spec, digest, cast(BinaryIO, rv.raw), descriptor['size'])
+        finally:
+            rv.close()
+
+    def _copy_image_blobs(self, source_pull_spec: str, pull_spec: str, manifest: Manifest) -> None:
+        """
+        Copy the config and layers of a single image to the repository of the image.
+
+        :param str source_pull_spec: the pull specification of the image to copy
+        :param str pull_spec: the pull specification to copy the image to
+        :param Manifest manifest: the manifest of the image to copy
+        :raises IIBError: if the manifest isn't an image manifest or a blob can't be copied
+        """
+        if manifest.media_type not in IMAGE_MANIFEST_MEDIA_TYPES:
+            raise IIBError(
+                f'The manifest of {source_pull_spec} has the unsupported media type '
+                f'{manifest.media_type}'
+            )
+        manifest_json = manifest.json()
+        for descriptor in [manifest_json['config'], *manifest_json.get('layers', [])]:
+            self.copy_blob(source_pull_spec, pull_spec, descriptor)
+
+    def _copy_image_manifest(self, source_pull_spec: str, pull_spec: str) -> None:
+        """
+        Copy a single image with its blobs to the reference of the image.
+
+        :param str source_pull_spec: the pull specification of the image to copy
+        :param str pull_spec: the pull specification to copy the image to
+        :raises IIBError: if the image can't be copied
+        """
+        manifest = self.get_manifest(source_pull_spec)
+        self._copy_image_blobs(source_pull_spec, pull_spec, manifest)
+        self.put_manifest(pull_spec, manifest.raw.encode('utf-8'), manifest.media_type)
+
+    def copy_image(self, source_pull_spec: str, pull_spec: str) -> str:
+        """
+        Copy the image or manifest list to the reference of the image, like ``skopeo copy --all``.
+
+        The manifests are pushed unmodified, so their digests don't change. The blobs which the
+        destination repository doesn't have yet are mounted when both repositories are in the
+        same registry, otherwise they are streamed between the registries.
+
+        :param str source_pull_spec: the pull specification of the image to copy
+        :param str pull_spec: the pull specification to copy the image to
+        :return: the digest of the copied manifest or manifest list
+        :rtype: str
+        :raises IIBError: if the image can't be copied
+        """
+        manifest = self.get_manifest(source_pull_spec)
+        if manifest.media_type in MANIFEST_LIST_MEDIA_TYPES:
+            source = parse_image_reference(source_pull_spec)
+            destination = parse_image_reference(pull_spec)
+            digests = [child['digest'] for child in manifest.json().get('manifests', [])]
+            max_workers = min(len(digests), get_worker_config().iib_registry_client_pool_size)
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                futures = [
+                    executor.submit(
+                        self._copy_image_manifest,
+                        f'{source.registry}/{source.repository}@{digest}',
+                        f'{destination.registry}/{destination.repository}@{digest}',
+                    )
+                    for digest in digests
+                ]
+                for future in futures:
+                    future.result()
+        else:
+            self._copy_image_blobs(source_pull_spec, pull_spec, manifest)
+        log.debug('Pushing the manifest %s to %s', manifest.digest, pull_spec)
+        return self.put_manifest(pull_spec, manifest.raw.encode('utf-8'), manifest.media_type)
+
+    def put_manifest(self, pull_spec: str, content: bytes, media_type: str) -> str:
+        """
+        Push the manifest or manifest list to the reference of the image.
+
+        :param str pull_spec: the pull specification to push the manifest to
+        :param bytes content: the manifest as it must be stored in the registry
+        :param str media_type: the media type of the manifest
+        :return: the digest of the pushed manifest
+        :rtype: str
+        :raises IIBError: if the push fails
+        """
+        image = parse_image_reference(pull_spec)
+        rv = self.request(
+            'PUT',
+            image,
+            f'manifests/{image.reference}',
+            actions='pull,push',
+            headers={'Content-Type': media_type},
+            data=content,
+        )
+        self._check_response(rv, pull_spec, f'Failed to push the manifest to {pull_spec}')
+        digest = f'sha256:{hashlib.sha256(content).hexdigest()}'
+        self.record_pushed_manifest(pull_spec, digest, media_type, len(content))
+        return digest
+
+    def record_pushed_manifest(
+        self,
+        pull_spec: str,
+        digest: str,
+        media_type: Optional[str] = None,
+        size: Optional[int] = None,
+    ) -> None:
+        """
+        Record the manifest pushed to the pull specification.
+
+        This is done by ``put_manifest`` and must be done by the callers pushing with other tools
+        so that the digest doesn't have to be read back from the registry.
+
+        :param str pull_spec: the pull specification the manifest was pushed to
+        :param str digest: the digest of the pushed manifest
+        :param str media_type: the media type of the pushed manifest, if known
+        :param int size: the size of the pushed manifest, if known
+        """
+        with self._lock:
+            self._pushed_manifests[pull_spec.removeprefix('docker://')] = PushedManifest(
+                digest, media_type, size
+            )
+
+    def get_pushed_manifest(self, pull_spec: str) -> Optional[PushedManifest]:
+        """
+        Get the manifest which was recorded as pushed to the pull specification.
+
+        :param str pull_spec: the pull specification the manifest was pushed to
+        :return: the pushed manifest or ``None`` if no manifest was recorded for it
+        :rtype: PushedManifest or None
+        """
+        with self._lock:
+            return self._pushed_manifests.get(pull_spec.removeprefix('docker://'))
+
+    def forget_pushed_manifests(self) -> None:
+        """Forget the recorded pushed manifests."""
+        with self._lock:
+            self._pushed_manifests.clear()
+
+
+def select_platform_manifest(
+    manifests: List[Dict[str, Any]], arch: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Select the manifest of the linux platform of the architecture from a manifest list.
+
+    :param list manifests: the ``manifests`` of the manifest list
+    :param str arch: the architecture; defaults to the architecture of the worker
+    :return: the matching manifest, the first manifest if none matches, or ``None`` if
+        ``manifests`` is empty
+    :rtype: dict or None
+    """
+    arch = arch or _get_host_arch()
+    for manifest in manifests:
+        manifest_platform = manifest.get('platform', {})
+        if (
+            manifest_platform.get('os', 'linux') == 'linux'
+            and manifest_platform.get('architecture') == arch
+        ):
+            return manifest
+    return manifests[0] if manifests else None
+
+
+_registry_client: Optional[RegistryClient] = None
+_registry_client_lock = threading.Lock()
+
+
+def get_registry_client() -> RegistryClient:
+    """
+    Get the registry client shared by the worker process.
+
+    :return: the registry client
+    :rtype: RegistryClient
+    """
+    global _registry_client
+    with _registry_client_lock:
+        if _registry_client is None:
+            _registry_client = RegistryClient()
+        return _registry_client
@@ -0,0 +1,343 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""
+Share the retries of the calls to container registries between the calls of a worker process.
+
+The calls to the same container registry share its recent outcomes, from which:
+
+* the delay between the attempts grows with the failure rate of the registry,
+* a circuit breaker makes the calls fail without being attempted once most of them fail,
+* a retry budget caps the number of retries of all the calls to the registry.
+
+Each call has a single outcome, whatever its number of attempts. Only the calls failing with a
+``RegistryAvailabilityError``, such as a server error, a throttled call or a timeout, are failures
+of the registry. The other errors, such as a missing image or a denied access, are caused by the
+call itself, so they never open the circuit breaker nor use the retry budget.
+
+Usage:
+    @retry_registry_operation(lambda pull_spec: get_pull_spec_registry(pull_spec))
+    def func(pull_spec):
+        pass
+"""
+from collections import deque
+import functools
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Optional, Tuple, Type, TypeVar, cast
+
+from opentelemetry import trace
+from tenacity import (
+    before_sleep_log,
+    retry_if_exception_type,
+    retry_if_not_exception_type,
+    Retrying,
+    RetryCallState,
+    stop_after_attempt,
+)
+from tenacity.stop import stop_base
+
+from iib.exceptions import IIBError, RegistryAvailabilityError, RegistryUnavailableError
+from iib.workers.config import get_worker_config
+from iib.workers.registry_client import parse_image_reference
+
+log = logging.getLogger(__name__)
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half-open'
+
+# The number of seconds of outcomes and retries taken into account for a registry
+_WINDOW = 60
+# The maximum number of seconds to wait between two attempts
+_MAX_WAIT = 300
+# The transports of skopeo and podman which don't access a container registry
+_LOCAL_TRANSPORTS = (
+    'containers-storage:',
+    'dir:',
+    'docker-archive:',
+    'docker-daemon:',
+    'oci:',
+    'oci-archive:',
+)
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+class RegistryState:
+    """The outcomes of the recent calls to a container registry and its circuit breaker."""
+
+    def __init__(self, registry: str) -> None:
+        """
+        Initialize the state of the registry.
+
+        :param str registry: the container registry, for example ``quay.io``
+        """
+        self.registry = registry
+        self.circuit = CIRCUIT_CLOSED
+        self._lock = threading.Lock()
+        # The time and whether it failed of each recent call
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        # The time of each recent retry
+        self._retries: Deque[float] = deque()
+        self._opened_at = 0.0
+        self._trial_in_progress = False
+
+    def _prune(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - _WINDOW:
+            self._outcomes.popleft()
+        while self._retries and self._retries[0] < now - _WINDOW:
+            self._retries.popleft()
+
+    def _set_circuit(self, circuit: str) -> None:
+        if circuit == self.circuit:
+            return
+        failures = sum(failed for _, failed in self._outcomes)
+        log_level = logging.WARNING if circuit == CIRCUIT_OPEN else logging.INFO
+        log.log(
+            log_level,
+            'The circuit breaker of the registry %s is %s after %d failures in %d calls',
+            self.registry,
+            circuit,
+            failures,
+            len(self._outcomes),
+        )
+        span = trace.get_current_span()
+        span.add_event(
+            'registry_circuit_breaker',
+            {
+                'registry': self.registry,
+                'circuit': circuit,
+                'previous_circuit': self.circuit,
+                'failures': failures,
+                'calls': len(self._outcomes),
+            },
+        )
+        span.set_attribute(f'registry.{self.registry}.circuit', circuit)
+        self.circuit = circuit
+
+    @property
+    def failure_rate(self) -> float:
+        """Return the failure rate of the calls to the registry in the last minute."""
+        with self._lock:
+            self._prune(time.monotonic())
+            if not self._outcomes:
+                return 0.0
+            return sum(failed for _, failed in self._outcomes) / len(self._outcomes)
+
+    def before_call(self) -> None:
+        """
+        Check that the registry can be called.
+
+        Once the circuit breaker was open for ``iib_registry_circuit_breaker_reset_timeout``
+        seconds, a single trial call is let through to decide whether to close it.
+
+        :raises RegistryUnavailableError: if the circuit breaker is open
+        """
+        conf = get_worker_config()
+        with self._lock:
+            if self.circuit == CIRCUIT_CLOSED:
+                return
+            now = time.monotonic()
+            if (
+                self.circuit == CIRCUIT_OPEN
+                and now - self._opened_at >= conf.iib_registry_circuit_breaker_reset_timeout
+            ):
+                self._set_circuit(CIRCUIT_HALF_OPEN)
+            if self.circuit == CIRCUIT_HALF_OPEN and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return
+        raise RegistryUnavailableError(
+            f'The registry {self.registry} is unavailable after repeated failures, try again later'
+        )
+
+    def record_success(self) -> None:
+        """Record that a call to the registry succeeded."""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            if self.circuit == CIRCUIT_HALF_OPEN:
+                # The registry recovered, so its previous failures no longer matter
+                self._outcomes.clear()
+                self._trial_in_progress = False
+                self._set_circuit(CIRCUIT_CLOSED)
+            self._outcomes.append((now, False))
+
+    def record_abort(self) -> None:
+        """Record that a call to the registry stopped with an error which isn't a failure."""
+        with self._lock:
+            self._trial_in_progress = False
+
+    def record_failure(self) -> None:
+        """Record that a call to the registry failed, which may open the circuit breaker."""
+        conf = get_worker_config()
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            self._outcomes.append((now, True))
+            if self.circuit == CIRCUIT_HALF_OPEN:
+                self._trial_in_progress = False
+                self._opened_at = now
+                self._set_circuit(CIRCUIT_OPEN)
+                return
+            failures = sum(failed for _, failed in self._outcomes)
+            if (
+                self.circuit == CIRCUIT_CLOSED
+                and len(self._outcomes) >= conf.iib_registry_circuit_breaker_min_calls
+                and failures / len(self._outcomes) >= conf.iib_registry_circuit_breaker_failure_rate
+            ):
+                self._opened_at = now
+                self._set_circuit(CIRCUIT_OPEN)
+
+    def acquire_retry(self) -> bool:
+        """
+        Take a retry from the retry budget of the registry.
+
+        :return: ``True`` if the call can be retried, ``False`` if the registry is unavailable or
+            the retry budget is exhausted
+        :rtype: bool
+        """
+        conf = get_worker_config()
+        with self._lock:
+            if self.circuit != CIRCUIT_CLOSED:
+                return False
+            now = time.monotonic()
+            self._prune(now)
+            if len(self._retries) >= conf.iib_registry_retry_budget:
+                log.warning(
+                    'The retry budget of %d retries per minute of the registry %s is exhausted',
+                    conf.iib_registry_retry_budget,
+                    self.registry,
+                )
+                return False
+            self._retries.append(now)
+            return True
+
+
+_registry_states: Dict[str, RegistryState] = {}
+_registry_states_lock = threading.Lock()
+
+
+def get_registry_state(registry: str) -> RegistryState:
+    """
+    Get the state of the container registry shared by all the calls of the worker process.
+
+    :param str registry: the container registry, for example ``quay.io``
+    :return: the state of the registry
+    :rtype: RegistryState
+    """
+    with _registry_states_lock:
+        return _registry_states.setdefault(registry, RegistryState(registry))
+
+
+def clear_registry_states() -> None:
+    """Forget the outcomes of the calls to all the container registries."""
+    with _registry_states_lock:
+        _registry_states.clear()
+
+
+def get_pull_spec_registry(pull_spec: str) -> Optional[str]:
+    """
+    Get the container registry accessed to pull or push the image.
+
+    :param str pull_spec: the pull specification of the container image, optionally prefixed
+        with a skopeo transport
+    :return: the registry, or ``None`` if the transport doesn't access a container registry
+    :rtype: str or None
+    """
+    if pull_spec.startswith(_LOCAL_TRANSPORTS):
+        return None
+    return parse_image_reference(pull_spec).registry
+
+
+class _stop_if_registry_unavailable(stop_base):
+    """Stop when the registry is unavailable or its retry budget is exhausted."""
+
+    def __init__(self, state: Optional[RegistryState]) -> None:
+        self.state = state
+
+    def __call__(self, retry_state: RetryCallState) -> bool:
+        if self.state is None or retry_state.outcome is None:
+            return False
+        if not isinstance(retry_state.outcome.exception(), RegistryAvailabilityError):
+            # The failures not caused by the registry don't take from its retry budget
+            return False
+        return not self.state.acquire_retry()
+
+
+class _wait_registry:
+    """Wait exponentially with jitter, longer the more the calls to the registry fail."""
+
+    def __init__(self, state: Optional[RegistryState]) -> None:
+        self.state = state
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        wait = get_worker_config().iib_retry_multiplier * 2 ** (retry_state.attempt_number - 1)
+        if self.state:
+            wait *= 1 + self.state.failure_rate
+        # Spread the retries of the concurrent calls which failed at the same time
+        return min(random.uniform(wait / 2, wait), _MAX_WAIT)
+
+
+def retry_registry_operation(
+    get_registry: Callable[..., Optional[str]],
+    retry_on: Type[BaseException] = IIBError,
+) -> Callable[[F], F]:
+    """
+    Retry the calls to a container registry with the retry policy shared by the registry.
+
+    The call is retried up to ``iib_total_attempts`` times. The failures of the registry are only
+    retried while the circuit breaker of the registry is closed and its retry budget isn't
+    exhausted, and only the calls which still fail with a ``RegistryAvailabilityError`` after their
+    last attempt count as failures of the registry. The calls to no registry are retried with the
+    same backoff, but without the circuit breaker and the retry budget.
+
+    :param callable get_registry: the function returning the registry accessed by the call from
+        its arguments, or ``None`` if it doesn't access a registry
+    :param type retry_on: the exception type of the failures to retry
+    :return: the decorator
+    :rtype: callable
+    :raises RegistryUnavailableError: if the circuit breaker of the registry is open
+    """
+
+    def decorator(func: F) -> F:
+        # The retry policy shared by the calls, which is completed with the registry of each call
+        retrying = Retrying(
+            before_sleep=before_sleep_log(log, logging.WARNING),
+            reraise=True,
+            retry=(
+                retry_if_exception_type(retry_on)
+                & retry_if_not_exception_type(RegistryUnavailableError)
+            ),
+            wait=_wait_registry(None),
+        )
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            registry = get_registry(*args, **kwargs)
+            state = get_registry_state(registry) if registry else None
+            call_retrying = retrying.copy(
+                stop=stop_after_attempt(get_worker_config().iib_total_attempts)
+                | _stop_if_registry_unavailable(state),
+                wait=_wait_registry(state),
+            )
+            if state is None:
+                return call_retrying(func, *args, **kwargs)
+
+            state.before_call()
+            try:
+                rv = call_retrying(func, *args, **kwargs)
+            except RegistryAvailabilityError:
+                state.record_failure()
+                raise
+            except BaseException:
+                state.record_abort()
+                raise
+            state.record_success()
+            return rv
+
+        # Like the functions decorated with tenacity's retry
+        wrapper.retry = retrying  # type: ignore[attr-defined] # noqa: F821
+        return cast(F, wrapper)
+
+    return decorator
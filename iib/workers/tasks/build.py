@@ -1,11 +1,15 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
 import logging
 import os
+import re
 import shutil
 import stat
 import tempfile
 import ruamel.yaml
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from operator_manifest.operator import ImageName, OperatorManifest
 from tenacity import (
@@ -13,22 +17,68 @@ from tenacity import (
     retry,
     retry_if_exception_type,
     stop_after_attempt,
-    wait_exponential,
     wait_incrementing,
 )
 
 from iib.common.common_utils import get_binary_versions
 from iib.common.tracing import instrument_tracing
-from iib.exceptions import IIBError, ExternalServiceError
+from iib.exceptions import IIBError, ExternalServiceError, RegistryUnavailableError
 from iib.workers.api_utils import set_request_state, update_request
+from iib.workers.artifact_cache import (
+    add_retained_files_to_cache,
+    add_to_cache,
+    copy_from_cache,
+    discard_retained_files,
+    get_copy_destination,
+    has_retained_files,
+    retain_files,
+)
+from iib.workers.build_memo import (
+    forget_build,
+    get_build_fingerprint,
+    get_memoized_build,
+    memoize_build,
+    MemoizedBuild,
+)
+from iib.workers.checkpoints import (
+    Checkpoint,
+    get_checkpoint,
+    get_checkpoint_context_dir,
+    PHASE_CONTEXT_PREPARED,
+    PHASE_IMAGES_PUSHED,
+    PHASE_MANIFEST_LIST_PUSHED,
+    remove_checkpoint,
+    save_checkpoint,
+)
 from iib.workers.config import get_worker_config
+from iib.workers.dogpile_cache import invalidate_tag_cache
 from iib.workers.tasks.celery import app
 from iib.workers.greenwave import gate_bundles
-from iib.workers.tasks.fbc_utils import is_image_fbc, get_catalog_dir, merge_catalogs_dirs
+from iib.workers.image_assembler import assemble_index_image, get_index_image_files
+from iib.workers.image_extractor import extract_path_from_image
+from iib.workers.registry_client import (
+    get_registry_client,
+    MEDIA_TYPE_DOCKER_MANIFEST,
+    MEDIA_TYPE_DOCKER_MANIFEST_LIST,
+    MEDIA_TYPE_OCI_INDEX,
+    MANIFEST_LIST_MEDIA_TYPES,
+    parse_image_reference,
+    PushedManifest,
+)
+from iib.workers.registry_resilience import get_pull_spec_registry, retry_registry_operation
+from iib.workers.tasks.fbc_utils import (
+    is_image_fbc,
+    get_catalog_dir,
+    get_catalog_package_digests,
+    merge_catalogs_dirs,
+)
 from iib.workers.tasks.git_utils import push_configs_to_git, revert_last_commit
 from iib.workers.tasks.opm_operations import (
+    clear_validated_packages,
+    memoize_retained_validated_packages,
     opm_registry_add_fbc,
     opm_migrate,
+    opm_migrate_changed_packages,
     opm_registry_rm_fbc,
     deprecate_bundles_fbc,
     generate_cache_locally,
@@ -45,17 +95,23 @@ from iib.workers.tasks.opm_operations import (
 from iib.workers.tasks.utils import (
     add_max_ocp_version_property,
     chmod_recursively,
+    clear_image_metadata,
     get_bundles_from_deprecation_list,
+    get_image_labels,
+    get_image_usage,
     get_operator_packages_from_deprecation_list,
     get_resolved_bundles,
     get_resolved_image,
+    get_resolved_pushed_image,
     podman_pull,
+    record_image_use,
     request_logger,
     reset_docker_config,
     run_cmd,
     set_registry_token,
     skopeo_inspect,
     RequestConfigAddRm,
+    get_image_arches,
     get_image_label,
     verify_labels,
     prepare_request_for_build,
@@ -72,6 +128,12 @@ __all__ = ['handle_add_request', 'handle_rm_request']
 
 log = logging.getLogger(__name__)
 worker_config = get_worker_config()
+# The local repository of the images kept by the build cache, see _build_image
+_BUILD_CACHE_REPOSITORY = 'localhost/iib-build-cache'
+_UNCHANGED_INDEX_IMAGE_REASON = 'The index image was unchanged, so the from_index image was reused'
+_MEMOIZED_INDEX_IMAGE_REASON = (
+    'The index image built by a previous request with the same inputs was reused'
+)
 
 
 @retry(
@@ -84,20 +146,41 @@ worker_config = get_worker_config()
         increment=worker_config.iib_retry_jitter,
     ),
 )
-def _build_image(dockerfile_dir: str, dockerfile_name: str, request_id: int, arch: str) -> None:
+def _build_image(
+    dockerfile_dir: str,
+    dockerfile_name: str,
+    request_id: int,
+    arch: str,
+    use_cache: bool = False,
+) -> None:
     """
     Build the index image for the specified architecture.
 
+    With ``use_cache``, the image previously built from the same inputs is reused, see
+    ``_get_build_cache_key``. If there is no such image, the image is built with ``--layers`` so
+    that the intermediate layers of the previous builds with the same base image and copied
+    content are reused. The built image is then kept in the build cache until the image garbage
+    collection removes it as one of the least recently used images.
+
     :param str dockerfile_dir: the path to the directory containing the data used for
         building the container image
     :param str dockerfile_name: the name of the Dockerfile in the dockerfile_dir to
         be used when building the container image
     :param int request_id: the ID of the IIB build request
     :param str arch: the architecture to build this image for
+    :param bool use_cache: if True, the build cache is used instead of building the image with
+        ``--no-cache``
     :raises IIBError: if the build fails
     """
     local_destination: str = _get_local_pull_spec(request_id, arch, include_transport=True)
     destination: str = local_destination.split('/')[1]
+    cache_image = None
+    if use_cache:
+        cache_key = _get_build_cache_key(dockerfile_dir, dockerfile_name, arch)
+        if cache_key:
+            cache_image = f'{_BUILD_CACHE_REPOSITORY}:{cache_key}'
+            if _tag_cached_image(cache_image, destination):
+                return
     log.info(
         'Building the container image with the %s dockerfile for arch %s and tagging it as %s',
         dockerfile_name,
@@ -110,22 +193,27 @@ def _build_image(dockerfile_dir: str, dockerfile_name: str, request_id: int, arc
     #
     # NOTE: The argument "--format docker" ensures buildah will not generate an index image with
     # default OCI v1 manifest but always use Docker v2 format.
+    build_cmd = [
+        'buildah',
+        'bud',
+        '--layers' if cache_image else '--no-cache',
+        '--format',
+        'docker',
+        '--override-arch',
+        arch,
+        '--arch',
+        arch,
+        '-t',
+        destination,
+        '-f',
+        dockerfile_path,
+    ]
+    if worker_config.iib_image_gc_policy == 'lru':
+        # Images are kept between requests, so make sure a floating tag of the binary image is
+        # not resolved to a stale local image. Layers which are already present are not pulled.
+        build_cmd.insert(3, '--pull-always')
     run_cmd(
-        [
-            'buildah',
-            'bud',
-            '--no-cache',
-            '--format',
-            'docker',
-            '--override-arch',
-            arch,
-            '--arch',
-            arch,
-            '-t',
-            destination,
-            '-f',
-            dockerfile_path,
-        ],
+        build_cmd,
         {'cwd': dockerfile_dir},
         exc_msg=f'Failed to build the container image on the arch {arch}',
     )
@@ -147,33 +235,269 @@ def _build_image(dockerfile_dir: str, dockerfile_name: str, request_id: int, arc
             f'expected arch {archmap.get(arch)}, found {destination_arch}'
         )
 
+    if cache_image:
+        run_cmd(
+            ['podman', 'tag', destination, cache_image],
+            exc_msg=f'Failed to tag the container image {destination} as {cache_image}',
+        )
+        record_image_use(cache_image)
+
+
+def _get_build_cache_key(dockerfile_dir: str, dockerfile_name: str, arch: str) -> Optional[str]:
+    """
+    Get the key of the build cache entry of the Dockerfile for the architecture.
+
+    The key is a hash of the architecture, the Dockerfile, the digest of the base image and the
+    paths, permissions and content of the files copied into the image.
+
+    :param str dockerfile_dir: the path to the directory containing the data used for
+        building the container image
+    :param str dockerfile_name: the name of the Dockerfile in the dockerfile_dir
+    :param str arch: the architecture to build the image for
+    :return: the key or ``None`` if the build can't be cached because the Dockerfile runs
+        commands, has multiple stages or adds remote or wildcard sources
+    :rtype: str or None
+    """
+    with open(os.path.join(dockerfile_dir, dockerfile_name), 'r') as f:
+        dockerfile = f.read()
+
+    base_images = []
+    sources = set()
+    for line in re.sub(r'\\\n', ' ', dockerfile).splitlines():
+        instruction, _, args = line.strip().partition(' ')
+        instruction = instruction.upper()
+        if instruction == 'FROM':
+            base_images.append(args.split()[0])
+        elif instruction in ('ADD', 'COPY'):
+            args = args.strip()
+            while args.startswith('--'):
+                args = args.partition(' ')[2].strip()
+            paths = json.loads(args) if args.startswith('[') else args.split()
+            for source in paths[:-1]:
+                if '://' in source or any(char in source for char in '*?['):
+                    return None
+                sources.add(os.path.normpath(source))
+        elif instruction == 'RUN':
+            return None
+    if len(base_images) != 1:
+        return None
+
+    cache_key = hashlib.sha256()
+    cache_key.update(f'{arch}\0{dockerfile}\0'.encode('utf-8'))
+    if base_images[0] != 'scratch':
+        cache_key.update(get_resolved_image(base_images[0]).encode('utf-8'))
+    for source in sorted(sources):
+        source_path = os.path.join(dockerfile_dir, source)
+        if not os.path.lexists(source_path):
+            # Let buildah report the missing source
+            return None
+        paths = [source_path]
+        for root, dirs, files in os.walk(source_path):
+            dirs.sort()
+            paths.extend(os.path.join(root, name) for name in dirs + sorted(files))
+        for path in paths:
+            path_stat = os.lstat(path)
+            relative_path = os.path.relpath(path, dockerfile_dir)
+            cache_key.update(f'\0{relative_path}\0{path_stat.st_mode:o}\0'.encode('utf-8'))
+            if stat.S_ISLNK(path_stat.st_mode):
+                cache_key.update(os.readlink(path).encode('utf-8'))
+            elif stat.S_ISREG(path_stat.st_mode):
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        cache_key.update(chunk)
+    return cache_key.hexdigest()
+
+
+def _tag_cached_image(cache_image: str, destination: str) -> bool:
+    """
+    Tag the image kept by the build cache as the image of the request, if it exists.
+
+    :param str cache_image: the pull specification of the image in the build cache
+    :param str destination: the local pull specification of the image of the request
+    :return: ``True`` if the cached image was tagged, ``False`` if it doesn't exist
+    :rtype: bool
+    :raises IIBError: if the cached image can't be tagged
+    """
+    if not run_cmd(['podman', 'images', '--quiet', cache_image], strict=False).strip():
+        return False
+    log.info('Reusing the container image %s built from the same inputs', cache_image)
+    run_cmd(
+        ['podman', 'tag', cache_image, destination],
+        exc_msg=f'Failed to tag the container image {cache_image} as {destination}',
+    )
+    record_image_use(cache_image)
+    return True
+
 
 def _cleanup() -> None:
     """
-    Remove all existing container images on the host.
+    Remove the stale container images on the host.
 
-    This will ensure that the host will not run out of disk space due to stale data, and that
-    all images referenced using floating tags will be up to date on the host.
+    This will ensure that the host will not run out of disk space due to stale data. With the
+    ``all`` value of ``iib_image_gc_policy``, all the images are removed so that all images
+    referenced using floating tags will be up to date on the host. With the ``lru`` value, only
+    the images of the IIB requests and the least recently used images are removed, see
+    ``_garbage_collect_images``.
 
     Additionally, this function will reset the Docker ``config.json`` to
-    ``iib_docker_config_template``.
+    ``iib_docker_config_template`` and forget the lookups of images by tag, the image metadata and
+    the validated packages kept in memory and the files retained for the artifact cache by the
+    previous request.
 
     :raises IIBError: if the command to remove the container images fails
     """
-    log.info('Removing all existing container images')
+    if get_worker_config().iib_image_gc_policy == 'lru':
+        _garbage_collect_images()
+    else:
+        log.info('Removing all existing container images')
+        run_cmd(
+            ['podman', 'rmi', '--all', '--force'],
+            exc_msg='Failed to remove the existing container images',
+        )
+    reset_docker_config()
+    invalidate_tag_cache()
+    clear_image_metadata()
+    clear_validated_packages()
+    discard_retained_files()
+
+
+def _get_request_image_regex() -> re.Pattern:
+    """
+    Get the regular expression matching the names of the images built by IIB requests.
+
+    :return: the compiled regular expression
+    :rtype: re.Pattern
+    """
+    conf = get_worker_config()
+    placeholder = 'IIBREQUESTID'
+    push_template = conf['iib_image_push_template'].format(
+        registry=conf['iib_registry'], request_id=placeholder
+    )
+    push_regex = re.escape(push_template).replace(placeholder, r'[^/:@]+')
+    local_repository = _get_local_pull_spec(0, '').split(':', 1)[0]
+    local_regex = re.escape(f'localhost/{local_repository}:') + r'[^/:@]+'
+    return re.compile(rf'^(?:{push_regex}|{local_regex})$')
+
+
+def _matches_any(image: Dict[str, Any], pull_specs: Set[str]) -> bool:
+    """Determine if any of the names or digests of the listed podman image is in the set."""
+    names = set(image.get('Names') or []) | set(image.get('RepoDigests') or [])
+    return bool(names & pull_specs)
+
+
+def _get_last_use(image: Dict[str, Any], usage: Dict[str, float]) -> float:
+    """Get the time the listed podman image was last used by this worker."""
+    names = (image.get('Names') or []) + (image.get('RepoDigests') or [])
+    # Images which weren't used by this worker are ordered by their creation time
+    return max([usage[name] for name in names if name in usage] or [image.get('Created') or 0])
+
+
+def _get_storage_usage() -> float:
+    """
+    Get the used fraction of the file system holding the container images.
+
+    :return: the used fraction, between 0 and 1
+    :rtype: float
+    """
+    graph_root = run_cmd(
+        ['podman', 'info', '--format', '{{.Store.GraphRoot}}'],
+        exc_msg='Failed to get the location of the container storage',
+    ).strip()
+    disk_usage = shutil.disk_usage(graph_root)
+    return disk_usage.used / disk_usage.total
+
+
+def _remove_images(image_refs: List[str]) -> None:
+    """
+    Remove the container images, logging instead of failing if they can't be removed.
+
+    :param list image_refs: the names or IDs of the container images
+    """
+    if not image_refs:
+        return
+    try:
+        run_cmd(
+            ['podman', 'rmi', '--force'] + image_refs,
+            exc_msg=f'Failed to remove the container images {", ".join(image_refs)}',
+        )
+    except IIBError as e:
+        # The images may have been removed in the meantime, which is fine
+        log.warning(e)
+
+
+def _garbage_collect_images() -> None:
+    """
+    Remove the images of the IIB requests and the least recently used container images.
+
+    The images built by IIB requests are always removed. The binary images and the
+    ``iib_image_gc_recent_from_index`` most recently used index images are kept. The other images
+    are removed from the least recently used one until their total size is at most
+    ``iib_image_gc_max_size`` and the file system holding them is used below
+    ``iib_image_gc_high_water_mark``. If the file system is still above the high-water mark,
+    all the images are removed.
+
+    :raises IIBError: if the container images can't be listed
+    """
+    conf = get_worker_config()
+    images = json.loads(
+        run_cmd(
+            ['podman', 'images', '--format', 'json'],
+            exc_msg='Failed to list the existing container images',
+        )
+        or '[]'
+    )
+    request_image_regex = _get_request_image_regex()
+    request_image_names = [
+        name
+        for image in images
+        for name in image.get('Names') or []
+        if request_image_regex.match(name)
+    ]
+    log.info('Removing the container images of IIB requests: %s', ', '.join(request_image_names))
+    _remove_images(request_image_names)
+    # Remove the image layers which are no longer referenced by any tag
     run_cmd(
-        ['podman', 'rmi', '--all', '--force'],
-        exc_msg='Failed to remove the existing container images',
+        ['podman', 'image', 'prune', '--force'],
+        exc_msg='Failed to remove the dangling container images',
     )
-    reset_docker_config()
 
+    usage, pinned = get_image_usage()
+    candidates = []
+    total_size = 0
+    for image in images:
+        names = image.get('Names') or []
+        if names and all(request_image_regex.match(name) for name in names):
+            continue
+        total_size += image.get('Size') or 0
+        if not _matches_any(image, pinned):
+            candidates.append(image)
+    candidates.sort(key=lambda image: _get_last_use(image, usage))
+
+    storage_usage = _get_storage_usage()
+    while candidates and (
+        total_size > conf.iib_image_gc_max_size or storage_usage > conf.iib_image_gc_high_water_mark
+    ):
+        image = candidates.pop(0)
+        log.info('Removing the least recently used container image %s', image.get('Names'))
+        _remove_images([image['Id']])
+        total_size -= image.get('Size') or 0
+        storage_usage = _get_storage_usage()
+
+    if storage_usage > conf.iib_image_gc_high_water_mark:
+        log.warning(
+            'The container storage is still %.0f%% full, removing all existing container images',
+            storage_usage * 100,
+        )
+        run_cmd(
+            ['podman', 'rmi', '--all', '--force'],
+            exc_msg='Failed to remove the existing container images',
+        )
 
-@retry(
-    before_sleep=before_sleep_log(log, logging.WARNING),
-    reraise=True,
-    retry=retry_if_exception_type(IIBError),
-    stop=stop_after_attempt(worker_config.iib_total_attempts),
-    wait=wait_exponential(multiplier=worker_config.iib_retry_multiplier),
+
+@retry_registry_operation(
+    lambda request_id, *args, **kwargs: get_pull_spec_registry(
+        get_rebuilt_image_pull_spec(request_id)
+    )
 )
 def _create_and_push_manifest_list(
     request_id: int,
@@ -183,6 +507,12 @@ def _create_and_push_manifest_list(
     """
     Create and push the manifest list to the configured registry.
 
+    With the native registry client, the manifest list is composed once from the manifests of
+    the single arch images and pushed to all the tags concurrently. Its digest is recorded by the
+    registry client, see ``get_resolved_pushed_image``. Otherwise, the manifest list is created
+    and pushed with ``buildah manifest`` for every tag. The callers record what was retained for
+    the index image once this returns, see ``_record_pushed_index_image``.
+
     :param int request_id: the ID of the IIB build request
     :param set arches: an set of arches to create the manifest list for
     :param build_tags: list of extra tag to use for intermediate index image
@@ -191,16 +521,16 @@ def _create_and_push_manifest_list(
     :raises IIBError: if creating or pushing the manifest list fails
     """
     buildah_manifest_cmd = ['buildah', 'manifest']
-    _tags = [str(request_id)]
-    if build_tags:
-        _tags.extend(build_tags)
     conf = get_worker_config()
-    output_pull_specs = []
-    for tag in _tags:
-        output_pull_spec = conf['iib_image_push_template'].format(
-            registry=conf['iib_registry'], request_id=tag
-        )
-        output_pull_specs.append(output_pull_spec)
+    output_pull_specs = _get_output_pull_specs(request_id, build_tags)
+    if conf.get('iib_registry_client') == 'native':
+        try:
+            _push_manifest_list(request_id, arches, output_pull_specs)
+        finally:
+            invalidate_tag_cache()
+        return output_pull_specs[0]
+
+    for output_pull_spec in output_pull_specs:
         try:
             run_cmd(
                 buildah_manifest_cmd + ['rm', output_pull_spec],
@@ -241,11 +571,102 @@ def _create_and_push_manifest_list(
             ],
             exc_msg=f'Failed to push the manifest list to {output_pull_spec}',
         )
+        invalidate_tag_cache()
 
     # return 1st item as it holds production tag
     return output_pull_specs[0]
 
 
+def _record_pushed_index_image(output_pull_spec: str) -> None:
+    """
+    Record the files and the validated packages retained for the pushed index image.
+
+    The files retained from the build context are stored in the artifact cache as the files of
+    the pushed manifest list, so that a following request based on the index image, such as the
+    next request of a serial queue, starts from them instead of extracting them again. See
+    ``_build_and_push_images``. The validated packages are recorded in the build memo, see
+    ``memoize_retained_validated_packages``.
+
+    This must only be called once the manifest list was pushed successfully, outside of the
+    retries of ``_create_and_push_manifest_list``.
+
+    :param str output_pull_spec: the pull specification of the pushed manifest list
+    """
+    if has_retained_files():
+        add_retained_files_to_cache(get_resolved_pushed_image(output_pull_spec))
+    memoize_retained_validated_packages(output_pull_spec)
+
+
+def _get_output_pull_specs(request_id: int, build_tags: Optional[List[str]]) -> List[str]:
+    """
+    Get the pull specifications the index image of the request is pushed to.
+
+    :param int request_id: the ID of the IIB build request
+    :param list build_tags: the extra tags to push the index image to
+    :return: the pull specifications, starting with the one of the request
+    :rtype: list
+    """
+    conf = get_worker_config()
+    return [
+        conf['iib_image_push_template'].format(registry=conf['iib_registry'], request_id=tag)
+        for tag in [str(request_id)] + (build_tags or [])
+    ]
+
+
+def _push_manifest_list(request_id: int, arches: Set[str], output_pull_specs: List[str]) -> None:
+    """
+    Compose the manifest list of the single arch images and push it to all the pull specifications.
+
+    The manifests of the single arch images pushed with the native registry client are known
+    already. The other ones are read from the registry once, by the digest recorded at push time
+    if there is one.
+
+    :param int request_id: the ID of the IIB build request
+    :param set arches: the set of arches to create the manifest list for
+    :param list output_pull_specs: the pull specifications to push the manifest list to
+    :raises IIBError: if reading the single arch manifests or pushing the manifest list fails
+    """
+    client = get_registry_client()
+    manifests = []
+    for arch in sorted(arches):
+        arch_pull_spec = _get_external_arch_pull_spec(request_id, arch)
+        pushed_manifest = client.get_pushed_manifest(arch_pull_spec)
+        if not pushed_manifest or pushed_manifest.media_type is None or not pushed_manifest.size:
+            if pushed_manifest:
+                arch_pull_spec = get_resolved_pushed_image(arch_pull_spec)
+            arch_manifest = client.get_manifest(arch_pull_spec)
+            pushed_manifest = PushedManifest(
+                arch_manifest.digest,
+                arch_manifest.media_type,
+                len(arch_manifest.raw.encode('utf-8')),
+            )
+        manifests.append(
+            {
+                'mediaType': pushed_manifest.media_type,
+                'size': pushed_manifest.size,
+                'digest': pushed_manifest.digest,
+                'platform': {'architecture': arch, 'os': 'linux'},
+            }
+        )
+
+    if all(manifest['mediaType'] == MEDIA_TYPE_DOCKER_MANIFEST for manifest in manifests):
+        media_type = MEDIA_TYPE_DOCKER_MANIFEST_LIST
+    else:
+        media_type = MEDIA_TYPE_OCI_INDEX
+    manifest_list = json.dumps(
+        {'schemaVersion': 2, 'mediaType': media_type, 'manifests': manifests}, indent=3
+    ).encode('utf-8')
+
+    def _put_manifest_list(output_pull_spec: str) -> None:
+        log.info('Pushing the manifest list %s', output_pull_spec)
+        client.put_manifest(output_pull_spec, manifest_list, media_type)
+
+    max_workers = min(len(output_pull_specs), worker_config.iib_registry_client_pool_size)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for future in [executor.submit(_put_manifest_list, spec) for spec in output_pull_specs]:
+            future.result()
+
+
 def _update_index_image_pull_spec(
     output_pull_spec: str,
     request_id: int,
@@ -313,15 +734,363 @@ def _update_index_image_pull_spec(
     payload: UpdateRequestPayload = {'arches': list(arches), 'index_image': index_image}
 
     if add_or_rm:
-        with set_registry_token(overwrite_from_index_token, from_index, append=True):
-            index_image_resolved = get_resolved_image(index_image)
+        # The digests recorded when the images were pushed are used, so the registry is only
+        # queried if a digest wasn't reported by the push
+        output_pull_spec_resolved = get_resolved_pushed_image(output_pull_spec)
+        if index_image == output_pull_spec:
+            index_image_resolved = output_pull_spec_resolved
+        elif index_image != from_index:
+            # The output registry serves the same manifest list under another name
+            index_image_resolved = output_pull_spec_resolved.replace(
+                conf['iib_registry'], conf['iib_index_image_output_registry'], 1
+            )
+        else:
+            with set_registry_token(overwrite_from_index_token, from_index, append=True):
+                index_image_resolved = get_resolved_pushed_image(index_image)
         payload['index_image_resolved'] = index_image_resolved
         payload['internal_index_image_copy'] = output_pull_spec
-        payload['internal_index_image_copy_resolved'] = get_resolved_image(output_pull_spec)
+        payload['internal_index_image_copy_resolved'] = output_pull_spec_resolved
 
     update_request(request_id, payload, exc_msg='Failed setting the index image on the request')
 
 
+def _get_arch_manifests(pull_spec: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Get the manifests of the single arch images in the manifest list.
+
+    :param str pull_spec: the pull specification of the manifest list
+    :return: the manifests keyed by the architecture, or an empty dictionary if the pull
+        specification doesn't refer to a manifest list
+    :rtype: dict
+    :raises IIBError: if the manifests can't be retrieved
+    """
+    manifest_list = skopeo_inspect(f'docker://{pull_spec}', '--raw')
+    if manifest_list.get('mediaType') not in MANIFEST_LIST_MEDIA_TYPES:
+        return {}
+    image = parse_image_reference(pull_spec)
+    return {
+        manifest['platform']['architecture']: skopeo_inspect(
+            f'docker://{image.registry}/{image.repository}@{manifest["digest"]}', '--raw'
+        )
+        for manifest in manifest_list.get('manifests', [])
+    }
+
+
+def _is_index_image_unchanged(
+    from_index_resolved: str,
+    prebuild_info: PrebuildInfo,
+    overwrite_from_index_token: Optional[str] = None,
+) -> bool:
+    """
+    Determine if building the index image would reproduce the ``from_index`` image.
+
+    The callers determine that the catalog content doesn't change. This checks that the
+    ``from_index`` image was built for the same arches on top of the layers of the same binary
+    image and has the same delivery labels.
+
+    :param str from_index_resolved: the resolved pull specification of the ``from_index`` image
+    :param dict prebuild_info: the information relevant to the build operation
+    :param str overwrite_from_index_token: the token used to access the ``from_index`` image
+    :return: ``True`` if the index image would be the same, ``False`` otherwise
+    :rtype: bool
+    :raises IIBError: if the images can't be inspected
+    """
+    with set_registry_token(overwrite_from_index_token, from_index_resolved, append=True):
+        labels = get_image_labels(from_index_resolved)
+        arch_manifests = _get_arch_manifests(from_index_resolved)
+    if labels.get('com.redhat.index.delivery.version') != prebuild_info.get(
+        'ocp_version'
+    ) or labels.get('com.redhat.index.delivery.distribution_scope') != prebuild_info.get(
+        'distribution_scope'
+    ):
+        log.debug('The delivery labels of %s are changed', from_index_resolved)
+        return False
+
+    if set(arch_manifests) != set(prebuild_info['arches']):
+        log.debug('The arches of %s are changed', from_index_resolved)
+        return False
+
+    binary_arch_manifests = _get_arch_manifests(prebuild_info['binary_image_resolved'])
+    for arch, manifest in arch_manifests.items():
+        layers = [layer['digest'] for layer in manifest.get('layers', [])]
+        base_layers = [
+            layer['digest'] for layer in binary_arch_manifests.get(arch, {}).get('layers', [])
+        ]
+        if not base_layers or layers[: len(base_layers)] != base_layers:
+            log.debug('The %s image of %s has another base image', arch, from_index_resolved)
+            return False
+
+    return True
+
+
+def _get_present_operators(
+    from_index_resolved: str,
+    base_dir: str,
+    operators: List[str],
+    overwrite_from_index_token: Optional[str] = None,
+) -> Set[str]:
+    """
+    Get the operator packages which are present in the index image.
+
+    :param str from_index_resolved: the resolved pull specification of the index image
+    :param str base_dir: the base directory to render the index image in
+    :param list operators: the operator packages to look for
+    :param str overwrite_from_index_token: the token used to access the index image
+    :return: the operator packages present in the index image
+    :rtype: set
+    """
+    with set_registry_token(overwrite_from_index_token, from_index_resolved, append=True):
+        present_bundles = get_list_bundles(from_index_resolved, base_dir)
+    return {bundle['packageName'] for bundle in present_bundles}.intersection(operators)
+
+
+def _get_memoized_build(prebuild_info: PrebuildInfo) -> Optional[MemoizedBuild]:
+    """
+    Get the index image previously built from the same resolved inputs as the request.
+
+    :param dict prebuild_info: the information relevant to the build operation
+    :return: the memoized build, or ``None`` if the inputs weren't built recently or the index
+        image is no longer available
+    :rtype: MemoizedBuild or None
+    """
+    fingerprint = prebuild_info.get('build_fingerprint')
+    if not fingerprint:
+        return None
+    memoized_build = get_memoized_build(fingerprint)
+    if not memoized_build:
+        log.debug('No index image was built recently from the inputs %s', fingerprint)
+        return None
+    index_image = memoized_build.index_image
+
+    try:
+        # The index image may have been removed from the registry since it was built
+        index_image_arches = get_image_arches(index_image)
+    except IIBError:
+        log.warning('The memoized index image %s is no longer available', index_image)
+        forget_build(fingerprint)
+        return None
+    if index_image_arches != prebuild_info['arches']:
+        log.warning('The memoized index image %s has unexpected arches', index_image)
+        forget_build(fingerprint)
+        return None
+
+    log.info('The index image %s was built recently from the inputs %s', index_image, fingerprint)
+    return memoized_build
+
+
+def _memoize_build(
+    prebuild_info: PrebuildInfo, output_pull_spec: str, rm_operators: Optional[List[str]] = None
+) -> None:
+    """
+    Record the index image built from the resolved inputs of the request in the build memo.
+
+    :param dict prebuild_info: the information relevant to the build operation
+    :param str output_pull_spec: the pull specification of the manifest list of the index image
+    :param list rm_operators: the operator packages removed from the catalog of the
+        ``from_index`` image by the build
+    """
+    fingerprint = prebuild_info.get('build_fingerprint')
+    if fingerprint:
+        memoize_build(fingerprint, get_resolved_pushed_image(output_pull_spec), rm_operators)
+
+
+def _complete_request_with_index_image(
+    request_id: int,
+    index_image: str,
+    state_reason: str,
+    prebuild_info: PrebuildInfo,
+    from_index: Optional[str],
+    overwrite_from_index: bool,
+    overwrite_from_index_token: Optional[str],
+    build_tags: Optional[List[str]],
+    is_image_fbc: bool,
+    index_repo_map: Optional[Dict[str, str]],
+    rm_operators: Optional[List[str]] = None,
+) -> None:
+    """
+    Complete the request with an existing index image instead of building it again.
+
+    The index image is pushed to the pull specifications of the request and its build tags, and
+    the request is updated like for a built index image.
+
+    :param int request_id: the ID of the IIB build request
+    :param str index_image: the pull specification of the existing index image referenced by
+        digest
+    :param str state_reason: the state reason of the completed request
+    :param dict prebuild_info: the information relevant to the build operation
+    :param str from_index: the pull specification of the ``from_index`` image
+    :param bool overwrite_from_index: if True, overwrite the input ``from_index`` with the
+        index image.
+    :param str overwrite_from_index_token: the token used for overwriting the input
+        ``from_index`` image.
+    :param list build_tags: the extra tags to push the index image to
+    :param bool is_image_fbc: if True, the index image is a File-Based Catalog image
+    :param dict index_repo_map: the mapping between index images and git repositories
+    :param list rm_operators: the operator packages to remove from the Git catalog during
+        overwrite
+    :raises IIBError: if the index image can't be pushed or the request can't be updated
+    """
+    log.info('Reusing the index image %s instead of building it again', index_image)
+    set_request_state(request_id, 'in_progress', f'Pushing the existing index image {index_image}')
+    output_pull_specs = _get_output_pull_specs(request_id, build_tags)
+    with set_registry_token(overwrite_from_index_token, index_image, append=True):
+        for output_pull_spec in output_pull_specs:
+            exc_msg = f'Failed to push {index_image} to {output_pull_spec}'
+            if get_worker_config().iib_registry_client == 'native':
+                _copy_index_image(index_image, output_pull_spec, exc_msg=exc_msg)
+            else:
+                _skopeo_copy(
+                    f'docker://{index_image}',
+                    f'docker://{output_pull_spec}',
+                    copy_all=True,
+                    exc_msg=exc_msg,
+                )
+
+    _update_index_image_pull_spec(
+        output_pull_spec=output_pull_specs[0],
+        request_id=request_id,
+        arches=prebuild_info['arches'],
+        from_index=from_index,
+        overwrite_from_index=overwrite_from_index,
+        overwrite_from_index_token=overwrite_from_index_token,
+        resolved_prebuild_from_index=prebuild_info.get('from_index_resolved'),
+        add_or_rm=True,
+        is_image_fbc=is_image_fbc,
+        index_repo_map=index_repo_map or {},
+        rm_operators=rm_operators,
+    )
+    _cleanup()
+    set_request_state(request_id, 'complete', state_reason)
+
+
+def _get_checkpoint_fingerprint(prebuild_info: PrebuildInfo, **inputs: Any) -> str:
+    """
+    Get the fingerprint of the resolved inputs which the checkpoints of the request depend on.
+
+    :param dict prebuild_info: the information relevant to the build operation
+    :param inputs: the other resolved inputs of the request, for example its bundles
+    :return: the fingerprint of the resolved inputs
+    :rtype: str
+    """
+    return get_build_fingerprint({'prebuild_info': prebuild_info, **inputs})
+
+
+def _get_request_checkpoint(request_id: int, fingerprint: str) -> Optional[Checkpoint]:
+    """
+    Get the checkpoint of a previous attempt of the request which it can be resumed from.
+
+    :param int request_id: the ID of the IIB build request
+    :param str fingerprint: the fingerprint of the resolved inputs of the request, see
+        ``_get_checkpoint_fingerprint``
+    :return: the checkpoint, or ``None`` if the request must start from the beginning
+    :rtype: Checkpoint or None
+    """
+    checkpoint = get_checkpoint(request_id, fingerprint)
+    if checkpoint:
+        log.info('Resuming the request %d after the phase %s', request_id, checkpoint.phase)
+        set_request_state(
+            request_id, 'in_progress', f'Resuming the request after the phase {checkpoint.phase}'
+        )
+    return checkpoint
+
+
+def _build_and_push_images_from_checkpoint(
+    request_id: int, checkpoint: Checkpoint, arches: Set[str], request_type: str
+) -> Checkpoint:
+    """
+    Build and push the single arch images from the build context saved with the checkpoint.
+
+    Nothing is done unless the request was resumed right after its build context was prepared.
+
+    :param int request_id: the ID of the IIB build request
+    :param Checkpoint checkpoint: the last completed phase of the request
+    :param set arches: the architectures to build the container images for
+    :param str request_type: the type of the request, for example ``add``
+    :return: the checkpoint of the last completed phase
+    :rtype: Checkpoint
+    :raises IIBError: if any of the builds or pushes fails
+    """
+    context_dir = get_checkpoint_context_dir(request_id)
+    if checkpoint.phase != PHASE_CONTEXT_PREPARED or not context_dir:
+        return checkpoint
+    set_request_state(request_id, 'in_progress', 'Building the index image from the saved context')
+    _build_and_push_images(
+        context_dir,
+        checkpoint.data['dockerfile_name'],
+        request_id,
+        arches,
+        request_type=request_type,
+    )
+    return save_checkpoint(request_id, checkpoint.fingerprint, PHASE_IMAGES_PUSHED, checkpoint.data)
+
+
+def _finish_add_request(
+    request_id: int,
+    checkpoint: Checkpoint,
+    prebuild_info: PrebuildInfo,
+    from_index: Optional[str],
+    overwrite_from_index: bool,
+    overwrite_from_index_token: Optional[str],
+    build_tags: Optional[List[str]],
+    is_image_fbc: bool,
+    index_repo_map: Optional[Dict[str, str]],
+) -> None:
+    """
+    Run the phases of the add request following its checkpoint and complete the request.
+
+    The checkpoint of each phase is saved once it's completed, so that the request can be resumed
+    after it if a later phase fails. The checkpoints are removed once the request is completed.
+
+    :param int request_id: the ID of the IIB build request
+    :param Checkpoint checkpoint: the last completed phase of the request
+    :param dict prebuild_info: the information relevant to the build operation
+    :param str from_index: the pull specification of the ``from_index`` image
+    :param bool overwrite_from_index: if True, overwrite the input ``from_index`` with the
+        built index image.
+    :param str overwrite_from_index_token: the token used for overwriting the input
+        ``from_index`` image.
+    :param list build_tags: the extra tags to push the index image to
+    :param bool is_image_fbc: if True, the index image is a File-Based Catalog image
+    :param dict index_repo_map: the mapping between index images and git repositories
+    :raises IIBError: if any of the phases fails
+    """
+    arches = prebuild_info['arches']
+    checkpoint = _build_and_push_images_from_checkpoint(request_id, checkpoint, arches, 'add')
+    if checkpoint.phase == PHASE_IMAGES_PUSHED:
+        set_request_state(request_id, 'in_progress', 'Creating the manifest list')
+        output_pull_spec = _create_and_push_manifest_list(request_id, arches, build_tags)
+        _record_pushed_index_image(output_pull_spec)
+        checkpoint = save_checkpoint(
+            request_id,
+            checkpoint.fingerprint,
+            PHASE_MANIFEST_LIST_PUSHED,
+            {**checkpoint.data, 'output_pull_spec': output_pull_spec},
+        )
+
+    output_pull_spec = checkpoint.data['output_pull_spec']
+    deprecated_operator_packages = checkpoint.data['rm_operators']
+    _memoize_build(prebuild_info, output_pull_spec, deprecated_operator_packages)
+
+    _update_index_image_pull_spec(
+        output_pull_spec=output_pull_spec,
+        request_id=request_id,
+        arches=arches,
+        from_index=from_index,
+        overwrite_from_index=overwrite_from_index,
+        overwrite_from_index_token=overwrite_from_index_token,
+        resolved_prebuild_from_index=prebuild_info.get('from_index_resolved'),
+        add_or_rm=True,
+        is_image_fbc=is_image_fbc,
+        index_repo_map=index_repo_map or {},
+        rm_operators=deprecated_operator_packages or None,
+    )
+    _cleanup()
+    remove_checkpoint(request_id)
+    set_request_state(
+        request_id, 'complete', 'The operator bundle(s) were successfully added to the index image'
+    )
+
+
 def _get_external_arch_pull_spec(
     request_id: int,
     arch: str,
@@ -487,6 +1256,11 @@ def _overwrite_from_index(
     """
     Overwrite the ``from_index`` image.
 
+    With the native registry client, the manifest list and its manifests are copied unmodified,
+    see ``RegistryClient.copy_image``. Blobs are mounted when both images are in the same registry
+    and only the missing blobs are transferred otherwise. With ``skopeo``, the images are copied
+    with ``skopeo copy --all``.
+
     :param int request_id: the ID of the request this index image is for.
     :param str output_pull_spec: the pull specification of the manifest list for the index image
         that IIB built.
@@ -507,10 +1281,13 @@ def _overwrite_from_index(
     log.info(state_reason)
     set_request_state(request_id, 'in_progress', state_reason)
 
+    native_copy = get_worker_config().iib_registry_client == 'native'
     new_index_src = f'docker://{output_pull_spec}'
     temp_dir = None
     try:
-        if overwrite_from_index_token:
+        # The native registry client reads the source and writes the destination with their own
+        # credentials, so the export workaround below is not needed
+        if overwrite_from_index_token and not native_copy:
             output_pull_spec_registry = ImageName.parse(output_pull_spec).registry
             from_index_registry = ImageName.parse(from_index).registry
             # If the registries are the same and `overwrite_from_index_token` was supplied, that
@@ -559,9 +1336,12 @@ def _overwrite_from_index(
                 exc_msg = (
                     f'Failed to overwrite the input from_index container image of {from_index}'
                 )
-                _skopeo_copy(
-                    new_index_src, f'docker://{from_index}', copy_all=True, exc_msg=exc_msg
-                )
+                if native_copy:
+                    _copy_index_image(output_pull_spec, from_index, exc_msg=exc_msg)
+                else:
+                    _skopeo_copy(
+                        new_index_src, f'docker://{from_index}', copy_all=True, exc_msg=exc_msg
+                    )
         except IIBError as e:
             revert_last_commit(
                 request_id=request_id,
@@ -574,6 +1354,26 @@ def _overwrite_from_index(
             temp_dir.cleanup()
 
 
+def _copy_index_image(source: str, destination: str, exc_msg: Optional[str] = None) -> None:
+    """
+    Copy the index image with the native registry client.
+
+    :param str source: the pull specification of the index image to copy
+    :param str destination: the pull specification to copy the index image to
+    :param str exc_msg: a custom exception message to provide
+    :raises IIBError: if the copy fails
+    """
+    log.info('Copying the index image %s to %s', source, destination)
+    try:
+        get_registry_client().copy_image(source, destination)
+    except IIBError as e:
+        log.error('Failed to copy %s to %s: %s', source, destination, e)
+        raise IIBError(exc_msg or f'Failed to copy {source} to {destination}')
+    finally:
+        # A failed copy may still have updated some of the manifests
+        invalidate_tag_cache()
+
+
 def _update_index_image_build_state(
     request_id: int,
     prebuild_info: PrebuildInfo,
@@ -629,17 +1429,16 @@ def _update_index_image_build_state(
     update_request(request_id, payload, exc_msg)
 
 
-@retry(
-    before_sleep=before_sleep_log(log, logging.WARNING),
-    reraise=True,
-    retry=retry_if_exception_type(IIBError),
-    stop=stop_after_attempt(worker_config.iib_total_attempts),
-    wait=wait_exponential(worker_config.iib_retry_multiplier),
+@retry_registry_operation(
+    lambda request_id, arch: get_pull_spec_registry(_get_external_arch_pull_spec(request_id, arch))
 )
 def _push_image(request_id: int, arch: str) -> None:
     """
     Push the single arch container image to the configured registry.
 
+    The image is pushed as a Docker v2 schema 2 manifest and the digest reported by the push is
+    recorded, see ``get_resolved_pushed_image``.
+
     :param int request_id: the ID of the IIB build request
     :param str arch: the architecture of the container image to push
     :raises IIBError: if the push fails
@@ -647,29 +1446,135 @@ def _push_image(request_id: int, arch: str) -> None:
     source = _get_local_pull_spec(request_id, arch)
     destination = _get_external_arch_pull_spec(request_id, arch, include_transport=True)
     log.info('Pushing the container image %s to %s', source, destination)
-    run_cmd(
-        ['podman', 'push', '-q', source, destination],
-        exc_msg=f'Failed to push the container image to {destination} for the arch {arch}',
-    )
+    with tempfile.TemporaryDirectory(prefix=f'iib-{request_id}-push-') as temp_dir:
+        digest_file = os.path.join(temp_dir, 'digest')
+        # NOTE: The manifest format is explicitly set so that podman never falls back to
+        # schema version 1 due to RHBZ#1810768
+        try:
+            run_cmd(
+                [
+                    'podman',
+                    'push',
+                    '-q',
+                    '--format',
+                    'v2s2',
+                    '--digestfile',
+                    digest_file,
+                    source,
+                    destination,
+                ],
+                exc_msg=f'Failed to push the container image to {destination} for the arch {arch}',
+            )
+        finally:
+            invalidate_tag_cache()
+        _record_pushed_digest(destination, digest_file, MEDIA_TYPE_DOCKER_MANIFEST)
 
-    log.debug(f'Verifying that {destination} was pushed as a v2 manifest due to RHBZ#1810768')
-    skopeo_raw = skopeo_inspect(destination, '--raw')
-    if skopeo_raw['schemaVersion'] != 2:
-        log.warning(
-            'The manifest for %s ended up using schema version 1 due to RHBZ#1810768. Manually '
-            'fixing it with skopeo.',
-            destination,
-        )
-        exc_msg = f'Failed to fix the manifest schema version on {destination}'
-        _skopeo_copy(destination, destination, exc_msg=exc_msg)
 
+def _record_pushed_digest(
+    destination: str, digest_file: str, media_type: Optional[str] = None
+) -> None:
+    """
+    Record the digest written by ``podman push`` or ``skopeo copy`` with ``--digestfile``.
+
+    Nothing is recorded if the digest file is missing or empty, so the digest is then read from
+    the registry when needed.
 
-@retry(
-    before_sleep=before_sleep_log(log, logging.WARNING),
-    reraise=True,
-    retry=retry_if_exception_type(IIBError),
-    stop=stop_after_attempt(worker_config.iib_total_attempts),
-    wait=wait_exponential(worker_config.iib_retry_multiplier),
+    :param str destination: the pull specification the image was pushed to
+    :param str digest_file: the path to the file containing the digest
+    :param str media_type: the media type of the pushed manifest, if known
+    """
+    try:
+        with open(digest_file, 'r') as f:
+            digest = f.read().strip()
+    except FileNotFoundError:
+        digest = ''
+    if not digest:
+        log.warning('The digest of %s was not reported by the push', destination)
+        return
+    log.debug('Pushed %s with the digest %s', destination, digest)
+    get_registry_client().record_pushed_manifest(destination, digest, media_type)
+
+
+def _build_and_push_images(
+    dockerfile_dir: str,
+    dockerfile_name: str,
+    request_id: int,
+    arches: Set[str],
+    request_type: Optional[str] = None,
+) -> None:
+    """
+    Build and push the single arch container images of all the architectures.
+
+    With the ``assemble`` value of ``iib_image_build_method``, the images are first assembled
+    from the Dockerfile without building them, see ``assemble_index_image``. Otherwise, or if the
+    Dockerfile can't be assembled, the images are built with buildah.
+
+    Up to ``iib_image_build_max_workers`` architectures are processed concurrently. The image of
+    an architecture is pushed as soon as it's built, so the pushes overlap with the builds of the
+    other architectures. The arch verification and the retries of ``_build_image`` and
+    ``_push_image`` apply to every architecture.
+
+    If the artifact cache is enabled, the catalog and the databases the Dockerfile adds to the
+    index image are retained until the manifest list is pushed, see
+    ``_create_and_push_manifest_list``.
+
+    :param str dockerfile_dir: the path to the directory containing the data used for
+        building the container images
+    :param str dockerfile_name: the name of the Dockerfile in the dockerfile_dir to
+        be used when building the container images
+    :param int request_id: the ID of the IIB build request
+    :param set arches: the architectures to build the container images for
+    :param str request_type: the type of the request, for example ``add``; the build cache is
+        used if it's in ``iib_image_build_cache_request_types``
+    :raises IIBError: if any of the builds or pushes fails
+    """
+    use_cache = request_type in worker_config.iib_image_build_cache_request_types
+    if get_worker_config().get('iib_artifact_cache_dir'):
+        retain_files(get_index_image_files(os.path.join(dockerfile_dir, dockerfile_name)))
+
+    def _build_and_push_image(arch: str) -> None:
+        _build_image(dockerfile_dir, dockerfile_name, request_id, arch, use_cache=use_cache)
+        _push_image(request_id, arch)
+
+    if worker_config.iib_image_build_method == 'assemble':
+        destinations = {arch: _get_external_arch_pull_spec(request_id, arch) for arch in arches}
+        try:
+            assembled = assemble_index_image(
+                os.path.join(dockerfile_dir, dockerfile_name), destinations
+            )
+        finally:
+            # A failed assembly may still have pushed some of the images
+            invalidate_tag_cache()
+        if assembled:
+            return
+
+    sorted_arches = sorted(arches)
+    max_workers = max(1, min(worker_config.iib_image_build_max_workers, len(arches)))
+    if max_workers == 1:
+        for arch in sorted_arches:
+            _build_and_push_image(arch)
+        return
+
+    log.info(
+        'Building and pushing the container images for the arches %s, %d at a time',
+        ', '.join(sorted_arches),
+        max_workers,
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_build_and_push_image, arch) for arch in sorted_arches]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            # Don't start the architectures which are still queued since the request will fail
+            for future in futures:
+                future.cancel()
+            raise
+
+
+@retry_registry_operation(
+    lambda source, destination, *args, **kwargs: get_pull_spec_registry(destination)
+    or get_pull_spec_registry(source)
 )
 def _skopeo_copy(
     source: str,
@@ -680,6 +1585,8 @@ def _skopeo_copy(
     """
     Wrap the ``skopeo copy`` command.
 
+    The digest of an image copied to a registry is recorded, see ``get_resolved_pushed_image``.
+
     :param str source: the source to copy
     :param str destination: the destination to copy the source to
     :param bool copy_all: if True, it passes ``--all`` to the command
@@ -691,9 +1598,21 @@ def _skopeo_copy(
     cmd = ['skopeo', '--command-timeout', skopeo_timeout, 'copy', '--format', 'v2s2']
     if copy_all:
         cmd.append('--all')
-    cmd.extend([source, destination])
 
-    run_cmd(cmd, exc_msg=exc_msg or f'Failed to copy {source} to {destination}')
+    record_digest = destination.startswith('docker://')
+
+    with tempfile.TemporaryDirectory(prefix='iib-copy-') as temp_dir:
+        digest_file = os.path.join(temp_dir, 'digest')
+        if record_digest:
+            cmd.extend(['--digestfile', digest_file])
+        cmd.extend([source, destination])
+        try:
+            run_cmd(cmd, exc_msg=exc_msg or f'Failed to copy {source} to {destination}')
+        finally:
+            # A failed copy may still have updated some of the tags
+            invalidate_tag_cache()
+        if record_digest:
+            _record_pushed_digest(destination, digest_file)
 
 
 def _verify_index_image(
@@ -760,6 +1679,9 @@ def inspect_related_images(
                     )
                 try:
                     skopeo_inspect(f'docker://{related_image_pull_spec}', '--raw')
+                except RegistryUnavailableError:
+                    # The related image may be accessible once the registry is available again
+                    raise
                 except IIBError as e:
                     log.error(e)
                     invalid_related_images.append(related_image_pull_spec)
@@ -770,7 +1692,7 @@ def inspect_related_images(
 
 @app.task
 @request_logger
-@instrument_tracing(span_name="workers.tasks.handle_add_request", attributes=get_binary_versions())
+@instrument_tracing(span_name="workers.tasks.handle_add_request", attributes=get_binary_versions)
 def handle_add_request(
     bundles: List[str],
     request_id: int,
@@ -853,6 +1775,14 @@ def handle_add_request(
     else:
         log.warning('Greenwave checks are disabled. Bundles will not be gated.')
 
+    build_inputs = None
+    if get_worker_config().get('iib_build_memo_dir'):
+        build_inputs = {
+            'request_type': 'add',
+            'bundles': sorted(resolved_bundles),
+            'deprecation_list': sorted(deprecation_list or []),
+            'graph_update_mode': graph_update_mode,
+        }
     prebuild_info = prepare_request_for_build(
         request_id,
         RequestConfigAddRm(
@@ -863,6 +1793,7 @@ def handle_add_request(
             bundles=bundles,
             distribution_scope=distribution_scope,
             binary_image_config=binary_image_config,
+            build_inputs=build_inputs,
         ),
     )
     from_index_resolved = prebuild_info['from_index_resolved']
@@ -881,6 +1812,44 @@ def handle_add_request(
         )
 
     _update_index_image_build_state(request_id, prebuild_info)
+    memoized_build = _get_memoized_build(prebuild_info)
+    if memoized_build:
+        _complete_request_with_index_image(
+            request_id=request_id,
+            index_image=memoized_build.index_image,
+            state_reason=_MEMOIZED_INDEX_IMAGE_REASON,
+            prebuild_info=prebuild_info,
+            from_index=from_index,
+            overwrite_from_index=overwrite_from_index,
+            overwrite_from_index_token=overwrite_from_index_token,
+            build_tags=build_tags,
+            is_image_fbc=is_fbc,
+            index_repo_map=index_to_gitlab_push_map,
+            rm_operators=memoized_build.rm_operators,
+        )
+        return
+
+    checkpoint_fingerprint = _get_checkpoint_fingerprint(
+        prebuild_info,
+        bundles=sorted(resolved_bundles),
+        deprecation_list=sorted(deprecation_list or []),
+        graph_update_mode=graph_update_mode,
+    )
+    checkpoint = _get_request_checkpoint(request_id, checkpoint_fingerprint)
+    if checkpoint:
+        _finish_add_request(
+            request_id=request_id,
+            checkpoint=checkpoint,
+            prebuild_info=prebuild_info,
+            from_index=from_index,
+            overwrite_from_index=overwrite_from_index,
+            overwrite_from_index_token=overwrite_from_index_token,
+            build_tags=build_tags,
+            is_image_fbc=is_fbc,
+            index_repo_map=index_to_gitlab_push_map,
+        )
+        return
+
     present_bundles: List[BundleImage] = []
     present_bundles_pull_spec: List[str] = []
     with tempfile.TemporaryDirectory(prefix=f'iib-{request_id}-') as temp_dir:
@@ -906,8 +1875,39 @@ def handle_add_request(
                     ' '.join(excluded_bundles),
                 )
 
+            if (
+                not resolved_bundles
+                and not get_bundles_from_deprecation_list(
+                    present_bundles_pull_spec, deprecation_list or []
+                )
+                and _is_index_image_unchanged(
+                    from_index_resolved, prebuild_info, overwrite_from_index_token
+                )
+            ):
+                # If the container-tool podman was used above, make sure temp_dir can be removed
+                chmod_recursively(
+                    temp_dir,
+                    dir_mode=(stat.S_IRWXU | stat.S_IRWXG),
+                    file_mode=(stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP),
+                )
+                _complete_request_with_index_image(
+                    request_id=request_id,
+                    index_image=from_index_resolved,
+                    state_reason=_UNCHANGED_INDEX_IMAGE_REASON,
+                    prebuild_info=prebuild_info,
+                    from_index=from_index,
+                    overwrite_from_index=overwrite_from_index,
+                    overwrite_from_index_token=overwrite_from_index_token,
+                    build_tags=build_tags,
+                    is_image_fbc=is_fbc,
+                    index_repo_map=index_to_gitlab_push_map,
+                )
+                return
+
+        previous_fingerprints = None
         if is_fbc:
-            opm_registry_add_fbc(
+            # the changed packages are migrated into the catalog of from_index below
+            previous_fingerprints = opm_registry_add_fbc(
                 base_dir=temp_dir,
                 bundles=resolved_bundles,
                 binary_image=prebuild_info['binary_image_resolved'],
@@ -915,6 +1915,7 @@ def handle_add_request(
                 graph_update_mode=graph_update_mode,
                 overwrite_from_index_token=overwrite_from_index_token,
                 overwrite_csv=(prebuild_info['distribution_scope'] in ['dev', 'stage']),
+                migrate=False,
             )
         else:
             opm_index_add(
@@ -947,6 +1948,7 @@ def handle_add_request(
                     base_dir=temp_dir,
                     binary_image=prebuild_info['binary_image'],
                     from_index=from_index_resolved,
+                    migrate=False,
                 )
             else:
                 # opm can only deprecate a bundle image on an existing index image. Build and
@@ -988,18 +1990,13 @@ def handle_add_request(
         if is_fbc:
             os.makedirs(os.path.join(temp_dir, 'from_db'), exist_ok=True)
             index_db_file = os.path.join(temp_dir, get_worker_config()['temp_index_db_path'])
-            # get catalog from SQLite index.db (hidden db) - not opted in operators
-            catalog_from_db, _ = opm_migrate(
-                index_db=index_db_file,
-                base_dir=os.path.join(temp_dir, 'from_db'),
-                generate_cache=False,
-            )
             # get catalog with opted-in operators
             os.makedirs(os.path.join(temp_dir, 'from_index'), exist_ok=True)
             with set_registry_token(overwrite_from_index_token, from_index_resolved, append=True):
                 catalog_from_index = get_catalog_dir(
                     from_index=from_index_resolved, base_dir=os.path.join(temp_dir, 'from_index')
                 )
+                from_index_packages = get_catalog_package_digests(catalog_from_index)
 
             # we have to remove all `deprecation_bundles` from `catalog_from_index`
             # before merging catalogs otherwise if catalog was deprecated and
@@ -1018,9 +2015,27 @@ def handle_add_request(
                     )
                     shutil.rmtree(bundle_from_index)
 
-            # overwrite data in `catalog_from_index` by data from `catalog_from_db`
-            # this adds changes on not opted in operators to final
-            merge_catalogs_dirs(catalog_from_db, catalog_from_index)
+            # only migrate the not opted in operators changed by the request into
+            # `catalog_from_index`, which already contains the others
+            if not opm_migrate_changed_packages(
+                index_db=index_db_file,
+                previous_fingerprints=previous_fingerprints,
+                catalog_dir=catalog_from_index,
+                base_dir=os.path.join(temp_dir, 'from_db'),
+                from_index=from_index_resolved,
+            ):
+                # get catalog from SQLite index.db (hidden db) - not opted in operators
+                catalog_from_db, _ = opm_migrate(
+                    index_db=index_db_file,
+                    base_dir=os.path.join(temp_dir, 'from_db'),
+                    generate_cache=False,
+                    from_index=from_index_resolved,
+                )
+                # overwrite data in `catalog_from_index` by data from `catalog_from_db`
+                # this adds changes on not opted in operators to final
+                merge_catalogs_dirs(
+                    catalog_from_db, catalog_from_index, from_index=from_index_resolved
+                )
 
             fbc_dir_path = os.path.join(temp_dir, 'catalog')
             # We need to regenerate file-based catalog because we merged changes
@@ -1033,11 +2048,14 @@ def handle_add_request(
             local_cache_path = os.path.join(temp_dir, 'cache')
             if os.path.exists(local_cache_path):
                 shutil.rmtree(local_cache_path)
-            generate_cache_locally(temp_dir, fbc_dir_path, local_cache_path)
-
-        for arch in sorted(arches):
-            _build_image(temp_dir, 'index.Dockerfile', request_id, arch)
-            _push_image(request_id, arch)
+            with set_registry_token(overwrite_from_index_token, from_index_resolved, append=True):
+                generate_cache_locally(
+                    temp_dir,
+                    fbc_dir_path,
+                    local_cache_path,
+                    from_index=from_index_resolved,
+                    from_index_packages=from_index_packages,
+                )
 
         # If the container-tool podman is used in the opm commands above, opm will create temporary
         # files and directories without the write permission. This will cause the context manager
@@ -1048,33 +2066,37 @@ def handle_add_request(
             file_mode=(stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP),
         )
 
-    set_request_state(request_id, 'in_progress', 'Creating the manifest list')
-    output_pull_spec = _create_and_push_manifest_list(request_id, arches, build_tags)
-
-    deprecated_operator_packages = get_operator_packages_from_deprecation_list(deprecation_bundles)
+        deprecated_operator_packages = get_operator_packages_from_deprecation_list(
+            deprecation_bundles
+        )
+        checkpoint = save_checkpoint(
+            request_id,
+            checkpoint_fingerprint,
+            PHASE_CONTEXT_PREPARED,
+            {'dockerfile_name': 'index.Dockerfile', 'rm_operators': deprecated_operator_packages},
+            context_dir=temp_dir,
+        )
+        _build_and_push_images(temp_dir, 'index.Dockerfile', request_id, arches, request_type='add')
+        checkpoint = save_checkpoint(
+            request_id, checkpoint_fingerprint, PHASE_IMAGES_PUSHED, checkpoint.data
+        )
 
-    _update_index_image_pull_spec(
-        output_pull_spec=output_pull_spec,
+    _finish_add_request(
         request_id=request_id,
-        arches=arches,
+        checkpoint=checkpoint,
+        prebuild_info=prebuild_info,
         from_index=from_index,
         overwrite_from_index=overwrite_from_index,
         overwrite_from_index_token=overwrite_from_index_token,
-        resolved_prebuild_from_index=from_index_resolved,
-        add_or_rm=True,
+        build_tags=build_tags,
         is_image_fbc=is_fbc,
-        index_repo_map=index_to_gitlab_push_map or {},
-        rm_operators=deprecated_operator_packages or None,
-    )
-    _cleanup()
-    set_request_state(
-        request_id, 'complete', 'The operator bundle(s) were successfully added to the index image'
+        index_repo_map=index_to_gitlab_push_map,
     )
 
 
 @app.task
 @request_logger
-@instrument_tracing(span_name="workers.tasks.handle_rm_request", attributes=get_binary_versions())
+@instrument_tracing(span_name="workers.tasks.handle_rm_request", attributes=get_binary_versions)
 def handle_rm_request(
     operators: List[str],
     request_id: int,
@@ -1124,6 +2146,11 @@ def handle_rm_request(
             add_arches=add_arches,
             distribution_scope=distribution_scope,
             binary_image_config=binary_image_config,
+            build_inputs=(
+                {'request_type': 'rm', 'operators': sorted(operators)}
+                if get_worker_config().get('iib_build_memo_dir')
+                else None
+            ),
         ),
     )
     _update_index_image_build_state(request_id, prebuild_info)
@@ -1135,6 +2162,23 @@ def handle_rm_request(
         with set_registry_token(overwrite_from_index_token, from_index_resolved, append=True):
             image_is_fbc = is_image_fbc(from_index_resolved)
 
+        memoized_build = _get_memoized_build(prebuild_info)
+        if memoized_build:
+            _complete_request_with_index_image(
+                request_id=request_id,
+                index_image=memoized_build.index_image,
+                state_reason=_MEMOIZED_INDEX_IMAGE_REASON,
+                prebuild_info=prebuild_info,
+                from_index=from_index,
+                overwrite_from_index=overwrite_from_index,
+                overwrite_from_index_token=overwrite_from_index_token,
+                build_tags=build_tags,
+                is_image_fbc=image_is_fbc,
+                index_repo_map=index_to_gitlab_push_map,
+                rm_operators=operators,
+            )
+            return
+
         if image_is_fbc:
             log.info("Processing File-Based Catalog image")
 
@@ -1146,13 +2190,20 @@ def handle_rm_request(
                 catalog_from_index = get_catalog_dir(
                     from_index=from_index_resolved, base_dir=os.path.join(temp_dir, 'from_index')
                 )
+            from_index_packages = get_catalog_package_digests(catalog_from_index)
             # remove operators and operator deprecations from /<temp_dir>/from_index/configs
             # if they exist
+            catalog_changed = False
             for operator in operators:
                 operator_path = os.path.join(catalog_from_index, operator)
+                deprecations_path = os.path.join(
+                    catalog_from_index, worker_config['operator_deprecations_dir'], operator
+                )
+                catalog_changed = catalog_changed or os.path.exists(deprecations_path)
                 if os.path.exists(operator_path):
                     log.debug('Removing operator from from_index FBC %s', operator_path)
                     shutil.rmtree(operator_path)
+                    catalog_changed = True
 
             remove_operator_deprecations(
                 from_index_configs_dir=catalog_from_index, operators=operators
@@ -1165,6 +2216,33 @@ def handle_rm_request(
                 operator_packages=operators,
                 overwrite_from_index_token=overwrite_from_index_token,
             )
+            if (
+                not catalog_changed
+                and not operators_in_db
+                and _is_index_image_unchanged(
+                    from_index_resolved, prebuild_info, overwrite_from_index_token
+                )
+            ):
+                # If the container-tool podman was used above, make sure temp_dir can be removed
+                chmod_recursively(
+                    temp_dir,
+                    dir_mode=(stat.S_IRWXU | stat.S_IRWXG),
+                    file_mode=(stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP),
+                )
+                _complete_request_with_index_image(
+                    request_id=request_id,
+                    index_image=from_index_resolved,
+                    state_reason=_UNCHANGED_INDEX_IMAGE_REASON,
+                    prebuild_info=prebuild_info,
+                    from_index=from_index,
+                    overwrite_from_index=overwrite_from_index,
+                    overwrite_from_index_token=overwrite_from_index_token,
+                    build_tags=build_tags,
+                    is_image_fbc=image_is_fbc,
+                    index_repo_map=index_to_gitlab_push_map,
+                    rm_operators=operators,
+                )
+                return
 
             if operators_in_db:
                 fbc_dir, _ = opm_registry_rm_fbc(
@@ -1172,16 +2250,22 @@ def handle_rm_request(
                     from_index=from_index_resolved,
                     operators=operators_in_db,
                     index_db_path=index_db_path,
+                    catalog_dir=catalog_from_index,
                 )
 
-                # rename `catalog` directory because we need to use this name for
-                # final destination of catalog (defined in Dockerfile)
-                catalog_from_db = os.path.join(temp_dir, 'from_db')
-                os.rename(fbc_dir, catalog_from_db)
-
-                # overwrite data in `catalog_from_index` by data from `catalog_from_db`
-                # this adds changes on not opted in operators to final
-                merge_catalogs_dirs(catalog_from_db, catalog_from_index)
+                # the not opted in operators are only migrated separately when the changed
+                # packages could not be migrated into `catalog_from_index`
+                if fbc_dir != catalog_from_index:
+                    # rename `catalog` directory because we need to use this name for
+                    # final destination of catalog (defined in Dockerfile)
+                    catalog_from_db = os.path.join(temp_dir, 'from_db')
+                    os.rename(fbc_dir, catalog_from_db)
+
+                    # overwrite data in `catalog_from_index` by data from `catalog_from_db`
+                    # this adds changes on not opted in operators to final
+                    merge_catalogs_dirs(
+                        catalog_from_db, catalog_from_index, from_index=from_index_resolved
+                    )
 
             fbc_dir_path = os.path.join(temp_dir, 'catalog')
             # We need to regenerate file-based catalog because we merged changes
@@ -1191,7 +2275,7 @@ def handle_rm_request(
             shutil.move(catalog_from_index, fbc_dir_path)
 
             # validate fbc config
-            opm_validate(fbc_dir_path)
+            opm_validate(fbc_dir_path, from_index=from_index_resolved)
 
             create_dockerfile(
                 fbc_dir=fbc_dir_path,
@@ -1205,9 +2289,37 @@ def handle_rm_request(
             local_cache_path = os.path.join(temp_dir, 'cache')
             if os.path.exists(local_cache_path):
                 shutil.rmtree(local_cache_path)
-            generate_cache_locally(temp_dir, fbc_dir_path, local_cache_path)
+            with set_registry_token(overwrite_from_index_token, from_index_resolved, append=True):
+                generate_cache_locally(
+                    temp_dir,
+                    fbc_dir_path,
+                    local_cache_path,
+                    from_index=from_index_resolved,
+                    from_index_packages=from_index_packages,
+                )
 
         else:
+            # Check the cheaper image metadata first to avoid rendering the index in most cases
+            if _is_index_image_unchanged(
+                from_index_resolved, prebuild_info, overwrite_from_index_token
+            ) and not _get_present_operators(
+                from_index_resolved, temp_dir, operators, overwrite_from_index_token
+            ):
+                _complete_request_with_index_image(
+                    request_id=request_id,
+                    index_image=from_index_resolved,
+                    state_reason=_UNCHANGED_INDEX_IMAGE_REASON,
+                    prebuild_info=prebuild_info,
+                    from_index=from_index,
+                    overwrite_from_index=overwrite_from_index,
+                    overwrite_from_index_token=overwrite_from_index_token,
+                    build_tags=build_tags,
+                    is_image_fbc=image_is_fbc,
+                    index_repo_map=index_to_gitlab_push_map,
+                    rm_operators=operators,
+                )
+                return
+
             opm_index_rm(
                 base_dir=temp_dir,
                 operators=operators,
@@ -1232,9 +2344,7 @@ def handle_rm_request(
         )
 
         arches = prebuild_info['arches']
-        for arch in sorted(arches):
-            _build_image(temp_dir, 'index.Dockerfile', request_id, arch)
-            _push_image(request_id, arch)
+        _build_and_push_images(temp_dir, 'index.Dockerfile', request_id, arches, request_type='rm')
 
         # If the container-tool podman is used in the opm commands above, opm will create temporary
         # files and directories without the write permission. This will cause the context manager
@@ -1247,6 +2357,8 @@ def handle_rm_request(
 
     set_request_state(request_id, 'in_progress', 'Creating the manifest list')
     output_pull_spec = _create_and_push_manifest_list(request_id, arches, build_tags)
+    _record_pushed_index_image(output_pull_spec)
+    _memoize_build(prebuild_info, output_pull_spec, operators)
 
     _update_index_image_pull_spec(
         output_pull_spec=output_pull_spec,
@@ -1273,6 +2385,26 @@ def _copy_files_from_image(image: str, src_path: str, dest_path: str) -> None:
 
     The file may be a directory.
 
+    :param str image: the pull specification of the container image.
+    :param str src_path: the full path within the container image to copy from.
+    :param str dest_path: the full path on the local host to copy into.
+    """
+    if copy_from_cache(image, src_path, dest_path):
+        return
+    destination = get_copy_destination(src_path, dest_path)
+
+    if get_worker_config().iib_image_extraction != 'stream' or not extract_path_from_image(
+        image, src_path, destination
+    ):
+        _podman_copy_files_from_image(image, src_path, dest_path)
+
+    add_to_cache(image, src_path, destination)
+
+
+def _podman_copy_files_from_image(image: str, src_path: str, dest_path: str) -> None:
+    """
+    Copy a file from the container image into the given destination path using podman.
+
     :param str image: the pull specification of the container image.
     :param str src_path: the full path within the container image to copy from.
     :param str dest_path: the full path on the local host to copy into.
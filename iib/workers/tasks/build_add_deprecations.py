@@ -10,15 +10,15 @@ from iib.common.tracing import instrument_tracing
 from iib.workers.api_utils import set_request_state
 from iib.workers.tasks.build import (
     _add_label_to_index,
-    _build_image,
+    _build_and_push_images,
     _cleanup,
     _create_and_push_manifest_list,
-    _push_image,
+    _record_pushed_index_image,
     _update_index_image_build_state,
     _update_index_image_pull_spec,
 )
 from iib.workers.tasks.celery import app
-from iib.workers.tasks.fbc_utils import get_catalog_dir
+from iib.workers.tasks.fbc_utils import get_catalog_dir, get_catalog_package_digests
 from iib.workers.tasks.opm_operations import (
     Opm,
     create_dockerfile,
@@ -43,7 +43,7 @@ log = logging.getLogger(__name__)
 @request_logger
 @instrument_tracing(
     span_name="workers.tasks.build.handle_add_deprecations_request",
-    attributes=get_binary_versions(),
+    attributes=get_binary_versions,
 )
 def handle_add_deprecations_request(
     deprecation_schema: str,
@@ -136,12 +136,13 @@ def handle_add_deprecations_request(
         )
 
         arches = prebuild_info['arches']
-        for arch in sorted(arches):
-            _build_image(temp_dir, 'index.Dockerfile', request_id, arch)
-            _push_image(request_id, arch)
+        _build_and_push_images(
+            temp_dir, 'index.Dockerfile', request_id, arches, request_type='add-deprecations'
+        )
 
     set_request_state(request_id, 'in_progress', 'Creating the manifest list')
     output_pull_spec = _create_and_push_manifest_list(request_id, arches, build_tags)
+    _record_pushed_index_image(output_pull_spec)
 
     _update_index_image_pull_spec(
         output_pull_spec=output_pull_spec,
@@ -185,6 +186,7 @@ def add_deprecations_to_index(
     set_request_state(request_id, 'in_progress', 'Getting all deprecations present in index image')
 
     from_index_configs_dir = get_catalog_dir(from_index=from_index_resolved, base_dir=temp_dir)
+    from_index_packages = get_catalog_package_digests(from_index_configs_dir)
     conf = get_worker_config()
     from_index_configs_deprecations_dir = os.path.join(
         from_index_configs_dir, conf['operator_deprecations_dir']
@@ -200,11 +202,15 @@ def add_deprecations_to_index(
     with open(operator_deprecations_file, 'w') as output_file:
         json.dump(json.loads(deprecation_schema), output_file)
 
-    opm_validate(from_index_configs_dir)
+    opm_validate(from_index_configs_dir, from_index=from_index_resolved)
 
     local_cache_path = os.path.join(temp_dir, 'cache')
     generate_cache_locally(
-        base_dir=temp_dir, fbc_dir=from_index_configs_dir, local_cache_path=local_cache_path
+        base_dir=temp_dir,
+        fbc_dir=from_index_configs_dir,
+        local_cache_path=local_cache_path,
+        from_index=from_index_resolved,
+        from_index_packages=from_index_packages,
     )
 
     log.info("Dockerfile generated from %s", from_index_configs_dir)
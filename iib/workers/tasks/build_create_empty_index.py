@@ -9,10 +9,10 @@ from iib.workers.api_utils import set_request_state
 from iib.common.common_utils import get_binary_versions
 from iib.workers.tasks.build import (
     _add_label_to_index,
-    _build_image,
+    _build_and_push_images,
     _cleanup,
     _create_and_push_manifest_list,
-    _push_image,
+    _record_pushed_index_image,
     _update_index_image_build_state,
     _update_index_image_pull_spec,
 )
@@ -39,7 +39,7 @@ log = logging.getLogger(__name__)
 @app.task
 @request_logger
 @instrument_tracing(
-    span_name="workers.tasks.handle_create_empty_index_request", attributes=get_binary_versions()
+    span_name="workers.tasks.handle_create_empty_index_request", attributes=get_binary_versions
 )
 def handle_create_empty_index_request(
     from_index: str,
@@ -125,12 +125,13 @@ def handle_create_empty_index_request(
 
         arches = prebuild_info['arches']
 
-        for arch in sorted(arches):
-            _build_image(temp_dir, 'index.Dockerfile', request_id, arch)
-            _push_image(request_id, arch)
+        _build_and_push_images(
+            temp_dir, 'index.Dockerfile', request_id, arches, request_type='create-empty-index'
+        )
 
     set_request_state(request_id, 'in_progress', 'Creating the manifest list')
     output_pull_spec = _create_and_push_manifest_list(request_id, arches, [])
+    _record_pushed_index_image(output_pull_spec)
 
     _update_index_image_pull_spec(
         output_pull_spec=output_pull_spec,
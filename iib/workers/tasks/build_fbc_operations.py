@@ -8,10 +8,10 @@ from iib.common.tracing import instrument_tracing
 from iib.workers.api_utils import set_request_state
 from iib.workers.tasks.build import (
     _add_label_to_index,
-    _build_image,
+    _build_and_push_images,
     _cleanup,
     _create_and_push_manifest_list,
-    _push_image,
+    _record_pushed_index_image,
     _update_index_image_build_state,
     _update_index_image_pull_spec,
 )
@@ -19,6 +19,7 @@ from iib.workers.tasks.celery import app
 from iib.workers.tasks.opm_operations import opm_registry_add_fbc_fragment, Opm
 from iib.workers.tasks.utils import (
     get_resolved_image,
+    map_images_concurrently,
     prepare_request_for_build,
     request_logger,
     set_registry_token,
@@ -33,7 +34,7 @@ log = logging.getLogger(__name__)
 @app.task
 @request_logger
 @instrument_tracing(
-    span_name="workers.tasks.build.handle_fbc_operation_request", attributes=get_binary_versions()
+    span_name="workers.tasks.build.handle_fbc_operation_request", attributes=get_binary_versions
 )
 def handle_fbc_operation_request(
     request_id: int,
@@ -70,11 +71,12 @@ def handle_fbc_operation_request(
     set_request_state(request_id, 'in_progress', 'Resolving the fbc fragments')
 
     # Resolve all fbc fragments
-    resolved_fbc_fragments = []
-    for fbc_fragment in fbc_fragments:
-        with set_registry_token(overwrite_from_index_token, fbc_fragment, append=True):
-            resolved_fbc_fragment = get_resolved_image(fbc_fragment)
-            resolved_fbc_fragments.append(resolved_fbc_fragment)
+    unique_fbc_fragments = list(dict.fromkeys(fbc_fragments))
+    with set_registry_token(overwrite_from_index_token, unique_fbc_fragments, append=True):
+        resolved = map_images_concurrently(unique_fbc_fragments, get_resolved_image)
+    # Keep one resolved pull spec per requested fbc fragment, in the order of the request
+    resolved_by_fragment = dict(zip(unique_fbc_fragments, resolved))
+    resolved_fbc_fragments = [resolved_by_fragment[fragment] for fragment in fbc_fragments]
 
     prebuild_info = prepare_request_for_build(
         request_id,
@@ -129,12 +131,13 @@ def handle_fbc_operation_request(
         )
 
         arches = prebuild_info['arches']
-        for arch in sorted(arches):
-            _build_image(temp_dir, 'index.Dockerfile', request_id, arch)
-            _push_image(request_id, arch)
+        _build_and_push_images(
+            temp_dir, 'index.Dockerfile', request_id, arches, request_type='fbc-operations'
+        )
 
     set_request_state(request_id, 'in_progress', 'Creating the manifest list')
     output_pull_spec = _create_and_push_manifest_list(request_id, arches, build_tags)
+    _record_pushed_index_image(output_pull_spec)
 
     _update_index_image_pull_spec(
         output_pull_spec=output_pull_spec,
@@ -26,17 +26,28 @@ from packaging.version import Version
 
 from iib.exceptions import IIBError
 from iib.workers.api_utils import set_request_state, get_request
+from iib.workers.checkpoints import (
+    Checkpoint,
+    PHASE_CONTEXT_PREPARED,
+    PHASE_IMAGES_PUSHED,
+    PHASE_MANIFEST_LIST_PUSHED,
+    remove_checkpoint,
+    save_checkpoint,
+)
 from iib.workers.tasks.build import (
     _add_label_to_index,
-    _build_image,
+    _build_and_push_images,
     _cleanup,
+    _build_and_push_images_from_checkpoint,
     _create_and_push_manifest_list,
+    _record_pushed_index_image,
+    _get_checkpoint_fingerprint,
     _get_external_arch_pull_spec,
+    _get_request_checkpoint,
     get_image_label,
     has_hidden_database,
     get_index_database,
     _get_present_bundles,
-    _push_image,
     _update_index_image_build_state,
     _update_index_image_pull_spec,
 )
@@ -51,7 +62,7 @@ from iib.workers.tasks.utils import (
     prepare_request_for_build,
     RequestConfigMerge,
 )
-from iib.workers.tasks.iib_static_types import BundleImage
+from iib.workers.tasks.iib_static_types import BundleImage, PrebuildInfo
 
 
 __all__ = ['handle_merge_request']
@@ -221,17 +232,74 @@ def _add_bundles_missing_in_source(
         base_dir,
         'index.Dockerfile',
     )
-    _build_image(base_dir, 'index.Dockerfile', request_id, arch)
-    _push_image(request_id, arch)
+    _build_and_push_images(
+        base_dir, 'index.Dockerfile', request_id, {arch}, request_type='merge-index-image'
+    )
     log.info('New index image created')
 
     return missing_bundles, invalid_bundles
 
 
+def _finish_merge_request(
+    request_id: int,
+    checkpoint: Checkpoint,
+    prebuild_info: PrebuildInfo,
+    target_index: Optional[str],
+    overwrite_target_index: bool,
+    overwrite_target_index_token: Optional[str],
+    build_tags: Optional[List[str]],
+) -> None:
+    """
+    Run the phases of the merge request following its checkpoint and complete the request.
+
+    The checkpoint of each phase is saved once it's completed, so that the request can be resumed
+    after it if a later phase fails. The checkpoints are removed once the request is completed.
+
+    :param int request_id: the ID of the IIB build request.
+    :param Checkpoint checkpoint: the last completed phase of the request.
+    :param dict prebuild_info: the information relevant to the build operation.
+    :param str target_index: pull specification of the target index image.
+    :param bool overwrite_target_index: if True, overwrite the input ``target_index`` with
+        the built index image.
+    :param str overwrite_target_index_token: the token used for overwriting the input
+        ``target_index`` image.
+    :param list build_tags: list of extra tags to use for the index image.
+    :raises IIBError: if any of the phases fails.
+    """
+    arches = prebuild_info['arches']
+    checkpoint = _build_and_push_images_from_checkpoint(
+        request_id, checkpoint, arches, 'merge-index-image'
+    )
+    if checkpoint.phase == PHASE_IMAGES_PUSHED:
+        output_pull_spec = _create_and_push_manifest_list(request_id, arches, build_tags)
+        _record_pushed_index_image(output_pull_spec)
+        checkpoint = save_checkpoint(
+            request_id,
+            checkpoint.fingerprint,
+            PHASE_MANIFEST_LIST_PUSHED,
+            {**checkpoint.data, 'output_pull_spec': output_pull_spec},
+        )
+
+    _update_index_image_pull_spec(
+        output_pull_spec=checkpoint.data['output_pull_spec'],
+        request_id=request_id,
+        arches=arches,
+        from_index=target_index,
+        overwrite_from_index=overwrite_target_index,
+        overwrite_from_index_token=overwrite_target_index_token,
+        resolved_prebuild_from_index=prebuild_info['target_index_resolved'],
+    )
+    _cleanup()
+    remove_checkpoint(request_id)
+    set_request_state(
+        request_id, 'complete', 'The index image was successfully cleaned and updated.'
+    )
+
+
 @app.task
 @request_logger
 @instrument_tracing(
-    span_name="workers.tasks.build.handle_merge_request", attributes=get_binary_versions()
+    span_name="workers.tasks.build.handle_merge_request", attributes=get_binary_versions
 )
 def handle_merge_request(
     source_from_index: str,
@@ -293,6 +361,25 @@ def handle_merge_request(
     _update_index_image_build_state(request_id, prebuild_info)
     dockerfile_name = 'index.Dockerfile'
 
+    checkpoint_fingerprint = _get_checkpoint_fingerprint(
+        prebuild_info,
+        deprecation_list=sorted(deprecation_list),
+        graph_update_mode=graph_update_mode,
+        ignore_bundle_ocp_version=ignore_bundle_ocp_version,
+    )
+    checkpoint = _get_request_checkpoint(request_id, checkpoint_fingerprint)
+    if checkpoint:
+        _finish_merge_request(
+            request_id=request_id,
+            checkpoint=checkpoint,
+            prebuild_info=prebuild_info,
+            target_index=target_index,
+            overwrite_target_index=overwrite_target_index,
+            overwrite_target_index_token=overwrite_target_index_token,
+            build_tags=build_tags,
+        )
+        return
+
     with tempfile.TemporaryDirectory(prefix=f'iib-{request_id}-') as temp_dir:
         with set_registry_token(overwrite_target_index_token, target_index, append=True):
             source_fbc = is_image_fbc(source_from_index_resolved)
@@ -429,8 +516,13 @@ def handle_merge_request(
                 # push a temporary index image to satisfy this requirement. Any arch will do.
                 # NOTE: we cannot use local builds because opm commands fails,
                 # index image has to be pushed to registry
-                _build_image(temp_dir, 'index.Dockerfile', request_id, arch)
-                _push_image(request_id, arch)
+                _build_and_push_images(
+                    temp_dir,
+                    'index.Dockerfile',
+                    request_id,
+                    {arch},
+                    request_type='merge-index-image',
+                )
 
                 deprecate_bundles(
                     bundles=deprecation_bundles,
@@ -473,10 +565,6 @@ def handle_merge_request(
             dockerfile_name,
         )
 
-        for arch in sorted(prebuild_info['arches']):
-            _build_image(temp_dir, dockerfile_name, request_id, arch)
-            _push_image(request_id, arch)
-
         # If the container-tool podman is used in the opm commands above, opm will create temporary
         # files and directories without the write permission. This will cause the context manager
         # to fail to delete these files. Adjust the file modes to avoid this error.
@@ -486,21 +574,32 @@ def handle_merge_request(
             file_mode=(stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP),
         )
 
-    output_pull_spec = _create_and_push_manifest_list(
-        request_id, prebuild_info['arches'], build_tags
-    )
-    _update_index_image_pull_spec(
-        output_pull_spec=output_pull_spec,
+        checkpoint = save_checkpoint(
+            request_id,
+            checkpoint_fingerprint,
+            PHASE_CONTEXT_PREPARED,
+            {'dockerfile_name': dockerfile_name},
+            context_dir=temp_dir,
+        )
+        _build_and_push_images(
+            temp_dir,
+            dockerfile_name,
+            request_id,
+            prebuild_info['arches'],
+            request_type='merge-index-image',
+        )
+        checkpoint = save_checkpoint(
+            request_id, checkpoint_fingerprint, PHASE_IMAGES_PUSHED, checkpoint.data
+        )
+
+    _finish_merge_request(
         request_id=request_id,
-        arches=prebuild_info['arches'],
-        from_index=target_index,
-        overwrite_from_index=overwrite_target_index,
-        overwrite_from_index_token=overwrite_target_index_token,
-        resolved_prebuild_from_index=target_index_resolved,
-    )
-    _cleanup()
-    set_request_state(
-        request_id, 'complete', 'The index image was successfully cleaned and updated.'
+        checkpoint=checkpoint,
+        prebuild_info=prebuild_info,
+        target_index=target_index,
+        overwrite_target_index=overwrite_target_index,
+        overwrite_target_index_token=overwrite_target_index_token,
+        build_tags=build_tags,
     )
 
 
@@ -52,7 +52,7 @@ log = logging.getLogger(__name__)
 @request_logger
 @instrument_tracing(
     span_name="workers.tasks.build.handle_recursive_related_bundles_request",
-    attributes=get_binary_versions(),
+    attributes=get_binary_versions,
 )
 def handle_recursive_related_bundles_request(
     parent_bundle_image: str,
@@ -17,9 +17,9 @@ from iib.workers.api_utils import set_request_state, update_request
 from iib.workers.tasks.build import (
     _cleanup,
     get_image_label,
-    _build_image,
-    _push_image,
+    _build_and_push_images,
     _create_and_push_manifest_list,
+    _record_pushed_index_image,
     _copy_files_from_image,
 )
 from iib.workers.config import get_worker_config
@@ -55,7 +55,7 @@ log = logging.getLogger(__name__)
 @request_logger
 @instrument_tracing(
     span_name="workers.tasks.build.handle_regenerate_bundle_request",
-    attributes=get_binary_versions(),
+    attributes=get_binary_versions,
 )
 def handle_regenerate_bundle_request(
     from_bundle_image: str,
@@ -135,12 +135,13 @@ def handle_regenerate_bundle_request(
                 for name, value in new_labels.items():
                     dockerfile.write(f'LABEL {name}={value}\n')
 
-            for arch in sorted(arches):
-                _build_image(temp_dir, 'Dockerfile', request_id, arch)
-                _push_image(request_id, arch)
+            _build_and_push_images(
+                temp_dir, 'Dockerfile', request_id, arches, request_type='regenerate-bundle'
+            )
 
     set_request_state(request_id, 'in_progress', 'Creating the manifest list')
     output_pull_spec = _create_and_push_manifest_list(request_id, arches, [])
+    _record_pushed_index_image(output_pull_spec)
 
     conf = get_worker_config()
     if conf['iib_index_image_output_registry']:
@@ -3,8 +3,6 @@ import os
 
 import celery
 from celery.signals import celeryd_init
-from opentelemetry.instrumentation.celery import CeleryInstrumentor
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
 from celery.signals import worker_process_init
 
 from iib.workers.config import configure_celery, validate_celery_config
@@ -18,6 +16,9 @@ configure_celery(app)
 celeryd_init.connect(validate_celery_config)
 
 if os.getenv('IIB_OTEL_TRACING', '').lower() == 'true':
+    # The instrumentations are only imported when the tracing is enabled
+    from opentelemetry.instrumentation.requests import RequestsInstrumentor
+
     RequestsInstrumentor().instrument(trace_provider=tracerWrapper.provider)
 
 
@@ -26,4 +27,6 @@ if os.getenv('IIB_OTEL_TRACING', '').lower() == 'true':
 def init_celery_tracing(*args, **kwargs):
     """Initialize the tracing for celery."""
     if os.getenv('IIB_OTEL_TRACING', '').lower() == 'true':
+        from opentelemetry.instrumentation.celery import CeleryInstrumentor
+
         CeleryInstrumentor().instrument(trace_provider=tracerWrapper.provider)
@@ -1,13 +1,14 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # This file contains functions that are common for File-Based Catalog image type
 import contextlib
+import hashlib
 import os
 import logging
 import shutil
 import json
 from datetime import datetime
 from pathlib import Path
-from typing import Tuple, List
+from typing import Dict, Tuple, List, Optional
 
 import ruamel.yaml
 
@@ -81,12 +82,14 @@ def get_hidden_index_database(from_index: str, base_dir: str) -> str:
     return base_db_file
 
 
-def merge_catalogs_dirs(src_config: str, dest_config: str):
+def merge_catalogs_dirs(src_config: str, dest_config: str, from_index: Optional[str] = None):
     """
     Merge two catalog directories by replacing everything from src_config over dest_config.
 
     :param str src_config: source config directory
     :param str dest_config: destination config directory
+    :param str from_index: the pull specification of the index image the catalogs are based on,
+        whose validated packages aren't validated again, see ``opm_validate``
     """
     from iib.workers.tasks.opm_operations import opm_validate
 
@@ -99,7 +102,7 @@ def merge_catalogs_dirs(src_config: str, dest_config: str):
     log.info("Merging config folders: %s to %s", src_config, dest_config)
     shutil.copytree(src_config, dest_config, dirs_exist_ok=True)
     enforce_json_config_dir(conf_dir)
-    opm_validate(conf_dir)
+    opm_validate(conf_dir, from_index=from_index)
 
 
 def extract_fbc_fragment(
@@ -134,6 +137,40 @@ def extract_fbc_fragment(
     return fbc_fragment_path, operator_packages
 
 
+def get_catalog_package_digests(catalog_dir: str) -> Dict[str, str]:
+    """
+    Compute the digest of the content of each package of the file-based catalog.
+
+    The packages are the entries at the root of the catalog directory, so that the files at the
+    root and the operator deprecations also get a digest.
+
+    :param str catalog_dir: the path to the file-based catalog directory
+    :return: the SHA-256 digests of the packages, mapped to the package names
+    :rtype: dict
+    """
+    digests = {}
+    for entry in sorted(os.listdir(catalog_dir)):
+        entry_path = os.path.join(catalog_dir, entry)
+        paths = [entry_path]
+        if os.path.isdir(entry_path):
+            paths = []
+            for dirpath, dirnames, filenames in os.walk(entry_path):
+                dirnames.sort()
+                paths.extend(os.path.join(dirpath, filename) for filename in sorted(filenames))
+
+        hasher = hashlib.sha256()
+        for path in paths:
+            # The relative path and the size of each file are hashed too, so that renaming or
+            # splitting the files changes the digest
+            relative_path = os.path.relpath(path, catalog_dir)
+            hasher.update(f'{relative_path}\0{os.path.getsize(path)}\0'.encode('utf-8'))
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(chunk)
+        digests[entry] = hasher.hexdigest()
+    return digests
+
+
 def _serialize_datetime(obj: datetime) -> str:
     """
     Serialize datetime objects.
@@ -38,6 +38,7 @@ class PrebuildInfo(TypedDict):
     arches: Set[str]
     binary_image: str
     binary_image_resolved: str
+    build_fingerprint: NotRequired[str]
     bundle_mapping: NotRequired[Dict[str, List[str]]]
     bundle_replacements: NotRequired[Dict[str, str]]
     distribution_scope: str
@@ -0,0 +1,398 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# This file contains functions reading the content of index images and of their catalogs
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import sqlite3
+from typing import Any, Dict, FrozenSet, Generator, Iterable, List, Optional, Sequence
+
+from iib.exceptions import IIBError
+from iib.workers.tasks.iib_static_types import BundleImage
+
+log = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s*')
+_SQLITE_HEADER = b'SQLite format 3\x00'
+# The bundles of the packages are the bundles referenced by their channels, like opm render does
+_SQLITE_BUNDLES_QUERY = '''
+SELECT DISTINCT
+    operatorbundle.name,
+    operatorbundle.bundlepath,
+    operatorbundle.version,
+    channel_entry.package_name,
+    properties.value
+FROM operatorbundle
+INNER JOIN channel_entry ON channel_entry.operatorbundle_name = operatorbundle.name
+LEFT JOIN properties ON
+    properties.operatorbundle_name = operatorbundle.name
+    AND properties.type = 'olm.package'
+{where}
+ORDER BY channel_entry.package_name, operatorbundle.name
+'''
+# The bundle paths are passed as a single JSON array, which SQLite turns into an indexed list
+_SQLITE_BUNDLE_PATHS_FILTER = 'WHERE operatorbundle.bundlepath IN (SELECT value FROM json_each(?))'
+_SQLITE_PACKAGES_QUERY = 'SELECT name FROM package ORDER BY name'
+# The rows which make up the content of each package, starting with the package name. The IDs of
+# the channel entries are replaced with bundle names since they change when other packages change.
+_SQLITE_PACKAGE_CONTENT_QUERIES = (
+    'SELECT name, default_channel FROM package',
+    'SELECT package_name, name, head_operatorbundle_name FROM channel',
+    '''
+    SELECT
+        channel_entry.package_name,
+        channel_entry.channel_name,
+        channel_entry.operatorbundle_name,
+        replaced.operatorbundle_name,
+        channel_entry.depth
+    FROM channel_entry
+    LEFT JOIN channel_entry AS replaced ON replaced.entry_id = channel_entry.replaces
+    ''',
+    '''
+    SELECT DISTINCT
+        channel_entry.package_name,
+        operatorbundle.name,
+        operatorbundle.csv,
+        operatorbundle.bundle,
+        operatorbundle.bundlepath,
+        operatorbundle.skips,
+        operatorbundle.version,
+        operatorbundle.skiprange,
+        operatorbundle.replaces,
+        operatorbundle.substitutesfor
+    FROM operatorbundle
+    INNER JOIN channel_entry ON channel_entry.operatorbundle_name = operatorbundle.name
+    ''',
+    '''
+    SELECT DISTINCT channel_entry.package_name, properties.*
+    FROM properties
+    INNER JOIN channel_entry ON channel_entry.operatorbundle_name = properties.operatorbundle_name
+    ''',
+    '''
+    SELECT DISTINCT channel_entry.package_name, related_image.*
+    FROM related_image
+    INNER JOIN channel_entry ON
+        channel_entry.operatorbundle_name = related_image.operatorbundle_name
+    ''',
+    '''
+    SELECT DISTINCT channel_entry.package_name, dependencies.*
+    FROM dependencies
+    INNER JOIN channel_entry ON
+        channel_entry.operatorbundle_name = dependencies.operatorbundle_name
+    ''',
+    '''
+    SELECT DISTINCT channel_entry.package_name, deprecated.*
+    FROM deprecated
+    INNER JOIN channel_entry ON channel_entry.operatorbundle_name = deprecated.operatorbundle_name
+    ''',
+    '''
+    SELECT
+        channel_entry.package_name,
+        channel_entry.channel_name,
+        channel_entry.operatorbundle_name,
+        api_provider.group_name,
+        api_provider.version,
+        api_provider.kind
+    FROM api_provider
+    INNER JOIN channel_entry ON channel_entry.entry_id = api_provider.channel_entry_id
+    ''',
+    '''
+    SELECT
+        channel_entry.package_name,
+        channel_entry.channel_name,
+        channel_entry.operatorbundle_name,
+        api_requirer.group_name,
+        api_requirer.version,
+        api_requirer.kind
+    FROM api_requirer
+    INNER JOIN channel_entry ON channel_entry.entry_id = api_requirer.channel_entry_id
+    ''',
+)
+
+
+def _is_sqlite_database(path: str) -> bool:
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(_SQLITE_HEADER)) == _SQLITE_HEADER
+
+
+def _query_sqlite_database(
+    db_path: str, query: str, parameters: Sequence[Any] = ()
+) -> Optional[List[Any]]:
+    """
+    Run the query against the index database opened in read-only mode.
+
+    :param str db_path: the path to the index database
+    :param str query: the SQL query to run
+    :param list parameters: the values of the parameters of the query
+    :return: the rows returned by the query, or ``None`` if the database doesn't have the
+        expected schema
+    :rtype: list or None
+    """
+    con = sqlite3.connect(f'{Path(db_path).resolve().as_uri()}?mode=ro', uri=True)
+    try:
+        return con.execute(query, parameters).fetchall()
+    except sqlite3.Error as e:
+        log.warning('Failed to read the index database %s: %s', db_path, e)
+        return None
+    finally:
+        con.close()
+
+
+def _decode_json_blobs(
+    decoder: json.JSONDecoder, text: str, strict: bool
+) -> Generator[Dict[str, Any], None, str]:
+    """
+    Decode the complete JSON blobs at the beginning of the text.
+
+    :param json.JSONDecoder decoder: the JSON decoder
+    :param str text: the text starting with concatenated JSON blobs
+    :param bool strict: if ``True``, the text must only contain complete JSON blobs
+    :return: the generator of the blobs, which returns the rest of the text
+    :rtype: Generator
+    :raises json.JSONDecodeError: if ``strict`` is ``True`` and the rest of the text isn't empty
+    """
+    index = 0
+    while True:
+        whitespace = _WHITESPACE.match(text, index)
+        if whitespace:
+            index = whitespace.end()
+        if index == len(text):
+            return ''
+        try:
+            blob, index = decoder.raw_decode(text, index)
+        except json.JSONDecodeError:
+            if strict:
+                raise
+            return text[index:]
+        yield blob
+
+
+def iter_json_blobs(lines: Iterable[str]) -> Generator[Dict[str, Any], None, None]:
+    """
+    Parse concatenated JSON blobs, such as the output of ``opm render``, line after line.
+
+    Only the lines of the blob being parsed are kept in memory, so that the memory used doesn't
+    depend on the size of the whole input.
+
+    :param Iterable lines: the lines of the concatenated JSON blobs
+    :return: the generator of the blobs
+    :rtype: Generator
+    :raises json.JSONDecodeError: if the input isn't made of JSON blobs
+    """
+    decoder = json.JSONDecoder()
+    buffer: List[str] = []
+    for line in lines:
+        buffer.append(line)
+        # The nested objects of indented blobs are on indented lines, so only try to decode
+        # the buffer when a line which isn't indented ends an object
+        if line[:1].isspace() or not line.rstrip().endswith('}'):
+            continue
+        rest = yield from _decode_json_blobs(decoder, ''.join(buffer), strict=False)
+        buffer = [rest] if rest else []
+    yield from _decode_json_blobs(decoder, ''.join(buffer), strict=True)
+
+
+def _iter_catalog_blobs(catalog_dir: str) -> Optional[Generator[Dict[str, Any], None, None]]:
+    """
+    Iterate over the declarative config blobs of the catalog, file after file.
+
+    Only the blob being parsed is kept in memory, see ``iter_json_blobs``.
+
+    :param str catalog_dir: the path to the catalog directory
+    :return: the generator of the blobs, or ``None`` if the catalog has files which are only
+        supported by opm, such as YAML files and ``.indexignore`` files
+    :rtype: Generator or None
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(catalog_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith('.json'):
+                log.debug(
+                    'The catalog %s has the file %s, which requires opm', catalog_dir, filename
+                )
+                return None
+            paths.append(os.path.join(dirpath, filename))
+
+    def _iter_blobs() -> Generator[Dict[str, Any], None, None]:
+        for path in paths:
+            yield from _iter_catalog_file_blobs(path)
+
+    return _iter_blobs()
+
+
+def _iter_catalog_file_blobs(path: str) -> Generator[Dict[str, Any], None, None]:
+    with open(path, 'r') as f:
+        try:
+            yield from iter_json_blobs(f)
+        except json.JSONDecodeError as e:
+            raise IIBError(f'Failed to parse the catalog file {path}: {e}')
+
+
+def _get_bundle_version(properties: List[Dict[str, Any]]) -> str:
+    for property in properties:
+        if property.get('type') == 'olm.package':
+            return property['value']['version']
+
+    error_msg = 'No olm package version found for OLM bundle.'
+    log.warning(error_msg)
+    raise IIBError(error_msg)
+
+
+def read_bundles(
+    input_data_path: str, bundle_paths: Optional[Iterable[str]] = None
+) -> Optional[List[BundleImage]]:
+    """
+    Read the bundles of an index database or a catalog directory.
+
+    The bundles are listed in the same way as from the output of ``opm render``.
+
+    :param str input_data_path: the path to the index database or to the catalog directory
+    :param Iterable bundle_paths: if set, only the bundles with these pull specifications are
+        read, which are selected by the query when reading an index database
+    :return: the bundles, or ``None`` if the input data can only be read with ``opm render``
+    :rtype: list(BundleImage) or None
+    :raises IIBError: if a bundle has no version or the catalog is invalid
+    """
+    if bundle_paths is not None:
+        bundle_paths = set(bundle_paths)
+
+    if _is_sqlite_database(input_data_path):
+        if bundle_paths is None:
+            rows = _query_sqlite_database(input_data_path, _SQLITE_BUNDLES_QUERY.format(where=''))
+        else:
+            rows = _query_sqlite_database(
+                input_data_path,
+                _SQLITE_BUNDLES_QUERY.format(where=_SQLITE_BUNDLE_PATHS_FILTER),
+                (json.dumps(sorted(bundle_paths)),),
+            )
+        if rows is None:
+            return None
+        bundles: List[BundleImage] = []
+        for name, bundle_path, version, package, package_property in rows:
+            if not version:
+                properties = []
+                if package_property:
+                    properties.append(
+                        {'type': 'olm.package', 'value': json.loads(package_property)}
+                    )
+                version = _get_bundle_version(properties)
+            bundles.append(
+                BundleImage(
+                    bundlePath=bundle_path or '',
+                    csvName=name,
+                    packageName=package,
+                    version=version,
+                )
+            )
+        return bundles
+
+    if not os.path.isdir(input_data_path):
+        return None
+    blobs = _iter_catalog_blobs(input_data_path)
+    if blobs is None:
+        return None
+    return [
+        BundleImage(
+            bundlePath=blob['image'],
+            csvName=blob['name'],
+            packageName=blob['package'],
+            version=_get_bundle_version(blob['properties']),
+        )
+        for blob in blobs
+        if blob.get('schema') == 'olm.bundle'
+        and (bundle_paths is None or blob.get('image') in bundle_paths)
+    ]
+
+
+def read_package_names(input_data_path: str) -> Optional[List[str]]:
+    """
+    Read the names of the packages of an index database or a catalog directory.
+
+    :param str input_data_path: the path to the index database or to the catalog directory
+    :return: the package names, or ``None`` if the input data can only be read with ``opm render``
+    :rtype: list(str) or None
+    :raises IIBError: if the catalog is invalid
+    """
+    if _is_sqlite_database(input_data_path):
+        rows = _query_sqlite_database(input_data_path, _SQLITE_PACKAGES_QUERY)
+        if rows is None:
+            return None
+        return [name for name, in rows]
+
+    if not os.path.isdir(input_data_path):
+        return None
+    blobs = _iter_catalog_blobs(input_data_path)
+    if blobs is None:
+        return None
+    return [blob['name'] for blob in blobs if blob.get('schema') == 'olm.package']
+
+
+def read_blob_package_names(catalog_path: str) -> Optional[FrozenSet[str]]:
+    """
+    Read the names of the packages which the declarative config blobs of a catalog belong to.
+
+    A blob belongs to the package it defines or to the package it references, such as the
+    package of a channel, a bundle or deprecations.
+
+    :param str catalog_path: the path to the catalog directory or to a catalog file
+    :return: the package names, or ``None`` if the catalog can only be read with ``opm render``
+    :rtype: frozenset(str) or None
+    :raises IIBError: if the catalog is invalid
+    """
+    if os.path.isfile(catalog_path):
+        if not catalog_path.endswith('.json'):
+            return None
+        blobs = _iter_catalog_file_blobs(catalog_path)
+    else:
+        catalog_blobs = _iter_catalog_blobs(catalog_path)
+        if catalog_blobs is None:
+            return None
+        blobs = catalog_blobs
+
+    names = (
+        blob.get('name') if blob.get('schema') == 'olm.package' else blob.get('package')
+        for blob in blobs
+    )
+    return frozenset(name for name in names if name)
+
+
+def get_package_fingerprints(db_path: str) -> Optional[Dict[str, str]]:
+    """
+    Compute a fingerprint of the content of each package of an index database.
+
+    The fingerprint of a package only changes when the package, its channels or its bundles
+    change, so that the packages changed by an ``opm registry`` command can be found by comparing
+    the fingerprints from before and after it.
+
+    :param str db_path: the path to the index database
+    :return: the SHA-256 fingerprints mapped to the package names, or ``None`` if the database
+        doesn't have the expected schema
+    :rtype: dict or None
+    """
+    if not _is_sqlite_database(db_path):
+        return None
+
+    row_digests: Dict[str, List[bytes]] = {}
+    con = sqlite3.connect(f'{Path(db_path).resolve().as_uri()}?mode=ro', uri=True)
+    try:
+        for index, query in enumerate(_SQLITE_PACKAGE_CONTENT_QUERIES):
+            # The rows are streamed so that the whole database is never loaded in memory
+            for package, *values in con.execute(query):
+                row = json.dumps([index, values], default=repr).encode('utf-8')
+                row_digests.setdefault(package, []).append(hashlib.sha256(row).digest())
+    except sqlite3.Error as e:
+        log.warning('Failed to read the index database %s: %s', db_path, e)
+        return None
+    finally:
+        con.close()
+
+    # The rows are not returned in a stable order, so their digests are sorted
+    return {
+        package: hashlib.sha256(b''.join(sorted(digests))).hexdigest()
+        for package, digests in row_digests.items()
+    }
@@ -7,9 +7,23 @@ import random
 import re
 import shutil
 import socket
+import sqlite3
 import tempfile
 import textwrap
-from typing import Callable, List, Optional, Set, Tuple, Union
+import threading
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 from packaging.version import Version
 
 from tenacity import (
@@ -21,17 +35,44 @@ from tenacity import (
 
 from iib.exceptions import AddressAlreadyInUse, IIBError
 from iib.workers.api_utils import set_request_state
+from iib.workers.build_memo import get_validated_packages, memoize_validated_packages
 from iib.workers.config import get_worker_config
 from iib.workers.tasks.fbc_utils import (
     is_image_fbc,
     get_catalog_dir,
     get_hidden_index_database,
     extract_fbc_fragment,
+    enforce_json_config_dir,
+    get_catalog_package_digests,
 )
 from iib.workers.tasks.iib_static_types import BundleImage
+from iib.workers.tasks.index_reader import (
+    get_package_fingerprints,
+    iter_json_blobs,
+    read_blob_package_names,
+    read_bundles,
+    read_package_names,
+)
 
 log = logging.getLogger(__name__)
 
+# The path of the cache of the file-based catalog within the index image, see create_dockerfile
+INDEX_IMAGE_CACHE_PATH = '/tmp/cache'
+# The file recording what the cache was generated from, at the root of the cache directory which
+# isn't covered by the integrity check of opm
+CACHE_MANIFEST_FILE = 'iib-cache-manifest.json'
+
+# The digests of the packages of the file-based catalogs validated during the request, see
+# get_catalog_package_digests, mapped to the opm binary which validated them and to the names of
+# the packages which their declarative config blobs belong to
+_validated_packages: Dict[str, Dict[str, FrozenSet[str]]] = {}
+# The index images whose validated packages were looked up during the request
+_validated_from_indexes: Set[Tuple[str, str]] = set()
+# The validated packages of the catalog of the index image being built, mapped to the version of
+# opm, until the index image is pushed, see memoize_retained_validated_packages
+_retained_validated_packages: Dict[str, Dict[str, List[str]]] = {}
+_validated_packages_lock = threading.Lock()
+
 
 class PortFileLock:
     """A class representing file-lock used during OPM operations."""
@@ -317,13 +358,13 @@ def get_operator_package_list(
     :return: list of package names present in input data.
     :rtype: [str]
     """
-    olm_packages = opm_render(input_image_or_path, base_dir)
+    package_names = read_package_names(_get_input_data_path(input_image_or_path, base_dir))
+    if package_names is not None:
+        return package_names
 
-    package_names = [
-        olm_package['name']
-        for olm_package in olm_packages
-        if olm_package['schema'] == 'olm.package'
-    ]
+    olm_packages = opm_render(input_image_or_path, base_dir, schemas={'olm.package'})
+
+    package_names = [olm_package['name'] for olm_package in olm_packages]
 
     return package_names
 
@@ -376,7 +417,10 @@ def get_list_bundles(
     base_dir: str,
 ) -> List[BundleImage]:
     """
-    Run OPM render to get list of bundles present in input data.
+    Get list of bundles present in input data.
+
+    The bundles of index databases and catalog directories are read directly. The other input
+    data are rendered with OPM render.
 
     :param str input_data: input data for opm render
         Example: catalog-image | catalog-directory | bundle-image | bundle-directory | sqlite-file
@@ -386,7 +430,11 @@ def get_list_bundles(
     """
     log.info("Get list of bundles from %s", input_data)
 
-    opm_data = opm_render(input_data, base_dir)
+    bundles = read_bundles(_get_input_data_path(input_data, base_dir))
+    if bundles is not None:
+        return bundles
+
+    opm_data = opm_render(input_data, base_dir, schemas={'olm.bundle'})
 
     # convert opm data to list of BundleImage
     olm_bundles: List[BundleImage] = [
@@ -397,7 +445,6 @@ def get_list_bundles(
             version=_get_olm_bundle_version(olm_bundle),
         )
         for olm_bundle in opm_data
-        if olm_bundle['schema'] == 'olm.bundle'
     ]
 
     return olm_bundles
@@ -406,31 +453,42 @@ def get_list_bundles(
 def opm_render(
     input_data: str,
     base_dir: str,
-):
+    schemas: Optional[Set[str]] = None,
+) -> Generator[Dict[str, Any], None, None]:
     """
     Run OPM render and extract data as valid JSON.
 
+    The output of OPM render is parsed while it's written, so that it's never held in memory as
+    a whole.
+
     :param str input_data: input data for opm render
         Example: catalog-image | catalog-directory | bundle-image | bundle-directory | sqlite-file
     :param str base_dir: temp directory where opm will be executed.
-    :return: list of parsed data from input
-    :rtype: list(dict)
+    :param set schemas: if set, only the data with one of these schemas are returned, for example
+        ``{'olm.bundle'}``
+    :return: the generator of the parsed data from input
+    :rtype: Generator
+    :raises IIBError: if OPM render fails or its output can't be parsed
     """
-    from iib.workers.tasks.utils import run_cmd
+    from iib.workers.tasks.utils import run_cmd_stream
 
     input_data_path = _get_input_data_path(input_data, base_dir)
     cmd = [Opm.opm_version, 'render', input_data_path]
-    opm_render_output = run_cmd(
-        cmd, {'cwd': base_dir}, exc_msg=f'Failed to run opm render with input: {input_data}'
-    )
-
-    if not opm_render_output:
-        log.info("There are no data in %s", input_data)
-        return []
+    exc_msg = f'Failed to run opm render with input: {input_data}'
+    opm_render_output = run_cmd_stream(cmd, {'cwd': base_dir}, exc_msg=exc_msg)
 
     log.debug("Parsing data from opm render")
-    for package in re.split(r'(?<=})\n(?={)', opm_render_output):
-        yield json.loads(package)
+    has_data = False
+    try:
+        for blob in iter_json_blobs(opm_render_output):
+            has_data = True
+            if schemas is None or blob.get('schema') in schemas:
+                yield blob
+    except json.JSONDecodeError as e:
+        raise IIBError(f'{exc_msg}: the output is not valid JSON: {e}')
+
+    if not has_data:
+        log.info("There are no data in %s", input_data)
 
 
 def _get_or_create_temp_index_db_file(
@@ -514,6 +572,7 @@ def deprecate_bundles_fbc(
     base_dir: str,
     binary_image: str,
     from_index: str,
+    migrate: bool = True,
 ) -> None:
     """
     Deprecate the specified bundles from the FBC index image.
@@ -524,6 +583,9 @@ def deprecate_bundles_fbc(
     :param str base_dir: base directory where operation files will be located.
     :param str binary_image: binary image to be used by the new index image.
     :param str from_index: index image, from which the bundles will be deprecated.
+    :param bool migrate: if set, the whole index.db is migrated to the file-based catalog,
+        otherwise only the packages changed in the index.db are expected to be migrated later,
+        see ``opm_migrate_changed_packages``
     """
     conf = get_worker_config()
     index_db_file = _get_or_create_temp_index_db_file(base_dir=base_dir, from_index=from_index)
@@ -540,7 +602,9 @@ def deprecate_bundles_fbc(
             bundles=bundles[i : i + conf.iib_deprecate_bundles_limit],  # Pass a chunk starting at i
         )
 
-    fbc_dir, _ = opm_migrate(index_db_file, base_dir)
+    fbc_dir = os.path.join(base_dir, 'catalog')
+    if migrate:
+        fbc_dir, _ = opm_migrate(index_db_file, base_dir)
     # we should keep generating Dockerfile here
     # to have the same behavior as we run `opm index deprecatetruncate` with '--generate' option
     create_dockerfile(
@@ -553,7 +617,7 @@ def deprecate_bundles_fbc(
 
 
 def opm_migrate(
-    index_db: str, base_dir: str, generate_cache: bool = True
+    index_db: str, base_dir: str, generate_cache: bool = True, from_index: Optional[str] = None
 ) -> Union[Tuple[str, str], Tuple[str, None]]:
     """
     Migrate SQLite database to File-Based catalog and generate cache using opm command.
@@ -561,11 +625,11 @@ def opm_migrate(
     :param str index_db: path to SQLite index.db which should migrated to FBC.
     :param str base_dir: base directory where catalog should be created.
     :param bool generate_cache: if set cache will be generated
+    :param str from_index: the pull specification of the index image the index.db comes from,
+        whose validated packages aren't validated again, see ``opm_validate``
     :return: Returns paths to directories for containing file-based catalog and it's cache
     :rtype: str, str|None
     """
-    from iib.workers.tasks.utils import run_cmd
-
     fbc_dir_path = os.path.join(base_dir, 'catalog')
 
     # It may happen that we need to regenerate file-based catalog
@@ -574,17 +638,9 @@ def opm_migrate(
     if os.path.exists(fbc_dir_path):
         shutil.rmtree(fbc_dir_path)
 
-    migrate_args = []
-    opm_new_migrate_version = get_worker_config().get('iib_opm_new_migrate_version')
-    opm_version_number = Opm.get_opm_version_number()
-    if Version(opm_version_number) > Version(opm_new_migrate_version):
-        migrate_args = ['--migrate-level', 'bundle-object-to-csv-metadata']
-
-    cmd = [Opm.opm_version, 'migrate', *migrate_args, index_db, fbc_dir_path]
-
-    run_cmd(cmd, {'cwd': base_dir}, exc_msg='Failed to migrate index.db to file-based catalog')
+    _run_opm_migrate(index_db, fbc_dir_path, base_dir)
     log.info("Migration to file-based catalog was completed.")
-    opm_validate(fbc_dir_path)
+    opm_validate(fbc_dir_path, from_index=from_index)
 
     if generate_cache:
         # Remove outdated cache before generating new one
@@ -597,6 +653,145 @@ def opm_migrate(
     return fbc_dir_path, None
 
 
+def _run_opm_migrate(index_db: str, fbc_dir: str, base_dir: str) -> None:
+    """
+    Migrate the SQLite database to a file-based catalog with opm.
+
+    :param str index_db: path to the SQLite index.db to migrate
+    :param str fbc_dir: path to the directory where the file-based catalog should be created
+    :param str base_dir: the directory to run opm in
+    :raises IIBError: if the migration fails
+    """
+    from iib.workers.tasks.utils import run_cmd
+
+    migrate_args = []
+    opm_new_migrate_version = get_worker_config().get('iib_opm_new_migrate_version')
+    opm_version_number = Opm.get_opm_version_number()
+    if Version(opm_version_number) > Version(opm_new_migrate_version):
+        migrate_args = ['--migrate-level', 'bundle-object-to-csv-metadata']
+
+    cmd = [Opm.opm_version, 'migrate', *migrate_args, index_db, fbc_dir]
+
+    run_cmd(cmd, {'cwd': base_dir}, exc_msg='Failed to migrate index.db to file-based catalog')
+
+
+def _create_packages_index_db(index_db: str, packages: List[str], dest_index_db: str) -> None:
+    """
+    Copy the index database with only the content of the given packages.
+
+    :param str index_db: path to the SQLite index.db to copy
+    :param list packages: the names of the packages to keep
+    :param str dest_index_db: path to the copy of the index.db
+    :raises sqlite3.Error: if the database doesn't have the expected schema
+    """
+    shutil.copyfile(index_db, dest_index_db)
+    con = sqlite3.connect(dest_index_db)
+    try:
+        with con:
+            con.execute('CREATE TEMP TABLE kept_package (name TEXT PRIMARY KEY)')
+            con.executemany('INSERT INTO kept_package VALUES (?)', ((p,) for p in packages))
+            for statement in (
+                'DELETE FROM channel_entry WHERE package_name NOT IN kept_package',
+                'DELETE FROM channel WHERE package_name NOT IN kept_package',
+                'DELETE FROM package WHERE name NOT IN kept_package',
+                'DELETE FROM operatorbundle '
+                'WHERE name NOT IN (SELECT operatorbundle_name FROM channel_entry)',
+                'DELETE FROM properties '
+                'WHERE operatorbundle_name NOT IN (SELECT name FROM operatorbundle)',
+                'DELETE FROM related_image '
+                'WHERE operatorbundle_name NOT IN (SELECT name FROM operatorbundle)',
+                'DELETE FROM dependencies '
+                'WHERE operatorbundle_name NOT IN (SELECT name FROM operatorbundle)',
+                'DELETE FROM deprecated '
+                'WHERE operatorbundle_name NOT IN (SELECT name FROM operatorbundle)',
+                'DELETE FROM api_provider '
+                'WHERE channel_entry_id NOT IN (SELECT entry_id FROM channel_entry)',
+                'DELETE FROM api_requirer '
+                'WHERE channel_entry_id NOT IN (SELECT entry_id FROM channel_entry)',
+            ):
+                con.execute(statement)
+    finally:
+        con.close()
+
+
+def opm_migrate_changed_packages(
+    index_db: str,
+    previous_fingerprints: Optional[Dict[str, str]],
+    catalog_dir: str,
+    base_dir: str,
+    from_index: Optional[str] = None,
+) -> bool:
+    """
+    Update the file-based catalog with the packages which changed in the SQLite database.
+
+    Only the packages whose fingerprint changed since ``previous_fingerprints``, or which are
+    missing from the catalog, are migrated into ``catalog_dir``, and the packages removed from the
+    database are removed from it. The other packages of the catalog are left untouched. The
+    catalog is then converted to JSON and validated, like after ``merge_catalogs_dirs``.
+
+    :param str index_db: path to the SQLite index.db after it was changed
+    :param dict previous_fingerprints: the fingerprints of the packages of the index.db before it
+        was changed, see ``get_package_fingerprints``
+    :param str catalog_dir: path to the file-based catalog migrated from the previous index.db
+    :param str base_dir: base directory where the changed packages can be migrated
+    :param str from_index: the pull specification of the index image the catalog comes from,
+        whose validated packages aren't validated again, see ``opm_validate``
+    :return: ``True`` if the catalog was updated, ``False`` if the changed packages can't be
+        determined, in which case the whole database has to be migrated
+    :rtype: bool
+    :raises IIBError: if the migration or the validation fails
+    """
+    fingerprints = get_package_fingerprints(index_db)
+    if previous_fingerprints is None or fingerprints is None:
+        log.info('Unable to find the packages changed in %s, it has to be fully migrated', index_db)
+        return False
+
+    changed_packages = sorted(
+        package
+        for package, fingerprint in fingerprints.items()
+        if previous_fingerprints.get(package) != fingerprint
+        or not os.path.isdir(os.path.join(catalog_dir, package))
+    )
+    removed_packages = sorted(previous_fingerprints.keys() - fingerprints.keys())
+    log.info(
+        'Migrating the changed packages %s and removing the packages %s from %s',
+        changed_packages,
+        removed_packages,
+        catalog_dir,
+    )
+
+    if changed_packages:
+        packages_index_db = os.path.join(base_dir, 'changed-packages-index.db')
+        packages_fbc_dir = os.path.join(base_dir, 'changed-packages-catalog')
+        try:
+            _create_packages_index_db(index_db, changed_packages, packages_index_db)
+        except sqlite3.Error as e:
+            log.warning('Failed to copy the changed packages of %s: %s', index_db, e)
+            return False
+        if os.path.exists(packages_fbc_dir):
+            shutil.rmtree(packages_fbc_dir)
+        _run_opm_migrate(packages_index_db, packages_fbc_dir, base_dir)
+        os.remove(packages_index_db)
+
+        for package in os.listdir(packages_fbc_dir):
+            shutil.copytree(
+                os.path.join(packages_fbc_dir, package),
+                os.path.join(catalog_dir, package),
+                dirs_exist_ok=True,
+            )
+        shutil.rmtree(packages_fbc_dir)
+
+    for package in removed_packages:
+        package_dir = os.path.join(catalog_dir, package)
+        if os.path.exists(package_dir):
+            log.debug('Removing the package %s removed from the database', package)
+            shutil.rmtree(package_dir)
+
+    enforce_json_config_dir(catalog_dir)
+    opm_validate(catalog_dir, from_index=from_index)
+    return True
+
+
 def create_dockerfile(
     fbc_dir: str,
     base_dir: str,
@@ -673,19 +868,90 @@ def create_dockerfile(
     return dockerfile_path
 
 
+def _reuse_from_index_cache(
+    from_index: str,
+    local_cache_path: str,
+    manifest: Dict[str, Any],
+    from_index_packages: Dict[str, str],
+) -> bool:
+    """
+    Reuse the cache of the index image when it was generated from the same file-based catalog.
+
+    The cache of opm can't be partially updated because its digest covers the whole catalog, so
+    it is only copied from the index image when none of the packages changed.
+
+    :param str from_index: the pull specification of the index image the catalog is based on
+    :param str local_cache_path: path where the cache should be created
+    :param dict manifest: the manifest of the cache to be generated, see ``CACHE_MANIFEST_FILE``
+    :param dict from_index_packages: the digests of the packages of the catalog of the index
+        image, see ``get_catalog_package_digests``
+    :return: ``True`` if the cache of the index image was copied to ``local_cache_path``
+    :rtype: bool
+    """
+    from iib.workers.tasks.build import _copy_files_from_image
+
+    changed_packages = sorted(
+        package
+        for package in from_index_packages.keys() | manifest['packages'].keys()
+        if from_index_packages.get(package) != manifest['packages'].get(package)
+    )
+    if changed_packages:
+        log.info(
+            'The packages %s changed since %s, so its cache cannot be reused',
+            ', '.join(changed_packages),
+            from_index,
+        )
+        return False
+
+    try:
+        _copy_files_from_image(from_index, INDEX_IMAGE_CACHE_PATH, local_cache_path)
+        with open(os.path.join(local_cache_path, CACHE_MANIFEST_FILE), 'r') as f:
+            from_index_manifest = json.load(f)
+    except (IIBError, OSError, ValueError) as e:
+        log.info('The cache of %s cannot be reused: %s', from_index, e)
+        from_index_manifest = None
+
+    # The cache must have been generated by the same opm, from the catalog of the index image
+    if not isinstance(from_index_manifest, dict) or {
+        key: from_index_manifest.get(key) for key in ('opm_version', 'packages')
+    } != {key: manifest[key] for key in ('opm_version', 'packages')}:
+        log.info(
+            'The cache of %s was not generated from its catalog by opm %s and cannot be reused',
+            from_index,
+            manifest['opm_version'],
+        )
+        if os.path.exists(local_cache_path):
+            shutil.rmtree(local_cache_path)
+        return False
+
+    log.info('Reusing the cache of %s since its file-based catalog did not change', from_index)
+    return True
+
+
 @create_port_filelocks(port_purposes=["opm_pprof_port"])
 def generate_cache_locally(
     base_dir: str,
     fbc_dir: str,
     local_cache_path: str,
+    from_index: Optional[str] = None,
+    from_index_packages: Optional[Dict[str, str]] = None,
     opm_pprof_port: Optional[int] = None,
 ) -> None:
     """
     Generate the cache for the index image locally before building it.
 
+    A manifest with the digests of the packages of the catalog is stored with the cache, so that
+    the cache can be reused by the requests based on the index image. The packages of the catalog
+    validated during the request are retained until the index image is pushed, see
+    ``memoize_retained_validated_packages``.
+
     :param str base_dir: base directory where cache should be created.
     :param str fbc_dir: directory containing file-based catalog (JSON or YAML files).
     :param str local_cache_path: path to the locally generated cache.
+    :param str from_index: the pull specification of the index image the catalog is based on,
+        whose cache is reused if the catalog didn't change and it was generated by the same opm
+    :param dict from_index_packages: the digests of the packages of the catalog extracted from
+        ``from_index``, see ``get_catalog_package_digests``
     :return: Returns path to generated cache
     :rtype: str
     :raises: IIBError when cache was not generated
@@ -693,6 +959,28 @@ def generate_cache_locally(
     """
     from iib.workers.tasks.utils import run_cmd
 
+    packages = get_catalog_package_digests(fbc_dir)
+    with _validated_packages_lock:
+        validated_packages = _validated_packages.get(Opm.opm_version, {})
+        blob_package_names = {
+            digest: sorted(validated_packages[digest])
+            for digest in packages.values()
+            if digest in validated_packages
+        }
+    manifest = {'opm_version': Opm.get_opm_version_number(), 'packages': packages}
+    if blob_package_names and get_worker_config().get('iib_build_memo_dir'):
+        with _validated_packages_lock:
+            _retained_validated_packages.clear()
+            _retained_validated_packages[manifest['opm_version']] = blob_package_names
+    if os.path.exists(local_cache_path):
+        shutil.rmtree(local_cache_path)
+    if (
+        from_index
+        and from_index_packages is not None
+        and _reuse_from_index_cache(from_index, local_cache_path, manifest, from_index_packages)
+    ):
+        return
+
     cmd = [
         Opm.opm_version,
         'serve',
@@ -708,8 +996,6 @@ def generate_cache_locally(
         cmd.extend(["--pprof-addr", f"127.0.0.1:{str(opm_pprof_port)}"])
 
     log.info('Generating cache for the file-based catalog')
-    if os.path.exists(local_cache_path):
-        shutil.rmtree(local_cache_path)
     run_cmd(cmd, {'cwd': base_dir}, exc_msg='Failed to generate cache for file-based catalog')
 
     # Check if the opm command generated cache successfully
@@ -718,6 +1004,9 @@ def generate_cache_locally(
         log.error(error_msg)
         raise IIBError(error_msg)
 
+    with open(os.path.join(local_cache_path, CACHE_MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+
 
 @retry(
     before_sleep=before_sleep_log(log, logging.WARNING),
@@ -810,7 +1099,8 @@ def opm_registry_add_fbc(
     overwrite_csv: bool = False,
     overwrite_from_index_token: Optional[str] = None,
     container_tool: Optional[str] = None,
-) -> None:
+    migrate: bool = True,
+) -> Optional[Dict[str, str]]:
     """
     Add the input bundles to an operator index.
 
@@ -831,6 +1121,12 @@ def opm_registry_add_fbc(
         ``source_from_index`` image. This is required to use ``overwrite_target_index``.
         The format of the token must be in the format "user:password".
     :param str container_tool: the container tool to be used to operate on the index image
+    :param bool migrate: if set, the whole index.db is migrated to the file-based catalog,
+        otherwise only the packages changed in the index.db are expected to be migrated later,
+        see ``opm_migrate_changed_packages``
+    :return: the fingerprints of the packages of the index.db before the bundles were added,
+        see ``get_package_fingerprints``, or ``None`` if the index.db was migrated
+    :rtype: dict or None
     """
     index_db_file = _get_or_create_temp_index_db_file(
         base_dir=base_dir,
@@ -838,6 +1134,7 @@ def opm_registry_add_fbc(
         overwrite_from_index_token=overwrite_from_index_token,
         ignore_existing=True,
     )
+    previous_fingerprints = None if migrate else get_package_fingerprints(index_db_file)
 
     _opm_registry_add(
         base_dir=base_dir,
@@ -848,7 +1145,9 @@ def opm_registry_add_fbc(
         graph_update_mode=graph_update_mode,
     )
 
-    fbc_dir, _ = opm_migrate(index_db=index_db_file, base_dir=base_dir)
+    fbc_dir = os.path.join(base_dir, 'catalog')
+    if migrate:
+        fbc_dir, _ = opm_migrate(index_db=index_db_file, base_dir=base_dir)
     # we should keep generating Dockerfile here
     # to have the same behavior as we run `opm index add` with '--generate' option
     create_dockerfile(
@@ -858,6 +1157,7 @@ def opm_registry_add_fbc(
         binary_image=binary_image,
         dockerfile_name='index.Dockerfile',
     )
+    return previous_fingerprints
 
 
 def _opm_registry_rm(
@@ -900,6 +1200,7 @@ def opm_registry_rm_fbc(
     from_index: str,
     operators: List[str],
     index_db_path: str,
+    catalog_dir: Optional[str] = None,
 ) -> Tuple[str, Optional[str]]:
     """
     Remove operator/s from a File Based Catalog index image.
@@ -918,15 +1219,28 @@ def opm_registry_rm_fbc(
         The format of the token must be in the format "user:password".
     :param bool generate_cache: if set cache of migrated file-based catalog will be generated
         The format of the token must be in the format "user:password".
+    :param str catalog_dir: the file-based catalog migrated from the index.db, which is updated
+        with only the packages changed in the index.db instead of migrating the whole index.db
 
-    :return: Returns paths to directories for containing file-based catalog and it's cache
+    :return: Returns paths to directories for containing file-based catalog and it's cache,
+        which is ``catalog_dir`` if it was updated
     :rtype: str, str|None
     """
+    previous_fingerprints = get_package_fingerprints(index_db_path) if catalog_dir else None
     log.info('Removing %s from %s index.db ', operators, from_index)
     _opm_registry_rm(index_db_path=index_db_path, operators=operators, base_dir=base_dir)
 
+    if catalog_dir and opm_migrate_changed_packages(
+        index_db=index_db_path,
+        previous_fingerprints=previous_fingerprints,
+        catalog_dir=catalog_dir,
+        base_dir=base_dir,
+        from_index=from_index,
+    ):
+        return catalog_dir, None
+
     fbc_dir, cache_dir = opm_migrate(
-        index_db=index_db_path, base_dir=base_dir, generate_cache=False
+        index_db=index_db_path, base_dir=base_dir, generate_cache=False, from_index=from_index
     )
 
     return fbc_dir, cache_dir
@@ -1024,6 +1338,7 @@ def opm_registry_add_fbc_fragment(
     # this will look like /tmp/iib-**/configs
     from_index_configs_dir = get_catalog_dir(from_index=from_index, base_dir=temp_dir)
     log.info("The content of from_index configs located at %s", from_index_configs_dir)
+    from_index_packages = get_catalog_package_digests(from_index_configs_dir)
 
     # Single pass: Extract all fragment paths and operators
     fragment_data = []
@@ -1058,6 +1373,7 @@ def opm_registry_add_fbc_fragment(
             index_db=index_db_path,
             base_dir=temp_dir,
             generate_cache=False,
+            from_index=from_index,
         )
         log.info("Migrated catalog after removing from db at %s", migrated_catalog_dir)
 
@@ -1094,7 +1410,11 @@ def opm_registry_add_fbc_fragment(
 
     local_cache_path = os.path.join(temp_dir, 'cache')
     generate_cache_locally(
-        base_dir=temp_dir, fbc_dir=from_index_configs_dir, local_cache_path=local_cache_path
+        base_dir=temp_dir,
+        fbc_dir=from_index_configs_dir,
+        local_cache_path=local_cache_path,
+        from_index=from_index,
+        from_index_packages=from_index_packages,
     )
 
     log.info("Dockerfile generated from %s", from_index_configs_dir)
@@ -1358,18 +1678,166 @@ def deprecate_bundles(
         run_cmd(cmd, {'cwd': base_dir}, exc_msg='Failed to deprecate the bundles')
 
 
-def opm_validate(config_dir: str) -> None:
+def clear_validated_packages() -> None:
+    """Forget the packages of the file-based catalogs validated during the request."""
+    with _validated_packages_lock:
+        _validated_packages.clear()
+        _validated_from_indexes.clear()
+        _retained_validated_packages.clear()
+
+
+def memoize_retained_validated_packages(output_pull_spec: str) -> None:
+    """
+    Record the validated packages of the catalog of the pushed index image in the build memo.
+
+    The packages are retained by ``generate_cache_locally`` until the index image is pushed, so
+    that the requests based on the index image don't validate them again.
+
+    :param str output_pull_spec: the pull specification of the pushed manifest list
+    """
+    from iib.workers.tasks.utils import get_resolved_pushed_image
+
+    with _validated_packages_lock:
+        retained = dict(_retained_validated_packages)
+        _retained_validated_packages.clear()
+    if not retained:
+        return
+
+    index_image = get_resolved_pushed_image(output_pull_spec)
+    for opm_version, validated_packages in retained.items():
+        memoize_validated_packages(index_image, opm_version, validated_packages)
+
+
+def _get_validated_packages(from_index: Optional[str] = None) -> Dict[str, FrozenSet[str]]:
+    """
+    Get the packages validated by the current opm binary during the request.
+
+    The packages validated when ``from_index`` was built are recorded in the build memo of the
+    workers, and are known to be valid as well when they were validated by the same version of
+    opm. The content of ``from_index`` itself is never trusted.
+
+    :param str from_index: the pull specification of the index image the catalog is based on
+    :return: the names of the packages which the declarative config blobs of each validated
+        package belong to, mapped to the digests of the packages
+    :rtype: dict
+    """
+    opm_version = Opm.opm_version
+    with _validated_packages_lock:
+        lookup_from_index = bool(from_index) and (
+            (opm_version, from_index) not in _validated_from_indexes
+        )
+
+    if from_index and lookup_from_index:
+        from_index_packages = {
+            digest: frozenset(names)
+            for digest, names in get_validated_packages(
+                from_index, Opm.get_opm_version_number()
+            ).items()
+        }
+        if from_index_packages:
+            log.info(
+                'Found %d packages validated when building %s',
+                len(from_index_packages),
+                from_index,
+            )
+        with _validated_packages_lock:
+            _validated_packages.setdefault(opm_version, {}).update(from_index_packages)
+            _validated_from_indexes.add((opm_version, from_index))
+
+    with _validated_packages_lock:
+        return dict(_validated_packages.get(opm_version, {}))
+
+
+def _get_packages_to_validate(
+    blob_package_names: Dict[str, Optional[FrozenSet[str]]], changed_packages: Iterable[str]
+) -> Set[str]:
+    """
+    Get the packages of the catalog to be validated together with the changed packages.
+
+    The checks of opm across packages only apply to the declarative config blobs which belong to
+    the same package, so the packages whose blobs share a package with a changed package are
+    validated with it.
+
+    :param dict blob_package_names: the names of the packages which the declarative config blobs
+        of each package of the catalog belong to, or ``None`` if they are unknown
+    :param changed_packages: the packages of the catalog which were not validated yet
+    :return: the packages to validate
+    :rtype: set
+    """
+    to_validate = set(changed_packages)
+    if any(blob_package_names[package] is None for package in to_validate):
+        return set(blob_package_names)
+
+    packages_by_name: Dict[str, Set[str]] = {}
+    for package, names in blob_package_names.items():
+        for name in names or ():
+            packages_by_name.setdefault(name, set()).add(package)
+
+    pending = list(to_validate)
+    while pending:
+        for name in blob_package_names[pending.pop()] or ():
+            for package in packages_by_name[name] - to_validate:
+                if blob_package_names[package] is None:
+                    return set(blob_package_names)
+                to_validate.add(package)
+                pending.append(package)
+    return to_validate
+
+
+def opm_validate(config_dir: str, from_index: Optional[str] = None) -> None:
     """
     Validate the declarative config files in a given directory.
 
+    The packages which were already validated during the request, or when building
+    ``from_index``, are identified by the digest of their content and aren't validated again,
+    unless they share a package with a changed package, see ``_get_packages_to_validate``.
+
     :param str config_dir: directory containing the declarative config files.
+    :param str from_index: the pull specification of the index image the catalog is based on
     :raises IIBError: if the validation fails
     """
     from iib.workers.tasks.utils import run_cmd
 
-    log.info("Validating files under %s", config_dir)
-    cmd = [Opm.opm_version, 'validate', config_dir]
-    run_cmd(cmd, exc_msg=f'Failed to validate the content from config_dir {config_dir}')
+    # opm reports the missing directories
+    digests = get_catalog_package_digests(config_dir) if os.path.isdir(config_dir) else {}
+    validated_packages = _get_validated_packages(from_index)
+    blob_package_names = {
+        package: (
+            validated_packages[digest]
+            if digest in validated_packages
+            else read_blob_package_names(os.path.join(config_dir, package))
+        )
+        for package, digest in digests.items()
+    }
+    to_validate = _get_packages_to_validate(
+        blob_package_names,
+        (package for package, digest in digests.items() if digest not in validated_packages),
+    )
+
+    exc_msg = f'Failed to validate the content from config_dir {config_dir}'
+    if digests and not to_validate:
+        log.info('Skipping the validation of %s since its packages were validated', config_dir)
+        return
+    elif len(to_validate) == len(digests):
+        log.info("Validating files under %s", config_dir)
+        run_cmd([Opm.opm_version, 'validate', config_dir], exc_msg=exc_msg)
+    else:
+        log.info('Validating the packages %s under %s', ', '.join(sorted(to_validate)), config_dir)
+        with tempfile.TemporaryDirectory(prefix='iib-validate-') as validate_dir:
+            for package in to_validate:
+                package_path = os.path.join(config_dir, package)
+                if os.path.isdir(package_path):
+                    shutil.copytree(package_path, os.path.join(validate_dir, package))
+                else:
+                    shutil.copy2(package_path, validate_dir)
+            run_cmd([Opm.opm_version, 'validate', validate_dir], exc_msg=exc_msg)
+
+    with _validated_packages_lock:
+        _validated_packages.setdefault(Opm.opm_version, {}).update(
+            (digests[package], names)
+            for package, names in blob_package_names.items()
+            if package in to_validate and names is not None
+        )
 
 
 class Opm:
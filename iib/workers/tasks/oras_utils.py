@@ -8,6 +8,7 @@ from typing import Dict, Optional, Any
 
 from iib.common.tracing import instrument_tracing
 from iib.exceptions import IIBError
+from iib.workers.dogpile_cache import invalidate_tag_cache
 from iib.workers.tasks.utils import run_cmd, set_registry_auths, get_image_digest
 
 log = logging.getLogger(__name__)
@@ -102,6 +103,8 @@ def push_oras_artifact(
             log.info('Successfully pushed OCI artifact to %s', artifact_ref)
         except Exception as e:
             raise IIBError(f'Failed to push OCI artifact to {artifact_ref}: {e}')
+        finally:
+            invalidate_tag_cache()
 
 
 def get_image_stream_digest(
@@ -2,7 +2,23 @@
 import base64
 import getpass
 import socket
-from typing import Any, Callable, Dict, Generator, List, Optional, Set, TYPE_CHECKING, Tuple, Union
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Generator,
+    List,
+    NoReturn,
+    Optional,
+    Sequence,
+    Set,
+    TYPE_CHECKING,
+    Tuple,
+    Union,
+)
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 import functools
 import hashlib
@@ -13,16 +29,11 @@ import os
 import re
 import sqlite3
 import subprocess
+import tempfile
+import threading
+import time
 
 from pathlib import Path
-from tenacity import (
-    before_sleep_log,
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_exponential,
-    wait_chain,
-)
 from celery.app.log import TaskFormatter
 from operator_manifest.operator import ImageName, OperatorManifest
 
@@ -30,13 +41,26 @@ from iib.common.common_utils import get_binary_versions
 from iib.workers.dogpile_cache import (
     create_dogpile_region,
     dogpile_cache,
+    get_cache_stats,
+    invalidate_tag_cache,
     skopeo_inspect_should_use_cache,
+    skopeo_inspect_should_use_tag_cache,
 )
 
-from iib.exceptions import IIBError, ExternalServiceError
+from iib.exceptions import (
+    IIBError,
+    ExternalServiceError,
+    RegistryAuthenticationError,
+    RegistryAvailabilityError,
+)
+from iib.workers.artifact_cache import get_artifact_cache_stats
+from iib.workers.build_memo import get_build_fingerprint
 from iib.workers.config import get_worker_config
+from iib.workers.registry_client import get_registry_client
+from iib.workers.registry_resilience import get_pull_spec_registry, retry_registry_operation
 from iib.workers.s3_utils import upload_file_to_s3_bucket
 from iib.workers.api_utils import set_request_state
+from iib.workers.tasks.index_reader import read_bundles
 from iib.workers.tasks.opm_operations import get_list_bundles
 from iib.workers.tasks.iib_static_types import (
     IndexImageInfo,
@@ -53,12 +77,12 @@ log = logging.getLogger(__name__)
 dogpile_cache_region = create_dogpile_region()
 
 
-def _add_property_to_index(db_path: str, property: Dict[str, str]) -> None:
+def _add_properties_to_index(db_path: str, properties: List[Dict[str, str]]) -> None:
     """
-    Add a property to the index.
+    Add the properties to the index in a single transaction.
 
     :param str db_path: path to the index database
-    :param dict property: a dict representing a property to be added to the index.db
+    :param list properties: the dicts representing the properties to be added to the index.db
     """
     insert = (
         'INSERT INTO properties '
@@ -66,19 +90,24 @@ def _add_property_to_index(db_path: str, property: Dict[str, str]) -> None:
         'VALUES (?, ?, ?, ?, ?);'
     )
     con = sqlite3.connect(db_path)
-    # Insert property
-    con.execute(
-        insert,
-        (
-            property['type'],
-            property['value'],
-            property['operatorbundle_name'],
-            property['operatorbundle_version'],
-            property['operatorbundle_path'],
-        ),
-    )
-    con.commit()
-    con.close()
+    try:
+        # The connection commits the inserted properties at once, or none of them on failure
+        with con:
+            con.executemany(
+                insert,
+                (
+                    (
+                        property['type'],
+                        property['value'],
+                        property['operatorbundle_name'],
+                        property['operatorbundle_version'],
+                        property['operatorbundle_path'],
+                    )
+                    for property in properties
+                ),
+            )
+    finally:
+        con.close()
 
 
 def add_max_ocp_version_property(resolved_bundles: List[str], temp_dir: str) -> None:
@@ -96,7 +125,12 @@ def add_max_ocp_version_property(resolved_bundles: List[str], temp_dir: str) ->
     # Get the CSV name and version (not just the bundle path)
     temp_index_db_path = get_worker_config()['temp_index_db_path']
     db_path = os.path.join(temp_dir, temp_index_db_path)
-    bundles = get_list_bundles(input_data=db_path, base_dir=temp_dir)
+    # Only select the bundles in the request from the index database when it can be read
+    bundles = read_bundles(db_path, bundle_paths=resolved_bundles)
+    if bundles is None:
+        bundles = get_list_bundles(input_data=db_path, base_dir=temp_dir)
+        # Filter index image bundles to get pull spec for bundles in the request
+        bundles = [bundle for bundle in bundles if bundle['bundlePath'] in resolved_bundles]
 
     # This branch is hit when `bundles` attribute is empty and the index image is empty.
     # Ideally the code should not reach here if the bundles attribute is empty but adding
@@ -107,25 +141,29 @@ def add_max_ocp_version_property(resolved_bundles: List[str], temp_dir: str) ->
         log.info('No bundles found in the index image')
         return
 
-    # Filter index image bundles to get pull spec for bundles in the request
-    updated_bundles: List[BundleImage] = list(
-        filter(lambda b: b['bundlePath'] in resolved_bundles, bundles)
+    requires_max_ocp_version = map_images_concurrently(
+        [bundle['bundlePath'] for bundle in bundles], _requires_max_ocp_version
     )
-
-    for bundle in updated_bundles:
-        if _requires_max_ocp_version(bundle['bundlePath']):
+    max_openshift_version_properties: List[Dict[str, str]] = []
+    for bundle, requires in zip(bundles, requires_max_ocp_version):
+        if requires:
             log.info('adding property for %s', bundle['bundlePath'])
-            max_openshift_version_property: Dict[str, str] = {
-                'type': 'olm.maxOpenShiftVersion',
-                'value': '4.8',
-                #  MYPY  error: Dict entry 2 has incompatible type "str": "Optional[str]";
-                #  expected "str": "str"
-                'operatorbundle_name': bundle['csvName'],  # type: ignore
-                'operatorbundle_version': bundle['version'],
-                'operatorbundle_path': bundle['bundlePath'],
-            }
-            _add_property_to_index(db_path, max_openshift_version_property)
-            log.info('property added for %s', bundle['bundlePath'])
+            max_openshift_version_properties.append(
+                {
+                    'type': 'olm.maxOpenShiftVersion',
+                    'value': '4.8',
+                    #  MYPY  error: Dict entry 2 has incompatible type "str": "Optional[str]";
+                    #  expected "str": "str"
+                    'operatorbundle_name': bundle['csvName'],  # type: ignore
+                    'operatorbundle_version': bundle['version'],
+                    'operatorbundle_path': bundle['bundlePath'],
+                }
+            )
+
+    if max_openshift_version_properties:
+        _add_properties_to_index(db_path, max_openshift_version_properties)
+        for property in max_openshift_version_properties:
+            log.info('property added for %s', property['operatorbundle_path'])
 
 
 def get_binary_image_from_config(
@@ -208,6 +246,9 @@ class RequestConfig:
         to the merged index image.
     :param dict binary_image_config: the dict of config required to
         identify the appropriate ``binary_image`` to use.
+    :param dict build_inputs: the resolved request specific inputs which
+        determine the content of the index image. If set, the fingerprint
+        of the build is computed to look up the build memo.
     """
 
     # these attrs should not be printed out
@@ -218,12 +259,18 @@ class RequestConfig:
         'registry_auths',
     ]
 
-    _attrs: List[str] = ["_binary_image", "distribution_scope", "binary_image_config"]
+    _attrs: List[str] = [
+        "_binary_image",
+        "distribution_scope",
+        "binary_image_config",
+        "build_inputs",
+    ]
     __slots__ = _attrs
     if TYPE_CHECKING:
         _binary_image: str
         distribution_scope: str
         binary_image_config: Dict[str, Dict[str, str]]
+        build_inputs: Dict[str, Any]
         overwrite_from_index_token: str
         overwrite_target_index_token: str
 
@@ -479,11 +526,14 @@ def get_operator_packages_from_deprecation_list(deprecation_list: List[str]) ->
     :return: unique operator package names from the deprecation list
     :rtype: list
     """
-    operator_packages: List[str] = []
-    for pull_spec in deprecation_list:
-        operator_package = get_image_label(
+    operator_package_labels = map_images_concurrently(
+        deprecation_list,
+        lambda pull_spec: get_image_label(
             pull_spec, 'operators.operatorframework.io.bundle.package.v1'
-        )
+        ),
+    )
+    operator_packages: List[str] = []
+    for pull_spec, operator_package in zip(deprecation_list, operator_package_labels):
         if operator_package:
             if _is_safe_operator_package_name(operator_package):
                 operator_packages.append(operator_package)
@@ -503,47 +553,133 @@ def get_operator_packages_from_deprecation_list(deprecation_list: List[str]) ->
     return list(dict.fromkeys(operator_packages))
 
 
-def get_resolved_bundles(bundles: List[str]) -> List[str]:
+def _get_registry(pull_spec: str) -> str:
     """
-    Get the pull specification of the bundle images using their digests.
+    Get the registry of a pull specification.
+
+    :param str pull_spec: the pull specification of the container image
+    :return: the registry hostname (and port), or an empty string if the pull spec has none
+    :rtype: str
+    """
+    return ImageName.parse(pull_spec).registry or ''
+
+
+def map_images_concurrently(pull_specs: List[str], func: Callable[[str], Any]) -> List[Any]:
+    """
+    Call ``func`` for each of the pull specifications concurrently.
+
+    The calls are made by a bounded pool of threads of ``iib_image_resolution_max_workers`` size.
+    The number of calls running at the same time against a single registry is limited by
+    ``iib_image_resolution_registry_limit`` so that a large request doesn't overload a registry.
+    The retry behavior is the one of ``func`` itself.
+
+    :param list pull_specs: the pull specifications of the container images
+    :param callable func: the function to call with each of the pull specifications
+    :return: the return values of ``func`` in the order of ``pull_specs``
+    :rtype: list
+    :raises Exception: the exception raised by ``func`` for the first failing pull specification
+        (in the order of ``pull_specs``)
+    """
+    if not pull_specs:
+        return []
+
+    conf = get_worker_config()
+    registry_limit = max(1, conf.iib_image_resolution_registry_limit)
+    registry_semaphores = {
+        registry: threading.BoundedSemaphore(registry_limit)
+        for registry in {_get_registry(pull_spec) for pull_spec in pull_specs}
+    }
+
+    def _call(pull_spec: str) -> Any:
+        with registry_semaphores[_get_registry(pull_spec)]:
+            return func(pull_spec)
+
+    max_workers = max(1, min(conf.iib_image_resolution_max_workers, len(pull_specs)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_call, pull_spec) for pull_spec in pull_specs]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def resolve_images_concurrently(
+    pull_specs: List[str], resolve_func: Callable[[str], str]
+) -> List[str]:
+    """
+    Resolve the pull specifications concurrently, see ``map_images_concurrently``.
+
+    :param list pull_specs: the pull specifications to resolve
+    :param callable resolve_func: the function which resolves a single pull specification
+    :return: the resolved pull specifications without duplicates, in the order of ``pull_specs``
+    :rtype: list
+    :raises IIBError: if unable to resolve any of the pull specifications
+    """
+    resolved = map_images_concurrently(list(dict.fromkeys(pull_specs)), resolve_func)
+    return list(dict.fromkeys(resolved))
+
+
+def get_resolved_images(pull_specs: List[str]) -> List[str]:
+    """
+    Get the pull specifications of the container images using their digests.
+
+    :param list pull_specs: the pull specifications of the container images to resolve
+    :return: the resolved pull specifications without duplicates, in the order of ``pull_specs``
+    :rtype: list
+    :raises IIBError: if unable to resolve a container image.
+    """
+    return resolve_images_concurrently(pull_specs, get_resolved_image)
+
+
+def _get_resolved_bundle(bundle_pull_spec: str) -> str:
+    """
+    Get the pull specification of the bundle image using its digest.
 
     Determine if the pull spec refers to a manifest list.
     If so, simply use the digest of the first item in the manifest list.
     If not a manifest list, it must be a v2s2 image manifest and should be used as it is.
 
+    :param str bundle_pull_spec: the bundle image to be resolved.
+    :return: the bundle image resolved to its digest.
+    :rtype: str
+    :raises IIBError: if unable to resolve the bundle image.
+    """
+    skopeo_raw = skopeo_inspect(f'docker://{bundle_pull_spec}', '--raw', require_media_type=True)
+    if skopeo_raw.get('mediaType') == 'application/vnd.docker.distribution.manifest.list.v2+json':
+        # Get the digest of the first item in the manifest list
+        digest = skopeo_raw['manifests'][0]['digest']
+        name = _get_container_image_name(bundle_pull_spec)
+        return f'{name}@{digest}'
+    elif (
+        skopeo_raw.get('mediaType') == 'application/vnd.docker.distribution.manifest.v2+json'
+        and skopeo_raw.get('schemaVersion') == 2
+    ):
+        return get_resolved_image(bundle_pull_spec)
+
+    error_msg = (
+        f'The pull specification of {bundle_pull_spec} is neither '
+        f'a v2 manifest list nor a v2s2 manifest. Type {skopeo_raw.get("mediaType")}'
+        f' and schema version {skopeo_raw.get("schemaVersion")} is not supported by IIB.'
+    )
+    raise IIBError(error_msg)
+
+
+def get_resolved_bundles(bundles: List[str]) -> List[str]:
+    """
+    Get the pull specification of the bundle images using their digests.
+
+    The bundles are resolved concurrently, see ``resolve_images_concurrently``.
+
     :param list bundles: the list of bundle images to be resolved.
-    :return: the list of bundle images resolved to their digests.
+    :return: the list of bundle images resolved to their digests, without duplicates and in the
+        order of ``bundles``.
     :rtype: list
     :raises IIBError: if unable to resolve a bundle image.
     """
     log.info('Resolving bundles %s', ', '.join(bundles))
-    resolved_bundles = set()
-    for bundle_pull_spec in bundles:
-        skopeo_raw = skopeo_inspect(
-            f'docker://{bundle_pull_spec}', '--raw', require_media_type=True
-        )
-        if (
-            skopeo_raw.get('mediaType')
-            == 'application/vnd.docker.distribution.manifest.list.v2+json'
-        ):
-            # Get the digest of the first item in the manifest list
-            digest = skopeo_raw['manifests'][0]['digest']
-            name = _get_container_image_name(bundle_pull_spec)
-            resolved_bundles.add(f'{name}@{digest}')
-        elif (
-            skopeo_raw.get('mediaType') == 'application/vnd.docker.distribution.manifest.v2+json'
-            and skopeo_raw.get('schemaVersion') == 2
-        ):
-            resolved_bundles.add(get_resolved_image(bundle_pull_spec))
-        else:
-            error_msg = (
-                f'The pull specification of {bundle_pull_spec} is neither '
-                f'a v2 manifest list nor a v2s2 manifest. Type {skopeo_raw.get("mediaType")}'
-                f' and schema version {skopeo_raw.get("schemaVersion")} is not supported by IIB.'
-            )
-            raise IIBError(error_msg)
-
-    return list(resolved_bundles)
+    return resolve_images_concurrently(bundles, _get_resolved_bundle)
 
 
 def _get_container_image_name(pull_spec: str) -> str:
@@ -559,6 +695,139 @@ def _get_container_image_name(pull_spec: str) -> str:
         return pull_spec.rsplit(':', 1)[0]
 
 
+class ImageMetadata:
+    """
+    The manifest and config of a container image, fetched at most once.
+
+    Use ``get_image_metadata`` to get the instances, so that the metadata of the same image
+    digest is shared by all the queries made while processing a request.
+    """
+
+    def __init__(self, pull_spec: str) -> None:
+        """
+        Initialize the image metadata.
+
+        :param str pull_spec: the pull specification of the container image
+        """
+        self.pull_spec = pull_spec
+        self._lock = threading.RLock()
+        self._raw_manifest: Optional[str] = None
+        self._digest: Optional[str] = None
+        self._config: Optional[Dict[str, Any]] = None
+
+    @property
+    def raw_manifest(self) -> str:
+        """Get the raw manifest or manifest list of the image."""
+        with self._lock:
+            if self._raw_manifest is None:
+                self._raw_manifest = skopeo_inspect(
+                    f'docker://{self.pull_spec}', '--raw', return_json=False
+                )
+            return self._raw_manifest
+
+    @property
+    def manifest(self) -> Dict[str, Any]:
+        """Get the parsed manifest or manifest list of the image."""
+        return json.loads(self.raw_manifest)
+
+    @property
+    def digest(self) -> str:
+        """Get the digest of the image."""
+        with self._lock:
+            if self._digest is None:
+                if self.manifest.get('schemaVersion') == 2:
+                    raw_digest = hashlib.sha256(self.raw_manifest.encode('utf-8')).hexdigest()
+                    self._digest = f'sha256:{raw_digest}'
+                else:
+                    # Schema 1 is not a stable format. The contents of the manifest may change
+                    # slightly between requests causing a different digest to be computed.
+                    # Instead, let's leverage skopeo's own logic for determining the digest in
+                    # this case. In the future, we may want to use skopeo in all cases, but this
+                    # will have significant performance issues until
+                    # https://github.com/containers/skopeo/issues/785
+                    self._digest = skopeo_inspect(f'docker://{self.pull_spec}')['Digest']
+            return self._digest
+
+    @property
+    def resolved_pull_spec(self) -> str:
+        """Get the pull specification of the image using its digest."""
+        return f'{_get_container_image_name(self.pull_spec)}@{self.digest}'
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        """Get the image config, as returned by ``skopeo inspect --config``."""
+        with self._lock:
+            if self._config is None:
+                self._config = skopeo_inspect(f'docker://{self.pull_spec}', '--config')
+            return self._config
+
+    @property
+    def labels(self) -> Dict[str, str]:
+        """Get the labels of the image."""
+        return self.config.get('config', {}).get('Labels') or {}
+
+    @property
+    def arches(self) -> Set[str]:
+        """
+        Get the architectures the image was built for.
+
+        :raises IIBError: if the image is neither a v2 manifest list nor a v2 manifest
+        """
+        manifest = self.manifest
+        arches = set()
+        if manifest.get('mediaType') == 'application/vnd.docker.distribution.manifest.list.v2+json':
+            for arch_manifest in manifest['manifests']:
+                arches.add(arch_manifest['platform']['architecture'])
+        elif manifest.get('mediaType') == 'application/vnd.docker.distribution.manifest.v2+json':
+            arches.add(self.config['architecture'])
+        else:
+            raise IIBError(
+                f'The pull specification of {self.pull_spec} is neither a v2 manifest list nor '
+                'a v2 manifest'
+            )
+        return arches
+
+
+_image_metadata: Dict[str, ImageMetadata] = {}
+_image_metadata_lock = threading.Lock()
+
+
+def get_image_metadata(pull_spec: str) -> ImageMetadata:
+    """
+    Get the metadata of the container image.
+
+    The metadata of digest pinned images is kept in memory until ``clear_image_metadata`` is
+    called, since their manifest and config can't change. Pull specifications using a tag are
+    always resolved again, and the resulting metadata is kept for the resolved pull specification.
+
+    :param str pull_spec: the pull specification of the container image
+    :return: the image metadata
+    :rtype: ImageMetadata
+    """
+    if '@sha256:' in pull_spec:
+        with _image_metadata_lock:
+            return _image_metadata.setdefault(pull_spec, ImageMetadata(pull_spec))
+
+    metadata = ImageMetadata(pull_spec)
+    resolved_pull_spec = metadata.resolved_pull_spec
+    with _image_metadata_lock:
+        resolved_metadata = _image_metadata.setdefault(
+            resolved_pull_spec, ImageMetadata(resolved_pull_spec)
+        )
+    with resolved_metadata._lock:
+        if resolved_metadata._raw_manifest is None:
+            resolved_metadata._raw_manifest = metadata.raw_manifest
+            resolved_metadata._digest = metadata.digest
+    return resolved_metadata
+
+
+def clear_image_metadata() -> None:
+    """Forget the image metadata and the pushed manifests kept in memory for the request."""
+    with _image_metadata_lock:
+        _image_metadata.clear()
+    get_registry_client().forget_pushed_manifests()
+
+
 def get_image_digest(pull_spec: str) -> str:
     """
     Get the digest of the image defined by pull_spec.
@@ -567,17 +836,7 @@ def get_image_digest(pull_spec: str) -> str:
     :return: the digest of the image
     :rtype: str
     """
-    skopeo_output = skopeo_inspect(f'docker://{pull_spec}', '--raw', return_json=False)
-    if json.loads(skopeo_output).get('schemaVersion') == 2:
-        raw_digest = hashlib.sha256(skopeo_output.encode('utf-8')).hexdigest()
-        return f'sha256:{raw_digest}'
-
-    # Schema 1 is not a stable format. The contents of the manifest may change slightly
-    # between requests causing a different digest to be computed. Instead, let's leverage
-    # skopeo's own logic for determining the digest in this case. In the future, we
-    # may want to use skopeo in all cases, but this will have significant performance
-    # issues until https://github.com/containers/skopeo/issues/785
-    return skopeo_inspect(f'docker://{pull_spec}')['Digest']
+    return get_image_metadata(pull_spec).digest
 
 
 def get_resolved_image(pull_spec: str) -> str:
@@ -596,24 +855,52 @@ def get_resolved_image(pull_spec: str) -> str:
     return pull_spec_resolved
 
 
+def get_resolved_pushed_image(pull_spec: str) -> str:
+    """
+    Get the pull specification of a container image pushed by IIB using its digest.
+
+    The digest recorded when the image was pushed is used, so the registry is only queried if
+    the image wasn't pushed with the native registry client while processing this request.
+
+    :param str pull_spec: the pull specification the image was pushed to
+    :return: the resolved pull specification
+    :rtype: str
+    """
+    pushed_manifest = get_registry_client().get_pushed_manifest(pull_spec)
+    if not pushed_manifest:
+        return get_resolved_image(pull_spec)
+    return f'{_get_container_image_name(pull_spec)}@{pushed_manifest.digest}'
+
+
 def get_image_labels(pull_spec: str) -> Dict[str, str]:
     """
     Get the labels from the image.
 
+    The labels of digest pinned images are read from the image metadata shared by the request.
+
     :param list<str> labels: the labels to get
     :return: the dictionary of the labels on the image
     :rtype: dict
     """
-    if pull_spec.startswith('docker://') or pull_spec.startswith('containers-storage'):
+    if pull_spec.startswith('containers-storage'):
         full_pull_spec = pull_spec
     else:
-        full_pull_spec = f'docker://{pull_spec}'
+        image = pull_spec.removeprefix('docker://')
+        if '@sha256:' in image:
+            log.debug('Getting the labels from %s', image)
+            return get_image_metadata(image).labels
+        full_pull_spec = f'docker://{image}'
     log.debug('Getting the labels from %s', full_pull_spec)
     return skopeo_inspect(full_pull_spec, '--config').get('config', {}).get('Labels', {})
 
 
 def reset_docker_config() -> None:
-    """Create a symlink from ``iib_docker_config_template`` to ``~/.docker/config.json``."""
+    """
+    Create a symlink from ``iib_docker_config_template`` to ``~/.docker/config.json``.
+
+    The cached lookups of images by tag are forgotten since they depend on the credentials in use.
+    """
+    invalidate_tag_cache()
     conf = get_worker_config()
     docker_config_path = os.path.join(os.path.expanduser('~'), '.docker', 'config.json')
 
@@ -657,10 +944,12 @@ def _docker_auth_key_for_image(container_image: str) -> str:
 
 @contextmanager
 def set_registry_token(
-    token: Optional[str], container_image: Optional[str], append: bool = False
+    token: Optional[str],
+    container_image: Optional[Union[str, List[str]]],
+    append: bool = False,
 ) -> Generator:
     """
-    Configure authentication for the image identified by ``container_image``.
+    Configure authentication for the image(s) identified by ``container_image``.
 
     The token is written to ``~/.docker/config.json`` under the most specific ``auths`` key that
     container runtimes reliably match for that pull specification:
@@ -679,8 +968,8 @@ def set_registry_token(
     manager does nothing.
 
     :param str token: the token in the format of ``username:password``
-    :param str container_image: the pull specification of the image to authenticate to. Used to
-        determine which ``auths`` entry receives ``token``.
+    :param str/list container_image: the pull specification of the image to authenticate to, or
+        a list of them. Used to determine which ``auths`` entries receive ``token``.
     :param bool append: when ``True``, start from the current ``~/.docker/config.json`` (if it
         exists) before applying the scoped token. This preserves unrelated ``auths`` entries and
         is the preferred mode for ``overwrite_from_index`` callers that must override credentials
@@ -706,7 +995,9 @@ def set_registry_token(
 
     encoded_token = base64.b64encode(token.encode('utf-8')).decode('utf-8')
     auth_entry = {'auth': encoded_token}
-    auth_key = _docker_auth_key_for_image(container_image)
+    if isinstance(container_image, str):
+        container_image = [container_image]
+    auth_keys = [_docker_auth_key_for_image(image) for image in container_image]
 
     registry_auths: Dict[str, Any] = {'auths': {}}
     if append:
@@ -721,8 +1012,9 @@ def set_registry_token(
 
                 log.debug('Docker config will be updated')
 
-    log.debug('Setting the override token for the image %s', auth_key)
-    registry_auths['auths'].update({auth_key: auth_entry})
+    for auth_key in auth_keys:
+        log.debug('Setting the override token for the image %s', auth_key)
+        registry_auths['auths'].update({auth_key: auth_entry})
 
     with set_registry_auths(registry_auths):
         yield
@@ -779,22 +1071,63 @@ def set_registry_auths(
 
         with open(docker_config_path, 'w') as f:
             json.dump(docker_config, f)
+        invalidate_tag_cache()
 
         yield
     finally:
         reset_docker_config()
 
 
-@retry(
-    before_sleep=before_sleep_log(log, logging.WARNING),
-    reraise=True,
-    retry=retry_if_exception_type(IIBError),
-    stop=stop_after_attempt(get_worker_config().iib_total_attempts),
-    wait=wait_chain(wait_exponential(multiplier=get_worker_config().iib_retry_multiplier)),
-)
+def _inspect_with_registry_client(*args) -> Optional[str]:
+    """
+    Get the output of ``skopeo inspect`` using the native registry client.
+
+    Only the ``--raw`` and ``--config`` inspections of a single ``docker://`` image are supported.
+
+    :param args: the arguments that would be passed to ``skopeo inspect``
+    :return: the output that ``skopeo inspect`` would return or ``None`` if the arguments are not
+        supported by the registry client
+    :rtype: str or None
+    :raises IIBError: if the registry request fails
+    """
+    images = [arg for arg in args if arg.startswith('docker://')]
+    flags = [arg for arg in args if not arg.startswith('docker://')]
+    if len(images) != 1 or flags not in (['--raw'], ['--config']):
+        return None
+
+    client = get_registry_client()
+    if flags == ['--raw']:
+        return client.get_manifest(images[0]).raw
+
+    image_config = client.get_image_config(images[0])
+    if image_config is None:
+        # Schema 1 images have no config blob, so let skopeo convert the manifest
+        return None
+    return json.dumps(image_config)
+
+
+def _get_args_registry(args: Sequence[str], prefix: Optional[str] = None) -> Optional[str]:
+    """
+    Get the container registry accessed by a command from its arguments.
+
+    :param args: the arguments of the command
+    :param str prefix: the prefix of the argument holding the pull specification. If not set, the
+        first argument which isn't an option holds the pull specification.
+    :return: the registry, or ``None`` if the command doesn't access a container registry
+    :rtype: str or None
+    """
+    for arg in args:
+        if arg.startswith(prefix) if prefix else not arg.startswith('-'):
+            return get_pull_spec_registry(arg)
+    return None
+
+
 @dogpile_cache(
-    dogpile_region=dogpile_cache_region, should_use_cache_fn=skopeo_inspect_should_use_cache
+    dogpile_region=dogpile_cache_region,
+    should_use_cache_fn=skopeo_inspect_should_use_cache,
+    should_use_tag_cache_fn=skopeo_inspect_should_use_tag_cache,
 )
+@retry_registry_operation(lambda *args, **kwargs: _get_args_registry(args, 'docker://'))
 def skopeo_inspect(
     *args,
     return_json: bool = True,
@@ -818,9 +1151,13 @@ def skopeo_inspect(
             exc_msg = f'Failed to inspect {arg}. Make sure it exists and is accessible to IIB.'
             break
 
-    skopeo_timeout = get_worker_config().iib_skopeo_timeout
-    cmd = ['skopeo', '--command-timeout', skopeo_timeout, 'inspect'] + list(args)
-    output = run_cmd(cmd, exc_msg=exc_msg)
+    conf = get_worker_config()
+    output = None
+    if conf.iib_registry_client == 'native':
+        output = _inspect_with_registry_client(*args)
+    if output is None:
+        cmd = ['skopeo', '--command-timeout', conf.iib_skopeo_timeout, 'inspect'] + list(args)
+        output = run_cmd(cmd, exc_msg=exc_msg)
     if not return_json:
         return output
 
@@ -831,13 +1168,51 @@ def skopeo_inspect(
     return json_output
 
 
-@retry(
-    before_sleep=before_sleep_log(log, logging.WARNING),
-    reraise=True,
-    retry=retry_if_exception_type(IIBError),
-    stop=stop_after_attempt(get_worker_config().iib_total_attempts),
-    wait=wait_chain(wait_exponential(multiplier=get_worker_config().iib_retry_multiplier)),
-)
+# The pull specifications of the container images used by the requests of this worker, mapped to
+# the time they were last used, which determine what the image garbage collection keeps
+_image_usage: Dict[str, float] = {}
+_pinned_images: Set[str] = set()
+_recent_from_index_images: Deque[str] = deque()
+_image_usage_lock = threading.Lock()
+
+
+def record_image_use(pull_spec: str, pin: bool = False, from_index: bool = False) -> None:
+    """
+    Record that the container image was used by a request.
+
+    :param str pull_spec: the pull specification of the container image
+    :param bool pin: if ``True``, the image is never removed by the image garbage collection
+    :param bool from_index: if ``True``, the image is kept by the image garbage collection while
+        it's one of the ``iib_image_gc_recent_from_index`` most recently used index images
+    """
+    pull_spec = pull_spec.removeprefix('docker://')
+    with _image_usage_lock:
+        _image_usage[pull_spec] = time.time()
+        if pin:
+            _pinned_images.add(pull_spec)
+        if from_index:
+            if pull_spec in _recent_from_index_images:
+                _recent_from_index_images.remove(pull_spec)
+            _recent_from_index_images.append(pull_spec)
+            while (
+                len(_recent_from_index_images) > get_worker_config().iib_image_gc_recent_from_index
+            ):
+                _recent_from_index_images.popleft()
+
+
+def get_image_usage() -> Tuple[Dict[str, float], Set[str]]:
+    """
+    Get the recorded usage of the container images.
+
+    :return: the pull specifications mapped to the time they were last used, and the pull
+        specifications of the images which must be kept
+    :rtype: tuple
+    """
+    with _image_usage_lock:
+        return dict(_image_usage), _pinned_images | set(_recent_from_index_images)
+
+
+@retry_registry_operation(lambda *args: _get_args_registry(args))
 def podman_pull(*args) -> None:
     """
     Wrap the ``podman pull`` command.
@@ -849,6 +1224,9 @@ def podman_pull(*args) -> None:
         ['podman', 'pull'] + list(args),
         exc_msg=f'Failed to pull the container image {" ".join(args)}',
     )
+    for arg in args:
+        if not arg.startswith('-'):
+            record_image_use(arg)
 
 
 def _regex_reverse_search(
@@ -889,6 +1267,87 @@ def _sanitize_cmd_log(cmd: List[str]) -> List[str]:
     return sanitized_args
 
 
+# The errors of the commands accessing a container registry which mean that the registry is
+# unavailable or overloaded, unlike the errors caused by the image itself, such as a missing
+# manifest or denied access
+_REGISTRY_AVAILABILITY_ERROR_REGEX = (
+    r'(?i).*('
+    r'(?:HTTP status|status code|StatusCode):? (?:50[0-9]|429)\b'
+    r'|\b(?:50[0-9]|429) (?:Internal Server Error|Not Implemented|Bad Gateway|Service Unavailable'
+    r'|Gateway Time-?out|Too Many Requests)'
+    r'|toomanyrequests'
+    r'|connection refused|connection reset by peer|no such host|network is unreachable'
+    r'|i/o timeout|TLS handshake timeout|Client\.Timeout exceeded|deadline exceeded'
+    r'|unexpected EOF'
+    r')'
+)
+# The errors of the commands accessing a container registry which mean that the credentials in use
+# are missing or not valid for the image
+_REGISTRY_AUTHENTICATION_ERROR_REGEX = (
+    r'(?i).*('
+    r'\bunauthorized\b|authentication required|requested access to the resource is denied'
+    r'|invalid username/password|(?:HTTP status|status code|StatusCode):? 40[13]\b'
+    r')'
+)
+
+
+def _raise_cmd_error(
+    cmd: List[str],
+    response: subprocess.CompletedProcess,
+    exc_msg: str,
+) -> NoReturn:
+    """
+    Raise the exception describing why the command failed.
+
+    This is a complementary function for ``run_cmd`` and ``run_cmd_stream``.
+
+    :param list cmd: list of strings representing the command which failed
+    :param subprocess.CompletedProcess response: the response of the command to get the STDERR from
+    :param str exc_msg: the exception message
+    :raises IIBError: always
+    :raises RegistryAvailabilityError: if the command failed to access an unavailable container
+        registry
+    :raises RegistryAuthenticationError: if the container registry denied the credentials
+    """
+    if set(['buildah', 'manifest', 'rm']) <= set(cmd) and 'image not known' in response.stderr:
+        raise IIBError('Manifest list not found locally.')
+    log.error('The command "%s" failed with: %s', ' '.join(cmd), response.stderr)
+    regex: str
+    match: Optional[re.Match]
+    if Path(cmd[0]).stem.startswith('opm'):
+        # Capture the error message right before the help display
+        regex = r'^(?:Error: )(.+)$'
+        match = _regex_reverse_search(regex, response)
+        if match:
+            raise IIBError(f'{exc_msg.rstrip(".")}: {match.groups()[0]}')
+        elif (
+            '"permissive mode disabled" error="error deleting packages from'
+            ' database: error removing operator package' in response.stderr
+        ):
+            raise IIBError("Error deleting packages from database")
+    elif cmd[0] == 'buildah':
+        # Check for HTTP 403 or 50X errors on buildah
+        network_regexes = [
+            r'.*([e,E]rror:? creating build container).*(:?(403|50[0-9]|125)\s?.*$)',
+            r'.*(read\/write on closed pipe.*$)',
+        ]
+        for regex in network_regexes:
+            match = _regex_reverse_search(regex, response)
+            if match:
+                raise ExternalServiceError(f'{exc_msg}: {": ".join(match.groups()).strip()}')
+
+    if cmd[0] in ('skopeo', 'podman', 'buildah'):
+        match = _regex_reverse_search(_REGISTRY_AVAILABILITY_ERROR_REGEX, response)
+        if match:
+            log.warning('The container registry is unavailable: %s', match.groups()[0])
+            raise RegistryAvailabilityError(exc_msg)
+        match = _regex_reverse_search(_REGISTRY_AUTHENTICATION_ERROR_REGEX, response)
+        if match:
+            raise RegistryAuthenticationError(exc_msg)
+
+    raise IIBError(exc_msg)
+
+
 def run_cmd(
     cmd: List[str],
     params: Optional[Dict[str, Any]] = None,
@@ -918,38 +1377,52 @@ def run_cmd(
     response: subprocess.CompletedProcess = subprocess.run(cmd, **params)
 
     if strict and response.returncode != 0:
-        if set(['buildah', 'manifest', 'rm']) <= set(cmd) and 'image not known' in response.stderr:
-            raise IIBError('Manifest list not found locally.')
-        log.error('The command "%s" failed with: %s', ' '.join(cmd), response.stderr)
-        regex: str
-        match: Optional[re.Match]
-        if Path(cmd[0]).stem.startswith('opm'):
-            # Capture the error message right before the help display
-            regex = r'^(?:Error: )(.+)$'
-            match = _regex_reverse_search(regex, response)
-            if match:
-                raise IIBError(f'{exc_msg.rstrip(".")}: {match.groups()[0]}')
-            elif (
-                '"permissive mode disabled" error="error deleting packages from'
-                ' database: error removing operator package' in response.stderr
-            ):
-                raise IIBError("Error deleting packages from database")
-        elif cmd[0] == 'buildah':
-            # Check for HTTP 403 or 50X errors on buildah
-            network_regexes = [
-                r'.*([e,E]rror:? creating build container).*(:?(403|50[0-9]|125)\s?.*$)',
-                r'.*(read\/write on closed pipe.*$)',
-            ]
-            for regex in network_regexes:
-                match = _regex_reverse_search(regex, response)
-                if match:
-                    raise ExternalServiceError(f'{exc_msg}: {": ".join(match.groups()).strip()}')
-
-        raise IIBError(exc_msg)
+        _raise_cmd_error(cmd, response, exc_msg)
 
     return response.stdout
 
 
+def run_cmd_stream(
+    cmd: List[str],
+    params: Optional[Dict[str, Any]] = None,
+    exc_msg: Optional[str] = None,
+) -> Generator[str, None, None]:
+    """
+    Run the given command and yield the lines of its output as they are written.
+
+    Unlike with ``run_cmd``, the output is never held in memory as a whole. The STDERR is written
+    to a temporary file, so that the command can't be blocked by a full pipe. The command is
+    terminated if the output isn't read until the end.
+
+    :param list cmd: list of strings representing the command to be executed
+    :param dict params: keyword parameters for command execution
+    :param str exc_msg: an optional exception message when the command fails
+    :return: the generator of the lines of the command output
+    :rtype: Generator
+    :raises IIBError: if the command fails, once its whole output was read
+    """
+    exc_msg = exc_msg or 'An unexpected error occurred'
+    params = dict(params or {})
+    params.setdefault('universal_newlines', True)
+    params.setdefault('encoding', 'utf-8')
+
+    log.debug('Running the command "%s"', ' '.join(_sanitize_cmd_log(cmd)))
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, **params)
+        try:
+            yield from proc.stdout  # type: ignore[misc] # noqa: F821
+            proc.wait()
+        finally:
+            if proc.returncode is None:
+                terminate_process(proc)
+
+        if proc.returncode != 0:
+            stderr.seek(0)
+            _raise_cmd_error(
+                cmd, subprocess.CompletedProcess(cmd, proc.returncode, '', stderr.read()), exc_msg
+            )
+
+
 def terminate_process(proc: subprocess.Popen, timeout: int = 5) -> None:
     """
     Terminate given process. Fallback to SIGKILL when process is not terminated in given timeout.
@@ -1010,10 +1483,20 @@ def request_logger(func: Callable) -> Callable:
             logger.info(worker_info)
             versions = get_binary_versions()
             logger.info(f"opm {versions['opm']}\n{versions['podman']}\n{versions['buildah']}")
+            cache_stats_before = get_cache_stats()
+            artifact_cache_stats_before = get_artifact_cache_stats()
         try:
             return func(*args, **kwargs)
         finally:
             if request_log_handler:
+                log.info(
+                    'Image inspection cache: %s',
+                    _format_cache_stats(cache_stats_before, get_cache_stats()),
+                )
+                log.info(
+                    'Artifact cache: %s',
+                    _format_cache_stats(artifact_cache_stats_before, get_artifact_cache_stats()),
+                )
                 logger.removeHandler(request_log_handler)
                 request_log_handler.flush()
                 if worker_config['iib_aws_s3_bucket_name']:
@@ -1022,6 +1505,11 @@ def request_logger(func: Callable) -> Callable:
     return wrapper
 
 
+def _format_cache_stats(before: Dict[str, int], after: Dict[str, int]) -> str:
+    """Format the difference between two snapshots of cache counters for logging."""
+    return ', '.join(f'{event}={count - before[event]}' for event, count in after.items())
+
+
 def _get_function_arg_value(
     arg_name: str,
     func: Callable,
@@ -1112,20 +1600,7 @@ def get_image_arches(pull_spec: str) -> Set[str]:
     :raises IIBError: if the pull specification is not a v2 manifest list
     """
     log.debug('Get the available arches for %s', pull_spec)
-    skopeo_raw = skopeo_inspect(f'docker://{pull_spec}', '--raw')
-    arches = set()
-    if skopeo_raw.get('mediaType') == 'application/vnd.docker.distribution.manifest.list.v2+json':
-        for manifest in skopeo_raw['manifests']:
-            arches.add(manifest['platform']['architecture'])
-    elif skopeo_raw.get('mediaType') == 'application/vnd.docker.distribution.manifest.v2+json':
-        skopeo_out = skopeo_inspect(f'docker://{pull_spec}', '--config')
-        arches.add(skopeo_out['architecture'])
-    else:
-        raise IIBError(
-            f'The pull specification of {pull_spec} is neither a v2 manifest list nor a v2 manifest'
-        )
-
-    return arches
+    return get_image_metadata(pull_spec).arches
 
 
 def get_index_image_info(
@@ -1329,6 +1804,8 @@ def prepare_request_for_build(
         arches = gather_index_image_arches(build_request_config, index_info)
         binary_image_resolved = get_resolved_image(binary_image)
         binary_image_arches = get_image_arches(binary_image_resolved)
+        record_image_use(binary_image, pin=True)
+        record_image_use(binary_image_resolved, pin=True)
 
     if not arches.issubset(binary_image_arches):
         raise IIBError(
@@ -1346,12 +1823,14 @@ def prepare_request_for_build(
         if operator:
             bundle_mapping.setdefault(operator, []).append(bundle)
     source_from_index_resolved = index_info['source_from_index']['resolved_from_index']
+    if index_info['from_index']['resolved_from_index']:
+        record_image_use(index_info['from_index']['resolved_from_index'], from_index=True)
 
     # MYPY error: Incompatible types (expression has type "Optional[str]",
     # - TypedDict item "from_index_resolved" has type "str")
     # - TypedDict item "source_from_index_resolved" has type "str")
     # - TypedDict item "target_index_resolved" has type "str")
-    return {
+    prebuild_info: PrebuildInfo = {
         'arches': arches,
         'binary_image': binary_image,
         'binary_image_resolved': binary_image_resolved,
@@ -1364,6 +1843,20 @@ def prepare_request_for_build(
         'target_index_resolved': index_info['target_index']['resolved_from_index'],  # type: ignore
         'target_ocp_version': index_info['target_index']['ocp_version'],
     }
+    if build_request_config.build_inputs is not None:
+        prebuild_info['build_fingerprint'] = get_build_fingerprint(
+            {
+                'arches': arches,
+                'binary_image_resolved': binary_image_resolved,
+                'distribution_scope': distribution_scope,
+                'from_index_resolved': prebuild_info['from_index_resolved'],
+                'ocp_version': prebuild_info['ocp_version'],
+                'source_from_index_resolved': source_from_index_resolved,
+                'target_index_resolved': prebuild_info['target_index_resolved'],
+                **build_request_config.build_inputs,
+            }
+        )
+    return prebuild_info
 
 
 def get_bundle_metadata(
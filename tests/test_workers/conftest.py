@@ -0,0 +1,113 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import sqlite3
+
+import pytest
+
+from iib.common.common_utils import get_binary_versions
+from iib.workers import dogpile_cache, registry_resilience
+from iib.workers.tasks import opm_operations, utils
+
+
+@pytest.fixture(autouse=True)
+def clear_image_metadata():
+    # The image metadata is kept in memory for the duration of a request, so make sure that
+    # the mocked registry responses of a test don't leak into other tests
+    utils.clear_image_metadata()
+    yield
+    utils.clear_image_metadata()
+
+
+@pytest.fixture(autouse=True)
+def clear_local_caches():
+    # The in-process caches in front of dogpile.cache live as long as the worker process
+    dogpile_cache.clear_local_caches()
+    yield
+    dogpile_cache.clear_local_caches()
+
+
+@pytest.fixture(autouse=True)
+def clear_registry_states():
+    # The circuit breakers and the retry budgets of the registries live as long as the worker
+    # process, so make sure that the failures mocked by a test don't fail the calls of other tests
+    registry_resilience.clear_registry_states()
+    yield
+    registry_resilience.clear_registry_states()
+
+
+@pytest.fixture(autouse=True)
+def clear_binary_versions():
+    # The versions of the binaries are looked up once per worker process
+    get_binary_versions.cache_clear()
+    yield
+    get_binary_versions.cache_clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_validated_packages():
+    # The validated packages are kept in memory for the duration of a request
+    opm_operations.clear_validated_packages()
+    yield
+    opm_operations.clear_validated_packages()
+
+
+@pytest.fixture
+def opm_index_db(tmpdir):
+    # An index database with the tables of opm which hold the content of the packages
+    db_path = str(tmpdir.join('opm-index.db'))
+    con = sqlite3.connect(db_path)
+    con.executescript(
+        '''
+        CREATE TABLE package (name TEXT PRIMARY KEY, default_channel TEXT, add_mode TEXT);
+        CREATE TABLE channel (
+            name TEXT, package_name TEXT, head_operatorbundle_name TEXT,
+            PRIMARY KEY(name, package_name)
+        );
+        CREATE TABLE operatorbundle (
+            name TEXT PRIMARY KEY, csv TEXT, bundle TEXT, bundlepath TEXT, skips TEXT,
+            version TEXT, skiprange TEXT, replaces TEXT, substitutesfor TEXT
+        );
+        CREATE TABLE channel_entry (
+            entry_id INTEGER PRIMARY KEY, channel_name TEXT, package_name TEXT,
+            operatorbundle_name TEXT, replaces INTEGER, depth INTEGER
+        );
+        CREATE TABLE properties (
+            type TEXT, value TEXT, operatorbundle_name TEXT, operatorbundle_version TEXT,
+            operatorbundle_path TEXT
+        );
+        CREATE TABLE related_image (image TEXT, operatorbundle_name TEXT);
+        CREATE TABLE dependencies (
+            type TEXT, value TEXT, operatorbundle_name TEXT, operatorbundle_version TEXT,
+            operatorbundle_path TEXT
+        );
+        CREATE TABLE deprecated (operatorbundle_name TEXT PRIMARY KEY);
+        CREATE TABLE api_provider (
+            group_name TEXT, version TEXT, kind TEXT, channel_entry_id INTEGER
+        );
+        CREATE TABLE api_requirer (
+            group_name TEXT, version TEXT, kind TEXT, channel_entry_id INTEGER
+        );
+        INSERT INTO package VALUES ('foo', 'stable', 'replaces'), ('bar', 'stable', 'replaces');
+        INSERT INTO channel VALUES ('stable', 'foo', 'foo.v2'), ('stable', 'bar', 'bar.v1');
+        INSERT INTO operatorbundle (name, csv, bundlepath, version, replaces) VALUES
+            ('foo.v1', '{}', 'quay.io/ns/foo-bundle:v1', '1.0.0', ''),
+            ('foo.v2', '{}', 'quay.io/ns/foo-bundle:v2', '2.0.0', 'foo.v1'),
+            ('bar.v1', '{}', 'quay.io/ns/bar-bundle:v1', '1.0.0', '');
+        INSERT INTO channel_entry VALUES
+            (1, 'stable', 'foo', 'foo.v1', NULL, 1),
+            (2, 'stable', 'foo', 'foo.v2', 1, 0),
+            (3, 'stable', 'bar', 'bar.v1', NULL, 0);
+        INSERT INTO properties VALUES
+            ('olm.package', '{"packageName": "foo", "version": "1.0.0"}', 'foo.v1', '1.0.0',
+             'quay.io/ns/foo-bundle:v1'),
+            ('olm.package', '{"packageName": "foo", "version": "2.0.0"}', 'foo.v2', '2.0.0',
+             'quay.io/ns/foo-bundle:v2'),
+            ('olm.package', '{"packageName": "bar", "version": "1.0.0"}', 'bar.v1', '1.0.0',
+             'quay.io/ns/bar-bundle:v1');
+        INSERT INTO related_image VALUES
+            ('quay.io/ns/foo:v1', 'foo.v1'), ('quay.io/ns/bar:v1', 'bar.v1');
+        INSERT INTO api_provider VALUES ('foo.io', 'v1', 'Foo', 1), ('bar.io', 'v1', 'Bar', 3);
+        '''
+    )
+    con.commit()
+    con.close()
+    return db_path
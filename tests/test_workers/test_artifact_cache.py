@@ -0,0 +1,162 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import os
+from unittest import mock
+
+import pytest
+
+from iib.workers import artifact_cache
+
+IMAGE = 'quay.io/ns/index@sha256:123'
+
+
+@pytest.fixture
+def cache_conf(tmpdir):
+    conf = mock.Mock(
+        iib_artifact_cache_dir=str(tmpdir.join('cache')), iib_artifact_cache_max_size=1024
+    )
+    with mock.patch('iib.workers.artifact_cache.get_worker_config', return_value=conf):
+        yield conf
+
+
+def _make_catalog(path, size=10):
+    os.makedirs(os.path.join(path, 'operator'))
+    with open(os.path.join(path, 'operator', 'catalog.json'), 'w') as f:
+        f.write('x' * size)
+
+
+def test_copy_from_cache_directory(cache_conf, tmpdir):
+    extracted = str(tmpdir.join('request-1', 'configs'))
+    _make_catalog(extracted)
+    stats_before = artifact_cache.get_artifact_cache_stats()
+
+    assert artifact_cache.copy_from_cache(IMAGE, '/configs', str(tmpdir.join('request-1'))) is False
+    artifact_cache.add_to_cache(IMAGE, '/configs', extracted)
+    request_dir = tmpdir.mkdir('request-2')
+    assert artifact_cache.copy_from_cache(IMAGE, '/configs/', str(request_dir)) is True
+
+    copied = request_dir.join('configs', 'operator', 'catalog.json')
+    assert copied.read() == 'x' * 10
+    # Modifying the materialized files must not modify the cached files
+    copied.write('modified')
+    request_dir = tmpdir.mkdir('request-3')
+    assert artifact_cache.copy_from_cache(IMAGE, '/configs', str(request_dir)) is True
+    assert request_dir.join('configs', 'operator', 'catalog.json').read() == 'x' * 10
+
+    stats = artifact_cache.get_artifact_cache_stats()
+    assert stats['hits'] - stats_before['hits'] == 2
+    assert stats['misses'] - stats_before['misses'] == 1
+
+
+def test_copy_from_cache_file(cache_conf, tmpdir):
+    extracted = tmpdir.join('index.db')
+    extracted.write('database')
+    artifact_cache.add_to_cache(IMAGE, '/var/lib/iib/_hidden/do.not.edit.db', str(extracted))
+
+    dest_path = str(tmpdir.join('request', 'index.db'))
+    os.makedirs(os.path.dirname(dest_path))
+    assert artifact_cache.copy_from_cache(IMAGE, '/var/lib/iib/_hidden/do.not.edit.db', dest_path)
+
+    with open(dest_path) as f:
+        assert f.read() == 'database'
+
+
+@pytest.mark.parametrize(
+    'image, cache_dir',
+    (('quay.io/ns/index:v4.15', '/cache'), (IMAGE, None)),
+)
+def test_copy_from_cache_not_used(image, cache_dir, cache_conf, tmpdir):
+    cache_conf.iib_artifact_cache_dir = cache_dir and str(tmpdir.join(cache_dir))
+    extracted = tmpdir.join('index.db')
+    extracted.write('database')
+
+    artifact_cache.add_to_cache(image, '/index.db', str(extracted))
+
+    assert artifact_cache.copy_from_cache(image, '/index.db', str(tmpdir.mkdir('dest'))) is False
+    assert not tmpdir.join('cache').exists()
+
+
+def test_add_to_cache_evicts_least_recently_used(cache_conf, tmpdir):
+    images = [f'quay.io/ns/index@sha256:{i}' for i in range(3)]
+    for i, image in enumerate(images[:2]):
+        extracted = str(tmpdir.join(f'extracted-{i}', 'configs'))
+        _make_catalog(extracted, size=400)
+        artifact_cache.add_to_cache(image, '/configs', extracted)
+        # Make the order of the modification times deterministic
+        entry_dir = artifact_cache._get_entry_dir(
+            cache_conf.iib_artifact_cache_dir, f'sha256:{i}', '/configs'
+        )
+        os.utime(entry_dir, (1000 + i, 1000 + i))
+
+    stats = artifact_cache.get_artifact_cache_stats()
+    # Using the first image makes the second image the least recently used one
+    assert artifact_cache.copy_from_cache(images[0], '/configs', str(tmpdir.mkdir('dest-0')))
+    extracted = str(tmpdir.join('extracted-2', 'configs'))
+    _make_catalog(extracted, size=400)
+    artifact_cache.add_to_cache(images[2], '/configs', extracted)
+
+    assert artifact_cache.get_artifact_cache_stats()['evictions'] - stats['evictions'] == 1
+    assert artifact_cache.copy_from_cache(images[0], '/configs', str(tmpdir.mkdir('dest-1')))
+    assert not artifact_cache.copy_from_cache(images[1], '/configs', str(tmpdir.mkdir('dest-2')))
+    assert artifact_cache.copy_from_cache(images[2], '/configs', str(tmpdir.mkdir('dest-3')))
+
+
+def test_add_to_cache_too_large(cache_conf, tmpdir):
+    extracted = str(tmpdir.join('extracted', 'configs'))
+    _make_catalog(extracted, size=2048)
+
+    artifact_cache.add_to_cache(IMAGE, '/configs', extracted)
+
+    assert artifact_cache.copy_from_cache(IMAGE, '/configs', str(tmpdir.mkdir('dest'))) is False
+
+
+def test_retain_files(cache_conf, tmpdir):
+    context_dir = tmpdir.mkdir('context')
+    _make_catalog(str(context_dir.join('catalog')))
+    context_dir.mkdir('database').join('index.db').write('database')
+
+    artifact_cache.retain_files(
+        {
+            '/configs': str(context_dir.join('catalog')),
+            '/var/lib/iib/_hidden/do.not.edit.db': str(context_dir.join('database', 'index.db')),
+        }
+    )
+    # The build context is removed before the digest of the pushed image is known
+    context_dir.remove()
+    assert artifact_cache.has_retained_files() is True
+    artifact_cache.add_retained_files_to_cache(IMAGE)
+
+    assert artifact_cache.has_retained_files() is False
+    request_dir = tmpdir.mkdir('request')
+    assert artifact_cache.copy_from_cache(IMAGE, '/configs', str(request_dir))
+    assert request_dir.join('configs', 'operator', 'catalog.json').read() == 'x' * 10
+    db_path = str(request_dir.join('index.db'))
+    assert artifact_cache.copy_from_cache(IMAGE, '/var/lib/iib/_hidden/do.not.edit.db', db_path)
+    assert request_dir.join('index.db').read() == 'database'
+    assert not [
+        name
+        for name in os.listdir(os.path.join(cache_conf.iib_artifact_cache_dir, 'entries'))
+        if name.startswith('.tmp-')
+    ]
+
+
+def test_discard_retained_files(cache_conf, tmpdir):
+    extracted = str(tmpdir.join('catalog'))
+    _make_catalog(extracted)
+    artifact_cache.retain_files({'/configs': extracted})
+
+    artifact_cache.discard_retained_files()
+    artifact_cache.add_retained_files_to_cache(IMAGE)
+
+    assert artifact_cache.has_retained_files() is False
+    assert os.listdir(os.path.join(cache_conf.iib_artifact_cache_dir, 'entries')) == []
+    assert artifact_cache.copy_from_cache(IMAGE, '/configs', str(tmpdir.mkdir('dest'))) is False
+
+
+def test_retain_files_cache_disabled(cache_conf, tmpdir):
+    cache_conf.iib_artifact_cache_dir = None
+    extracted = str(tmpdir.join('catalog'))
+    _make_catalog(extracted)
+
+    artifact_cache.retain_files({'/configs': extracted})
+
+    assert artifact_cache.has_retained_files() is False
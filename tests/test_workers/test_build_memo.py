@@ -0,0 +1,124 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import os
+import time
+from unittest import mock
+
+import pytest
+
+from iib.workers import build_memo
+
+INDEX_IMAGE = 'quay.io/iib/iib-build@sha256:123'
+
+
+@pytest.fixture
+def memo_conf(tmpdir):
+    conf = mock.Mock(iib_build_memo_dir=str(tmpdir.join('memo')), iib_build_memo_max_age=3600)
+    with mock.patch('iib.workers.build_memo.get_worker_config', return_value=conf):
+        yield conf
+
+
+def test_get_build_fingerprint():
+    fingerprint = build_memo.get_build_fingerprint(
+        {'arches': {'s390x', 'amd64'}, 'bundles': ['a', 'b'], 'from_index_resolved': None}
+    )
+
+    assert fingerprint == build_memo.get_build_fingerprint(
+        {'from_index_resolved': None, 'bundles': ['a', 'b'], 'arches': {'amd64', 's390x'}}
+    )
+    assert fingerprint != build_memo.get_build_fingerprint(
+        {'arches': {'amd64'}, 'bundles': ['a', 'b'], 'from_index_resolved': None}
+    )
+    assert len(fingerprint) == 64
+
+
+def test_memoize_build(memo_conf):
+    assert build_memo.get_memoized_build('abc') is None
+
+    build_memo.memoize_build('abc', INDEX_IMAGE, ['some-operator'])
+
+    assert build_memo.get_memoized_build('abc') == build_memo.MemoizedBuild(
+        INDEX_IMAGE, ['some-operator']
+    )
+    assert os.listdir(memo_conf.iib_build_memo_dir) == ['abc.json']
+    build_memo.forget_build('abc')
+    assert build_memo.get_memoized_build('abc') is None
+
+
+def test_memoize_build_expired(memo_conf):
+    build_memo.memoize_build('abc', INDEX_IMAGE)
+    path = os.path.join(memo_conf.iib_build_memo_dir, 'abc.json')
+    expired = time.time() - 7200
+    os.utime(path, (expired, expired))
+
+    assert build_memo.get_memoized_build('abc') is None
+    assert not os.path.exists(path)
+
+
+def test_memoize_build_prunes_expired_entries(memo_conf):
+    build_memo.memoize_build('abc', INDEX_IMAGE)
+    expired = time.time() - 7200
+    os.utime(os.path.join(memo_conf.iib_build_memo_dir, 'abc.json'), (expired, expired))
+
+    build_memo.memoize_build('def', INDEX_IMAGE)
+
+    assert os.listdir(memo_conf.iib_build_memo_dir) == ['def.json']
+
+
+def test_get_memoized_build_invalid_entry(memo_conf):
+    os.makedirs(memo_conf.iib_build_memo_dir)
+    path = os.path.join(memo_conf.iib_build_memo_dir, 'abc.json')
+    with open(path, 'w') as f:
+        f.write('{"index')
+
+    assert build_memo.get_memoized_build('abc') is None
+    assert not os.path.exists(path)
+
+
+@mock.patch('iib.workers.build_memo.get_worker_config')
+def test_build_memo_disabled(mock_gwc):
+    mock_gwc.return_value = mock.Mock(iib_build_memo_dir=None)
+
+    build_memo.memoize_build('abc', INDEX_IMAGE)
+
+    assert build_memo.get_memoized_build('abc') is None
+
+
+def test_memoize_validated_packages(memo_conf):
+    validated_packages = {'digest1': ['package1'], 'digest2': ['package1', 'package2']}
+    assert build_memo.get_validated_packages(INDEX_IMAGE, '1.26.4') == {}
+
+    build_memo.memoize_validated_packages(INDEX_IMAGE, '1.26.4', validated_packages)
+
+    assert build_memo.get_validated_packages(INDEX_IMAGE, '1.26.4') == validated_packages
+    # The entry is shared by the repositories of the index image
+    assert (
+        build_memo.get_validated_packages('quay.io/ns/index@sha256:123', '1.26.4')
+        == validated_packages
+    )
+    assert build_memo.get_validated_packages(INDEX_IMAGE, '1.26.3') == {}
+    assert build_memo.get_validated_packages('quay.io/iib/iib-build@sha256:456', '1.26.4') == {}
+
+
+def test_memoize_validated_packages_not_by_digest(memo_conf):
+    build_memo.memoize_validated_packages('quay.io/iib/iib-build:3', '1.26.4', {'digest1': []})
+
+    assert build_memo.get_validated_packages('quay.io/iib/iib-build:3', '1.26.4') == {}
+    assert not os.path.exists(memo_conf.iib_build_memo_dir)
+
+
+@pytest.mark.parametrize('content', ('{"validated', '{"validated_packages": ["digest1"]}', None))
+def test_get_validated_packages_invalid_or_expired_entry(memo_conf, content):
+    build_memo.memoize_validated_packages(INDEX_IMAGE, '1.26.4', {'digest1': ['package1']})
+    (path,) = (
+        os.path.join(memo_conf.iib_build_memo_dir, name)
+        for name in os.listdir(memo_conf.iib_build_memo_dir)
+    )
+    if content:
+        with open(path, 'w') as f:
+            f.write(content)
+    else:
+        expired = time.time() - 7200
+        os.utime(path, (expired, expired))
+
+    assert build_memo.get_validated_packages(INDEX_IMAGE, '1.26.4') == {}
+    assert not os.path.exists(path)
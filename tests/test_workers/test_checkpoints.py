@@ -0,0 +1,105 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import os
+import time
+from unittest import mock
+
+import pytest
+
+from iib.workers import checkpoints
+
+
+@pytest.fixture
+def checkpoint_conf(tmpdir):
+    conf = mock.Mock(
+        iib_request_checkpoint_dir=str(tmpdir.join('checkpoints')),
+        iib_request_checkpoint_max_age=3600,
+    )
+    with mock.patch('iib.workers.checkpoints.get_worker_config', return_value=conf):
+        yield conf
+
+
+def test_save_checkpoint(checkpoint_conf):
+    assert checkpoints.get_checkpoint(1, 'abc') is None
+
+    checkpoint = checkpoints.save_checkpoint(
+        1, 'abc', checkpoints.PHASE_IMAGES_PUSHED, {'rm_operators': ['some-operator']}
+    )
+
+    assert checkpoint == checkpoints.Checkpoint(
+        checkpoints.PHASE_IMAGES_PUSHED, 'abc', {'rm_operators': ['some-operator']}
+    )
+    assert checkpoints.get_checkpoint(1, 'abc') == checkpoint
+    assert os.listdir(os.path.join(checkpoint_conf.iib_request_checkpoint_dir, '1')) == [
+        'checkpoint.json'
+    ]
+    checkpoints.remove_checkpoint(1)
+    assert checkpoints.get_checkpoint(1, 'abc') is None
+    assert os.listdir(checkpoint_conf.iib_request_checkpoint_dir) == []
+
+
+def test_save_checkpoint_with_context(checkpoint_conf, tmpdir):
+    context_dir = tmpdir.mkdir('context')
+    context_dir.mkdir('catalog').join('catalog.json').write('{}')
+    context_dir.join('index.Dockerfile').write('FROM scratch\n')
+
+    checkpoints.save_checkpoint(
+        1, 'abc', checkpoints.PHASE_CONTEXT_PREPARED, context_dir=str(context_dir)
+    )
+    # The saved context is kept when the build context is removed
+    context_dir.remove()
+
+    saved_context_dir = checkpoints.get_checkpoint_context_dir(1)
+    assert saved_context_dir == os.path.join(
+        checkpoint_conf.iib_request_checkpoint_dir, '1', 'context'
+    )
+    assert sorted(os.listdir(saved_context_dir)) == ['catalog', 'index.Dockerfile']
+    with open(os.path.join(saved_context_dir, 'catalog', 'catalog.json')) as f:
+        assert f.read() == '{}'
+
+
+def test_get_checkpoint_different_fingerprint(checkpoint_conf):
+    checkpoints.save_checkpoint(1, 'abc', checkpoints.PHASE_IMAGES_PUSHED)
+
+    assert checkpoints.get_checkpoint(1, 'def') is None
+    assert not os.path.exists(os.path.join(checkpoint_conf.iib_request_checkpoint_dir, '1'))
+
+
+def test_get_checkpoint_expired(checkpoint_conf):
+    checkpoints.save_checkpoint(1, 'abc', checkpoints.PHASE_IMAGES_PUSHED)
+    path = os.path.join(checkpoint_conf.iib_request_checkpoint_dir, '1', 'checkpoint.json')
+    expired = time.time() - 7200
+    os.utime(path, (expired, expired))
+
+    assert checkpoints.get_checkpoint(1, 'abc') is None
+    assert not os.path.exists(path)
+
+
+def test_get_checkpoint_invalid(checkpoint_conf):
+    request_dir = os.path.join(checkpoint_conf.iib_request_checkpoint_dir, '1')
+    os.makedirs(request_dir)
+    with open(os.path.join(request_dir, 'checkpoint.json'), 'w') as f:
+        f.write('{"phase')
+
+    assert checkpoints.get_checkpoint(1, 'abc') is None
+    assert not os.path.exists(request_dir)
+
+
+def test_save_checkpoint_prunes_expired_checkpoints(checkpoint_conf):
+    checkpoints.save_checkpoint(1, 'abc', checkpoints.PHASE_IMAGES_PUSHED)
+    expired = time.time() - 7200
+    os.utime(os.path.join(checkpoint_conf.iib_request_checkpoint_dir, '1'), (expired, expired))
+
+    checkpoints.save_checkpoint(2, 'def', checkpoints.PHASE_IMAGES_PUSHED)
+
+    assert os.listdir(checkpoint_conf.iib_request_checkpoint_dir) == ['2']
+
+
+@mock.patch('iib.workers.checkpoints.get_worker_config')
+def test_checkpoints_disabled(mock_gwc):
+    mock_gwc.return_value = mock.Mock(iib_request_checkpoint_dir=None)
+
+    checkpoint = checkpoints.save_checkpoint(1, 'abc', checkpoints.PHASE_IMAGES_PUSHED)
+
+    assert checkpoint == checkpoints.Checkpoint(checkpoints.PHASE_IMAGES_PUSHED, 'abc', {})
+    assert checkpoints.get_checkpoint(1, 'abc') is None
+    assert checkpoints.get_checkpoint_context_dir(1) is None
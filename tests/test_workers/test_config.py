@@ -95,6 +95,152 @@ def test_validate_celery_config_iib_replace_registry_not_dict():
         validate_celery_config(conf)
 
 
+def test_validate_celery_config_invalid_registry_client():
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        'iib_registry_client': 'crane',
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        'iib_required_labels': {},
+    }
+    with pytest.raises(
+        ConfigError, match='iib_registry_client must be set to "native" or "skopeo"'
+    ):
+        validate_celery_config(conf)
+
+
+def test_validate_celery_config_invalid_image_build_method():
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        'iib_image_build_method': 'podman',
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        'iib_required_labels': {},
+    }
+    with pytest.raises(
+        ConfigError, match='iib_image_build_method must be set to "assemble" or "buildah"'
+    ):
+        validate_celery_config(conf)
+
+
+def test_validate_celery_config_invalid_image_extraction():
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        'iib_image_extraction': 'buildah',
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        'iib_required_labels': {},
+    }
+    with pytest.raises(
+        ConfigError, match='iib_image_extraction must be set to "stream" or "podman"'
+    ):
+        validate_celery_config(conf)
+
+
+def test_validate_celery_config_invalid_image_build_cache_request_types():
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        'iib_image_build_cache_request_types': ['add', 'recursive-related-bundles'],
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        'iib_required_labels': {},
+    }
+    with pytest.raises(
+        ConfigError,
+        match=(
+            'iib_image_build_cache_request_types contains the invalid request types '
+            'recursive-related-bundles'
+        ),
+    ):
+        validate_celery_config(conf)
+
+
+@pytest.mark.parametrize('max_age', (0, -1, '3600'))
+def test_validate_celery_config_invalid_build_memo_max_age(max_age):
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        'iib_build_memo_max_age': max_age,
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        'iib_required_labels': {},
+    }
+    with pytest.raises(ConfigError, match='iib_build_memo_max_age must be a positive integer'):
+        validate_celery_config(conf)
+
+
+@pytest.mark.parametrize('max_age', (0, -1, '3600'))
+def test_validate_celery_config_invalid_request_checkpoint_max_age(max_age):
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        'iib_request_checkpoint_max_age': max_age,
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        'iib_required_labels': {},
+    }
+    with pytest.raises(
+        ConfigError, match='iib_request_checkpoint_max_age must be a positive integer'
+    ):
+        validate_celery_config(conf)
+
+
+@pytest.mark.parametrize(
+    'option, value, error',
+    (
+        (
+            'iib_registry_circuit_breaker_failure_rate',
+            0,
+            'iib_registry_circuit_breaker_failure_rate must be a number greater than 0',
+        ),
+        (
+            'iib_registry_circuit_breaker_failure_rate',
+            1.5,
+            'iib_registry_circuit_breaker_failure_rate must be a number greater than 0',
+        ),
+        (
+            'iib_registry_circuit_breaker_min_calls',
+            0,
+            'iib_registry_circuit_breaker_min_calls must be a positive integer',
+        ),
+        (
+            'iib_registry_circuit_breaker_reset_timeout',
+            '60',
+            'iib_registry_circuit_breaker_reset_timeout must be a positive integer',
+        ),
+        ('iib_registry_retry_budget', -1, 'iib_registry_retry_budget must be a non-negative'),
+    ),
+)
+def test_validate_celery_config_invalid_registry_resilience(option, value, error):
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        option: value,
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        'iib_required_labels': {},
+    }
+    with pytest.raises(ConfigError, match=error):
+        validate_celery_config(conf)
+
+
+def test_validate_celery_config_invalid_image_gc_policy():
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        'iib_image_gc_policy': 'none',
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        'iib_required_labels': {},
+    }
+    with pytest.raises(ConfigError, match='iib_image_gc_policy must be set to "all" or "lru"'):
+        validate_celery_config(conf)
+
+
 @pytest.mark.parametrize(
     'config, error',
     (
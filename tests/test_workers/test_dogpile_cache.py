@@ -1,6 +1,13 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from unittest import mock
+
+from dogpile.cache import make_region
 import pytest
 
+from iib.exceptions import IIBError, RegistryAuthenticationError
+from iib.workers import dogpile_cache
 from iib.workers.dogpile_cache import generate_cache_key
 
 
@@ -33,3 +40,121 @@ from iib.workers.dogpile_cache import generate_cache_key
 def test_generate_cache_key(args, kwargs):
     passwd = generate_cache_key('function_name', *args, **kwargs)
     assert len(passwd) <= 250
+
+
+@pytest.fixture
+def cache_conf():
+    conf = mock.Mock(iib_dogpile_local_cache_size=2, iib_dogpile_tag_expiration_time=30)
+    with mock.patch('iib.workers.dogpile_cache.get_worker_config', return_value=conf):
+        yield conf
+
+
+def _cached_function(region, func):
+    return dogpile_cache.dogpile_cache(
+        dogpile_region=region,
+        should_use_cache_fn=dogpile_cache.skopeo_inspect_should_use_cache,
+        should_use_tag_cache_fn=dogpile_cache.skopeo_inspect_should_use_tag_cache,
+    )(func)
+
+
+def test_dogpile_cache_local_tier(cache_conf):
+    region = make_region().configure('dogpile.cache.memory')
+    func = mock.Mock(__name__='inspect', side_effect=lambda image: {'Name': image})
+    cached = _cached_function(region, func)
+    stats_before = dogpile_cache.get_cache_stats()
+
+    assert cached('docker://image@sha256:1') == {'Name': 'docker://image@sha256:1'}
+    # Modifying a returned value must not modify the cached value
+    cached('docker://image@sha256:1')['Name'] = 'changed'
+    assert cached('docker://image@sha256:1') == {'Name': 'docker://image@sha256:1'}
+    # Evict the first image from the local cache which only holds two entries
+    cached('docker://image@sha256:2')
+    cached('docker://image@sha256:3')
+    assert cached('docker://image@sha256:1') == {'Name': 'docker://image@sha256:1'}
+
+    assert func.call_count == 3
+    stats = dogpile_cache.get_cache_stats()
+    assert stats['local_hits'] - stats_before['local_hits'] == 2
+    assert stats['shared_hits'] - stats_before['shared_hits'] == 1
+    assert stats['misses'] - stats_before['misses'] == 3
+
+
+def test_dogpile_cache_single_flight(cache_conf):
+    region = make_region().configure('dogpile.cache.null')
+
+    def inspect(image):
+        threading.Event().wait(0.1)
+        return {'Name': image}
+
+    func = mock.Mock(__name__='inspect', side_effect=inspect)
+    cached = _cached_function(region, func)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(cached, ['docker://image@sha256:1'] * 4))
+
+    assert results == [{'Name': 'docker://image@sha256:1'}] * 4
+    func.assert_called_once()
+
+
+def test_dogpile_cache_tag_tier(cache_conf):
+    region = mock.Mock()
+    func = mock.Mock(__name__='inspect', side_effect=[{'Name': 'v1'}, {'Name': 'v2'}])
+    cached = _cached_function(region, func)
+
+    assert cached('docker://image:latest') == {'Name': 'v1'}
+    assert cached('docker://image:latest') == {'Name': 'v1'}
+    dogpile_cache.invalidate_tag_cache()
+    assert cached('docker://image:latest') == {'Name': 'v2'}
+
+    assert func.call_count == 2
+    # Tags are never stored in the shared region since they can point to other images later
+    region.get.assert_not_called()
+    region.set.assert_not_called()
+
+
+def test_dogpile_cache_tag_tier_negative(cache_conf):
+    func = mock.Mock(__name__='inspect', side_effect=IIBError('Failed to inspect'))
+    cached = _cached_function(mock.Mock(), func)
+
+    for _ in range(2):
+        with pytest.raises(IIBError, match='Failed to inspect'):
+            cached('docker://image:missing')
+
+    func.assert_called_once()
+
+
+def test_dogpile_cache_tag_tier_authentication_error_not_cached(cache_conf):
+    func = mock.Mock(
+        __name__='inspect',
+        side_effect=[RegistryAuthenticationError('Failed to inspect'), {'Name': 'v1'}],
+    )
+    cached = _cached_function(mock.Mock(), func)
+
+    with pytest.raises(RegistryAuthenticationError, match='Failed to inspect'):
+        cached('docker://image:private')
+    assert cached('docker://image:private') == {'Name': 'v1'}
+
+    assert func.call_count == 2
+
+
+@mock.patch('iib.workers.dogpile_cache.time.monotonic')
+def test_dogpile_cache_tag_tier_expired(mock_monotonic, cache_conf):
+    # Stored at 100 and valid for 30 seconds, hit at 120, expired at 140 and stored again
+    mock_monotonic.side_effect = [100, 120, 140, 140]
+    func = mock.Mock(__name__='inspect', side_effect=[{'Name': 'v1'}, {'Name': 'v2'}])
+    cached = _cached_function(mock.Mock(), func)
+
+    assert cached('docker://image:latest') == {'Name': 'v1'}
+    assert cached('docker://image:latest') == {'Name': 'v1'}
+    assert cached('docker://image:latest') == {'Name': 'v2'}
+
+
+def test_dogpile_cache_tag_tier_disabled(cache_conf):
+    cache_conf.iib_dogpile_tag_expiration_time = 0
+    func = mock.Mock(__name__='inspect', return_value={'Name': 'v1'})
+    cached = _cached_function(mock.Mock(), func)
+
+    cached('docker://image:latest')
+    cached('docker://image:latest')
+
+    assert func.call_count == 2
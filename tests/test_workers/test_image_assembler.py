@@ -0,0 +1,273 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import gzip
+import hashlib
+import io
+import json
+import os
+import tarfile
+from unittest import mock
+
+import pytest
+
+from iib.exceptions import IIBError
+from iib.workers import image_assembler
+from iib.workers.registry_client import (
+    Manifest,
+    MEDIA_TYPE_DOCKER_MANIFEST,
+    MEDIA_TYPE_DOCKER_MANIFEST_LIST,
+)
+
+DOCKERFILE = '''\
+FROM registry.io/ns/opm:v4.15
+
+# Configure the entrypoint and command
+ENTRYPOINT ["/bin/opm"]
+CMD ["serve", "/configs", "--cache-dir=/tmp/cache"]
+# Copy declarative config root and cache into image
+ADD catalog /configs
+COPY --chown=1001:0 cache /tmp/cache
+
+LABEL operators.operatorframework.io.index.configs.v1=/configs
+
+ADD database/index.db /var/lib/iib/_hidden/do.not.edit.db
+
+LABEL com.redhat.index.delivery.version="v4.15"
+'''
+
+
+def _digest(content):
+    return f'sha256:{hashlib.sha256(content).hexdigest()}'
+
+
+@pytest.fixture
+def context_dir(tmpdir):
+    tmpdir.mkdir('catalog').mkdir('pkg').join('catalog.json').write('{}')
+    tmpdir.mkdir('cache').join('cache.json').write('{}')
+    tmpdir.mkdir('database').join('index.db').write('db')
+    tmpdir.join('index.Dockerfile').write(DOCKERFILE)
+    return tmpdir
+
+
+@pytest.fixture
+def mock_registry():
+    """Serve a multi-arch binary image and record the pushes through a mocked registry client."""
+    client = mock.Mock()
+    manifests = {}
+    blobs = {}
+    arch_manifests = []
+    for arch in ('amd64', 's390x'):
+        config = json.dumps(
+            {
+                'architecture': arch,
+                'os': 'linux',
+                'config': {'Cmd': ['/bin/bash'], 'Labels': {'version': 'v4.15'}},
+                'rootfs': {'type': 'layers', 'diff_ids': [f'sha256:{arch}-diff']},
+            }
+        ).encode()
+        blobs[_digest(config)] = config
+        manifest = json.dumps(
+            {
+                'schemaVersion': 2,
+                'mediaType': MEDIA_TYPE_DOCKER_MANIFEST,
+                'config': {'digest': _digest(config), 'size': len(config)},
+                'layers': [
+                    {
+                        'mediaType': image_assembler.MEDIA_TYPE_DOCKER_LAYER,
+                        'digest': f'sha256:{arch}-layer',
+                        'size': 10,
+                    }
+                ],
+            }
+        )
+        manifests[f'registry.io/ns/opm@{_digest(manifest.encode())}'] = Manifest(
+            manifest, MEDIA_TYPE_DOCKER_MANIFEST, _digest(manifest.encode())
+        )
+        arch_manifests.append(
+            {
+                'digest': _digest(manifest.encode()),
+                'platform': {'architecture': arch, 'os': 'linux'},
+            }
+        )
+    manifest_list = json.dumps({'manifests': arch_manifests})
+    manifests['registry.io/ns/opm:v4.15'] = Manifest(
+        manifest_list, MEDIA_TYPE_DOCKER_MANIFEST_LIST, 'sha256:list'
+    )
+
+    uploaded = {}
+
+    def _upload_blob(pull_spec, digest, content, size=None):
+        if not isinstance(content, bytes):
+            content = content.read()
+        uploaded[digest] = content
+
+    client.get_manifest.side_effect = lambda pull_spec: manifests[pull_spec]
+    client.get_blob.side_effect = lambda pull_spec, digest: blobs[digest]
+    client.blob_exists.side_effect = lambda pull_spec, digest: digest in uploaded
+    client.upload_blob.side_effect = _upload_blob
+    client.uploaded = uploaded
+    with mock.patch('iib.workers.image_assembler.get_registry_client', return_value=client):
+        yield client
+
+
+def test_parse_dockerfile(context_dir):
+    dockerfile = image_assembler._parse_dockerfile(str(context_dir.join('index.Dockerfile')))
+
+    assert dockerfile.base_image == 'registry.io/ns/opm:v4.15'
+    assert dockerfile.copies == [
+        image_assembler._Copy('catalog', '/configs', 0, 0),
+        image_assembler._Copy('cache', '/tmp/cache', 1001, 0),
+        image_assembler._Copy('database/index.db', '/var/lib/iib/_hidden/do.not.edit.db', 0, 0),
+    ]
+    assert dockerfile.labels == {
+        'operators.operatorframework.io.index.configs.v1': '/configs',
+        'com.redhat.index.delivery.version': 'v4.15',
+    }
+    assert dockerfile.entrypoint == ['/bin/opm']
+    assert dockerfile.cmd == ['serve', '/configs', '--cache-dir=/tmp/cache']
+
+
+@pytest.mark.parametrize(
+    'content, error',
+    (
+        ('FROM scratch\nRUN echo hi\n', 'the RUN instruction'),
+        ('FROM a AS b\nFROM b\n', 'multi-stage builds'),
+        ('FROM scratch\nCMD opm serve\n', 'the shell form of CMD'),
+        ('FROM scratch\nADD https://example.com/a /a\n', 'the remote source'),
+        ('LABEL a=b\n', 'before FROM'),
+    ),
+)
+def test_parse_dockerfile_unsupported(content, error, tmpdir):
+    tmpdir.join('Dockerfile').write(content)
+
+    with pytest.raises(image_assembler._UnsupportedBuild, match=error):
+        image_assembler._parse_dockerfile(str(tmpdir.join('Dockerfile')))
+
+
+def test_create_layer(context_dir, tmpdir):
+    dockerfile = image_assembler._parse_dockerfile(str(context_dir.join('index.Dockerfile')))
+    layer_dir = tmpdir.mkdir('layer')
+
+    layer = image_assembler._create_layer(str(context_dir), dockerfile, str(layer_dir))
+
+    with open(layer.path, 'rb') as f:
+        compressed = f.read()
+    uncompressed = gzip.decompress(compressed)
+    assert layer.digest == _digest(compressed)
+    assert layer.diff_id == _digest(uncompressed)
+    assert layer.size == len(compressed)
+    with tarfile.open(fileobj=io.BytesIO(uncompressed)) as layer_tar:
+        owners = {member.name: (member.uid, member.gid) for member in layer_tar}
+    assert owners == {
+        'configs': (0, 0),
+        'configs/pkg': (0, 0),
+        'configs/pkg/catalog.json': (0, 0),
+        'tmp/cache': (1001, 0),
+        'tmp/cache/cache.json': (1001, 0),
+        'var/lib/iib/_hidden/do.not.edit.db': (0, 0),
+    }
+
+
+def test_create_layer_archive_source(tmpdir):
+    with tarfile.open(str(tmpdir.join('content.tar')), 'w') as archive:
+        archive.add(__file__, arcname='a')
+    tmpdir.join('Dockerfile').write('FROM scratch\nADD content.tar /\n')
+    dockerfile = image_assembler._parse_dockerfile(str(tmpdir.join('Dockerfile')))
+
+    with pytest.raises(image_assembler._UnsupportedBuild, match='the archive content.tar'):
+        image_assembler._create_layer(str(tmpdir), dockerfile, str(tmpdir.mkdir('layer')))
+
+
+def test_get_index_image_files(context_dir):
+    files = image_assembler.get_index_image_files(str(context_dir.join('index.Dockerfile')))
+
+    # The cache is not extracted from index images, so it's not included
+    assert files == {
+        '/configs': os.path.realpath(str(context_dir.join('catalog'))),
+        '/var/lib/iib/_hidden/do.not.edit.db': os.path.realpath(
+            str(context_dir.join('database', 'index.db'))
+        ),
+    }
+
+
+def test_get_index_image_files_unsupported_dockerfile(tmpdir):
+    tmpdir.join('Dockerfile').write('FROM registry.io/ns/opm:v4.15\nRUN echo hi\n')
+
+    assert image_assembler.get_index_image_files(str(tmpdir.join('Dockerfile'))) == {}
+
+
+def test_assemble_index_image(mock_registry, context_dir):
+    destinations = {
+        'amd64': 'registry:8443/iib-build:1-amd64',
+        's390x': 'registry:8443/iib-build:1-s390x',
+    }
+
+    assembled = image_assembler.assemble_index_image(
+        str(context_dir.join('index.Dockerfile')), destinations
+    )
+
+    assert assembled is True
+    # The shared layer is uploaded once and the temporary layer is removed
+    layer_uploads = [
+        c for c in mock_registry.upload_blob.call_args_list if not isinstance(c[0][2], bytes)
+    ]
+    assert len(layer_uploads) == 1
+    assert sorted(os.listdir(str(context_dir))) == [
+        'cache',
+        'catalog',
+        'database',
+        'index.Dockerfile',
+    ]
+    assert mock_registry.copy_blob.call_count == 2
+
+    pushed = {c[0][0]: json.loads(c[0][1]) for c in mock_registry.put_manifest.call_args_list}
+    assert set(pushed) == set(destinations.values())
+    for arch, destination in destinations.items():
+        manifest = pushed[destination]
+        assert manifest['mediaType'] == MEDIA_TYPE_DOCKER_MANIFEST
+        assert [layer['digest'] for layer in manifest['layers']][0] == f'sha256:{arch}-layer'
+        assert manifest['layers'][1]['digest'] == layer_uploads[0][0][1]
+        image_config = json.loads(mock_registry.uploaded[manifest['config']['digest']])
+        assert image_config['architecture'] == arch
+        assert image_config['config']['Entrypoint'] == ['/bin/opm']
+        assert image_config['config']['Cmd'] == ['serve', '/configs', '--cache-dir=/tmp/cache']
+        assert image_config['config']['Labels'] == {
+            'version': 'v4.15',
+            'operators.operatorframework.io.index.configs.v1': '/configs',
+            'com.redhat.index.delivery.version': 'v4.15',
+        }
+        assert len(image_config['rootfs']['diff_ids']) == 2
+
+
+def test_assemble_index_image_missing_arch(mock_registry, context_dir):
+    assembled = image_assembler.assemble_index_image(
+        str(context_dir.join('index.Dockerfile')), {'ppc64le': 'registry:8443/iib-build:1-ppc64le'}
+    )
+
+    assert assembled is False
+    mock_registry.put_manifest.assert_not_called()
+
+
+def test_assemble_index_image_unsupported_dockerfile(mock_registry, tmpdir):
+    tmpdir.join('Dockerfile').write('FROM registry.io/ns/opm:v4.15\nRUN echo hi\n')
+
+    assembled = image_assembler.assemble_index_image(
+        str(tmpdir.join('Dockerfile')), {'amd64': 'registry:8443/iib-build:1-amd64'}
+    )
+
+    assert assembled is False
+    mock_registry.upload_blob.assert_not_called()
+
+
+def test_get_base_image_wrong_arch(mock_registry):
+    manifest = mock_registry.get_manifest('registry.io/ns/opm:v4.15').json()['manifests'][0]
+    mock_registry.get_manifest.side_effect = None
+    mock_registry.get_manifest.return_value = Manifest(
+        json.dumps({'config': {'digest': 'sha256:missing'}, 'layers': []}),
+        MEDIA_TYPE_DOCKER_MANIFEST,
+        manifest['digest'],
+    )
+    mock_registry.get_blob.side_effect = None
+    mock_registry.get_blob.return_value = json.dumps({'architecture': 'amd64'}).encode()
+
+    with pytest.raises(IIBError, match='expected arch s390x, found amd64'):
+        image_assembler._get_base_image('registry.io/ns/opm@sha256:abc', 's390x')
@@ -0,0 +1,183 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import io
+import os
+import tarfile
+from unittest import mock
+
+import pytest
+
+from iib.exceptions import IIBError
+from iib.workers import image_extractor
+
+GZIP_LAYER = 'application/vnd.oci.image.layer.v1.tar+gzip'
+
+
+def _make_layer(entries):
+    """Create a gzipped layer from (name, content) tuples; a content of None is a directory."""
+    content = io.BytesIO()
+    with tarfile.open(fileobj=content, mode='w:gz') as layer_tar:
+        for name, data in entries:
+            member = tarfile.TarInfo(name)
+            if data is None:
+                member.type = tarfile.DIRTYPE
+                member.mode = 0o755
+                layer_tar.addfile(member)
+            elif isinstance(data, tuple):
+                member.type = tarfile.SYMTYPE
+                member.linkname = data[0]
+                layer_tar.addfile(member)
+            else:
+                member.size = len(data)
+                member.mode = 0o644
+                layer_tar.addfile(member, io.BytesIO(data))
+    return content.getvalue()
+
+
+@pytest.fixture
+def mock_registry():
+    """Serve the layers, from the bottom one to the top one, through a mocked registry client."""
+    layers = {}
+    client = mock.Mock()
+
+    def set_layers(*contents, media_type=GZIP_LAYER):
+        layers.clear()
+        descriptors = []
+        for i, content in enumerate(contents):
+            layers[f'sha256:{i}'] = content
+            descriptors.append({'mediaType': media_type, 'digest': f'sha256:{i}'})
+        client.get_image_manifest.return_value = (
+            'registry.io/ns/index@sha256:abc',
+            {'mediaType': 'application/vnd.oci.image.manifest.v1+json', 'layers': descriptors},
+        )
+
+    client.open_blob.side_effect = lambda pull_spec, digest: mock.Mock(
+        raw=io.BytesIO(layers[digest])
+    )
+    client.set_layers = set_layers
+    with mock.patch('iib.workers.image_extractor.get_registry_client', return_value=client):
+        yield client
+
+
+def test_extract_path_from_image_directory(mock_registry, tmpdir):
+    mock_registry.set_layers(
+        _make_layer(
+            [
+                ('configs', None),
+                ('configs/a', None),
+                ('configs/a/catalog.json', b'old'),
+                ('configs/c', None),
+                ('configs/c/catalog.json', b'removed'),
+                ('usr/bin/opm', b'binary'),
+            ]
+        ),
+        _make_layer([('configs/b', None), ('configs/b/catalog.json', b'b')]),
+        _make_layer(
+            [
+                ('configs/a/catalog.json', b'new'),
+                ('configs/.wh.c', b''),
+                ('configs/d', ('a',)),
+            ]
+        ),
+    )
+    destination = str(tmpdir.join('configs'))
+
+    assert image_extractor.extract_path_from_image(
+        'registry.io/ns/index:v4.15', '/configs/', destination
+    )
+
+    assert sorted(os.listdir(destination)) == ['a', 'b', 'd']
+    assert tmpdir.join('configs', 'a', 'catalog.json').read() == 'new'
+    assert tmpdir.join('configs', 'b', 'catalog.json').read() == 'b'
+    assert os.readlink(os.path.join(destination, 'd')) == 'a'
+    assert mock_registry.open_blob.call_count == 3
+    # Only the destination is left behind
+    assert tmpdir.listdir() == [tmpdir.join('configs')]
+
+
+def test_extract_path_from_image_opaque_directory(mock_registry, tmpdir):
+    mock_registry.set_layers(
+        _make_layer([('configs/old/catalog.json', b'old')]),
+        _make_layer([('configs/.wh..wh..opq', b''), ('configs/new/catalog.json', b'new')]),
+    )
+    destination = str(tmpdir.join('configs'))
+
+    assert image_extractor.extract_path_from_image(
+        'registry.io/ns/index:v4.15', '/configs', destination
+    )
+
+    assert os.listdir(destination) == ['new']
+    # The bottom layer is not downloaded since it can't change the contents of /configs
+    mock_registry.open_blob.assert_called_once_with('registry.io/ns/index@sha256:abc', 'sha256:1')
+
+
+def test_extract_path_from_image_file(mock_registry, tmpdir):
+    mock_registry.set_layers(
+        _make_layer([('var/lib/iib/_hidden/do.not.edit.db', b'old')]),
+        _make_layer([('var/lib/iib/_hidden/do.not.edit.db', b'new')]),
+    )
+    destination = str(tmpdir.join('index.db'))
+
+    assert image_extractor.extract_path_from_image(
+        'registry.io/ns/index:v4.15', '/var/lib/iib/_hidden/do.not.edit.db', destination
+    )
+
+    assert tmpdir.join('index.db').read() == 'new'
+    mock_registry.open_blob.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    'layers',
+    (
+        [[('configs/a/catalog.json', b'a')], [('configs/nested', None)]],
+        [[('manifests.yaml', b'a')]],
+    ),
+)
+def test_extract_path_from_image_not_found(layers, mock_registry, tmpdir):
+    mock_registry.set_layers(*(_make_layer(layer) for layer in layers))
+
+    with pytest.raises(IIBError, match='Failed to copy the contents of /manifests from'):
+        image_extractor.extract_path_from_image(
+            'registry.io/ns/index:v4.15', '/manifests', str(tmpdir.join('manifests'))
+        )
+
+    assert tmpdir.listdir() == []
+
+
+def test_extract_path_from_image_whiteout_of_source(mock_registry, tmpdir):
+    mock_registry.set_layers(
+        _make_layer([('configs/a/catalog.json', b'a')]),
+        _make_layer([('.wh.configs', b'')]),
+    )
+
+    with pytest.raises(IIBError, match='Failed to copy the contents of /configs from'):
+        image_extractor.extract_path_from_image(
+            'registry.io/ns/index:v4.15', '/configs', str(tmpdir.join('configs'))
+        )
+
+    mock_registry.open_blob.assert_called_once()
+
+
+def test_extract_path_from_image_unsupported_layer(mock_registry, tmpdir):
+    mock_registry.set_layers(
+        _make_layer([('configs/a/catalog.json', b'a')]),
+        media_type='application/vnd.oci.image.layer.v1.tar+zstd',
+    )
+
+    assert not image_extractor.extract_path_from_image(
+        'registry.io/ns/index:v4.15', '/configs', str(tmpdir.join('configs'))
+    )
+
+    mock_registry.open_blob.assert_not_called()
+    assert tmpdir.listdir() == []
+
+
+def test_extract_path_from_image_symlink_escape(mock_registry, tmpdir):
+    mock_registry.set_layers(
+        _make_layer([('configs/link', ('/etc',)), ('configs/link/passwd', b'oops')]),
+    )
+
+    assert not image_extractor.extract_path_from_image(
+        'registry.io/ns/index:v4.15', '/configs', str(tmpdir.join('configs'))
+    )
+
+    assert tmpdir.listdir() == []
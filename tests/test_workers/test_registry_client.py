@@ -0,0 +1,373 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import base64
+import hashlib
+import http.server
+import io
+import json
+import threading
+import urllib.parse
+from unittest import mock
+
+import pytest
+
+from iib.exceptions import IIBError, RegistryAuthenticationError, RegistryAvailabilityError
+from iib.workers import registry_client
+
+
+class _StandInRegistry(http.server.BaseHTTPRequestHandler):
+    """A minimal registry which requires bearer tokens issued for valid credentials."""
+
+    manifests = {}
+    blobs = {}
+    token_requests = []
+    mounts = []
+    credentials = ('iib', 'secret')
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith('/token'):
+            expected = base64.b64encode(':'.join(self.credentials).encode()).decode()
+            self.token_requests.append(self.path)
+            if self.headers.get('Authorization') != f'Basic {expected}':
+                return self._send(401)
+            body = json.dumps({'token': 'the-token', 'expires_in': 300}).encode()
+            return self._send(200, body, {'Content-Type': 'application/json'})
+
+        if not self._authorized():
+            return
+
+        repository, kind, reference = self.path.removeprefix('/v2/').rsplit('/', 2)
+        if repository == 'ns/unavailable':
+            return self._send(503)
+        if kind == 'manifests' and (repository, reference) in self.manifests:
+            media_type, body = self.manifests[(repository, reference)]
+            return self._send(200, body, {'Content-Type': media_type})
+        if kind == 'blobs' and reference in self.blobs:
+            return self._send(200, self.blobs[reference])
+        self._send(404, b'{"errors": [{"code": "MANIFEST_UNKNOWN"}]}')
+
+    def _authorized(self):
+        if self.headers.get('Authorization') == 'Bearer the-token':
+            return True
+        host = f'127.0.0.1:{self.server.server_port}'
+        challenge = f'Bearer realm="http://{host}/token",service="{host}"'
+        self._send(401, headers={'WWW-Authenticate': challenge})
+        return False
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def do_HEAD(self):
+        if not self._authorized():
+            return
+        digest = self.path.rsplit('/', 1)[-1]
+        self._send(200 if digest in self.blobs else 404)
+
+    def do_POST(self):
+        self._read_body()
+        if not self._authorized():
+            return
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        repository = url.path.removeprefix('/v2/').removesuffix('/blobs/uploads/')
+        if query.get('mount', [None])[0] in self.blobs:
+            self.mounts.append((query['from'][0], repository))
+            return self._send(201)
+        self._send(202, headers={'Location': f'/v2/{repository}/blobs/uploads/the-upload?s=1'})
+
+    def do_PUT(self):
+        body = self._read_body()
+        if not self._authorized():
+            return
+        url = urllib.parse.urlparse(self.path)
+        repository, kind, reference = url.path.removeprefix('/v2/').rsplit('/', 2)
+        if kind == 'manifests':
+            self.manifests[(repository, reference)] = (self.headers['Content-Type'], body)
+            return self._send(201)
+        digest = urllib.parse.parse_qs(url.query)['digest'][0]
+        if _digest(body) != digest:
+            return self._send(400, b'{"errors": [{"code": "DIGEST_INVALID"}]}')
+        self.blobs[digest] = body
+        self._send(201)
+
+    def do_DELETE(self):
+        if self._authorized():
+            self._send(204)
+
+
+def _digest(content):
+    return f'sha256:{hashlib.sha256(content).hexdigest()}'
+
+
+@pytest.fixture
+def registry(tmpdir):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _StandInRegistry)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host = f'127.0.0.1:{server.server_port}'
+
+    config_blob = json.dumps(
+        {'architecture': 's390x', 'config': {'Labels': {'version': 'v4.15'}}}
+    ).encode()
+    amd64_config_blob = json.dumps(
+        {'architecture': 'amd64', 'config': {'Labels': {'version': 'v4.16'}}}
+    ).encode()
+    s390x_manifest = json.dumps(
+        {
+            'schemaVersion': 2,
+            'mediaType': registry_client.MEDIA_TYPE_DOCKER_MANIFEST,
+            'config': {'digest': _digest(config_blob)},
+            'layers': [],
+        }
+    ).encode()
+    amd64_manifest = json.dumps(
+        {
+            'schemaVersion': 2,
+            'mediaType': registry_client.MEDIA_TYPE_DOCKER_MANIFEST,
+            'config': {'digest': _digest(amd64_config_blob)},
+            'layers': [],
+        }
+    ).encode()
+    manifest_list = json.dumps(
+        {
+            'schemaVersion': 2,
+            'mediaType': registry_client.MEDIA_TYPE_DOCKER_MANIFEST_LIST,
+            'manifests': [
+                {'digest': _digest(s390x_manifest), 'platform': {'architecture': 's390x'}},
+                {'digest': _digest(amd64_manifest), 'platform': {'architecture': 'amd64'}},
+            ],
+        }
+    ).encode()
+    _StandInRegistry.token_requests = []
+    _StandInRegistry.mounts = []
+    _StandInRegistry.blobs = {
+        _digest(config_blob): config_blob,
+        _digest(amd64_config_blob): amd64_config_blob,
+    }
+    _StandInRegistry.manifests = {
+        ('ns/index', 'v4.15'): (registry_client.MEDIA_TYPE_DOCKER_MANIFEST_LIST, manifest_list),
+        ('ns/index', _digest(manifest_list)): (
+            registry_client.MEDIA_TYPE_DOCKER_MANIFEST_LIST,
+            manifest_list,
+        ),
+        ('ns/index', _digest(s390x_manifest)): (
+            registry_client.MEDIA_TYPE_DOCKER_MANIFEST,
+            s390x_manifest,
+        ),
+        ('ns/index', _digest(amd64_manifest)): (
+            registry_client.MEDIA_TYPE_DOCKER_MANIFEST,
+            amd64_manifest,
+        ),
+    }
+
+    docker_dir = tmpdir.mkdir('.docker')
+    auth = base64.b64encode(b'iib:secret').decode()
+    docker_dir.join('config.json').write(json.dumps({'auths': {f'{host}/ns': {'auth': auth}}}))
+
+    conf = mock.Mock(
+        iib_registry_client_insecure_registries=[host],
+        iib_registry_client_pool_size=4,
+        iib_registry_client_timeout=10,
+        iib_supported_archs={'amd64': 'x86_64', 's390x': 's390x'},
+    )
+    with mock.patch('iib.workers.registry_client.get_worker_config', return_value=conf):
+        with mock.patch('os.path.expanduser', return_value=str(tmpdir)):
+            yield host, manifest_list
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_manifest(registry):
+    host, manifest_list = registry
+    client = registry_client.RegistryClient()
+
+    manifest = client.get_manifest(f'docker://{host}/ns/index:v4.15')
+
+    assert manifest.raw == manifest_list.decode()
+    assert manifest.media_type == registry_client.MEDIA_TYPE_DOCKER_MANIFEST_LIST
+    assert manifest.digest == _digest(manifest_list)
+
+
+def test_get_manifest_token_cached(registry):
+    host, manifest_list = registry
+    client = registry_client.RegistryClient()
+
+    client.get_manifest(f'{host}/ns/index:v4.15')
+    client.get_manifest(f'{host}/ns/index@{_digest(manifest_list)}')
+
+    assert len(_StandInRegistry.token_requests) == 1
+    assert 'scope=repository%3Ans%2Findex%3Apull' in _StandInRegistry.token_requests[0]
+
+
+@mock.patch('platform.machine', return_value='x86_64')
+def test_get_image_config_manifest_list(mock_machine, registry):
+    host, _ = registry
+    client = registry_client.RegistryClient()
+
+    image_config = client.get_image_config(f'{host}/ns/index:v4.15')
+
+    assert image_config == {'architecture': 'amd64', 'config': {'Labels': {'version': 'v4.16'}}}
+
+
+def test_open_blob(registry):
+    host, manifest_list = registry
+    client = registry_client.RegistryClient()
+    pull_spec, manifest = client.get_image_manifest(f'{host}/ns/index:v4.15')
+    config_digest = manifest['config']['digest']
+
+    rv = client.open_blob(pull_spec, config_digest)
+    try:
+        assert json.loads(rv.raw.read())['architecture'] in ('amd64', 's390x')
+    finally:
+        rv.close()
+
+
+def test_upload_blob_and_put_manifest(registry):
+    host, _ = registry
+    client = registry_client.RegistryClient()
+    pull_spec = f'{host}/ns/iib-build:1-amd64'
+
+    assert not client.blob_exists(pull_spec, _digest(b'layer'))
+    client.upload_blob(pull_spec, _digest(b'layer'), io.BytesIO(b'layer'), 5)
+    assert client.blob_exists(pull_spec, _digest(b'layer'))
+
+    digest = client.put_manifest(
+        pull_spec, b'{"schemaVersion": 2}', registry_client.MEDIA_TYPE_DOCKER_MANIFEST
+    )
+    assert digest == _digest(b'{"schemaVersion": 2}')
+    assert client.get_manifest(pull_spec).raw == '{"schemaVersion": 2}'
+    # The pushed manifest is known without reading it back
+    assert client.get_pushed_manifest(f'docker://{pull_spec}') == registry_client.PushedManifest(
+        digest, registry_client.MEDIA_TYPE_DOCKER_MANIFEST, 20
+    )
+    client.record_pushed_manifest('registry.io/ns/other:tag', 'sha256:123')
+    assert client.get_pushed_manifest('registry.io/ns/other:tag') == (
+        registry_client.PushedManifest('sha256:123', None, None)
+    )
+    client.forget_pushed_manifests()
+    assert client.get_pushed_manifest(pull_spec) is None
+    assert client.get_pushed_manifest('registry.io/ns/other:tag') is None
+
+
+def test_copy_blob_mounts_within_registry(registry):
+    host, _ = registry
+    client = registry_client.RegistryClient()
+    _StandInRegistry.blobs[_digest(b'base')] = b'base'
+    # The blob is reported as missing so that the mount is attempted
+    with mock.patch.object(client, 'blob_exists', return_value=False):
+        client.copy_blob(
+            f'{host}/ns/binary:v4.15',
+            f'{host}/ns/iib-build:1-amd64',
+            {'digest': _digest(b'base'), 'size': 4},
+        )
+
+    assert _StandInRegistry.mounts == [('ns/binary', 'ns/iib-build')]
+
+
+def test_copy_image(registry):
+    host, manifest_list = registry
+    client = registry_client.RegistryClient()
+    for (repository, reference), manifest in list(_StandInRegistry.manifests.items()):
+        reference = '1' if reference == 'v4.15' else reference
+        _StandInRegistry.manifests[('ns/iib-build', reference)] = manifest
+
+    # The blobs are reported as missing so that they are mounted
+    with mock.patch.object(client, 'blob_exists', return_value=False):
+        digest = client.copy_image(f'{host}/ns/iib-build:1', f'docker://{host}/ns/index:v4.16')
+
+    # The manifest list is copied unmodified
+    assert digest == _digest(manifest_list)
+    assert _StandInRegistry.manifests[('ns/index', 'v4.16')][1] == manifest_list
+    assert _StandInRegistry.mounts == [('ns/iib-build', 'ns/index')] * 2
+    assert client.get_pushed_manifest(f'{host}/ns/index:v4.16').digest == digest
+
+
+def test_upload_blob_digest_mismatch(registry):
+    host, _ = registry
+    client = registry_client.RegistryClient()
+
+    with pytest.raises(IIBError, match='Failed to upload the blob sha256:.+ to .+/ns/iib-build'):
+        client.upload_blob(f'{host}/ns/iib-build:1-amd64', _digest(b'other'), b'layer')
+
+
+def test_get_manifest_not_found(registry):
+    host, _ = registry
+    client = registry_client.RegistryClient()
+
+    with pytest.raises(IIBError, match='Failed to inspect docker://.+/ns/missing:latest') as e:
+        client.get_manifest(f'{host}/ns/missing:latest')
+
+    # A missing image doesn't mean that the registry is unavailable
+    assert not isinstance(e.value, RegistryAvailabilityError)
+
+
+def test_get_manifest_registry_unavailable(registry):
+    host, _ = registry
+    client = registry_client.RegistryClient()
+
+    with pytest.raises(RegistryAvailabilityError, match='Failed to inspect docker://.+'):
+        client.get_manifest(f'{host}/ns/unavailable:latest')
+
+
+def test_get_manifest_connection_failed(registry):
+    client = registry_client.RegistryClient()
+
+    with pytest.raises(RegistryAvailabilityError, match='The connection to 127.0.0.1:1 failed'):
+        client.get_manifest('127.0.0.1:1/ns/index:v4.15')
+
+
+def test_get_manifest_invalid_credentials(registry, tmpdir):
+    host, _ = registry
+    auth = base64.b64encode(b'iib:wrong').decode()
+    tmpdir.join('.docker', 'config.json').write(json.dumps({'auths': {host: {'auth': auth}}}))
+    client = registry_client.RegistryClient()
+
+    with pytest.raises(RegistryAuthenticationError, match='Failed to get a token'):
+        client.get_manifest(f'{host}/ns/index:v4.15')
+
+
+@pytest.mark.parametrize(
+    'pull_spec, expected',
+    (
+        ('quay.io/ns/repo:v1', ('quay.io', 'ns/repo', 'v1')),
+        ('docker://quay.io/ns/repo@sha256:123', ('quay.io', 'ns/repo', 'sha256:123')),
+        ('localhost:5000/repo', ('localhost:5000', 'repo', 'latest')),
+        ('docker.io/busybox:1', ('registry-1.docker.io', 'library/busybox', '1')),
+    ),
+)
+def test_parse_image_reference(pull_spec, expected):
+    assert registry_client.parse_image_reference(pull_spec) == expected
+
+
+@pytest.mark.parametrize(
+    'auths, expected',
+    (
+        ({'quay.io': 'a', 'quay.io/ns': 'b', 'quay.io/ns/repo': 'c'}, 'c'),
+        ({'https://quay.io/': 'a', 'quay.io/ns': 'b'}, 'b'),
+        ({'https://quay.io/': 'a', 'quay.io/other': 'b'}, 'a'),
+        ({'registry.io': 'a'}, None),
+    ),
+)
+def test_get_credentials_most_specific(auths, expected, tmpdir):
+    docker_config = {
+        'auths': {
+            key: {'auth': base64.b64encode(f'{value}:pw'.encode()).decode()}
+            for key, value in auths.items()
+        }
+    }
+    tmpdir.mkdir('.docker').join('config.json').write(json.dumps(docker_config))
+    with mock.patch('os.path.expanduser', return_value=str(tmpdir)):
+        credentials = registry_client.RegistryClient()._get_credentials('quay.io', 'ns/repo')
+
+    assert credentials == ((expected, 'pw') if expected else None)
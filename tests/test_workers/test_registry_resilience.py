@@ -0,0 +1,192 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+from unittest import mock
+
+import pytest
+
+from iib.exceptions import IIBError, RegistryAvailabilityError, RegistryUnavailableError
+from iib.workers import registry_resilience
+
+
+@pytest.fixture
+def resilience_conf():
+    conf = mock.Mock(
+        iib_total_attempts=3,
+        iib_retry_multiplier=5,
+        iib_registry_circuit_breaker_failure_rate=0.5,
+        iib_registry_circuit_breaker_min_calls=4,
+        iib_registry_circuit_breaker_reset_timeout=60,
+        iib_registry_retry_budget=20,
+    )
+    with mock.patch('iib.workers.registry_resilience.get_worker_config', return_value=conf):
+        yield conf
+
+
+@pytest.fixture
+def mock_monotonic():
+    with mock.patch('iib.workers.registry_resilience.time.monotonic', return_value=1000.0) as m:
+        yield m
+
+
+def _get_registry_operation(side_effect):
+    func = mock.Mock(side_effect=side_effect)
+    decorated = registry_resilience.retry_registry_operation(
+        registry_resilience.get_pull_spec_registry
+    )(func)
+    return func, decorated
+
+
+@pytest.mark.parametrize(
+    'pull_spec, expected',
+    (
+        ('docker://quay.io/ns/repo:latest', 'quay.io'),
+        ('registry:8443/ns/repo@sha256:123', 'registry:8443'),
+        ('ubuntu:latest', 'registry-1.docker.io'),
+        ('oci:/tmp/image', None),
+        ('containers-storage:localhost/image', None),
+    ),
+)
+def test_get_pull_spec_registry(pull_spec, expected):
+    assert registry_resilience.get_pull_spec_registry(pull_spec) == expected
+
+
+def test_retry_registry_operation(resilience_conf, mock_monotonic):
+    func, decorated = _get_registry_operation([RegistryAvailabilityError('Failed'), 'result'])
+
+    assert decorated('quay.io/ns/repo:latest') == 'result'
+    assert func.call_count == 2
+    # The call has a single outcome, whatever its number of attempts
+    assert registry_resilience.get_registry_state('quay.io').failure_rate == 0
+
+
+def test_retry_registry_operation_attempts_exhausted(resilience_conf, mock_monotonic):
+    func, decorated = _get_registry_operation(RegistryAvailabilityError('Failed'))
+
+    with pytest.raises(RegistryAvailabilityError, match='Failed'):
+        decorated('quay.io/ns/repo:latest')
+
+    assert func.call_count == 3
+    assert registry_resilience.get_registry_state('quay.io').failure_rate == 1
+
+
+def test_retry_registry_operation_not_retried(resilience_conf, mock_monotonic):
+    func, decorated = _get_registry_operation(ValueError('Invalid'))
+
+    with pytest.raises(ValueError, match='Invalid'):
+        decorated('quay.io/ns/repo:latest')
+
+    assert func.call_count == 1
+    assert registry_resilience.get_registry_state('quay.io').failure_rate == 0
+
+
+def test_retry_registry_operation_not_registry_failure(resilience_conf, mock_monotonic):
+    resilience_conf.iib_registry_retry_budget = 0
+    func, decorated = _get_registry_operation(IIBError('manifest unknown'))
+
+    for _ in range(5):
+        with pytest.raises(IIBError, match='manifest unknown'):
+            decorated('quay.io/ns/missing:latest')
+
+    # A missing image is retried without the retry budget and never opens the circuit breaker
+    assert func.call_count == 15
+    state = registry_resilience.get_registry_state('quay.io')
+    assert state.circuit == 'closed'
+    assert state.failure_rate == 0
+
+
+def test_retry_registry_operation_no_registry(resilience_conf):
+    resilience_conf.iib_registry_retry_budget = 0
+    func, decorated = _get_registry_operation(RegistryAvailabilityError('Failed'))
+
+    with pytest.raises(IIBError, match='Failed'):
+        decorated('oci:/tmp/image')
+
+    # The calls which don't access a registry are retried without the retry budget
+    assert func.call_count == 3
+
+
+def test_retry_registry_operation_circuit_breaker(resilience_conf, mock_monotonic):
+    func, decorated = _get_registry_operation(RegistryAvailabilityError('Failed'))
+    # Calls to other registries are not affected
+    other_func, other_decorated = _get_registry_operation(['result'])
+
+    for _ in range(4):
+        with pytest.raises(RegistryAvailabilityError, match='Failed'):
+            decorated('quay.io/ns/repo:latest')
+
+    # The breaker opened after the 4th failed call
+    assert func.call_count == 12
+    assert registry_resilience.get_registry_state('quay.io').circuit == 'open'
+    with pytest.raises(RegistryUnavailableError, match='The registry quay.io is unavailable'):
+        decorated('quay.io/ns/repo:latest')
+    assert func.call_count == 12
+    assert other_decorated('registry.io/ns/repo:latest') == 'result'
+
+    # After the reset timeout, a failed trial call, which isn't retried, opens the breaker again
+    mock_monotonic.return_value += 60
+    with pytest.raises(RegistryAvailabilityError, match='Failed'):
+        decorated('quay.io/ns/repo:latest')
+    assert func.call_count == 13
+    assert registry_resilience.get_registry_state('quay.io').circuit == 'open'
+
+    # And a successful trial call closes it
+    mock_monotonic.return_value += 60
+    func.side_effect = None
+    func.return_value = 'result'
+    assert decorated('quay.io/ns/repo:latest') == 'result'
+    assert registry_resilience.get_registry_state('quay.io').circuit == 'closed'
+    assert registry_resilience.get_registry_state('quay.io').failure_rate == 0
+
+
+def test_retry_registry_operation_half_open_single_trial(resilience_conf, mock_monotonic):
+    state = registry_resilience.get_registry_state('quay.io')
+    for _ in range(4):
+        state.record_failure()
+    mock_monotonic.return_value += 60
+
+    state.before_call()
+
+    assert state.circuit == 'half-open'
+    # Only one trial call is let through at a time
+    with pytest.raises(RegistryUnavailableError):
+        state.before_call()
+    state.record_abort()
+    state.before_call()
+
+
+def test_retry_registry_operation_retry_budget(resilience_conf, mock_monotonic):
+    resilience_conf.iib_registry_circuit_breaker_min_calls = 100
+    resilience_conf.iib_registry_retry_budget = 3
+    func, decorated = _get_registry_operation(RegistryAvailabilityError('Failed'))
+
+    with pytest.raises(IIBError, match='Failed'):
+        decorated('quay.io/ns/repo:latest')
+    with pytest.raises(IIBError, match='Failed'):
+        decorated('quay.io/ns/repo:latest')
+
+    # The second call only got the retry left in the budget shared with the first call
+    assert func.call_count == 5
+
+    # The retries older than a minute are given back to the budget
+    mock_monotonic.return_value += 61
+    with pytest.raises(IIBError, match='Failed'):
+        decorated('quay.io/ns/repo:latest')
+    assert func.call_count == 8
+
+
+@mock.patch('iib.workers.registry_resilience.random.uniform')
+def test_wait_registry(mock_uniform, resilience_conf, mock_monotonic):
+    mock_uniform.side_effect = lambda low, high: high
+    state = registry_resilience.get_registry_state('quay.io')
+    wait = registry_resilience._wait_registry(state)
+    retry_state = mock.Mock(attempt_number=2)
+
+    assert wait(retry_state) == 10
+    mock_uniform.assert_called_once_with(5, 10)
+
+    state.record_failure()
+    state.record_success()
+    # The wait grows with the failure rate of the registry
+    assert wait(retry_state) == 15
+
+    retry_state.attempt_number = 10
+    assert wait(retry_state) == 300
@@ -5,11 +5,27 @@ import os
 import re
 import stat
 import textwrap
+import threading
 from unittest import mock
 
 import pytest
 
-from iib.exceptions import ExternalServiceError, IIBError
+from iib.exceptions import ExternalServiceError, IIBError, RegistryUnavailableError
+from iib.workers.build_memo import MemoizedBuild
+from iib.workers.checkpoints import (
+    Checkpoint,
+    PHASE_CONTEXT_PREPARED,
+    PHASE_IMAGES_PUSHED,
+    PHASE_MANIFEST_LIST_PUSHED,
+)
+from iib.workers.registry_client import (
+    Manifest,
+    MEDIA_TYPE_DOCKER_MANIFEST,
+    MEDIA_TYPE_DOCKER_MANIFEST_LIST,
+    MEDIA_TYPE_OCI_INDEX,
+    MEDIA_TYPE_OCI_MANIFEST,
+    PushedManifest,
+)
 from iib.workers.tasks import build
 from iib.workers.tasks.iib_static_types import BundleImage
 from iib.workers.tasks.utils import RequestConfigAddRm
@@ -56,6 +72,187 @@ def test_build_image(mock_run_cmd, mock_get_label, arch):
     mock_get_label.assert_called_with(local_destination, 'architecture')
 
 
+@mock.patch('iib.workers.tasks.build.worker_config')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
+def test_build_and_push_images(mock_bi, mock_pi, mock_wc):
+    mock_wc.iib_image_build_max_workers = 4
+    arches = {'amd64', 'arm64', 's390x'}
+    all_building = threading.Barrier(len(arches), timeout=5)
+    # All the builds must run at the same time for the barrier to be passed
+    mock_bi.side_effect = lambda *args, **kwargs: all_building.wait()
+
+    build._build_and_push_images('/tmp/dir', 'index.Dockerfile', 3, arches)
+
+    assert mock_bi.call_count == 3
+    for arch in arches:
+        mock_bi.assert_any_call('/tmp/dir', 'index.Dockerfile', 3, arch, use_cache=False)
+        mock_pi.assert_any_call(3, arch)
+
+
+@mock.patch('iib.workers.tasks.build.worker_config')
+def test_build_and_push_images_serial(mock_wc):
+    mock_wc.iib_image_build_max_workers = 1
+    manager = mock.Mock()
+    with mock.patch('iib.workers.tasks.build._build_image', manager.build), mock.patch(
+        'iib.workers.tasks.build._push_image', manager.push
+    ):
+        build._build_and_push_images('/tmp/dir', 'Dockerfile', 3, {'s390x', 'amd64'})
+
+    assert manager.mock_calls == [
+        mock.call.build('/tmp/dir', 'Dockerfile', 3, 'amd64', use_cache=False),
+        mock.call.push(3, 'amd64'),
+        mock.call.build('/tmp/dir', 'Dockerfile', 3, 's390x', use_cache=False),
+        mock.call.push(3, 's390x'),
+    ]
+
+
+@mock.patch('iib.workers.tasks.build.worker_config')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
+def test_build_and_push_images_failure(mock_bi, mock_pi, mock_wc):
+    mock_wc.iib_image_build_max_workers = 2
+
+    def _build_image(dockerfile_dir, dockerfile_name, request_id, arch, use_cache):
+        if arch == 'arm64':
+            raise IIBError('Failed to build the container image on the arch arm64')
+
+    mock_bi.side_effect = _build_image
+
+    with pytest.raises(IIBError, match='Failed to build the container image on the arch arm64'):
+        build._build_and_push_images('/tmp/dir', 'index.Dockerfile', 3, {'amd64', 'arm64'})
+
+    mock_pi.assert_called_once_with(3, 'amd64')
+
+
+@mock.patch('iib.workers.tasks.build.retain_files')
+@mock.patch('iib.workers.tasks.build.get_index_image_files')
+@mock.patch('iib.workers.tasks.build.get_worker_config')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
+def test_build_and_push_images_retains_files(mock_bi, mock_pi, mock_gwc, mock_giif, mock_rf):
+    mock_gwc.return_value = {'iib_artifact_cache_dir': '/var/cache/iib'}
+    mock_giif.return_value = {'/configs': '/tmp/dir/catalog'}
+
+    build._build_and_push_images('/tmp/dir', 'index.Dockerfile', 3, {'amd64'})
+
+    mock_giif.assert_called_once_with('/tmp/dir/index.Dockerfile')
+    mock_rf.assert_called_once_with({'/configs': '/tmp/dir/catalog'})
+    mock_pi.assert_called_once_with(3, 'amd64')
+
+
+@pytest.mark.parametrize('retained', (True, False))
+@mock.patch('iib.workers.tasks.build.memoize_retained_validated_packages')
+@mock.patch('iib.workers.tasks.build.add_retained_files_to_cache')
+@mock.patch('iib.workers.tasks.build.get_resolved_pushed_image')
+@mock.patch('iib.workers.tasks.build.has_retained_files')
+def test_record_pushed_index_image(mock_hrf, mock_grpi, mock_arftc, mock_mrvp, retained):
+    mock_hrf.return_value = retained
+    mock_grpi.return_value = 'registry:8443/iib-build@sha256:123'
+
+    build._record_pushed_index_image('registry:8443/iib-build:3')
+
+    if retained:
+        mock_grpi.assert_called_once_with('registry:8443/iib-build:3')
+        mock_arftc.assert_called_once_with('registry:8443/iib-build@sha256:123')
+    else:
+        mock_grpi.assert_not_called()
+        mock_arftc.assert_not_called()
+    mock_mrvp.assert_called_once_with('registry:8443/iib-build:3')
+
+
+@pytest.mark.parametrize('assembled', (True, False))
+@mock.patch('iib.workers.tasks.build.worker_config')
+@mock.patch('iib.workers.tasks.build.invalidate_tag_cache')
+@mock.patch('iib.workers.tasks.build.assemble_index_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
+def test_build_and_push_images_assemble(mock_bi, mock_pi, mock_aii, mock_itc, mock_wc, assembled):
+    mock_wc.iib_image_build_method = 'assemble'
+    mock_wc.iib_image_build_max_workers = 1
+    mock_aii.return_value = assembled
+
+    build._build_and_push_images('/tmp/dir', 'index.Dockerfile', 3, {'s390x', 'amd64'})
+
+    mock_aii.assert_called_once_with(
+        '/tmp/dir/index.Dockerfile',
+        {
+            'amd64': 'registry:8443/iib-build:3-amd64',
+            's390x': 'registry:8443/iib-build:3-s390x',
+        },
+    )
+    mock_itc.assert_called_once_with()
+    # The images are only built when they can't be assembled
+    assert mock_bi.call_count == (0 if assembled else 2)
+    assert mock_pi.call_count == (0 if assembled else 2)
+
+
+@pytest.mark.parametrize('cached', (True, False))
+@mock.patch('iib.workers.tasks.build.record_image_use')
+@mock.patch('iib.workers.tasks.build._get_build_cache_key', return_value='abc123')
+@mock.patch('iib.workers.tasks.build.get_image_label', return_value='x86_64')
+@mock.patch('iib.workers.tasks.build.run_cmd')
+def test_build_image_cache(mock_run_cmd, mock_get_label, mock_gbck, mock_riu, cached):
+    mock_run_cmd.return_value = 'image-id\n' if cached else ''
+
+    build._build_image('/some/dir', 'some.Dockerfile', 3, 'amd64', use_cache=True)
+
+    cache_image = 'localhost/iib-build-cache:abc123'
+    mock_gbck.assert_called_once_with('/some/dir', 'some.Dockerfile', 'amd64')
+    cmds = [c[0][0] for c in mock_run_cmd.call_args_list]
+    assert cmds[0] == ['podman', 'images', '--quiet', cache_image]
+    if cached:
+        assert cmds[1:] == [['podman', 'tag', cache_image, 'iib-build:3-amd64']]
+        mock_get_label.assert_not_called()
+    else:
+        assert cmds[1][0:3] == ['buildah', 'bud', '--layers']
+        assert '--no-cache' not in cmds[1]
+        assert cmds[2] == ['podman', 'tag', 'iib-build:3-amd64', cache_image]
+    mock_riu.assert_called_once_with(cache_image)
+
+
+@mock.patch('iib.workers.tasks.build.get_resolved_image', return_value='registry.io/opm@sha256:1')
+def test_get_build_cache_key(mock_gri, tmpdir):
+    tmpdir.mkdir('catalog').join('catalog.json').write('{}')
+    tmpdir.mkdir('unrelated').join('file').write('a')
+    tmpdir.join('index.Dockerfile').write(
+        'FROM registry.io/opm:v1\nADD catalog /configs\nCOPY --chown=1001:0 \\\n'
+        '  ["catalog", "/tmp/cache"]\nLABEL a=b\n'
+    )
+
+    def _key(arch='amd64'):
+        return build._get_build_cache_key(str(tmpdir), 'index.Dockerfile', arch)
+
+    key = _key()
+    assert key == _key()
+    mock_gri.assert_called_with('registry.io/opm:v1')
+    assert key != _key('s390x')
+    # The files which aren't copied into the image don't change the key
+    tmpdir.join('unrelated', 'file').write('b')
+    assert key == _key()
+    # A new digest of the base image changes the key
+    mock_gri.return_value = 'registry.io/opm@sha256:2'
+    assert key != _key()
+    mock_gri.return_value = 'registry.io/opm@sha256:1'
+    tmpdir.join('catalog', 'catalog.json').write('{"schema": "olm.package"}')
+    assert key != _key()
+
+
+@pytest.mark.parametrize(
+    'dockerfile',
+    (
+        'FROM registry.io/opm:v1\nRUN echo hi\n',
+        'FROM registry.io/opm:v1 AS builder\nFROM scratch\nCOPY --from=builder /a /a\n',
+        'FROM scratch\nADD https://example.com/a /a\n',
+        'FROM scratch\nCOPY *.json /a\n',
+    ),
+)
+def test_get_build_cache_key_not_cacheable(dockerfile, tmpdir):
+    tmpdir.join('Dockerfile').write(dockerfile)
+
+    assert build._get_build_cache_key(str(tmpdir), 'Dockerfile', 'amd64') is None
+
+
 @mock.patch('iib.workers.tasks.build.get_image_label')
 @mock.patch('iib.workers.tasks.build.run_cmd')
 def test_build_image_incorrect_arch(mock_run_cmd, mock_get_label):
@@ -94,13 +291,97 @@ def test_build_image_retry(mock_run_cmd):
 
 @mock.patch('iib.workers.tasks.build.run_cmd')
 @mock.patch('iib.workers.tasks.build.reset_docker_config')
-def test_cleanup(mock_rdc, mock_run_cmd):
+@mock.patch('iib.workers.tasks.build.invalidate_tag_cache')
+@mock.patch('iib.workers.tasks.build.clear_validated_packages')
+@mock.patch('iib.workers.tasks.build.clear_image_metadata')
+def test_cleanup(mock_cim, mock_cvp, mock_itc, mock_rdc, mock_run_cmd):
     build._cleanup()
 
     mock_run_cmd.assert_called_once()
     rmi_args = mock_run_cmd.call_args[0][0]
     assert rmi_args[0:2] == ['podman', 'rmi']
     mock_rdc.assert_called_once_with()
+    mock_itc.assert_called_once_with()
+    mock_cim.assert_called_once_with()
+    mock_cvp.assert_called_once_with()
+
+
+@pytest.mark.parametrize(
+    'storage_usages, expected_removed, remove_all',
+    (
+        # Only the total size is over the limit, so only the least recently used image is removed
+        ([0.5, 0.5], ['old-id'], False),
+        # The storage is over the high-water mark, so the unpinned images are removed
+        ([0.9, 0.9, 0.5], ['old-id', 'new-id'], False),
+        # The storage stays over the high-water mark, so all the images are removed
+        ([0.9, 0.9, 0.9], ['old-id', 'new-id'], True),
+    ),
+)
+@mock.patch('iib.workers.tasks.build.shutil.disk_usage')
+@mock.patch('iib.workers.tasks.build.get_image_usage')
+@mock.patch('iib.workers.tasks.build.get_worker_config')
+@mock.patch('iib.workers.tasks.build.run_cmd')
+@mock.patch('iib.workers.tasks.build.reset_docker_config')
+@mock.patch('iib.workers.tasks.build.clear_image_metadata')
+def test_cleanup_lru(
+    mock_cim,
+    mock_rdc,
+    mock_run_cmd,
+    mock_gwc,
+    mock_giu,
+    mock_du,
+    storage_usages,
+    expected_removed,
+    remove_all,
+):
+    conf = {
+        'iib_image_gc_policy': 'lru',
+        'iib_image_gc_max_size': 350,
+        'iib_image_gc_high_water_mark': 0.8,
+        'iib_image_push_template': '{registry}/iib-build:{request_id}',
+        'iib_registry': 'registry:8443',
+    }
+    mock_gwc.return_value = mock.MagicMock(**conf)
+    mock_gwc.return_value.__getitem__.side_effect = conf.__getitem__
+    images = [
+        {'Id': 'build-id', 'Names': ['localhost/iib-build:1-amd64'], 'Size': 100},
+        {'Id': 'list-id', 'Names': ['registry:8443/iib-build:1'], 'Size': 1},
+        {'Id': 'binary-id', 'Names': ['quay.io/ns/opm:v4.15'], 'Size': 100, 'Created': 1},
+        {
+            'Id': 'index-id',
+            'Names': [],
+            'RepoDigests': ['quay.io/ns/index@sha256:123'],
+            'Size': 100,
+            'Created': 1,
+        },
+        {'Id': 'new-id', 'Names': ['quay.io/ns/bundle:new'], 'Size': 100, 'Created': 1},
+        {'Id': 'old-id', 'Names': ['quay.io/ns/bundle:old'], 'Size': 100, 'Created': 5},
+    ]
+    mock_giu.return_value = (
+        {'quay.io/ns/bundle:new': 10},
+        {'quay.io/ns/opm:v4.15', 'quay.io/ns/index@sha256:123'},
+    )
+    mock_run_cmd.side_effect = lambda cmd, *args, **kwargs: (
+        json.dumps(images) if cmd[:2] == ['podman', 'images'] else '/var/lib/containers/storage\n'
+    )
+    mock_du.side_effect = [mock.Mock(used=usage * 100, total=100) for usage in storage_usages]
+
+    build._cleanup()
+
+    rmi_calls = [call[0][0] for call in mock_run_cmd.call_args_list if call[0][0][1] == 'rmi']
+    assert rmi_calls[0] == [
+        'podman',
+        'rmi',
+        '--force',
+        'localhost/iib-build:1-amd64',
+        'registry:8443/iib-build:1',
+    ]
+    assert rmi_calls[1:][: len(expected_removed)] == [
+        ['podman', 'rmi', '--force', image_id] for image_id in expected_removed
+    ]
+    assert (['podman', 'rmi', '--all', '--force'] in rmi_calls) is remove_all
+    mock_rdc.assert_called_once_with()
+    mock_cim.assert_called_once_with()
 
 
 @mock.patch('iib.workers.tasks.build.tempfile.TemporaryDirectory')
@@ -240,6 +521,69 @@ def test_create_and_push_manifest_list_failure_to_rm_manifest_list(mock_run_cmd,
         build._create_and_push_manifest_list(3, {'amd64', 's390x'}, [])
 
 
+@pytest.mark.parametrize(
+    'pushed_media_type, expected_media_type',
+    (
+        (MEDIA_TYPE_DOCKER_MANIFEST, MEDIA_TYPE_DOCKER_MANIFEST_LIST),
+        (MEDIA_TYPE_OCI_MANIFEST, MEDIA_TYPE_OCI_INDEX),
+    ),
+)
+@mock.patch('iib.workers.tasks.build.invalidate_tag_cache')
+@mock.patch('iib.workers.tasks.build.run_cmd')
+@mock.patch('iib.workers.tasks.build.get_registry_client')
+@mock.patch('iib.workers.tasks.build.get_worker_config')
+def test_create_and_push_manifest_list_native(
+    mock_gwc, mock_grc, mock_run_cmd, mock_itc, pushed_media_type, expected_media_type
+):
+    mock_gwc.return_value = {
+        'iib_registry_client': 'native',
+        'iib_image_push_template': '{registry}/iib-build:{request_id}',
+        'iib_registry': 'registry:8443',
+    }
+    client = mock_grc.return_value
+    # The amd64 image was pushed by IIB, the s390x image is read from the registry
+    client.get_pushed_manifest.side_effect = lambda pull_spec: (
+        PushedManifest('sha256:amd64', pushed_media_type, 8)
+        if pull_spec.endswith('-amd64')
+        else None
+    )
+    client.get_manifest.return_value = Manifest('{"s": 390}', pushed_media_type, 'sha256:s390x')
+
+    output_pull_spec = build._create_and_push_manifest_list(
+        3, {'amd64', 's390x'}, ['extra_build_tag1']
+    )
+
+    assert output_pull_spec == 'registry:8443/iib-build:3'
+    client.get_manifest.assert_called_once_with('registry:8443/iib-build:3-s390x')
+    assert client.put_manifest.call_count == 2
+    pushed = {c[0][0]: c[0][1:] for c in client.put_manifest.call_args_list}
+    assert set(pushed) == {'registry:8443/iib-build:3', 'registry:8443/iib-build:extra_build_tag1'}
+    # The manifest list is composed once and pushed as-is to all the tags
+    assert len(set(pushed.values())) == 1
+    manifest_list, media_type = pushed['registry:8443/iib-build:3']
+    assert media_type == expected_media_type
+    assert json.loads(manifest_list) == {
+        'schemaVersion': 2,
+        'mediaType': expected_media_type,
+        'manifests': [
+            {
+                'mediaType': pushed_media_type,
+                'size': 8,
+                'digest': 'sha256:amd64',
+                'platform': {'architecture': 'amd64', 'os': 'linux'},
+            },
+            {
+                'mediaType': pushed_media_type,
+                'size': 10,
+                'digest': 'sha256:s390x',
+                'platform': {'architecture': 's390x', 'os': 'linux'},
+            },
+        ],
+    }
+    mock_run_cmd.assert_not_called()
+    mock_itc.assert_called_once_with()
+
+
 @pytest.mark.parametrize(
     'iib_index_image_output_registry, from_index, overwrite, expected, resolved_from_index,'
     'add_or_rm, is_image_fbc',
@@ -254,6 +598,16 @@ def test_create_and_push_manifest_list_failure_to_rm_manifest_list(mock_run_cmd,
             False,
             True,
         ),
+        (
+            'registry-proxy.domain.local',
+            None,
+            False,
+            'registry-proxy.domain.local/{default_no_registry}',
+            None,
+            True,
+            False,
+        ),
+        (None, None, False, '{default}', None, True, False),
         (
             None,
             'quay.io/ns/iib:v4.5',
@@ -277,11 +631,13 @@ def test_create_and_push_manifest_list_failure_to_rm_manifest_list(mock_run_cmd,
 @mock.patch('iib.workers.tasks.build.get_worker_config')
 @mock.patch('iib.workers.tasks.build._overwrite_from_index')
 @mock.patch('iib.workers.tasks.build.update_request')
+@mock.patch('iib.workers.tasks.build.get_resolved_pushed_image')
 @mock.patch('iib.workers.tasks.build.get_resolved_image')
 @mock.patch('iib.workers.tasks.build.set_registry_token')
 def test_update_index_image_pull_spec(
     mock_st_rgstr_tknm,
     mock_get_rslv_img,
+    mock_grpi,
     mock_ur,
     mock_ofi,
     mock_gwc,
@@ -301,6 +657,7 @@ def test_update_index_image_pull_spec(
     overwrite_token = 'username:password'
 
     mock_get_rslv_img.return_value = "quay.io/ns/iib@sha256:abcdef1234"
+    mock_grpi.side_effect = lambda pull_spec: f'{pull_spec.rsplit(":", 1)[0]}@sha256:123456'
     mock_gwc.return_value = {
         'iib_index_image_output_registry': iib_index_image_output_registry,
         'iib_registry': 'quay.io',
@@ -340,6 +697,14 @@ def test_update_index_image_pull_spec(
             'internal_index_image_copy',
             'internal_index_image_copy_resolved',
         }
+        # The digests recorded when the manifest lists were pushed are used
+        mock_get_rslv_img.assert_not_called()
+        assert (
+            update_request_payload['internal_index_image_copy_resolved']
+            == 'quay.io/namespace/some-image@sha256:123456'
+        )
+        expected_resolved = f'{expected_pull_spec.rsplit(":", 1)[0]}@sha256:123456'
+        assert update_request_payload['index_image_resolved'] == expected_resolved
     else:
         assert update_request_payload.keys() == {'arches', 'index_image'}
     assert update_request_payload['index_image'] == expected_pull_spec
@@ -580,6 +945,72 @@ def test_overwrite_from_index_reverts_on_failure(
     )
 
 
+@pytest.mark.parametrize('copy_fails', (False, True))
+@mock.patch('iib.workers.tasks.build.get_worker_config')
+@mock.patch('iib.workers.tasks.build.revert_last_commit')
+@mock.patch('iib.workers.tasks.build.set_request_state')
+@mock.patch('iib.workers.tasks.build._skopeo_copy')
+@mock.patch('iib.workers.tasks.build.get_registry_client')
+@mock.patch('iib.workers.tasks.build.invalidate_tag_cache')
+@mock.patch('iib.workers.tasks.build.set_registry_token')
+@mock.patch('iib.workers.tasks.build.push_configs_to_git')
+@mock.patch('iib.workers.tasks.build.get_catalog_dir')
+@mock.patch('iib.workers.tasks.build._verify_index_image')
+def test_overwrite_from_index_native(
+    mock_vii,
+    mock_gcd,
+    mock_pgt,
+    mock_srt,
+    mock_itc,
+    mock_grc,
+    mock_sc,
+    mock_srs,
+    mock_rlc,
+    mock_gwc,
+    copy_fails,
+):
+    mock_gwc.return_value = mock.Mock(iib_registry_client='native')
+    mock_gcd.return_value = '/path/to/configs'
+    if copy_fails:
+        mock_grc.return_value.copy_image.side_effect = IIBError('Failed to upload the blob')
+    from_index = 'quay.io/ns/repo:v1'
+    output_pull_spec = 'quay.io/ns/iib-build:1'
+    url_repo_map = {from_index: 'https://fake.url.git'}
+
+    if copy_fails:
+        match = f'Failed to overwrite the input from_index container image of {from_index}'
+        with pytest.raises(IIBError, match=match):
+            build._overwrite_from_index(
+                request_id=1,
+                output_pull_spec=output_pull_spec,
+                from_index=from_index,
+                resolved_prebuild_from_index='quay.io/ns/repo@sha256:abcdef',
+                overwrite_from_index_token='user:pass',
+                is_image_fbc=True,
+                index_repo_map=url_repo_map,
+            )
+        mock_rlc.assert_called_once_with(
+            request_id=1, from_index=from_index, index_repo_map=url_repo_map
+        )
+    else:
+        build._overwrite_from_index(
+            request_id=1,
+            output_pull_spec=output_pull_spec,
+            from_index=from_index,
+            resolved_prebuild_from_index='quay.io/ns/repo@sha256:abcdef',
+            overwrite_from_index_token='user:pass',
+            is_image_fbc=True,
+            index_repo_map=url_repo_map,
+        )
+        mock_rlc.assert_not_called()
+
+    # The index image isn't exported even though both images are in the same registry
+    mock_sc.assert_not_called()
+    mock_grc.return_value.copy_image.assert_called_once_with(output_pull_spec, from_index)
+    mock_itc.assert_called_once_with()
+    mock_pgt.assert_called_once()
+
+
 @pytest.mark.parametrize('bundle_mapping', (True, False))
 @pytest.mark.parametrize('from_index_resolved', (True, False))
 @mock.patch('iib.workers.tasks.build.update_request')
@@ -612,27 +1043,37 @@ def test_update_index_image_build_state(mock_ur, bundle_mapping, from_index_reso
     mock_ur.assert_called_once_with(request_id, expected_payload, mock.ANY)
 
 
-@pytest.mark.parametrize('schema_version', (1, 2))
+@pytest.mark.parametrize('digest', ('sha256:123456', ''))
 @mock.patch('iib.workers.tasks.build._get_local_pull_spec')
 @mock.patch('iib.workers.tasks.build.run_cmd')
-@mock.patch('iib.workers.tasks.build.skopeo_inspect')
-@mock.patch('iib.workers.tasks.build._skopeo_copy')
-def test_push_image(mock_sc, mock_si, mock_run_cmd, mock_glps, schema_version):
+@mock.patch('iib.workers.tasks.build.invalidate_tag_cache')
+@mock.patch('iib.workers.tasks.build.get_registry_client')
+def test_push_image(mock_grc, mock_itc, mock_run_cmd, mock_glps, digest):
     mock_glps.return_value = 'source:tag'
-    mock_si.return_value = {'schemaVersion': schema_version}
+
+    def _push(cmd, *args, **kwargs):
+        with open(cmd[cmd.index('--digestfile') + 1], 'w') as f:
+            f.write(digest)
+
+    mock_run_cmd.side_effect = _push
 
     build._push_image(3, 'amd64')
 
     push_args = mock_run_cmd.mock_calls[0][1][0]
     assert push_args[0:2] == ['podman', 'push']
+    assert push_args[push_args.index('--format') + 1] == 'v2s2'
     assert 'source:tag' in push_args
     destination = 'docker://registry:8443/iib-build:3-amd64'
     assert destination in push_args
-
-    if schema_version == 1:
-        mock_sc.assert_called_once()
+    mock_run_cmd.assert_called_once()
+    mock_itc.assert_called_once_with()
+    # The manifest isn't read back from the registry
+    if digest:
+        mock_grc.return_value.record_pushed_manifest.assert_called_once_with(
+            destination, digest, 'application/vnd.docker.distribution.manifest.v2+json'
+        )
     else:
-        mock_run_cmd.assert_called_once()
+        mock_grc.return_value.record_pushed_manifest.assert_not_called()
 
 
 @pytest.mark.parametrize('copy_all', (False, True))
@@ -668,6 +1109,24 @@ def test_skopeo_copy(mock_run_cmd, copy_all):
     mock_run_cmd.assert_called_once()
 
 
+@mock.patch('iib.workers.tasks.build.run_cmd')
+@mock.patch('iib.workers.tasks.build.get_registry_client')
+def test_skopeo_copy_records_digest(mock_grc, mock_run_cmd):
+    def _copy(cmd, *args, **kwargs):
+        with open(cmd[cmd.index('--digestfile') + 1], 'w') as f:
+            f.write('sha256:123456\n')
+
+    mock_run_cmd.side_effect = _copy
+    destination = 'docker://quay.io/ns/iib:v4.5'
+
+    build._skopeo_copy('oci:/tmp/index', destination, copy_all=True)
+
+    assert mock_run_cmd.mock_calls[0][1][0][-2:] == ['oci:/tmp/index', destination]
+    mock_grc.return_value.record_pushed_manifest.assert_called_once_with(
+        destination, 'sha256:123456', None
+    )
+
+
 @mock.patch('iib.workers.tasks.build.run_cmd')
 def test_skopeo_copy_fail_max_retries(mock_run_cmd):
     match_str = 'Something went wrong'
@@ -986,6 +1445,285 @@ def test_handle_add_request_passes_rm_operators_for_deprecation(
     )
 
 
+def _raw_manifests(arch_layers):
+    manifest_list = {
+        'mediaType': MEDIA_TYPE_DOCKER_MANIFEST_LIST,
+        'manifests': [
+            {'digest': f'sha256:{arch}', 'platform': {'architecture': arch}} for arch in arch_layers
+        ],
+    }
+    return [manifest_list] + [
+        {'layers': [{'digest': layer} for layer in layers]} for layers in arch_layers.values()
+    ]
+
+
+@pytest.mark.parametrize(
+    'labels, index_layers, binary_layers, expected',
+    (
+        (
+            {'version': 'v4.5', 'scope': 'prod'},
+            {'amd64': ['a1', 'a2', 'a3'], 's390x': ['s1', 's2']},
+            {'amd64': ['a1', 'a2'], 's390x': ['s1']},
+            True,
+        ),
+        (
+            {'version': 'v4.6', 'scope': 'prod'},
+            {'amd64': ['a1', 'a2', 'a3'], 's390x': ['s1', 's2']},
+            {'amd64': ['a1', 'a2'], 's390x': ['s1']},
+            False,
+        ),
+        (
+            {'version': 'v4.5', 'scope': 'stage'},
+            {'amd64': ['a1', 'a2', 'a3'], 's390x': ['s1', 's2']},
+            {'amd64': ['a1', 'a2'], 's390x': ['s1']},
+            False,
+        ),
+        (
+            {'version': 'v4.5', 'scope': 'prod'},
+            {'amd64': ['a1', 'a2', 'a3']},
+            {'amd64': ['a1', 'a2'], 's390x': ['s1']},
+            False,
+        ),
+        (
+            {'version': 'v4.5', 'scope': 'prod'},
+            {'amd64': ['a1', 'a2', 'a3'], 's390x': ['s1', 's2']},
+            {'amd64': ['a0', 'a2'], 's390x': ['s1']},
+            False,
+        ),
+    ),
+)
+@mock.patch('iib.workers.tasks.build.set_registry_token')
+@mock.patch('iib.workers.tasks.build.skopeo_inspect')
+@mock.patch('iib.workers.tasks.build.get_image_labels')
+def test_is_index_image_unchanged(
+    mock_gil, mock_si, mock_srt, labels, index_layers, binary_layers, expected
+):
+    mock_gil.return_value = {
+        'com.redhat.index.delivery.version': labels['version'],
+        'com.redhat.index.delivery.distribution_scope': labels['scope'],
+    }
+    mock_si.side_effect = _raw_manifests(index_layers) + _raw_manifests(binary_layers)
+    prebuild_info = {
+        'arches': {'amd64', 's390x'},
+        'binary_image_resolved': 'binary-image@sha256:abcdef',
+        'ocp_version': 'v4.5',
+        'distribution_scope': 'prod',
+    }
+
+    unchanged = build._is_index_image_unchanged(
+        'quay.io/ns/from-index@sha256:bcdefg', prebuild_info, 'user:pass'
+    )
+
+    assert unchanged is expected
+    mock_gil.assert_called_once_with('quay.io/ns/from-index@sha256:bcdefg')
+    assert mock_si.mock_calls[1][1] == ('docker://quay.io/ns/from-index@sha256:amd64', '--raw')
+    mock_srt.assert_called_once_with(
+        'user:pass', 'quay.io/ns/from-index@sha256:bcdefg', append=True
+    )
+
+
+@pytest.mark.parametrize('iib_registry_client', ('native', 'skopeo'))
+@mock.patch('iib.workers.tasks.build.set_request_state')
+@mock.patch('iib.workers.tasks.build._cleanup')
+@mock.patch('iib.workers.tasks.build._update_index_image_pull_spec')
+@mock.patch('iib.workers.tasks.build._skopeo_copy')
+@mock.patch('iib.workers.tasks.build._copy_index_image')
+@mock.patch('iib.workers.tasks.build.get_worker_config')
+def test_complete_request_with_index_image(
+    mock_gwc, mock_cii, mock_sc, mock_uiips, mock_cleanup, mock_srs, iib_registry_client
+):
+    mock_gwc.return_value = mock.MagicMock(
+        iib_registry_client=iib_registry_client,
+        **{
+            '__getitem__.side_effect': {
+                'iib_image_push_template': '{registry}/iib-build:{request_id}',
+                'iib_registry': 'quay.io',
+            }.__getitem__
+        },
+    )
+    from_index_resolved = 'quay.io/ns/from-index@sha256:bcdefg'
+    prebuild_info = {'arches': {'amd64'}, 'from_index_resolved': from_index_resolved}
+
+    build._complete_request_with_index_image(
+        request_id=3,
+        index_image=from_index_resolved,
+        state_reason='The index image was reused',
+        prebuild_info=prebuild_info,
+        from_index='quay.io/ns/from-index:latest',
+        overwrite_from_index=False,
+        overwrite_from_index_token=None,
+        build_tags=['extra_tag'],
+        is_image_fbc=True,
+        index_repo_map=None,
+        rm_operators=['some-operator'],
+    )
+
+    destinations = ['quay.io/iib-build:3', 'quay.io/iib-build:extra_tag']
+    if iib_registry_client == 'native':
+        assert [c[0][:2] for c in mock_cii.call_args_list] == [
+            (from_index_resolved, destination) for destination in destinations
+        ]
+        mock_sc.assert_not_called()
+    else:
+        assert [c[0][:2] for c in mock_sc.call_args_list] == [
+            (f'docker://{from_index_resolved}', f'docker://{destination}')
+            for destination in destinations
+        ]
+        mock_cii.assert_not_called()
+    mock_uiips.assert_called_once_with(
+        output_pull_spec='quay.io/iib-build:3',
+        request_id=3,
+        arches={'amd64'},
+        from_index='quay.io/ns/from-index:latest',
+        overwrite_from_index=False,
+        overwrite_from_index_token=None,
+        resolved_prebuild_from_index=from_index_resolved,
+        add_or_rm=True,
+        is_image_fbc=True,
+        index_repo_map={},
+        rm_operators=['some-operator'],
+    )
+    mock_cleanup.assert_called_once()
+    mock_srs.assert_called_with(3, 'complete', 'The index image was reused')
+
+
+@pytest.mark.parametrize(
+    'memoized_build, arches, expected',
+    (
+        (None, None, None),
+        (
+            ('quay.io/iib/iib-build@sha256:123', ['op']),
+            {'amd64'},
+            ('quay.io/iib/iib-build@sha256:123', ['op']),
+        ),
+        (('quay.io/iib/iib-build@sha256:123', []), {'amd64', 's390x'}, None),
+        (('quay.io/iib/iib-build@sha256:123', []), IIBError('not found'), None),
+    ),
+)
+@mock.patch('iib.workers.tasks.build.forget_build')
+@mock.patch('iib.workers.tasks.build.get_image_arches')
+@mock.patch('iib.workers.tasks.build.get_memoized_build')
+def test_get_memoized_build(mock_gmb, mock_gia, mock_fb, memoized_build, arches, expected):
+    mock_gmb.return_value = MemoizedBuild(*memoized_build) if memoized_build else None
+    mock_gia.side_effect = [arches]
+    prebuild_info = {'arches': {'amd64'}, 'build_fingerprint': 'abc'}
+
+    result = build._get_memoized_build(prebuild_info)
+
+    assert result == (MemoizedBuild(*expected) if expected else None)
+    mock_gmb.assert_called_once_with('abc')
+    if memoized_build and not expected:
+        mock_fb.assert_called_once_with('abc')
+    else:
+        mock_fb.assert_not_called()
+
+
+@mock.patch('iib.workers.tasks.build.get_memoized_build')
+def test_get_memoized_build_without_fingerprint(mock_gmb):
+    assert build._get_memoized_build({'arches': {'amd64'}}) is None
+    mock_gmb.assert_not_called()
+
+
+@mock.patch('iib.workers.tasks.build.memoize_build')
+@mock.patch('iib.workers.tasks.build.get_resolved_pushed_image')
+def test_memoize_build(mock_grpi, mock_mb):
+    mock_grpi.return_value = 'quay.io/iib/iib-build@sha256:123'
+
+    build._memoize_build({'build_fingerprint': 'abc'}, 'quay.io/iib/iib-build:3', ['op'])
+    build._memoize_build({}, 'quay.io/iib/iib-build:4', ['op'])
+
+    mock_grpi.assert_called_once_with('quay.io/iib/iib-build:3')
+    mock_mb.assert_called_once_with('abc', 'quay.io/iib/iib-build@sha256:123', ['op'])
+
+
+@mock.patch('iib.workers.tasks.build.save_checkpoint')
+@mock.patch('iib.workers.tasks.build._build_and_push_images')
+@mock.patch('iib.workers.tasks.build.get_checkpoint_context_dir')
+@mock.patch('iib.workers.tasks.build.set_request_state')
+def test_build_and_push_images_from_checkpoint(mock_srs, mock_gccd, mock_bapi, mock_sc):
+    mock_gccd.return_value = '/checkpoints/3/context'
+    data = {'dockerfile_name': 'index.Dockerfile', 'rm_operators': []}
+    checkpoint = Checkpoint(PHASE_CONTEXT_PREPARED, 'abc', data)
+
+    rv = build._build_and_push_images_from_checkpoint(3, checkpoint, {'amd64'}, 'add')
+
+    assert rv == mock_sc.return_value
+    mock_bapi.assert_called_once_with(
+        '/checkpoints/3/context', 'index.Dockerfile', 3, {'amd64'}, request_type='add'
+    )
+    mock_sc.assert_called_once_with(3, 'abc', PHASE_IMAGES_PUSHED, data)
+
+    # The images are not built again once they were pushed
+    pushed_checkpoint = Checkpoint(PHASE_IMAGES_PUSHED, 'abc', data)
+    rv = build._build_and_push_images_from_checkpoint(3, pushed_checkpoint, {'amd64'}, 'add')
+
+    assert rv == pushed_checkpoint
+    mock_bapi.assert_called_once()
+
+
+@pytest.mark.parametrize('phase', (PHASE_IMAGES_PUSHED, PHASE_MANIFEST_LIST_PUSHED))
+@mock.patch('iib.workers.tasks.build.remove_checkpoint')
+@mock.patch('iib.workers.tasks.build.save_checkpoint')
+@mock.patch('iib.workers.tasks.build._cleanup')
+@mock.patch('iib.workers.tasks.build._update_index_image_pull_spec')
+@mock.patch('iib.workers.tasks.build._memoize_build')
+@mock.patch('iib.workers.tasks.build._create_and_push_manifest_list')
+@mock.patch('iib.workers.tasks.build.set_request_state')
+def test_finish_add_request(
+    mock_srs, mock_capml, mock_mb, mock_uiips, mock_cleanup, mock_sc, mock_rc, phase
+):
+    output_pull_spec = 'quay.io/iib/iib-build:3'
+    data = {'dockerfile_name': 'index.Dockerfile', 'rm_operators': ['some-operator']}
+    if phase == PHASE_MANIFEST_LIST_PUSHED:
+        data['output_pull_spec'] = output_pull_spec
+    mock_capml.return_value = output_pull_spec
+    mock_sc.side_effect = lambda request_id, fingerprint, phase, data: Checkpoint(
+        phase, fingerprint, data
+    )
+    prebuild_info = {'arches': {'amd64'}, 'from_index_resolved': 'from-index@sha256:123'}
+
+    build._finish_add_request(
+        request_id=3,
+        checkpoint=Checkpoint(phase, 'abc', data),
+        prebuild_info=prebuild_info,
+        from_index='from-index:latest',
+        overwrite_from_index=False,
+        overwrite_from_index_token=None,
+        build_tags=['extra_tag'],
+        is_image_fbc=False,
+        index_repo_map=None,
+    )
+
+    if phase == PHASE_IMAGES_PUSHED:
+        mock_capml.assert_called_once_with(3, {'amd64'}, ['extra_tag'])
+        mock_sc.assert_called_once_with(
+            3, 'abc', PHASE_MANIFEST_LIST_PUSHED, {**data, 'output_pull_spec': output_pull_spec}
+        )
+    else:
+        # The request is resumed after the manifest list was pushed
+        mock_capml.assert_not_called()
+        mock_sc.assert_not_called()
+    mock_mb.assert_called_once_with(prebuild_info, output_pull_spec, ['some-operator'])
+    mock_uiips.assert_called_once_with(
+        output_pull_spec=output_pull_spec,
+        request_id=3,
+        arches={'amd64'},
+        from_index='from-index:latest',
+        overwrite_from_index=False,
+        overwrite_from_index_token=None,
+        resolved_prebuild_from_index='from-index@sha256:123',
+        add_or_rm=True,
+        is_image_fbc=False,
+        index_repo_map={},
+        rm_operators=['some-operator'],
+    )
+    mock_cleanup.assert_called_once_with()
+    mock_rc.assert_called_once_with(3)
+    mock_srs.assert_called_with(
+        3, 'complete', 'The operator bundle(s) were successfully added to the index image'
+    )
+
+
 @mock.patch('iib.workers.tasks.build.update_request')
 @mock.patch('iib.workers.tasks.build._cleanup')
 @mock.patch('iib.workers.tasks.build.run_cmd')
@@ -1259,6 +1997,7 @@ def test_handle_add_request_bundle_resolution_failure(mock_sov, mock_grb, mock_s
 
 
 @pytest.mark.parametrize('binary_image', ('binary-image:latest', None))
+@mock.patch('iib.workers.tasks.build._is_index_image_unchanged', return_value=False)
 @mock.patch('iib.workers.tasks.build._cleanup')
 @mock.patch('iib.workers.tasks.build.prepare_request_for_build')
 @mock.patch('iib.workers.tasks.build._update_index_image_build_state')
@@ -1288,6 +2027,7 @@ def test_handle_rm_request(
     mock_oir,
     mock_prfb,
     mock_cleanup,
+    mock_iiiu,
     binary_image,
 ):
     arches = {'amd64', 's390x'}
@@ -1334,6 +2074,152 @@ def test_handle_rm_request(
     assert mock_srs.call_args[0][1] == 'complete'
 
 
+@pytest.mark.parametrize(
+    'present_packages, unchanged, expected_reuse',
+    (
+        (['other-operator'], True, True),
+        (['some-operator'], True, False),
+        (['other-operator'], False, False),
+    ),
+)
+@mock.patch('iib.workers.tasks.build._complete_request_with_index_image')
+@mock.patch('iib.workers.tasks.build._is_index_image_unchanged')
+@mock.patch('iib.workers.tasks.build.get_list_bundles')
+@mock.patch('iib.workers.tasks.build._cleanup')
+@mock.patch('iib.workers.tasks.build.prepare_request_for_build')
+@mock.patch('iib.workers.tasks.build._update_index_image_build_state')
+@mock.patch('iib.workers.tasks.build.opm_index_rm')
+@mock.patch('iib.workers.tasks.build._build_and_push_images')
+@mock.patch('iib.workers.tasks.build.set_request_state')
+@mock.patch('iib.workers.tasks.build._create_and_push_manifest_list')
+@mock.patch('iib.workers.tasks.build._update_index_image_pull_spec')
+@mock.patch('iib.workers.tasks.build._add_label_to_index')
+@mock.patch('iib.workers.tasks.build.is_image_fbc', return_value=False)
+@mock.patch('iib.workers.tasks.opm_operations.Opm.set_opm_version')
+def test_handle_rm_request_unchanged(
+    mock_sov,
+    mock_iifbc,
+    mock_alti,
+    mock_uiips,
+    mock_capml,
+    mock_srs,
+    mock_bapi,
+    mock_oir,
+    mock_uiibs,
+    mock_prfb,
+    mock_cleanup,
+    mock_glb,
+    mock_iiiu,
+    mock_cur,
+    present_packages,
+    unchanged,
+    expected_reuse,
+):
+    prebuild_info = {
+        'arches': {'amd64'},
+        'binary_image': 'binary-image:latest',
+        'binary_image_resolved': 'binary-image@sha256:abcdef',
+        'from_index_resolved': 'from-index@sha256:bcdefg',
+        'ocp_version': 'v4.6',
+        'distribution_scope': 'prod',
+    }
+    mock_prfb.return_value = prebuild_info
+    mock_glb.return_value = [{'packageName': package} for package in present_packages]
+    mock_iiiu.return_value = unchanged
+
+    build.handle_rm_request(['some-operator'], 3, 'from-index:latest', 'binary-image:latest')
+
+    mock_iiiu.assert_called_once_with('from-index@sha256:bcdefg', prebuild_info, None)
+    if expected_reuse:
+        mock_cur.assert_called_once_with(
+            request_id=3,
+            index_image='from-index@sha256:bcdefg',
+            state_reason=build._UNCHANGED_INDEX_IMAGE_REASON,
+            prebuild_info=prebuild_info,
+            from_index='from-index:latest',
+            overwrite_from_index=False,
+            overwrite_from_index_token=None,
+            build_tags=None,
+            is_image_fbc=False,
+            index_repo_map=None,
+            rm_operators=['some-operator'],
+        )
+        mock_oir.assert_not_called()
+        mock_bapi.assert_not_called()
+    else:
+        mock_cur.assert_not_called()
+        mock_oir.assert_called_once()
+        mock_bapi.assert_called_once()
+    # The index image is only rendered when its metadata is unchanged
+    assert mock_glb.call_count == int(unchanged)
+
+
+@mock.patch('iib.workers.tasks.build._memoize_build')
+@mock.patch('iib.workers.tasks.build._complete_request_with_index_image')
+@mock.patch('iib.workers.tasks.build._get_memoized_build')
+@mock.patch('iib.workers.tasks.build.get_worker_config')
+@mock.patch('iib.workers.tasks.build._cleanup')
+@mock.patch('iib.workers.tasks.build.prepare_request_for_build')
+@mock.patch('iib.workers.tasks.build._update_index_image_build_state')
+@mock.patch('iib.workers.tasks.build.opm_index_rm')
+@mock.patch('iib.workers.tasks.build._build_and_push_images')
+@mock.patch('iib.workers.tasks.build.set_request_state')
+@mock.patch('iib.workers.tasks.build.is_image_fbc', return_value=True)
+@mock.patch('iib.workers.tasks.opm_operations.Opm.set_opm_version')
+def test_handle_rm_request_memoized(
+    mock_sov,
+    mock_iifbc,
+    mock_srs,
+    mock_bapi,
+    mock_oir,
+    mock_uiibs,
+    mock_prfb,
+    mock_cleanup,
+    mock_gwc,
+    mock_gmb,
+    mock_crwii,
+    mock_mb,
+):
+    mock_gwc.return_value = mock.Mock(iib_build_memo_dir='/var/cache/iib-build-memo')
+    prebuild_info = {
+        'arches': {'amd64'},
+        'binary_image': 'binary-image:latest',
+        'binary_image_resolved': 'binary-image@sha256:abcdef',
+        'build_fingerprint': 'abc',
+        'from_index_resolved': 'from-index@sha256:bcdefg',
+        'ocp_version': 'v4.6',
+        'distribution_scope': 'prod',
+    }
+    mock_prfb.return_value = prebuild_info
+    mock_gmb.return_value = MemoizedBuild('quay.io/iib/iib-build@sha256:123', ['some-operator'])
+
+    build.handle_rm_request(
+        ['some-operator'], 3, 'from-index:latest', 'binary-image:latest', build_tags=['extra']
+    )
+
+    assert mock_prfb.call_args[0][1].build_inputs == {
+        'request_type': 'rm',
+        'operators': ['some-operator'],
+    }
+    mock_gmb.assert_called_once_with(prebuild_info)
+    mock_crwii.assert_called_once_with(
+        request_id=3,
+        index_image='quay.io/iib/iib-build@sha256:123',
+        state_reason=build._MEMOIZED_INDEX_IMAGE_REASON,
+        prebuild_info=prebuild_info,
+        from_index='from-index:latest',
+        overwrite_from_index=False,
+        overwrite_from_index_token=None,
+        build_tags=['extra'],
+        is_image_fbc=True,
+        index_repo_map=None,
+        rm_operators=['some-operator'],
+    )
+    mock_oir.assert_not_called()
+    mock_bapi.assert_not_called()
+    mock_mb.assert_not_called()
+
+
 @mock.patch('iib.workers.tasks.build.opm_validate')
 @mock.patch('iib.workers.tasks.build.verify_operators_exists')
 @mock.patch('iib.workers.tasks.build._cleanup')
@@ -1511,9 +2397,11 @@ def test_verify_index_image_failure(mock_gri, mock_srt):
 
 
 @pytest.mark.parametrize('fail_rm', (True, False))
+@mock.patch('iib.workers.tasks.build.add_to_cache')
+@mock.patch('iib.workers.tasks.build.copy_from_cache', return_value=False)
 @mock.patch('iib.workers.tasks.build.run_cmd')
 @mock.patch('iib.workers.tasks.build.podman_pull')
-def test_copy_files_from_image(mock_podman_pull, mock_run_cmd, fail_rm):
+def test_copy_files_from_image(mock_podman_pull, mock_run_cmd, mock_cfc, mock_atc, fail_rm):
     image = 'bundle-image:latest'
     src_path = '/manifests'
     dest_path = '/destination/path/manifests'
@@ -1539,6 +2427,23 @@ def test_copy_files_from_image(mock_podman_pull, mock_run_cmd, fail_rm):
             mock.call(['podman', 'rm', container_id], exc_msg=mock.ANY),
         ]
     )
+    mock_cfc.assert_called_once_with(image, src_path, dest_path)
+    mock_atc.assert_called_once_with(image, src_path, dest_path)
+
+
+@mock.patch('iib.workers.tasks.build.add_to_cache')
+@mock.patch('iib.workers.tasks.build.copy_from_cache', return_value=True)
+@mock.patch('iib.workers.tasks.build.run_cmd')
+@mock.patch('iib.workers.tasks.build.podman_pull')
+def test_copy_files_from_image_cached(mock_podman_pull, mock_run_cmd, mock_cfc, mock_atc):
+    image = 'index-image@sha256:123'
+
+    build._copy_files_from_image(image, '/configs', '/destination/path')
+
+    mock_cfc.assert_called_once_with(image, '/configs', '/destination/path')
+    mock_podman_pull.assert_not_called()
+    mock_run_cmd.assert_not_called()
+    mock_atc.assert_not_called()
 
 
 def test_add_label_to_index(tmpdir):
@@ -1619,10 +2524,10 @@ def test_get_missing_bundles_match_hash():
 
 
 @mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
-@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
 def test_get_present_bundles(mock_run_cmd, mock_gidp, tmpdir):
     mock_gidp.return_value = '/tmp'
-    mock_run_cmd.return_value = '\n'.join(
+    mock_run_cmd.return_value = iter(
         json.dumps(a)
         for a in [
             {
@@ -1671,13 +2576,13 @@ def test_get_present_bundles(mock_run_cmd, mock_gidp, tmpdir):
 
 
 @mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
-@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
 def test_get_no_present_bundles(
     mock_run_cmd,
     mock_gidp,
     tmpdir,
 ):
-    mock_run_cmd.return_value = ''
+    mock_run_cmd.return_value = iter([])
     mock_gidp.return_value = '/tmp'
 
     bundle, bundle_pull_spec = build._get_present_bundles('quay.io/index-image:4.5', str(tmpdir))
@@ -1731,6 +2636,23 @@ def test_inspect_related_images(mock_gil, mock_cffi, mock_fd, mock_gbd, mock_si,
     ]
 
 
+@mock.patch('iib.workers.tasks.build.skopeo_inspect')
+@mock.patch('iib.workers.tasks.build.get_bundle_metadata')
+@mock.patch('iib.workers.tasks.build.OperatorManifest.from_directory')
+@mock.patch('iib.workers.tasks.build._copy_files_from_image')
+@mock.patch('iib.workers.tasks.build.get_image_label')
+def test_inspect_related_images_registry_unavailable(
+    mock_gil, mock_cffi, mock_fd, mock_gbd, mock_si, tmpdir
+):
+    mock_gil.return_value = '/manifests'
+    mock_gbd.return_value = {'found_pullspecs': {ImageName.parse('quay.io/related/image:v1')}}
+    mock_si.side_effect = RegistryUnavailableError('The registry quay.io is unavailable')
+
+    # The related images are not reported as inaccessible when the registry is unavailable
+    with pytest.raises(RegistryUnavailableError, match='The registry quay.io is unavailable'):
+        build.inspect_related_images(bundles=['quay.io/repo/image@sha256:123'], request_id=5)
+
+
 @mock.patch('iib.workers.tasks.build.skopeo_inspect')
 @mock.patch('iib.workers.tasks.build.get_bundle_metadata')
 @mock.patch('iib.workers.tasks.build.OperatorManifest.from_directory')
@@ -6,14 +6,15 @@ import pytest
 
 
 from iib.workers.tasks import build_add_deprecations
+from iib.workers.tasks.fbc_utils import get_catalog_package_digests
 from iib.workers.tasks.utils import RequestConfigAddDeprecations, IIBError
 from iib.workers.config import get_worker_config
 
 
 @mock.patch('iib.workers.tasks.build_add_deprecations._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build_add_deprecations._create_and_push_manifest_list')
-@mock.patch('iib.workers.tasks.build_add_deprecations._push_image')
-@mock.patch('iib.workers.tasks.build_add_deprecations._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_add_deprecations._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_add_deprecations.add_deprecations_to_index')
 @mock.patch('iib.workers.tasks.opm_operations.verify_operators_exists')
@@ -105,8 +106,8 @@ def test_handle_add_deprecations_request(
     assert mock_srs.call_args[0][1] == 'complete'
 
 
-@mock.patch('iib.workers.tasks.build_add_deprecations._push_image')
-@mock.patch('iib.workers.tasks.build_add_deprecations._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_add_deprecations.add_deprecations_to_index')
 @mock.patch('iib.workers.tasks.opm_operations.verify_operators_exists')
 @mock.patch('iib.workers.tasks.build_add_deprecations.verify_operators_exists')
@@ -203,6 +204,7 @@ def test_add_deprecations_to_index_dep_dir_not_exist(
     configs_dir = os.path.join(tmpdir, 'configs')
     os.makedirs(configs_dir)
     mock_gcd.return_value = configs_dir
+    from_index_packages = get_catalog_package_digests(configs_dir)
     build_add_deprecations.add_deprecations_to_index(
         request_id,
         tmpdir,
@@ -217,6 +219,8 @@ def test_add_deprecations_to_index_dep_dir_not_exist(
         base_dir=tmpdir,
         fbc_dir=mock_gcd.return_value,
         local_cache_path=os.path.join(tmpdir, 'cache'),
+        from_index=from_index_resolved,
+        from_index_packages=from_index_packages,
     )
     mock_cd.assert_called_once()
     # assert deprecations_file and dir exist
@@ -255,6 +259,7 @@ def test_add_deprecations_to_index_dep_dir_exist(
     configs_dir = os.path.join(tmpdir, 'configs')
     os.makedirs(os.path.join(configs_dir, get_worker_config()['operator_deprecations_dir']))
     mock_gcd.return_value = configs_dir
+    from_index_packages = get_catalog_package_digests(configs_dir)
     build_add_deprecations.add_deprecations_to_index(
         request_id,
         tmpdir,
@@ -269,6 +274,8 @@ def test_add_deprecations_to_index_dep_dir_exist(
         base_dir=tmpdir,
         fbc_dir=mock_gcd.return_value,
         local_cache_path=os.path.join(tmpdir, 'cache'),
+        from_index=from_index_resolved,
+        from_index_packages=from_index_packages,
     )
     mock_cd.assert_called_once()
     # assert file has right content
@@ -313,6 +320,7 @@ def test_add_deprecations_to_index_file_exist(
     with open(operator_deprecation_file, 'w') as output_file:
         json.dump(json.loads(old_deprecation_schema), output_file)
     mock_gcd.return_value = configs_dir
+    from_index_packages = get_catalog_package_digests(configs_dir)
     build_add_deprecations.add_deprecations_to_index(
         request_id,
         tmpdir,
@@ -327,6 +335,8 @@ def test_add_deprecations_to_index_file_exist(
         base_dir=tmpdir,
         fbc_dir=mock_gcd.return_value,
         local_cache_path=os.path.join(tmpdir, 'cache'),
+        from_index=from_index_resolved,
+        from_index_packages=from_index_packages,
     )
     mock_cd.assert_called_once()
 
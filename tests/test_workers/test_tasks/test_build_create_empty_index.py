@@ -18,8 +18,8 @@ from tests.test_workers.test_tasks.test_opm_operations import ensure_opm_default
 @mock.patch('iib.workers.tasks.build_create_empty_index.get_operator_package_list')
 @mock.patch('iib.workers.tasks.build_create_empty_index.opm_index_rm')
 @mock.patch('iib.workers.tasks.build_create_empty_index._add_label_to_index')
-@mock.patch('iib.workers.tasks.build_create_empty_index._build_image')
-@mock.patch('iib.workers.tasks.build_create_empty_index._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
 @mock.patch('iib.workers.tasks.build_create_empty_index._create_and_push_manifest_list')
 @mock.patch('iib.workers.tasks.build_create_empty_index._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build_create_empty_index.is_image_fbc')
@@ -138,8 +138,8 @@ def test_handle_create_empty_index_request_raises(mock_fiv, mock_prfb, mock_iifb
 @mock.patch('iib.workers.tasks.build_create_empty_index.set_request_state')
 @mock.patch('iib.workers.tasks.build_create_empty_index.get_operator_package_list')
 @mock.patch('iib.workers.tasks.build_create_empty_index._add_label_to_index')
-@mock.patch('iib.workers.tasks.build_create_empty_index._build_image')
-@mock.patch('iib.workers.tasks.build_create_empty_index._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
 @mock.patch('iib.workers.tasks.build_create_empty_index._create_and_push_manifest_list')
 @mock.patch('iib.workers.tasks.build_create_empty_index._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build_create_empty_index.opm_create_empty_fbc')
@@ -232,8 +232,8 @@ def test_handle_create_empty_index_request_fbc(
 @mock.patch('iib.workers.tasks.build_create_empty_index.set_request_state')
 @mock.patch('iib.workers.tasks.build_create_empty_index.get_operator_package_list')
 @mock.patch('iib.workers.tasks.build_create_empty_index._add_label_to_index')
-@mock.patch('iib.workers.tasks.build_create_empty_index._build_image')
-@mock.patch('iib.workers.tasks.build_create_empty_index._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
 @mock.patch('iib.workers.tasks.build_create_empty_index._create_and_push_manifest_list')
 @mock.patch('iib.workers.tasks.build_create_empty_index._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build_create_empty_index.is_image_fbc')
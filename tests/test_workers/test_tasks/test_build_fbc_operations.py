@@ -5,9 +5,10 @@ from iib.workers.tasks.utils import RequestConfigFBCOperation
 
 
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_pull_spec')
+@mock.patch('iib.workers.tasks.build_fbc_operations._record_pushed_index_image')
 @mock.patch('iib.workers.tasks.build_fbc_operations._create_and_push_manifest_list')
-@mock.patch('iib.workers.tasks.build_fbc_operations._push_image')
-@mock.patch('iib.workers.tasks.build_fbc_operations._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_fbc_operations._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_fbc_operations.opm_registry_add_fbc_fragment')
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_build_state')
@@ -30,6 +31,7 @@ def test_handle_fbc_operation_request(
     mock_bi,
     mock_pi,
     mock_cpml,
+    mock_rpii,
     mock_uiips,
 ):
     request_id = 10
@@ -79,6 +81,7 @@ def test_handle_fbc_operation_request(
         None,  # overwrite_from_index_token
     )
     mock_cpml.assert_called_once_with(request_id, {'s390x', 'amd64'}, None)
+    mock_rpii.assert_called_once_with(mock_cpml.return_value)
     assert mock_srs.call_count == 3  # 3 original calls (no internal calls due to mocking)
     assert mock_alti.call_count == 2
     assert mock_bi.call_count == 2
@@ -88,8 +91,86 @@ def test_handle_fbc_operation_request(
 
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build_fbc_operations._create_and_push_manifest_list')
-@mock.patch('iib.workers.tasks.build_fbc_operations._push_image')
-@mock.patch('iib.workers.tasks.build_fbc_operations._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
+@mock.patch('iib.workers.tasks.build_fbc_operations._add_label_to_index')
+@mock.patch('iib.workers.tasks.build_fbc_operations.opm_registry_add_fbc_fragment')
+@mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_build_state')
+@mock.patch('iib.workers.tasks.build_fbc_operations.prepare_request_for_build')
+@mock.patch('iib.workers.tasks.build_fbc_operations.set_registry_token')
+@mock.patch('iib.workers.tasks.build_fbc_operations.get_resolved_image')
+@mock.patch('iib.workers.tasks.build_fbc_operations.set_request_state')
+@mock.patch('iib.workers.tasks.build_fbc_operations._cleanup')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.set_opm_version')
+def test_handle_fbc_operation_request_duplicate_fragments(
+    mock_sov,
+    mock_cleanup,
+    mock_srs,
+    mock_gri,
+    mock_srt,
+    mock_prfb,
+    mock_uiibs,
+    mock_oraff,
+    mock_alti,
+    mock_bi,
+    mock_pi,
+    mock_cpml,
+    mock_uiips,
+):
+    """Test that each fbc fragment is resolved once but kept once per requested fragment."""
+    request_id = 10
+    fbc_fragments = [
+        'quay.io/iib/fbc-fragment1:latest',
+        'quay.io/iib/fbc-fragment2:latest',
+        'quay.io/iib/fbc-fragment1:latest',
+    ]
+    mock_prfb.return_value = {
+        'arches': {'amd64'},
+        'binary_image': 'binary-image:latest',
+        'binary_image_resolved': 'binary-image@sha256:abcdef',
+        'from_index_resolved': 'from-index@sha256:bcdefg',
+        'ocp_version': 'v4.6',
+        'distribution_scope': "prod",
+    }
+    resolved_fbc_fragments = {
+        fbc_fragments[0]: 'quay.io/iib/fbc-fragment1@sha256:qwerty',
+        fbc_fragments[1]: 'quay.io/iib/fbc-fragment2@sha256:asdfgh',
+    }
+    mock_gri.side_effect = resolved_fbc_fragments.get
+
+    build_fbc_operations.handle_fbc_operation_request(
+        request_id=request_id,
+        fbc_fragments=fbc_fragments,
+        from_index='from-index:latest',
+        binary_image='binary-image:latest',
+        overwrite_from_index_token='user:password',
+    )
+
+    mock_srt.assert_called_once_with(
+        'user:password', [fbc_fragments[0], fbc_fragments[1]], append=True
+    )
+    assert mock_gri.call_count == 2
+    expected_resolved = [
+        'quay.io/iib/fbc-fragment1@sha256:qwerty',
+        'quay.io/iib/fbc-fragment2@sha256:asdfgh',
+        'quay.io/iib/fbc-fragment1@sha256:qwerty',
+    ]
+    mock_oraff.assert_called_once_with(
+        request_id,
+        mock.ANY,  # temp_dir
+        'from-index@sha256:bcdefg',
+        'binary-image@sha256:abcdef',
+        expected_resolved,
+        'user:password',
+    )
+    assert mock_uiibs.call_args[0][1]['fbc_fragments_resolved'] == expected_resolved
+    assert '3 FBC fragment(s) were successfully added' in mock_srs.call_args_list[-1][0][2]
+
+
+@mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_pull_spec')
+@mock.patch('iib.workers.tasks.build_fbc_operations._create_and_push_manifest_list')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_fbc_operations._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_fbc_operations.opm_registry_add_fbc_fragment')
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_build_state')
@@ -130,7 +211,11 @@ def test_handle_fbc_operation_request_multiple_fragments(
         'ocp_version': 'v4.6',
         'distribution_scope': "prod",
     }
-    mock_gri.side_effect = ['fbc-fragment1@sha256:qwerty', 'fbc-fragment2@sha256:asdfgh']
+    resolved_fbc_fragments = {
+        fbc_fragments[0]: 'fbc-fragment1@sha256:qwerty',
+        fbc_fragments[1]: 'fbc-fragment2@sha256:asdfgh',
+    }
+    mock_gri.side_effect = resolved_fbc_fragments.get
 
     build_fbc_operations.handle_fbc_operation_request(
         request_id=request_id,
@@ -168,8 +253,8 @@ def test_handle_fbc_operation_request_multiple_fragments(
 
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build_fbc_operations._create_and_push_manifest_list')
-@mock.patch('iib.workers.tasks.build_fbc_operations._push_image')
-@mock.patch('iib.workers.tasks.build_fbc_operations._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_fbc_operations._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_fbc_operations.opm_registry_add_fbc_fragment')
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_build_state')
@@ -244,8 +329,8 @@ def test_handle_fbc_operation_request_empty_fragments(
 
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build_fbc_operations._create_and_push_manifest_list')
-@mock.patch('iib.workers.tasks.build_fbc_operations._push_image')
-@mock.patch('iib.workers.tasks.build_fbc_operations._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_fbc_operations._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_fbc_operations.opm_registry_add_fbc_fragment')
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_build_state')
@@ -291,7 +376,11 @@ def test_handle_fbc_operation_request_with_overwrite_token(
         'ocp_version': 'v4.6',
         'distribution_scope': "prod",
     }
-    mock_gri.side_effect = ['fbc-fragment1@sha256:qwerty', 'fbc-fragment2@sha256:asdfgh']
+    resolved_fbc_fragments = {
+        fbc_fragments[0]: 'fbc-fragment1@sha256:qwerty',
+        fbc_fragments[1]: 'fbc-fragment2@sha256:asdfgh',
+    }
+    mock_gri.side_effect = resolved_fbc_fragments.get
 
     build_fbc_operations.handle_fbc_operation_request(
         request_id=request_id,
@@ -332,8 +421,8 @@ def test_handle_fbc_operation_request_with_overwrite_token(
 
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build_fbc_operations._create_and_push_manifest_list')
-@mock.patch('iib.workers.tasks.build_fbc_operations._push_image')
-@mock.patch('iib.workers.tasks.build_fbc_operations._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_fbc_operations._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_fbc_operations.opm_registry_add_fbc_fragment')
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_build_state')
@@ -394,8 +483,8 @@ def test_handle_fbc_operation_request_with_build_tags(
 
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build_fbc_operations._create_and_push_manifest_list')
-@mock.patch('iib.workers.tasks.build_fbc_operations._push_image')
-@mock.patch('iib.workers.tasks.build_fbc_operations._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_fbc_operations._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_fbc_operations.opm_registry_add_fbc_fragment')
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_build_state')
@@ -466,8 +555,8 @@ def test_handle_fbc_operation_request_with_add_arches(
 
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build_fbc_operations._create_and_push_manifest_list')
-@mock.patch('iib.workers.tasks.build_fbc_operations._push_image')
-@mock.patch('iib.workers.tasks.build_fbc_operations._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_fbc_operations._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_fbc_operations.opm_registry_add_fbc_fragment')
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_build_state')
@@ -538,8 +627,8 @@ def test_handle_fbc_operation_request_with_distribution_scope(
 
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build_fbc_operations._create_and_push_manifest_list')
-@mock.patch('iib.workers.tasks.build_fbc_operations._push_image')
-@mock.patch('iib.workers.tasks.build_fbc_operations._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_fbc_operations._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_fbc_operations.opm_registry_add_fbc_fragment')
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_build_state')
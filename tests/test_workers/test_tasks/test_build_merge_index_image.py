@@ -8,6 +8,7 @@ from unittest import mock
 import pytest
 
 from iib.exceptions import IIBError
+from iib.workers.checkpoints import Checkpoint, PHASE_CONTEXT_PREPARED, PHASE_MANIFEST_LIST_PUSHED
 from iib.workers.tasks import build_merge_index_image
 from iib.workers.tasks.utils import RequestConfigMerge
 
@@ -23,14 +24,14 @@ from iib.workers.tasks.utils import RequestConfigMerge
 @mock.patch('iib.workers.tasks.build_merge_index_image.get_bundles_latest_version')
 @mock.patch('iib.workers.tasks.build_merge_index_image.has_hidden_database')
 @mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
-@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
 @mock.patch('iib.workers.tasks.build_merge_index_image._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build._verify_index_image')
 @mock.patch('iib.workers.tasks.build_merge_index_image.create_dockerfile')
 @mock.patch('iib.workers.tasks.build.get_index_database')
 @mock.patch('iib.workers.tasks.build_merge_index_image.opm_migrate')
-@mock.patch('iib.workers.tasks.build_merge_index_image._push_image')
-@mock.patch('iib.workers.tasks.build_merge_index_image._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_merge_index_image.deprecate_bundles_fbc')
 @mock.patch('iib.workers.tasks.build_merge_index_image.verify_operators_exists')
 @mock.patch('iib.workers.tasks.build_merge_index_image.deprecate_bundles')
@@ -129,15 +130,19 @@ def test_handle_merge_request(
     mock_verify_operator_exits.return_value = (mock_dep_b, "")
 
     mock_gidp.return_value = '/tmp'
-    mock_run_cmd.return_value = json.dumps(
-        {
-            "schema": "olm.bundle",
-            "image": "bundle1",
-            "name": "name1",
-            "package": "package1",
-            "version": "v1.0",
-            "properties": [{"type": "olm.package", "value": {"version": "0.1.0"}}],
-        }
+    mock_run_cmd.return_value = iter(
+        [
+            json.dumps(
+                {
+                    "schema": "olm.bundle",
+                    "image": "bundle1",
+                    "name": "name1",
+                    "package": "package1",
+                    "version": "v1.0",
+                    "properties": [{"type": "olm.package", "value": {"version": "0.1.0"}}],
+                }
+            )
+        ]
     )
 
     build_merge_index_image.handle_merge_request(
@@ -194,14 +199,14 @@ def test_handle_merge_request(
 @mock.patch('iib.workers.tasks.build_merge_index_image.get_index_database')
 @mock.patch('iib.workers.tasks.build_merge_index_image.has_hidden_database')
 @mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
-@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
 @mock.patch('iib.workers.tasks.build_merge_index_image._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build._verify_index_image')
 @mock.patch('iib.workers.tasks.build_merge_index_image.create_dockerfile')
 @mock.patch('iib.workers.tasks.build.get_index_database')
 @mock.patch('iib.workers.tasks.build_merge_index_image.opm_migrate')
-@mock.patch('iib.workers.tasks.build_merge_index_image._push_image')
-@mock.patch('iib.workers.tasks.build_merge_index_image._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_merge_index_image.deprecate_bundles_fbc')
 @mock.patch('iib.workers.tasks.build_merge_index_image.verify_operators_exists')
 @mock.patch('iib.workers.tasks.build_merge_index_image.deprecate_bundles')
@@ -302,15 +307,19 @@ def test_handle_merge_request_filter_out_pure_fbc(
     mock_verify_operator_exits.return_value = (mock_dep_b, "")
 
     mock_gidp.return_value = '/tmp'
-    mock_run_cmd.return_value = json.dumps(
-        {
-            "schema": "olm.bundle",
-            "image": "bundle1",
-            "name": "name1",
-            "package": "package1",
-            "version": "v1.0",
-            "properties": [{"type": "olm.package", "value": {"version": "0.1.0"}}],
-        }
+    mock_run_cmd.return_value = iter(
+        [
+            json.dumps(
+                {
+                    "schema": "olm.bundle",
+                    "image": "bundle1",
+                    "name": "name1",
+                    "package": "package1",
+                    "version": "v1.0",
+                    "properties": [{"type": "olm.package", "value": {"version": "0.1.0"}}],
+                }
+            )
+        ]
     )
 
     build_merge_index_image.handle_merge_request(
@@ -386,15 +395,15 @@ def test_handle_merge_request_filter_out_pure_fbc(
 @mock.patch('iib.workers.tasks.build_merge_index_image.get_bundles_latest_version')
 @mock.patch('iib.workers.tasks.build_merge_index_image.has_hidden_database')
 @mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
-@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
 @mock.patch('iib.workers.tasks.build_merge_index_image._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build._verify_index_image')
 @mock.patch('iib.workers.tasks.build_merge_index_image.create_dockerfile')
 @mock.patch('iib.workers.tasks.build.get_index_database')
 @mock.patch('iib.workers.tasks.build_merge_index_image.opm_migrate')
 @mock.patch('iib.workers.tasks.build_merge_index_image._create_and_push_manifest_list')
-@mock.patch('iib.workers.tasks.build_merge_index_image._push_image')
-@mock.patch('iib.workers.tasks.build_merge_index_image._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_merge_index_image.deprecate_bundles_fbc')
 @mock.patch('iib.workers.tasks.build_merge_index_image.verify_operators_exists')
 @mock.patch('iib.workers.tasks.build_merge_index_image.deprecate_bundles')
@@ -473,15 +482,19 @@ def test_handle_merge_request_no_deprecate(
     mock_abmis.return_value = ([], invalid_bundles)
     mock_gid.return_value = 'database/index.db'
     mock_om.return_value = 'catalog', 'cache'
-    mock_run_cmd.return_value = json.dumps(
-        {
-            "schema": "olm.bundle",
-            "image": "bundle1",
-            "name": "name1",
-            "package": "package1",
-            "version": "v1.0",
-            "properties": [{"type": "olm.package", "value": {"version": "0.1.0"}}],
-        }
+    mock_run_cmd.return_value = iter(
+        [
+            json.dumps(
+                {
+                    "schema": "olm.bundle",
+                    "image": "bundle1",
+                    "name": "name1",
+                    "package": "package1",
+                    "version": "v1.0",
+                    "properties": [{"type": "olm.package", "value": {"version": "0.1.0"}}],
+                }
+            )
+        ]
     )
     mock_verify_operators_exists.return_value = (filtered_invalid_version_bundles_names, "db_path")
     build_merge_index_image.handle_merge_request(
@@ -553,12 +566,64 @@ def test_handle_merge_request_no_deprecate(
     mock_run_cmd.assert_not_called()
 
 
+@mock.patch('iib.workers.tasks.build_merge_index_image.remove_checkpoint')
+@mock.patch('iib.workers.tasks.build_merge_index_image.save_checkpoint')
+@mock.patch('iib.workers.tasks.build_merge_index_image._cleanup')
+@mock.patch('iib.workers.tasks.build_merge_index_image._update_index_image_pull_spec')
+@mock.patch('iib.workers.tasks.build_merge_index_image._create_and_push_manifest_list')
+@mock.patch('iib.workers.tasks.build_merge_index_image._build_and_push_images_from_checkpoint')
+@mock.patch('iib.workers.tasks.build_merge_index_image.set_request_state')
+def test_finish_merge_request_resumed(
+    mock_srs, mock_bapifc, mock_capml, mock_uiips, mock_cleanup, mock_sc, mock_rc
+):
+    checkpoint = Checkpoint(PHASE_CONTEXT_PREPARED, 'abc', {'dockerfile_name': 'index.Dockerfile'})
+    mock_capml.return_value = 'quay.io/iib/iib-build:1'
+    mock_bapifc.return_value = checkpoint._replace(phase='images_pushed')
+    mock_sc.return_value = Checkpoint(
+        PHASE_MANIFEST_LIST_PUSHED, 'abc', {'output_pull_spec': 'quay.io/iib/iib-build:1'}
+    )
+    prebuild_info = {'arches': {'amd64'}, 'target_index_resolved': 'target-index@sha256:123'}
+
+    build_merge_index_image._finish_merge_request(
+        request_id=1,
+        checkpoint=checkpoint,
+        prebuild_info=prebuild_info,
+        target_index='target-index:1.0',
+        overwrite_target_index=False,
+        overwrite_target_index_token=None,
+        build_tags=None,
+    )
+
+    mock_bapifc.assert_called_once_with(1, checkpoint, {'amd64'}, 'merge-index-image')
+    mock_capml.assert_called_once_with(1, {'amd64'}, None)
+    mock_sc.assert_called_once_with(
+        1,
+        'abc',
+        PHASE_MANIFEST_LIST_PUSHED,
+        {'dockerfile_name': 'index.Dockerfile', 'output_pull_spec': 'quay.io/iib/iib-build:1'},
+    )
+    mock_uiips.assert_called_once_with(
+        output_pull_spec='quay.io/iib/iib-build:1',
+        request_id=1,
+        arches={'amd64'},
+        from_index='target-index:1.0',
+        overwrite_from_index=False,
+        overwrite_from_index_token=None,
+        resolved_prebuild_from_index='target-index@sha256:123',
+    )
+    mock_cleanup.assert_called_once_with()
+    mock_rc.assert_called_once_with(1)
+    mock_srs.assert_called_once_with(
+        1, 'complete', 'The index image was successfully cleaned and updated.'
+    )
+
+
 @mock.patch('iib.workers.config.get_worker_config')
 @mock.patch('iib.workers.tasks.build_merge_index_image.is_image_fbc')
 @mock.patch('iib.workers.tasks.build_merge_index_image.get_image_label')
 @mock.patch('iib.workers.tasks.build_merge_index_image._create_and_push_manifest_list')
-@mock.patch('iib.workers.tasks.build_merge_index_image._push_image')
-@mock.patch('iib.workers.tasks.build_merge_index_image._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_merge_index_image._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_merge_index_image.opm_index_add')
 @mock.patch('iib.workers.tasks.build_merge_index_image.set_request_state')
@@ -710,8 +775,8 @@ def test_add_bundles_missing_in_source(
 @mock.patch('iib.workers.tasks.build_merge_index_image.get_worker_config')
 @mock.patch('iib.workers.tasks.build_merge_index_image.is_image_fbc')
 @mock.patch('iib.workers.tasks.build_merge_index_image.get_image_label')
-@mock.patch('iib.workers.tasks.build_merge_index_image._push_image')
-@mock.patch('iib.workers.tasks.build_merge_index_image._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_merge_index_image._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_merge_index_image.opm_index_add')
 @mock.patch('iib.workers.tasks.build_merge_index_image.set_request_state')
@@ -788,8 +853,8 @@ def test_add_bundles_missing_in_source_user_in_allow_list(
 @mock.patch('iib.workers.tasks.build_merge_index_image.get_worker_config')
 @mock.patch('iib.workers.tasks.build_merge_index_image.is_image_fbc')
 @mock.patch('iib.workers.tasks.build_merge_index_image.get_image_label')
-@mock.patch('iib.workers.tasks.build_merge_index_image._push_image')
-@mock.patch('iib.workers.tasks.build_merge_index_image._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_merge_index_image._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_merge_index_image.opm_index_add')
 @mock.patch('iib.workers.tasks.build_merge_index_image.set_request_state')
@@ -944,8 +1009,8 @@ def test_add_bundles_missing_in_source_user_not_in_allow_list(
     ),
 )
 @mock.patch('iib.workers.tasks.build_merge_index_image._create_and_push_manifest_list')
-@mock.patch('iib.workers.tasks.build_merge_index_image._push_image')
-@mock.patch('iib.workers.tasks.build_merge_index_image._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_merge_index_image._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_merge_index_image.opm_index_add')
 @mock.patch('iib.workers.tasks.build_merge_index_image.set_request_state')
@@ -978,8 +1043,8 @@ def test_add_bundles_missing_in_source_error_tag_specified(
 @mock.patch('iib.workers.tasks.build_merge_index_image.is_image_fbc')
 @mock.patch('iib.workers.tasks.build_merge_index_image.get_image_label')
 @mock.patch('iib.workers.tasks.build_merge_index_image._create_and_push_manifest_list')
-@mock.patch('iib.workers.tasks.build_merge_index_image._push_image')
-@mock.patch('iib.workers.tasks.build_merge_index_image._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
 @mock.patch('iib.workers.tasks.build_merge_index_image._add_label_to_index')
 @mock.patch('iib.workers.tasks.build_merge_index_image.opm_index_add')
 @mock.patch('iib.workers.tasks.build_merge_index_image.set_request_state')
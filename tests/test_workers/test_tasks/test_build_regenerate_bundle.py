@@ -37,8 +37,8 @@ yaml = build_regenerate_bundle.yaml
 @mock.patch('iib.workers.tasks.build_regenerate_bundle.get_image_arches')
 @mock.patch('iib.workers.tasks.build_regenerate_bundle._copy_files_from_image')
 @mock.patch('iib.workers.tasks.build_regenerate_bundle._adjust_operator_bundle')
-@mock.patch('iib.workers.tasks.build_regenerate_bundle._build_image')
-@mock.patch('iib.workers.tasks.build_regenerate_bundle._push_image')
+@mock.patch('iib.workers.tasks.build._build_image')
+@mock.patch('iib.workers.tasks.build._push_image')
 @mock.patch('iib.workers.tasks.build_regenerate_bundle.set_request_state')
 @mock.patch('iib.workers.tasks.build_regenerate_bundle._create_and_push_manifest_list')
 @mock.patch('iib.workers.tasks.build_regenerate_bundle.get_worker_config')
@@ -117,7 +117,7 @@ def test_handle_regenerate_bundle_request(
     assert mock_bi.call_count == len(arches)
     assert mock_pi.call_count == len(arches)
     for arch in arches:
-        mock_bi.assert_any_call(mock.ANY, 'Dockerfile', request_id, arch)
+        mock_bi.assert_any_call(mock.ANY, 'Dockerfile', request_id, arch, use_cache=False)
         mock_pi.assert_any_call(request_id, arch)
 
     assert mock_srs.call_count == 2
@@ -16,6 +16,7 @@ from iib.workers.tasks.fbc_utils import (
     merge_catalogs_dirs,
     enforce_json_config_dir,
     extract_fbc_fragment,
+    get_catalog_package_digests,
     _serialize_datetime,
 )
 
@@ -291,6 +292,28 @@ def test_extract_fbc_fragment_isolation(mock_cffi, mock_osldr, tmpdir):
     mock_cffi.assert_has_calls(expected_calls, any_order=True)
 
 
+def test_get_catalog_package_digests(tmpdir):
+    catalog = tmpdir.mkdir('catalog')
+    catalog.mkdir('package1').join('catalog.json').write('{"schema": "olm.package"}')
+    catalog.mkdir('package2').join('catalog.json').write('{"schema": "olm.package"}')
+    catalog.join('README').write('')
+
+    digests = get_catalog_package_digests(str(catalog))
+
+    assert sorted(digests) == ['README', 'package1', 'package2']
+    # The digests depend on the paths of the files, and not only on their content
+    assert digests['package1'] != digests['package2']
+    assert get_catalog_package_digests(str(catalog)) == digests
+
+    catalog.join('package1', 'catalog.json').write('{"schema": "olm.bundle"}')
+    catalog.join('package2', 'catalog.json').rename(catalog.join('package2', 'bundles.json'))
+    changed_digests = get_catalog_package_digests(str(catalog))
+
+    assert changed_digests['README'] == digests['README']
+    assert changed_digests['package1'] != digests['package1']
+    assert changed_digests['package2'] != digests['package2']
+
+
 def test__serialize_datetime():
     assert (
         _serialize_datetime(datetime.datetime.fromisoformat("2025-01-22")) == "2025-01-22T00:00:00"
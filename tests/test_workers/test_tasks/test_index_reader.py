@@ -0,0 +1,264 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import json
+import sqlite3
+
+import pytest
+
+from iib.exceptions import IIBError
+from iib.workers.tasks import index_reader
+from iib.workers.tasks.iib_static_types import BundleImage
+
+
+@pytest.fixture
+def index_db(tmpdir):
+    db_path = str(tmpdir.join('index.db'))
+    con = sqlite3.connect(db_path)
+    con.executescript(
+        '''
+        CREATE TABLE operatorbundle (
+            name TEXT PRIMARY KEY, csv TEXT, bundle TEXT, bundlepath TEXT, skips TEXT,
+            version TEXT, skiprange TEXT, replaces TEXT, substitutesfor TEXT
+        );
+        CREATE TABLE package (name TEXT PRIMARY KEY, default_channel TEXT, add_mode TEXT);
+        CREATE TABLE channel_entry (
+            entry_id INTEGER PRIMARY KEY, channel_name TEXT, package_name TEXT,
+            operatorbundle_name TEXT, replaces INTEGER, depth INTEGER
+        );
+        CREATE TABLE properties (
+            type TEXT, value TEXT, operatorbundle_name TEXT, operatorbundle_version TEXT,
+            operatorbundle_path TEXT
+        );
+        INSERT INTO package VALUES ('foo', 'stable', 'replaces'), ('bar', 'stable', 'replaces');
+        INSERT INTO operatorbundle (name, bundlepath, version) VALUES
+            ('foo.v1', 'quay.io/ns/foo-bundle:v1', '1.0.0'),
+            ('foo.v2', 'quay.io/ns/foo-bundle:v2', ''),
+            ('bar.v1', 'quay.io/ns/bar-bundle:v1', '1.0.0'),
+            ('orphan.v1', 'quay.io/ns/orphan-bundle:v1', '1.0.0');
+        INSERT INTO channel_entry (channel_name, package_name, operatorbundle_name) VALUES
+            ('stable', 'foo', 'foo.v1'),
+            ('beta', 'foo', 'foo.v1'),
+            ('stable', 'foo', 'foo.v2'),
+            ('stable', 'bar', 'bar.v1');
+        INSERT INTO properties VALUES
+            ('olm.package', '{"packageName": "foo", "version": "2.0.0"}', 'foo.v2', '',
+             'quay.io/ns/foo-bundle:v2');
+        '''
+    )
+    con.commit()
+    con.close()
+    return db_path
+
+
+@pytest.fixture
+def catalog_dir(tmpdir):
+    catalog = tmpdir.mkdir('catalog')
+    blobs = [
+        {'schema': 'olm.package', 'name': 'foo', 'defaultChannel': 'stable'},
+        {'schema': 'olm.channel', 'name': 'stable', 'package': 'foo', 'entries': []},
+        {
+            'schema': 'olm.bundle',
+            'name': 'foo.v1',
+            'package': 'foo',
+            'image': 'quay.io/ns/foo-bundle:v1',
+            'properties': [
+                {'type': 'olm.gvk', 'value': {}},
+                {'type': 'olm.package', 'value': {'packageName': 'foo', 'version': '1.0.0'}},
+            ],
+        },
+    ]
+    # The blobs are concatenated, like in the output of opm render
+    catalog.mkdir('foo').join('catalog.json').write(
+        '\n'.join(json.dumps(blob, indent=4) for blob in blobs)
+    )
+    catalog.mkdir('bar').join('catalog.json').write(
+        json.dumps({'schema': 'olm.package', 'name': 'bar', 'defaultChannel': 'stable'})
+    )
+    return catalog
+
+
+@pytest.mark.parametrize(
+    'content',
+    (
+        # The output of opm render
+        '{\n    "schema": "olm.package",\n    "name": "foo",\n    "nested": {\n        "a": 1\n'
+        '    }\n}\n{\n    "schema": "olm.package",\n    "name": "bar"\n}\n',
+        # The JSON blobs written by IIB
+        '{"schema": "olm.package", "name": "foo", "nested": {"a": 1}}'
+        '{"schema": "olm.package", "name": "bar"}',
+        '\n  {"schema": "olm.package", "name": "foo", "nested": {"a": 1}}\n'
+        '  {"schema": "olm.package", "name": "bar"}  \n\n',
+    ),
+)
+def test_iter_json_blobs(content):
+    blobs = index_reader.iter_json_blobs(content.splitlines(keepends=True))
+
+    assert list(blobs) == [
+        {'schema': 'olm.package', 'name': 'foo', 'nested': {'a': 1}},
+        {'schema': 'olm.package', 'name': 'bar'},
+    ]
+
+
+def test_iter_json_blobs_invalid():
+    blobs = index_reader.iter_json_blobs(['{"schema": "olm.package"}\n', '{"schema": \n'])
+
+    assert next(blobs) == {'schema': 'olm.package'}
+    with pytest.raises(json.JSONDecodeError):
+        next(blobs)
+
+
+def test_read_bundles_index_db(index_db):
+    assert index_reader.read_bundles(index_db) == [
+        BundleImage(
+            bundlePath='quay.io/ns/bar-bundle:v1',
+            csvName='bar.v1',
+            packageName='bar',
+            version='1.0.0',
+        ),
+        BundleImage(
+            bundlePath='quay.io/ns/foo-bundle:v1',
+            csvName='foo.v1',
+            packageName='foo',
+            version='1.0.0',
+        ),
+        BundleImage(
+            bundlePath='quay.io/ns/foo-bundle:v2',
+            csvName='foo.v2',
+            packageName='foo',
+            version='2.0.0',
+        ),
+    ]
+
+
+def test_read_bundles_filtered(index_db, catalog_dir):
+    bundle_paths = ['quay.io/ns/foo-bundle:v1', 'quay.io/ns/missing-bundle:v1']
+
+    assert index_reader.read_bundles(index_db, bundle_paths=bundle_paths) == [
+        BundleImage(
+            bundlePath='quay.io/ns/foo-bundle:v1',
+            csvName='foo.v1',
+            packageName='foo',
+            version='1.0.0',
+        ),
+    ]
+    assert index_reader.read_bundles(str(catalog_dir), bundle_paths=bundle_paths) == [
+        BundleImage(
+            bundlePath='quay.io/ns/foo-bundle:v1',
+            csvName='foo.v1',
+            packageName='foo',
+            version='1.0.0',
+        ),
+    ]
+    assert index_reader.read_bundles(index_db, bundle_paths=[]) == []
+
+
+def test_read_bundles_index_db_no_version(index_db):
+    con = sqlite3.connect(index_db)
+    con.execute('DELETE FROM properties')
+    con.commit()
+    con.close()
+
+    with pytest.raises(IIBError, match='No olm package version found for OLM bundle.'):
+        index_reader.read_bundles(index_db)
+
+
+def test_read_bundles_index_db_unexpected_schema(tmpdir):
+    db_path = str(tmpdir.join('index.db'))
+    con = sqlite3.connect(db_path)
+    con.execute('CREATE TABLE something (name TEXT)')
+    con.close()
+
+    assert index_reader.read_bundles(db_path) is None
+    assert index_reader.read_package_names(db_path) is None
+
+
+def test_read_bundles_catalog(catalog_dir):
+    assert index_reader.read_bundles(str(catalog_dir)) == [
+        BundleImage(
+            bundlePath='quay.io/ns/foo-bundle:v1',
+            csvName='foo.v1',
+            packageName='foo',
+            version='1.0.0',
+        ),
+    ]
+
+
+def test_read_bundles_catalog_invalid(catalog_dir):
+    catalog_dir.join('foo', 'catalog.json').write('{"schema": "olm.package", ')
+
+    with pytest.raises(IIBError, match='Failed to parse the catalog file .*/foo/catalog.json'):
+        index_reader.read_bundles(str(catalog_dir))
+
+
+@pytest.mark.parametrize('filename', ('catalog.yaml', '.indexignore'))
+def test_read_catalog_requiring_opm(filename, catalog_dir):
+    catalog_dir.join('bar', filename).write('')
+
+    assert index_reader.read_bundles(str(catalog_dir)) is None
+    assert index_reader.read_package_names(str(catalog_dir)) is None
+
+
+def test_read_unsupported_input(tmpdir):
+    tmpdir.join('bundle.tar').write('not a database')
+
+    assert index_reader.read_bundles(str(tmpdir.join('bundle.tar'))) is None
+    assert index_reader.read_package_names(str(tmpdir.join('missing'))) is None
+
+
+def test_read_package_names(index_db, catalog_dir):
+    assert index_reader.read_package_names(index_db) == ['bar', 'foo']
+    assert index_reader.read_package_names(str(catalog_dir)) == ['bar', 'foo']
+
+
+def test_read_blob_package_names(catalog_dir):
+    catalog_dir.mkdir('deprecations').join('catalog.json').write(
+        json.dumps({'schema': 'olm.deprecations', 'package': 'foo', 'entries': []})
+    )
+    catalog_dir.join('other.json').write(json.dumps({'schema': 'olm.template'}))
+
+    assert index_reader.read_blob_package_names(str(catalog_dir)) == {'foo', 'bar'}
+    assert index_reader.read_blob_package_names(str(catalog_dir.join('foo'))) == {'foo'}
+    assert index_reader.read_blob_package_names(str(catalog_dir.join('deprecations'))) == {'foo'}
+    assert index_reader.read_blob_package_names(str(catalog_dir.join('other.json'))) == set()
+
+
+@pytest.mark.parametrize('filename', ('catalog.yaml', '.indexignore'))
+def test_read_blob_package_names_requiring_opm(filename, catalog_dir):
+    catalog_dir.join('bar', filename).write('')
+    catalog_dir.join(filename).write('')
+
+    assert index_reader.read_blob_package_names(str(catalog_dir.join('bar'))) is None
+    assert index_reader.read_blob_package_names(str(catalog_dir.join(filename))) is None
+
+
+def test_get_package_fingerprints(opm_index_db):
+    fingerprints = index_reader.get_package_fingerprints(opm_index_db)
+
+    assert sorted(fingerprints) == ['bar', 'foo']
+    assert index_reader.get_package_fingerprints(opm_index_db) == fingerprints
+
+    # Renumbering the channel entries doesn't change the fingerprints
+    con = sqlite3.connect(opm_index_db)
+    con.executescript(
+        '''
+        UPDATE channel_entry SET entry_id = entry_id + 10, replaces = replaces + 10
+        WHERE package_name = 'foo';
+        UPDATE api_provider SET channel_entry_id = channel_entry_id + 10
+        WHERE channel_entry_id < 3;
+        '''
+    )
+    con.commit()
+    assert index_reader.get_package_fingerprints(opm_index_db) == fingerprints
+
+    con.execute("INSERT INTO related_image VALUES ('quay.io/ns/foo:v2', 'foo.v2')")
+    con.commit()
+    con.close()
+    changed_fingerprints = index_reader.get_package_fingerprints(opm_index_db)
+
+    assert changed_fingerprints['foo'] != fingerprints['foo']
+    assert changed_fingerprints['bar'] == fingerprints['bar']
+
+
+def test_get_package_fingerprints_unexpected_schema(index_db, tmpdir):
+    # The test database doesn't have all the tables of opm
+    assert index_reader.get_package_fingerprints(index_db) is None
+    assert index_reader.get_package_fingerprints(str(tmpdir.join('missing.db'))) is None
@@ -1,5 +1,7 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+import json
 import os.path
+import sqlite3
 import pytest
 import textwrap
 import socket
@@ -9,6 +11,8 @@ from unittest import mock
 from iib.exceptions import IIBError, AddressAlreadyInUse
 from iib.workers.config import get_worker_config
 from iib.workers.tasks import opm_operations
+from iib.workers.tasks.fbc_utils import get_catalog_package_digests
+from iib.workers.tasks.index_reader import get_package_fingerprints
 from iib.workers.tasks.iib_static_types import BundleImage
 from iib.workers.tasks.opm_operations import (
     Opm,
@@ -20,6 +24,7 @@ from iib.workers.tasks.opm_operations import (
     _get_olm_bundle_version,
     get_list_bundles,
     get_operator_package_list,
+    opm_render,
 )
 
 
@@ -319,7 +324,7 @@ def test_opm_migrate(
         exc_msg='Failed to migrate index.db to file-based catalog',
     )
 
-    mock_opmvalidate.assert_called_once_with(fbc_dir)
+    mock_opmvalidate.assert_called_once_with(fbc_dir, from_index=None)
     mock_gcl.assert_called_once_with(tmpdir, fbc_dir, mock.ANY)
 
 
@@ -491,7 +496,7 @@ def test_opm_registry_add_fbc(
     mock_om.return_value = (fbc_dir, cache_dir)
     mock_iifbc.return_value = is_fbc
 
-    opm_operations.opm_registry_add_fbc(
+    previous_fingerprints = opm_operations.opm_registry_add_fbc(
         base_dir=tmpdir,
         bundles=bundles,
         binary_image="some:image",
@@ -510,6 +515,7 @@ def test_opm_registry_add_fbc(
         graph_update_mode=graph_update_mode,
     )
 
+    assert previous_fingerprints is None
     mock_om.assert_called_once_with(index_db=index_db_file, base_dir=tmpdir)
     mock_ogd.assert_called_once_with(
         fbc_dir=fbc_dir,
@@ -520,6 +526,43 @@ def test_opm_registry_add_fbc(
     )
 
 
+@mock.patch('iib.workers.tasks.opm_operations.create_dockerfile')
+@mock.patch('iib.workers.tasks.opm_operations.opm_migrate')
+@mock.patch('iib.workers.tasks.opm_operations._opm_registry_add')
+@mock.patch('iib.workers.tasks.opm_operations.get_package_fingerprints')
+@mock.patch('iib.workers.tasks.opm_operations.get_hidden_index_database')
+@mock.patch('iib.workers.tasks.opm_operations.is_image_fbc', return_value=True)
+def test_opm_registry_add_fbc_without_migrate(
+    mock_iifbc, mock_ghid, mock_gpf, mock_ora, mock_om, mock_ogd, tmpdir
+):
+    index_db_file = os.path.join(tmpdir, 'database/index.db')
+    mock_ghid.return_value = index_db_file
+    # The fingerprints must be read before the bundles are added to the index.db
+    mock_gpf.side_effect = lambda index_db: (
+        {'package1': 'fingerprint1'} if not mock_ora.called else {}
+    )
+
+    previous_fingerprints = opm_operations.opm_registry_add_fbc(
+        base_dir=tmpdir,
+        bundles=['bundle:1.2'],
+        binary_image='some:image',
+        from_index='some_index@sha256:123',
+        migrate=False,
+    )
+
+    assert previous_fingerprints == {'package1': 'fingerprint1'}
+    mock_gpf.assert_called_once_with(index_db_file)
+    mock_ora.assert_called_once()
+    mock_om.assert_not_called()
+    mock_ogd.assert_called_once_with(
+        fbc_dir=os.path.join(tmpdir, 'catalog'),
+        base_dir=tmpdir,
+        index_db=index_db_file,
+        binary_image='some:image',
+        dockerfile_name='index.Dockerfile',
+    )
+
+
 @pytest.mark.parametrize('operators', (['abc-operator', 'xyz-operator'], []))
 @mock.patch('iib.workers.tasks.opm_operations.create_dockerfile')
 @mock.patch('iib.workers.tasks.opm_operations.opm_migrate')
@@ -547,7 +590,102 @@ def test_opm_registry_rm_fbc(
         index_db_path=index_db_file, operators=operators, base_dir=tmpdir
     )
 
-    mock_om.assert_called_once_with(index_db=index_db_file, base_dir=tmpdir, generate_cache=False)
+    mock_om.assert_called_once_with(
+        index_db=index_db_file, base_dir=tmpdir, generate_cache=False, from_index=from_index
+    )
+
+
+@mock.patch('iib.workers.tasks.opm_operations.opm_migrate')
+@mock.patch('iib.workers.tasks.opm_operations.opm_migrate_changed_packages')
+@mock.patch('iib.workers.tasks.opm_operations.get_package_fingerprints')
+@mock.patch('iib.workers.tasks.opm_operations._opm_registry_rm')
+def test_opm_registry_rm_fbc_changed_packages(mock_orr, mock_gpf, mock_omcp, mock_om, tmpdir):
+    index_db_file = os.path.join(tmpdir, 'database/index.db')
+    catalog_dir = os.path.join(tmpdir, 'from_index', 'configs')
+
+    fbc_dir, cache_dir = opm_operations.opm_registry_rm_fbc(
+        tmpdir, 'some_index:latest', ['abc-operator'], index_db_file, catalog_dir=catalog_dir
+    )
+
+    assert (fbc_dir, cache_dir) == (catalog_dir, None)
+    mock_gpf.assert_called_once_with(index_db_file)
+    mock_omcp.assert_called_once_with(
+        index_db=index_db_file,
+        previous_fingerprints=mock_gpf.return_value,
+        catalog_dir=catalog_dir,
+        base_dir=tmpdir,
+        from_index='some_index:latest',
+    )
+    mock_om.assert_not_called()
+
+
+def _migrate_index_db(cmd, params, exc_msg):
+    # Migrate each package of the database to a directory like opm does
+    index_db, fbc_dir = cmd[-2:]
+    con = sqlite3.connect(index_db)
+    for package, bundles in con.execute(
+        'SELECT package_name, group_concat(operatorbundle_name) FROM channel_entry '
+        'GROUP BY package_name'
+    ):
+        os.makedirs(os.path.join(fbc_dir, package))
+        with open(os.path.join(fbc_dir, package, 'catalog.json'), 'w') as f:
+            json.dump({'schema': 'olm.package', 'name': package, 'bundles': bundles}, f)
+    con.close()
+
+
+@mock.patch('iib.workers.tasks.opm_operations.opm_validate')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.get_opm_version_number', return_value='1.26.4')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_opm_migrate_changed_packages(mock_run_cmd, mock_govn, mock_ov, opm_index_db, tmpdir):
+    catalog_dir = tmpdir.mkdir('catalog')
+    catalog_dir.mkdir('foo').join('catalog.json').write('outdated')
+    catalog_dir.mkdir('bar').join('catalog.json').write('unchanged')
+    catalog_dir.mkdir('removed').join('catalog.json').write('removed')
+    catalog_dir.mkdir('opted-in').join('catalog.json').write('opted-in')
+    previous_fingerprints = get_package_fingerprints(opm_index_db)
+    previous_fingerprints['removed'] = 'removed-package-fingerprint'
+    con = sqlite3.connect(opm_index_db)
+    con.execute("INSERT INTO related_image VALUES ('quay.io/ns/foo:v2', 'foo.v2')")
+    con.commit()
+    con.close()
+    mock_run_cmd.side_effect = _migrate_index_db
+
+    assert opm_operations.opm_migrate_changed_packages(
+        opm_index_db, previous_fingerprints, str(catalog_dir), str(tmpdir)
+    )
+
+    # Only the changed package was migrated from a copy of the database
+    mock_run_cmd.assert_called_once()
+    assert mock_run_cmd.call_args[0][0][-2:] == [
+        os.path.join(tmpdir, 'changed-packages-index.db'),
+        os.path.join(tmpdir, 'changed-packages-catalog'),
+    ]
+    assert sorted(os.listdir(catalog_dir)) == ['bar', 'foo', 'opted-in']
+    assert json.loads(catalog_dir.join('foo', 'catalog.json').read()) == {
+        'schema': 'olm.package',
+        'name': 'foo',
+        'bundles': mock.ANY,
+    }
+    assert sorted(
+        json.loads(catalog_dir.join('foo', 'catalog.json').read())['bundles'].split(',')
+    ) == ['foo.v1', 'foo.v2']
+    assert catalog_dir.join('bar', 'catalog.json').read() == 'unchanged'
+    assert not os.path.exists(os.path.join(tmpdir, 'changed-packages-index.db'))
+    assert not os.path.exists(os.path.join(tmpdir, 'changed-packages-catalog'))
+    mock_ov.assert_called_once_with(str(catalog_dir), from_index=None)
+
+
+@mock.patch('iib.workers.tasks.opm_operations.opm_validate')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_opm_migrate_changed_packages_unknown_changes(mock_run_cmd, mock_ov, opm_index_db, tmpdir):
+    catalog_dir = tmpdir.mkdir('catalog')
+
+    assert not opm_operations.opm_migrate_changed_packages(
+        opm_index_db, None, str(catalog_dir), str(tmpdir)
+    )
+
+    mock_run_cmd.assert_not_called()
+    mock_ov.assert_not_called()
 
 
 @mock.patch('iib.workers.tasks.utils.run_cmd')
@@ -654,6 +792,7 @@ def test_opm_registry_deprecatetruncate(mock_run_cmd, bundles):
     )
 
 
+@pytest.mark.parametrize('migrate', (True, False))
 @pytest.mark.parametrize('bundles', (['bundle:1.2', 'bundle:1.3'], []))
 @pytest.mark.parametrize('from_index', (None, 'some_index:latest'))
 @mock.patch('iib.workers.tasks.opm_operations.create_dockerfile')
@@ -667,6 +806,7 @@ def test_deprecate_bundles_fbc(
     mock_cd,
     from_index,
     bundles,
+    migrate,
     tmpdir,
 ):
     index_db_file = os.path.join(tmpdir, 'database/index.db')
@@ -680,11 +820,17 @@ def test_deprecate_bundles_fbc(
         base_dir=tmpdir,
         binary_image="some:image",
         from_index=from_index,
+        migrate=migrate,
     )
     if bundles:
         mock_ord.assert_called_once_with(base_dir=tmpdir, index_db=index_db_file, bundles=bundles)
 
-    mock_om.assert_called_once_with(index_db_file, tmpdir)
+    if migrate:
+        mock_om.assert_called_once_with(index_db_file, tmpdir)
+    else:
+        # The changed packages are migrated by the caller
+        mock_om.assert_not_called()
+        fbc_dir = os.path.join(tmpdir, 'catalog')
     mock_cd.assert_called_once_with(
         fbc_dir=fbc_dir,
         base_dir=tmpdir,
@@ -745,8 +891,20 @@ def test_deprecate_bundles_fbc_too_many_bundles(
     assert mock_ord.call_count == expected_call_count
 
 
+@pytest.fixture
+def cache_catalog_dir(tmpdir):
+    fbc_dir = tmpdir.mkdir('catalogs')
+    fbc_dir.mkdir('package1').join('catalog.json').write('{"schema": "olm.package"}')
+    return str(fbc_dir)
+
+
+def _generate_opm_cache(cmd, params, exc_msg):
+    cache_dir = next(arg for arg in cmd if arg.startswith('--cache-dir=')).split('=', 1)[1]
+    os.makedirs(os.path.join(cache_dir, 'cache'))
+
+
 @mock.patch('iib.workers.tasks.utils.run_cmd')
-@mock.patch('iib.workers.tasks.opm_operations.os.path.isdir', return_value=True)
+@mock.patch('iib.workers.tasks.opm_operations.Opm.get_opm_version_number', return_value='1.26.4')
 @mock.patch(
     'iib.workers.tasks.opm_operations.get_opm_port_stacks',
     return_value=(
@@ -760,11 +918,12 @@ def test_generate_cache_locally(
     mock_pfl_u,
     mock_pfl_la,
     mock_gops,
-    mock_isdir,
+    mock_govn,
     mock_cmd,
+    cache_catalog_dir,
     tmpdir,
 ):
-    fbc_dir = os.path.join(tmpdir, 'catalogs')
+    fbc_dir = cache_catalog_dir
     local_cache_path = os.path.join(tmpdir, 'cache')
     cmd = [
         'opm',
@@ -775,6 +934,7 @@ def test_generate_cache_locally(
         '--termination-log',
         '/dev/null',
     ]
+    mock_cmd.side_effect = _generate_opm_cache
 
     opm_operations.generate_cache_locally(tmpdir, fbc_dir, local_cache_path)
 
@@ -785,9 +945,15 @@ def test_generate_cache_locally(
         {'cwd': tmpdir},
         exc_msg='Failed to generate cache for file-based catalog',
     )
+    with open(os.path.join(local_cache_path, opm_operations.CACHE_MANIFEST_FILE), 'r') as f:
+        assert json.load(f) == {
+            'opm_version': '1.26.4',
+            'packages': get_catalog_package_digests(fbc_dir),
+        }
 
 
 @mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.get_opm_version_number', return_value='1.26.4')
 @mock.patch(
     'iib.workers.tasks.opm_operations.get_opm_port_stacks',
     return_value=([None], []),
@@ -798,10 +964,12 @@ def test_generate_cache_locally_failed(
     mock_pfl_u,
     mock_pfl_la,
     mock_gops,
+    mock_govn,
     mock_cmd,
+    cache_catalog_dir,
     tmpdir,
 ):
-    fbc_dir = os.path.join(tmpdir, 'catalogs')
+    fbc_dir = cache_catalog_dir
     local_cache_path = os.path.join(tmpdir, 'cache')
     cmd = [
         'opm',
@@ -815,15 +983,289 @@ def test_generate_cache_locally_failed(
 
     with pytest.raises(IIBError, match='Cannot find generated cache at .+'):
         opm_operations.generate_cache_locally(tmpdir, fbc_dir, local_cache_path)
-        mock_cmd.assert_called_once_with(
-            cmd, {'cwd': tmpdir}, exc_msg='Failed to generate cache for file-based catalog'
+    mock_cmd.assert_called_once_with(
+        cmd, {'cwd': tmpdir}, exc_msg='Failed to generate cache for file-based catalog'
+    )
+
+
+def _mock_from_index_cache(manifest):
+    def _copy_files_from_image(image, src_path, dest_path):
+        os.makedirs(os.path.join(dest_path, 'cache'))
+        if manifest is not None:
+            with open(os.path.join(dest_path, opm_operations.CACHE_MANIFEST_FILE), 'w') as f:
+                json.dump(manifest, f)
+
+    return _copy_files_from_image
+
+
+@mock.patch('iib.workers.tasks.build._copy_files_from_image')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.get_opm_version_number', return_value='1.26.4')
+@mock.patch('iib.workers.tasks.opm_operations.get_opm_port_stacks', return_value=([None], []))
+def test_generate_cache_locally_reuse_from_index(
+    mock_gops, mock_govn, mock_cmd, mock_cffi, cache_catalog_dir, tmpdir
+):
+    local_cache_path = os.path.join(tmpdir, 'cache')
+    packages = get_catalog_package_digests(cache_catalog_dir)
+    mock_cffi.side_effect = _mock_from_index_cache({'opm_version': '1.26.4', 'packages': packages})
+
+    opm_operations.generate_cache_locally(
+        tmpdir,
+        cache_catalog_dir,
+        local_cache_path,
+        from_index='from-index@sha256:123',
+        from_index_packages=packages,
+    )
+
+    mock_cmd.assert_not_called()
+    mock_cffi.assert_called_once_with('from-index@sha256:123', '/tmp/cache', local_cache_path)
+    assert os.path.isdir(os.path.join(local_cache_path, 'cache'))
+
+
+@pytest.mark.parametrize(
+    'from_index_packages',
+    (
+        None,
+        {'package1': 'outdated-digest'},
+        {'package2': 'removed-package-digest'},
+    ),
+)
+@mock.patch('iib.workers.tasks.build._copy_files_from_image')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.get_opm_version_number', return_value='1.26.4')
+@mock.patch('iib.workers.tasks.opm_operations.get_opm_port_stacks', return_value=([None], []))
+def test_generate_cache_locally_catalog_changed(
+    mock_gops, mock_govn, mock_cmd, mock_cffi, from_index_packages, cache_catalog_dir, tmpdir
+):
+    local_cache_path = os.path.join(tmpdir, 'cache')
+    if from_index_packages and 'package2' in from_index_packages:
+        from_index_packages.update(get_catalog_package_digests(cache_catalog_dir))
+    mock_cmd.side_effect = _generate_opm_cache
+
+    opm_operations.generate_cache_locally(
+        tmpdir,
+        cache_catalog_dir,
+        local_cache_path,
+        from_index='from-index@sha256:123',
+        from_index_packages=from_index_packages,
+    )
+
+    # The whole cache is regenerated without reading the index image
+    mock_cmd.assert_called_once()
+    mock_cffi.assert_not_called()
+    with open(os.path.join(local_cache_path, opm_operations.CACHE_MANIFEST_FILE), 'r') as f:
+        assert json.load(f)['packages'] == get_catalog_package_digests(cache_catalog_dir)
+
+
+@pytest.mark.parametrize(
+    'manifest',
+    (
+        None,
+        {'opm_version': '1.26.3', 'packages': 'catalog'},
+        {'opm_version': '1.26.4', 'packages': {'package1': 'other-digest'}},
+    ),
+)
+@mock.patch('iib.workers.tasks.build._copy_files_from_image')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.get_opm_version_number', return_value='1.26.4')
+@mock.patch('iib.workers.tasks.opm_operations.get_opm_port_stacks', return_value=([None], []))
+def test_generate_cache_locally_from_index_cache_not_reusable(
+    mock_gops, mock_govn, mock_cmd, mock_cffi, manifest, cache_catalog_dir, tmpdir
+):
+    local_cache_path = os.path.join(tmpdir, 'cache')
+    packages = get_catalog_package_digests(cache_catalog_dir)
+    if manifest and manifest['packages'] == 'catalog':
+        manifest['packages'] = packages
+    mock_cffi.side_effect = _mock_from_index_cache(manifest)
+    mock_cmd.side_effect = _generate_opm_cache
+
+    opm_operations.generate_cache_locally(
+        tmpdir,
+        cache_catalog_dir,
+        local_cache_path,
+        from_index='from-index@sha256:123',
+        from_index_packages=packages,
+    )
+
+    # The copied cache is discarded since it wasn't generated from the catalog by the same opm
+    mock_cffi.assert_called_once_with('from-index@sha256:123', '/tmp/cache', local_cache_path)
+    mock_cmd.assert_called_once()
+    with open(os.path.join(local_cache_path, opm_operations.CACHE_MANIFEST_FILE), 'r') as f:
+        assert json.load(f)['opm_version'] == '1.26.4'
+
+
+@pytest.fixture
+def validate_catalog_dir(tmpdir):
+    catalog = tmpdir.mkdir('validate-catalog')
+    for package in ('foo', 'bar', 'baz'):
+        catalog.mkdir(package).join('catalog.json').write(
+            json.dumps({'schema': 'olm.package', 'name': package})
         )
+    catalog.mkdir('deprecations').mkdir('baz').join('baz.json').write(
+        json.dumps({'schema': 'olm.deprecations', 'package': 'baz', 'entries': []})
+    )
+    return catalog
+
+
+def _record_validated_packages(validated_packages):
+    # Record the packages of the directory validated by opm
+    def _run_cmd(cmd, exc_msg):
+        validated_packages.append(sorted(os.listdir(cmd[2])))
+
+    return _run_cmd
+
+
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_opm_validate(mock_run_cmd, validate_catalog_dir):
+    validated_packages = []
+    mock_run_cmd.side_effect = _record_validated_packages(validated_packages)
+
+    opm_operations.opm_validate(str(validate_catalog_dir))
+    opm_operations.opm_validate(str(validate_catalog_dir))
+
+    # The packages are only validated once
+    mock_run_cmd.assert_called_once_with(
+        [opm_operations.Opm.opm_version, 'validate', str(validate_catalog_dir)],
+        exc_msg=f'Failed to validate the content from config_dir {validate_catalog_dir}',
+    )
+
+    validate_catalog_dir.join('foo', 'catalog.json').write(
+        json.dumps({'schema': 'olm.package', 'name': 'foo', 'description': 'changed'})
+    )
+    opm_operations.opm_validate(str(validate_catalog_dir))
+    # The deprecations of baz are validated with it
+    validate_catalog_dir.join('baz', 'catalog.json').write(
+        json.dumps({'schema': 'olm.package', 'name': 'baz', 'description': 'changed'})
+    )
+    opm_operations.opm_validate(str(validate_catalog_dir))
+
+    assert validated_packages == [
+        ['bar', 'baz', 'deprecations', 'foo'],
+        ['foo'],
+        ['baz', 'deprecations'],
+    ]
+
+
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_opm_validate_failed(mock_run_cmd, validate_catalog_dir):
+    mock_run_cmd.side_effect = IIBError('Failed to validate the content')
+
+    for _ in range(2):
+        with pytest.raises(IIBError, match='Failed to validate the content'):
+            opm_operations.opm_validate(str(validate_catalog_dir))
+
+    # The packages which failed the validation are not recorded
+    assert mock_run_cmd.call_count == 2
+
+
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_opm_validate_requiring_opm(mock_run_cmd, validate_catalog_dir):
+    validated_packages = []
+    mock_run_cmd.side_effect = _record_validated_packages(validated_packages)
+    opm_operations.opm_validate(str(validate_catalog_dir))
+    validate_catalog_dir.join('foo', 'catalog.yaml').write('schema: olm.package')
+
+    opm_operations.opm_validate(str(validate_catalog_dir))
+
+    # The packages of the YAML files are unknown, so the whole catalog is validated again
+    assert validated_packages == [['bar', 'baz', 'deprecations', 'foo']] * 2
+
+
+@pytest.mark.parametrize(
+    'opm_version, expected_validated_packages',
+    (('1.26.4', [['foo']]), ('1.26.3', [['bar', 'baz', 'deprecations', 'foo']])),
+)
+@mock.patch('iib.workers.tasks.opm_operations.get_validated_packages')
+@mock.patch('iib.workers.tasks.build._copy_files_from_image')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.get_opm_version_number', return_value='1.26.4')
+def test_opm_validate_from_index(
+    mock_govn,
+    mock_run_cmd,
+    mock_cffi,
+    mock_gvp,
+    opm_version,
+    expected_validated_packages,
+    validate_catalog_dir,
+):
+    validated_packages = []
+    mock_run_cmd.side_effect = _record_validated_packages(validated_packages)
+    digests = get_catalog_package_digests(str(validate_catalog_dir))
+    # The packages validated when building the index image by another version of opm are unknown
+    mock_gvp.side_effect = lambda index_image, version: (
+        {
+            digests['bar']: ['bar'],
+            digests['baz']: ['baz'],
+            digests['deprecations']: ['baz'],
+        }
+        if version == opm_version
+        else {}
+    )
+
+    for _ in range(2):
+        opm_operations.opm_validate(str(validate_catalog_dir), from_index='from-index@sha256:123')
+
+    assert validated_packages == expected_validated_packages
+    # The validated packages of the index image are only looked up once during the request, and
+    # never read from the index image itself
+    mock_gvp.assert_called_once_with('from-index@sha256:123', '1.26.4')
+    mock_cffi.assert_not_called()
+
+
+@pytest.mark.parametrize('memo_dir', ('/var/cache/iib-build-memo', None))
+@mock.patch('iib.workers.tasks.opm_operations.memoize_validated_packages')
+@mock.patch('iib.workers.tasks.utils.get_resolved_pushed_image')
+@mock.patch('iib.workers.tasks.opm_operations.get_worker_config')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.get_opm_version_number', return_value='1.26.4')
+@mock.patch('iib.workers.tasks.opm_operations.get_opm_port_stacks', return_value=([None], []))
+def test_generate_cache_locally_validated_packages(
+    mock_gops,
+    mock_govn,
+    mock_cmd,
+    mock_gwc,
+    mock_grpi,
+    mock_mvp,
+    memo_dir,
+    validate_catalog_dir,
+    tmpdir,
+):
+    mock_gwc.return_value = {'iib_build_memo_dir': memo_dir}
+    mock_grpi.return_value = 'quay.io/iib/iib-build@sha256:456'
+    local_cache_path = os.path.join(tmpdir, 'cache')
+    opm_operations.opm_validate(str(validate_catalog_dir))
+    validate_catalog_dir.join('foo', 'catalog.json').write('{"schema": "olm.package"}')
+    mock_cmd.side_effect = _generate_opm_cache
+
+    opm_operations.generate_cache_locally(tmpdir, str(validate_catalog_dir), local_cache_path)
+    for _ in range(2):
+        opm_operations.memoize_retained_validated_packages('quay.io/iib/iib-build:3')
+
+    with open(os.path.join(local_cache_path, opm_operations.CACHE_MANIFEST_FILE), 'r') as f:
+        assert 'validated_packages' not in json.load(f)
+    if not memo_dir:
+        mock_grpi.assert_not_called()
+        mock_mvp.assert_not_called()
+        return
+    # Only the packages validated in their current state are recorded, once
+    mock_grpi.assert_called_once_with('quay.io/iib/iib-build:3')
+    digests = get_catalog_package_digests(str(validate_catalog_dir))
+    mock_mvp.assert_called_once_with(
+        'quay.io/iib/iib-build@sha256:456',
+        '1.26.4',
+        {
+            digests['bar']: ['bar'],
+            digests['baz']: ['baz'],
+            digests['deprecations']: ['baz'],
+        },
+    )
 
 
 @pytest.mark.parametrize(
     'operators_exists, index_db_path',
     [(['test-operator'], "index_path"), ([], "index_path")],
 )
+@mock.patch('iib.workers.tasks.opm_operations.get_catalog_package_digests')
 @mock.patch('iib.workers.tasks.opm_operations.create_dockerfile')
 @mock.patch('iib.workers.tasks.opm_operations.generate_cache_locally')
 @mock.patch('iib.workers.tasks.opm_operations.shutil.copytree')
@@ -845,6 +1287,7 @@ def test_opm_registry_add_fbc_fragment(
     mock_cpt,
     mock_gcc,
     mock_ogd,
+    mock_gcpd,
     operators_exists,
     index_db_path,
     tmpdir,
@@ -908,7 +1351,9 @@ def test_opm_registry_add_fbc_fragment(
         mock_orr.assert_called_with(
             index_db_path=index_db_path, operators=fbc_fragment_operators, base_dir=tmpdir
         )
-        mock_om.assert_called_with(index_db=index_db_path, base_dir=tmpdir, generate_cache=False)
+        mock_om.assert_called_with(
+            index_db=index_db_path, base_dir=tmpdir, generate_cache=False, from_index=from_index
+        )
         mock_cpt.assert_has_calls(
             [
                 mock.call(
@@ -939,7 +1384,14 @@ def test_opm_registry_add_fbc_fragment(
             )
         ]
     )
-    mock_gcc.assert_called_once()
+    mock_gcpd.assert_called_once_with(configs_dir)
+    mock_gcc.assert_called_once_with(
+        base_dir=tmpdir,
+        fbc_dir=configs_dir,
+        local_cache_path=os.path.join(tmpdir, 'cache'),
+        from_index=from_index,
+        from_index_packages=mock_gcpd.return_value,
+    )
     mock_ogd.assert_called_once()
 
 
@@ -1211,7 +1663,7 @@ def test__get_olm_package_version_raise():
 
 
 @mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
-@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
 @mock.patch.object(opm_operations.Opm, 'opm_version', 'opm-v1.26.8')
 def test_get_list_bundles(mock_run_cmd, mock_gidp, tmpdir):
     input_image = 'registry.example.com/example_operator:tag'
@@ -1279,7 +1731,7 @@ def test_get_list_bundles(mock_run_cmd, mock_gidp, tmpdir):
 }
     """
 
-    mock_run_cmd.return_value = opm_render_output
+    mock_run_cmd.return_value = iter(opm_render_output.splitlines(keepends=True))
 
     bundles = get_list_bundles(input_data=input_image, base_dir=tmpdir)
 
@@ -1305,7 +1757,7 @@ def test_get_list_bundles(mock_run_cmd, mock_gidp, tmpdir):
 
 
 @mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
-@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
 @mock.patch.object(opm_operations.Opm, 'opm_version', 'opm-v1.26.8')
 def test_get_operator_package_list(mock_run_cmd, mock_gidp, tmpdir):
     input_image = 'registry.example.com/example_operator:tag'
@@ -1352,7 +1804,7 @@ def test_get_operator_package_list(mock_run_cmd, mock_gidp, tmpdir):
 }
     """
 
-    mock_run_cmd.return_value = opm_render_output
+    mock_run_cmd.return_value = iter(opm_render_output.splitlines(keepends=True))
     packages = get_operator_package_list(input_image_or_path=input_image, base_dir=tmpdir)
 
     assert packages == ['example-operator']
@@ -1361,3 +1813,43 @@ def test_get_operator_package_list(mock_run_cmd, mock_gidp, tmpdir):
         {'cwd': tmpdir},
         exc_msg=f'Failed to run opm render with input: {input_image}',
     )
+
+
+@pytest.mark.parametrize(
+    'schemas, expected',
+    (
+        (None, ['olm.package', 'olm.bundle', 'olm.bundle']),
+        ({'olm.bundle'}, ['olm.bundle', 'olm.bundle']),
+        ({'olm.channel'}, []),
+    ),
+)
+@mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
+def test_opm_render_schemas(mock_run_cmd, mock_gidp, schemas, expected, tmpdir):
+    mock_gidp.return_value = '/tmp/path'
+    mock_run_cmd.return_value = iter(
+        [
+            '{\n',
+            '    "schema": "olm.package"\n',
+            '}\n',
+            '{"schema": "olm.bundle"}\n',
+            '{"schema": "olm.bundle"}\n',
+        ]
+    )
+
+    rendered = opm_render('some-index:latest', tmpdir, schemas=schemas)
+
+    assert [blob['schema'] for blob in rendered] == expected
+
+
+@mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
+def test_opm_render_invalid_output(mock_run_cmd, mock_gidp, tmpdir):
+    mock_gidp.return_value = '/tmp/path'
+    mock_run_cmd.return_value = iter(['{"schema": "olm.bundle"}\n', 'time="2024" level=info\n'])
+
+    with pytest.raises(
+        IIBError,
+        match='Failed to run opm render with input: some-index:latest: the output is not valid',
+    ):
+        list(opm_render('some-index:latest', tmpdir))
@@ -1,16 +1,25 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+import collections
 import hashlib
 import json
 import logging
 import os
+import sqlite3
 import stat
 import subprocess
 import textwrap
+import threading
 from unittest import mock
 
 import pytest
 
-from iib.exceptions import ExternalServiceError, IIBError
+from iib.common.common_utils import get_binary_versions
+from iib.exceptions import (
+    ExternalServiceError,
+    IIBError,
+    RegistryAuthenticationError,
+    RegistryAvailabilityError,
+)
 from iib.workers.config import get_worker_config
 from iib.workers.tasks import utils
 
@@ -28,8 +37,15 @@ def test_get_image_labels(mock_si):
 @mock.patch('os.remove')
 @mock.patch('os.path.exists')
 @mock.patch('os.symlink')
+@mock.patch('iib.workers.tasks.utils.invalidate_tag_cache')
 def test_reset_docker_config(
-    mock_symlink, mock_exists, mock_remove, mock_expanduser, config_exists, template_exists
+    mock_itc,
+    mock_symlink,
+    mock_exists,
+    mock_remove,
+    mock_expanduser,
+    config_exists,
+    template_exists,
 ):
     mock_expanduser.return_value = '/home/iib-worker'
     if not config_exists:
@@ -38,6 +54,7 @@ def test_reset_docker_config(
 
     utils.reset_docker_config()
 
+    mock_itc.assert_called_once_with()
     mock_remove.assert_called_once_with('/home/iib-worker/.docker/config.json')
     if template_exists:
         mock_symlink.assert_called_once_with(
@@ -138,6 +155,39 @@ def test_set_registry_token_registry_only_auth_key(
     mock_rdc.assert_called_once_with()
 
 
+@mock.patch('os.path.expanduser')
+@mock.patch('os.remove')
+@mock.patch('os.path.exists', return_value=True)
+@mock.patch('iib.workers.tasks.utils.open')
+@mock.patch('iib.workers.tasks.utils.json.dump')
+@mock.patch('iib.workers.tasks.utils.reset_docker_config')
+def test_set_registry_token_multiple_images(
+    mock_rdc,
+    mock_json_dump,
+    mock_open,
+    mock_exists,
+    mock_remove,
+    mock_expanduser,
+):
+    mock_expanduser.return_value = '/home/iib-worker'
+    mock_open.side_effect = mock.mock_open(
+        read_data=r'{"auths": {"quay.io": {"auth": "cXVheV90b2tlbg=="}}}'
+    )
+
+    with utils.set_registry_token(
+        'user:pass', ['quay.io/ns/fragment1:v1', 'quay.io/ns/fragment2:v1'], append=True
+    ):
+        pass
+
+    mock_json_dump.assert_called_once()
+    assert mock_json_dump.call_args[0][0]['auths'] == {
+        'quay.io': {'auth': 'cXVheV90b2tlbg=='},
+        'quay.io/ns/fragment1': {'auth': 'dXNlcjpwYXNz'},
+        'quay.io/ns/fragment2': {'auth': 'dXNlcjpwYXNz'},
+    }
+    mock_rdc.assert_called_once_with()
+
+
 @pytest.mark.parametrize(
     'container_image, expected_auth_key',
     (
@@ -207,9 +257,11 @@ def test_docker_auth_key_for_image_namespace_without_registry(mock_parse):
 @mock.patch('os.path.exists')
 @mock.patch('iib.workers.tasks.utils.open')
 @mock.patch('iib.workers.tasks.utils.json.dump')
+@mock.patch('iib.workers.tasks.utils.invalidate_tag_cache')
 @mock.patch('iib.workers.tasks.utils.reset_docker_config')
 def test_set_registry_auths(
     mock_rdc,
+    mock_itc,
     mock_json_dump,
     mock_open,
     mock_exists,
@@ -238,7 +290,8 @@ def test_set_registry_auths(
         }
     }
     with utils.set_registry_auths(registry_auths):
-        pass
+        # The lookups of images by tag made with the previous credentials are forgotten
+        mock_itc.assert_called_once_with()
 
     mock_remove.assert_called_once_with('/home/iib-worker/.docker/config.json')
     if template_exists:
@@ -346,6 +399,34 @@ def test_run_cmd_failed(mock_sub_run, exc_msg):
     mock_sub_run.assert_called_once()
 
 
+def test_run_cmd_stream():
+    lines = utils.run_cmd_stream(['sh', '-c', 'echo hello; echo world'])
+
+    assert list(lines) == ['hello\n', 'world\n']
+
+
+def test_run_cmd_stream_failed():
+    lines = utils.run_cmd_stream(
+        ['sh', '-c', 'echo hello; echo "some failure" >&2; exit 1'], exc_msg='Failed to say hello'
+    )
+
+    assert next(lines) == 'hello\n'
+    # The failure is raised once the whole output was read
+    with pytest.raises(IIBError, match='Failed to say hello'):
+        next(lines)
+
+
+@mock.patch('iib.workers.tasks.utils.terminate_process')
+def test_run_cmd_stream_closed(mock_terminate):
+    mock_terminate.side_effect = lambda proc: proc.kill()
+    lines = utils.run_cmd_stream(['sh', '-c', 'echo hello; sleep 60'])
+
+    assert next(lines) == 'hello\n'
+    lines.close()
+
+    mock_terminate.assert_called_once()
+
+
 @mock.patch('iib.workers.tasks.utils.subprocess.run')
 def test_run_cmd_failed_opm(mock_sub_run):
     mock_rv = mock.Mock()
@@ -473,6 +554,50 @@ def test_run_cmd_failed_buildah(mock_sub_run, expected_exc, subprocess_stderr):
     mock_sub_run.assert_called_once()
 
 
+@pytest.mark.parametrize(
+    'stderr, expected_exc',
+    (
+        (
+            'time="2024-04-25T15:46:56Z" level=fatal msg="Error parsing image name '
+            '\\"docker://quay.io/ns/image:v1\\": reading manifest v1 in quay.io/ns/image: '
+            'received unexpected HTTP status: 502 Bad Gateway"',
+            RegistryAvailabilityError,
+        ),
+        ('Error: 503 Service Unavailable', RegistryAvailabilityError),
+        ('Error: toomanyrequests: Rate exceeded', RegistryAvailabilityError),
+        (
+            'Error: pinging container registry quay.io: Get "https://quay.io/v2/": '
+            'dial tcp 10.0.0.1:443: i/o timeout',
+            RegistryAvailabilityError,
+        ),
+        (
+            'Error: reading manifest v1 in quay.io/ns/image: manifest unknown: manifest unknown',
+            IIBError,
+        ),
+        (
+            'Error: reading manifest v1 in quay.io/ns/image: unauthorized: access to the '
+            'requested resource is not authorized',
+            RegistryAuthenticationError,
+        ),
+        (
+            'Error: writing manifest: denied: requested access to the resource is denied',
+            RegistryAuthenticationError,
+        ),
+    ),
+)
+@mock.patch('iib.workers.tasks.utils.subprocess.run')
+def test_run_cmd_failed_registry_availability(mock_sub_run, stderr, expected_exc):
+    mock_sub_run.return_value = mock.Mock(returncode=1, stderr=stderr)
+
+    with pytest.raises(IIBError, match='Failed to inspect the image') as exc_info:
+        utils.run_cmd(
+            ['skopeo', 'inspect', 'docker://quay.io/ns/image:v1'],
+            exc_msg='Failed to inspect the image',
+        )
+
+    assert type(exc_info.value) is expected_exc
+
+
 @mock.patch('iib.workers.tasks.utils.subprocess.run')
 def test_run_cmd_failed_buildah_manifest_rm(mock_sub_run):
     mock_rv = mock.Mock()
@@ -578,6 +703,69 @@ def test_skopeo_inspect(mock_run_cmd):
     assert skopeo_args == expected
 
 
+@pytest.mark.parametrize(
+    'args, expected',
+    (
+        (('docker://some-image:latest', '--raw'), {'schemaVersion': 2}),
+        (('--config', 'docker://some-image:latest'), {'config': {'Labels': {'a': 'b'}}}),
+    ),
+)
+@mock.patch('iib.workers.tasks.utils.get_worker_config')
+@mock.patch('iib.workers.tasks.utils.get_registry_client')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_skopeo_inspect_registry_client(mock_run_cmd, mock_grc, mock_gwc, args, expected):
+    mock_gwc.return_value = mock.Mock(iib_registry_client='native', iib_skopeo_timeout='300s')
+    mock_grc.return_value.get_manifest.return_value.raw = '{"schemaVersion": 2}'
+    mock_grc.return_value.get_image_config.return_value = {'config': {'Labels': {'a': 'b'}}}
+    rv = utils.skopeo_inspect(*args)
+
+    assert rv == expected
+    mock_run_cmd.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    'args',
+    (
+        ('docker://some-image:latest',),
+        ('containers-storage:some-image:latest', '--config'),
+        ('docker://some-image:latest', '--config'),
+    ),
+)
+@mock.patch('iib.workers.tasks.utils.get_worker_config')
+@mock.patch('iib.workers.tasks.utils.get_registry_client')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_skopeo_inspect_registry_client_fallback(mock_run_cmd, mock_grc, mock_gwc, args):
+    mock_gwc.return_value = mock.Mock(iib_registry_client='native', iib_skopeo_timeout='300s')
+    # Schema 1 images have no image config
+    mock_grc.return_value.get_image_config.return_value = None
+    mock_run_cmd.return_value = '{"Name": "some-image"}'
+    rv = utils.skopeo_inspect(*args)
+
+    assert rv == {"Name": "some-image"}
+    assert mock_run_cmd.call_args[0][0] == ['skopeo', '--command-timeout', '300s', 'inspect'] + [
+        *args
+    ]
+
+
+@mock.patch('iib.workers.registry_resilience.random.uniform', return_value=0)
+@mock.patch('iib.workers.tasks.utils.subprocess.run')
+def test_skopeo_inspect_missing_image_keeps_registry_available(mock_sub_run, mock_uniform):
+    def _skopeo_inspect(cmd, **kwargs):
+        if cmd[-1] == 'docker://quay.io/ns/missing:v1':
+            return mock.Mock(returncode=1, stderr='Error: manifest unknown: manifest unknown')
+        return mock.Mock(returncode=0, stdout='{"Name": "image"}')
+
+    mock_sub_run.side_effect = _skopeo_inspect
+    for i in range(5):
+        utils.skopeo_inspect(f'docker://quay.io/ns/image:v{i}')
+    with pytest.raises(IIBError, match='Failed to inspect docker://quay.io/ns/missing:v1'):
+        utils.skopeo_inspect('docker://quay.io/ns/missing:v1')
+
+    # The missing image was retried, but the registry is still considered available
+    assert mock_sub_run.call_count == 10
+    assert utils.skopeo_inspect('docker://quay.io/ns/image:v5') == {'Name': 'image'}
+
+
 @mock.patch('iib.workers.tasks.utils.run_cmd')
 def test_podman_pull(mock_run_cmd):
     image = 'some-image:latest'
@@ -594,6 +782,27 @@ def test_podman_pull_wait_retry(mock_run_cmd):
     assert mock_run_cmd.call_count == 2
 
 
+@mock.patch('iib.workers.tasks.utils._recent_from_index_images', new_callable=collections.deque)
+@mock.patch('iib.workers.tasks.utils._pinned_images', new_callable=set)
+@mock.patch('iib.workers.tasks.utils._image_usage', new_callable=dict)
+@mock.patch('iib.workers.tasks.utils.get_worker_config')
+def test_record_image_use(mock_gwc, mock_usage, mock_pinned, mock_recent):
+    mock_gwc.return_value = mock.Mock(iib_image_gc_recent_from_index=2)
+    utils.record_image_use('docker://quay.io/ns/opm:v4.15', pin=True)
+    for index in ('index@sha256:1', 'index@sha256:2', 'index@sha256:1', 'index@sha256:3'):
+        utils.record_image_use(f'quay.io/ns/{index}', from_index=True)
+
+    usage, pinned = utils.get_image_usage()
+
+    assert len(usage) == 4
+    # Only the two most recently used index images are kept
+    assert pinned == {
+        'quay.io/ns/opm:v4.15',
+        'quay.io/ns/index@sha256:1',
+        'quay.io/ns/index@sha256:3',
+    }
+
+
 @mock.patch('iib.workers.tasks.utils.run_cmd')
 @mock.patch('iib.workers.tasks.utils.upload_file_to_s3_bucket')
 def test_request_logger(mock_ufts3b, mock_runcmd, tmpdir):
@@ -626,20 +835,49 @@ def test_request_logger(mock_ufts3b, mock_runcmd, tmpdir):
         ' iib.workers.tasks.utils MainProcess request-{rid} '
         'INFO test_utils.mock_handler this is a test\n'
     )
+    expected_cache_messages = (
+        ' iib.workers.tasks.utils MainProcess request-{rid} INFO utils.wrapper '
+        'Image inspection cache: local_hits=0, shared_hits=0, tag_hits=0, misses=0',
+        ' iib.workers.tasks.utils MainProcess request-{rid} INFO utils.wrapper '
+        'Artifact cache: hits=0, misses=0, evictions=0',
+    )
 
     mock_handler('spam', 'eggs', 123, 'bacon')
-    assert logs_dir.join('123.log').read().endswith(expected_message.format(rid=123))
+    request_log = logs_dir.join('123.log').read()
+    assert expected_message.format(rid=123) in request_log
+    for line, expected_cache_message in zip(request_log.splitlines()[-2:], expected_cache_messages):
+        assert line.endswith(expected_cache_message.format(rid=123))
     assert original_handlers_count == len(logging.getLogger().handlers)
     mock_ufts3b.assert_called_with(f'{logs_dir}/123.log', 'request_logs', '123.log')
 
     mock_handler('spam', 'eggs', bacon='bacon', request_id=321)
-    assert logs_dir.join('321.log').read().endswith(expected_message.format(rid=321))
+    request_log = logs_dir.join('321.log').read()
+    assert expected_message.format(rid=321) in request_log
+    for line, expected_cache_message in zip(request_log.splitlines()[-2:], expected_cache_messages):
+        assert line.endswith(expected_cache_message.format(rid=321))
     assert original_handlers_count == len(logging.getLogger().handlers)
     mock_ufts3b.assert_called_with(f'{logs_dir}/321.log', 'request_logs', '321.log')
 
     assert mock_ufts3b.call_count == 2
 
 
+@mock.patch('iib.common.common_utils.get_worker_config')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_get_binary_versions_cached(mock_run_cmd, mock_gwc):
+    mock_gwc.return_value = {'iib_default_opm': 'opm', 'iib_ocp_opm_mapping': None}
+    mock_run_cmd.return_value = 'version 1.0\n'
+
+    assert get_binary_versions() == {
+        'opm': ['version 1.0'],
+        'podman': 'version 1.0',
+        'buildah': 'version 1.0',
+    }
+    assert get_binary_versions() is get_binary_versions()
+
+    # The binaries are only run on the first call of the process
+    assert mock_run_cmd.call_count == 3
+
+
 def test_request_logger_no_request_id(tmpdir):
     logs_dir = tmpdir.join('logs')
     logs_dir.mkdir()
@@ -827,6 +1065,24 @@ def test_get_resolved_image(mock_si, pull_spec, expected):
     assert rv == expected
 
 
+@pytest.mark.parametrize('pushed', (True, False))
+@mock.patch('iib.workers.tasks.utils.get_resolved_image')
+@mock.patch('iib.workers.tasks.utils.get_registry_client')
+def test_get_resolved_pushed_image(mock_grc, mock_gri, pushed):
+    pushed_manifest = mock.Mock(digest='sha256:123456')
+    mock_grc.return_value.get_pushed_manifest.return_value = pushed_manifest if pushed else None
+    mock_gri.return_value = 'registry:8443/iib-build@sha256:abcdef'
+
+    rv = utils.get_resolved_pushed_image('registry:8443/iib-build:3')
+
+    if pushed:
+        assert rv == 'registry:8443/iib-build@sha256:123456'
+        mock_gri.assert_not_called()
+    else:
+        assert rv == 'registry:8443/iib-build@sha256:abcdef'
+        mock_gri.assert_called_once_with('registry:8443/iib-build:3')
+
+
 @mock.patch('iib.workers.tasks.utils.skopeo_inspect')
 def test_get_resolved_image_manifest_list(mock_si):
     mock_si.return_value = (
@@ -938,6 +1194,70 @@ def test_get_resolved_bundles_success(mock_si, mock_gri, skopeo_inspect_rv, expe
     assert response == expected_response
 
 
+@mock.patch('iib.workers.tasks.utils._get_resolved_bundle')
+def test_get_resolved_bundles_keeps_order(mock_grb):
+    resolved = {
+        'quay.io/ns/bundle1:1': 'quay.io/ns/bundle1@sha256:111',
+        'quay.io/ns/bundle2:2': 'quay.io/ns/bundle2@sha256:222',
+        'registry.example.com/ns/bundle3:3': 'registry.example.com/ns/bundle3@sha256:333',
+        'quay.io/ns/bundle1:latest': 'quay.io/ns/bundle1@sha256:111',
+    }
+    mock_grb.side_effect = lambda pull_spec: resolved[pull_spec]
+
+    response = utils.get_resolved_bundles(list(resolved) + ['quay.io/ns/bundle2:2'])
+
+    assert response == [
+        'quay.io/ns/bundle1@sha256:111',
+        'quay.io/ns/bundle2@sha256:222',
+        'registry.example.com/ns/bundle3@sha256:333',
+    ]
+    assert mock_grb.call_count == 4
+
+
+@mock.patch('iib.workers.tasks.utils.get_worker_config')
+def test_map_images_concurrently_registry_limit(mock_gwc):
+    mock_gwc.return_value = mock.Mock(
+        iib_image_resolution_max_workers=8, iib_image_resolution_registry_limit=2
+    )
+    lock = threading.Lock()
+    running = collections.Counter()
+    max_running = collections.Counter()
+
+    def _func(pull_spec):
+        registry = pull_spec.split('/', 1)[0]
+        with lock:
+            running[registry] += 1
+            max_running[registry] = max(max_running[registry], running[registry])
+        threading.Event().wait(0.05)
+        with lock:
+            running[registry] -= 1
+        return pull_spec.upper()
+
+    pull_specs = [f'quay.io/ns/repo{i}:1' for i in range(6)] + [
+        f'registry.example.com/ns/repo{i}:1' for i in range(6)
+    ]
+    assert utils.map_images_concurrently(pull_specs, _func) == [p.upper() for p in pull_specs]
+    assert max_running['quay.io'] <= 2
+    assert max_running['registry.example.com'] <= 2
+    assert sum(max_running.values()) > 2
+
+
+@mock.patch('iib.workers.tasks.utils._get_resolved_bundle')
+def test_get_resolved_bundles_first_failure_raised(mock_grb):
+    def _resolve(pull_spec):
+        if pull_spec.endswith(':1'):
+            threading.Event().wait(0.05)
+            raise IIBError(f'failed {pull_spec}')
+        if pull_spec.endswith(':2'):
+            raise IIBError(f'failed {pull_spec}')
+        return pull_spec
+
+    mock_grb.side_effect = _resolve
+
+    with pytest.raises(IIBError, match='failed quay.io/ns/repo:1'):
+        utils.get_resolved_bundles(['quay.io/ns/repo:0', 'quay.io/ns/repo:1', 'quay.io/ns/repo:2'])
+
+
 @mock.patch('iib.workers.tasks.utils.skopeo_inspect')
 def test_get_resolved_bundles_failure(mock_si):
     skopeo_inspect_rv = {
@@ -992,12 +1312,13 @@ def testget_bundles_from_deprecation_list(mock_grb):
 
 @mock.patch('iib.workers.tasks.utils.get_image_label')
 def test_get_operator_packages_from_deprecation_list(mock_get_image_label):
-    mock_get_image_label.side_effect = ['safe-operator', 'unsafe/../op', '']
     deprecation_list = [
         'quay.io/bundle1@sha256:123',
         'quay.io/bundle2@sha256:456',
         'quay.io/bundle3@sha256:789',
     ]
+    labels = dict(zip(deprecation_list, ['safe-operator', 'unsafe/../op', '']))
+    mock_get_image_label.side_effect = lambda pull_spec, label: labels[pull_spec]
 
     operator_packages = utils.get_operator_packages_from_deprecation_list(deprecation_list)
 
@@ -1048,34 +1369,72 @@ def test_chmod_recursiverly(tmpdir):
 
 @mock.patch('iib.workers.tasks.utils.skopeo_inspect')
 def test_get_image_arches(mock_si):
-    mock_si.return_value = {
-        'mediaType': 'application/vnd.docker.distribution.manifest.list.v2+json',
-        'manifests': [
-            {'platform': {'architecture': 'amd64'}},
-            {'platform': {'architecture': 's390x'}},
-        ],
-    }
+    mock_si.return_value = json.dumps(
+        {
+            'schemaVersion': 2,
+            'mediaType': 'application/vnd.docker.distribution.manifest.list.v2+json',
+            'manifests': [
+                {'platform': {'architecture': 'amd64'}},
+                {'platform': {'architecture': 's390x'}},
+            ],
+        }
+    )
     rv = utils.get_image_arches('image:latest')
     assert rv == {'amd64', 's390x'}
+    mock_si.assert_called_once_with('docker://image:latest', '--raw', return_json=False)
 
 
 @mock.patch('iib.workers.tasks.utils.skopeo_inspect')
 def test_get_image_arches_manifest(mock_si):
-    mock_si.side_effect = [
-        {'mediaType': 'application/vnd.docker.distribution.manifest.v2+json'},
-        {'architecture': 'amd64'},
-    ]
+    raw_manifest = json.dumps(
+        {'schemaVersion': 2, 'mediaType': 'application/vnd.docker.distribution.manifest.v2+json'}
+    )
+    digest = hashlib.sha256(raw_manifest.encode('utf-8')).hexdigest()
+    mock_si.side_effect = [raw_manifest, {'architecture': 'amd64'}]
     rv = utils.get_image_arches('image:latest')
     assert rv == {'amd64'}
+    mock_si.assert_called_with(f'docker://image@sha256:{digest}', '--config')
 
 
 @mock.patch('iib.workers.tasks.utils.skopeo_inspect')
 def test_get_image_arches_not_manifest_list(mock_si):
-    mock_si.return_value = {'mediaType': 'application/vnd.docker.distribution.notmanifest.v2+json'}
+    mock_si.return_value = json.dumps(
+        {'schemaVersion': 2, 'mediaType': 'application/vnd.docker.distribution.notmanifest.v2+json'}
+    )
     with pytest.raises(IIBError, match='.+is neither a v2 manifest list nor a v2 manifest'):
         utils.get_image_arches('image:latest')
 
 
+@mock.patch('iib.workers.tasks.utils.skopeo_inspect')
+def test_image_metadata_fetched_once_per_digest(mock_si):
+    raw_manifest = json.dumps(
+        {'schemaVersion': 2, 'mediaType': 'application/vnd.docker.distribution.manifest.v2+json'}
+    )
+    digest = hashlib.sha256(raw_manifest.encode('utf-8')).hexdigest()
+    resolved = f'quay.io/ns/index@sha256:{digest}'
+    mock_si.side_effect = [
+        raw_manifest,
+        {'architecture': 'amd64', 'config': {'Labels': {'version': 'v4.15', 'scope': 'prod'}}},
+    ]
+
+    info = utils.get_index_image_info(None, 'quay.io/ns/index:v4.15')
+    assert info['resolved_from_index'] == resolved
+    assert info['arches'] == {'amd64'}
+    assert utils.get_image_label(resolved, 'version') == 'v4.15'
+    assert utils.get_image_labels(f'docker://{resolved}') == {'version': 'v4.15', 'scope': 'prod'}
+    assert mock_si.call_count == 2
+
+    # Tags are always resolved again
+    mock_si.side_effect = [raw_manifest]
+    assert utils.get_resolved_image('quay.io/ns/index:v4.15') == resolved
+    assert mock_si.call_count == 3
+
+    utils.clear_image_metadata()
+    mock_si.side_effect = [{'config': {'Labels': {'version': 'v4.16'}}}]
+    assert utils.get_image_label(resolved, 'version') == 'v4.16'
+    assert mock_si.call_count == 4
+
+
 @pytest.mark.parametrize('label, expected', (('some_label', 'value'), ('not_there', '')))
 @mock.patch('iib.workers.tasks.utils.skopeo_inspect')
 def test_get_image_label(mock_si, label, expected):
@@ -1485,6 +1844,48 @@ def test_prepare_request_for_build_binaryless_invalid_conditions(
         )
 
 
+@mock.patch('iib.workers.tasks.utils.set_request_state')
+@mock.patch('iib.workers.tasks.utils.get_index_image_info')
+@mock.patch('iib.workers.tasks.utils.get_resolved_image')
+@mock.patch('iib.workers.tasks.utils.get_image_arches')
+def test_prepare_request_for_build_fingerprint(mock_gia, mock_gri, mock_giii, mock_srs):
+    mock_giii.return_value = {
+        'resolved_from_index': 'some-index@sha256:bcdefg',
+        'ocp_version': 'v4.5',
+        'arches': {'amd64', 's390x'},
+        'resolved_distribution_scope': 'prod',
+    }
+    mock_gri.return_value = 'binary-image@sha256:abcdef'
+    mock_gia.return_value = {'amd64', 's390x'}
+
+    def _prepare(build_inputs):
+        return utils.prepare_request_for_build(
+            1,
+            utils.RequestConfigAddRm(
+                _binary_image='binary-image:latest',
+                from_index='some-index:latest',
+                build_inputs=build_inputs,
+            ),
+        )
+
+    rv = _prepare({'request_type': 'rm', 'operators': ['some-operator']})
+
+    assert (
+        rv['build_fingerprint']
+        == _prepare({'operators': ['some-operator'], 'request_type': 'rm'})['build_fingerprint']
+    )
+    assert (
+        rv['build_fingerprint']
+        != _prepare({'request_type': 'rm', 'operators': ['other']})['build_fingerprint']
+    )
+    mock_gri.return_value = 'binary-image@sha256:123456'
+    assert (
+        rv['build_fingerprint']
+        != _prepare({'request_type': 'rm', 'operators': ['some-operator']})['build_fingerprint']
+    )
+    assert 'build_fingerprint' not in _prepare(None)
+
+
 @mock.patch('iib.workers.tasks.utils.set_request_state')
 @mock.patch('iib.workers.tasks.utils.get_resolved_image')
 @mock.patch('iib.workers.tasks.utils.get_image_arches')
@@ -1554,7 +1955,7 @@ def test_get_binary_image_config_no_config_val():
 
 @mock.patch('iib.workers.tasks.utils.get_bundle_json')
 @mock.patch('iib.workers.tasks.utils.get_list_bundles')
-@mock.patch('iib.workers.tasks.utils._add_property_to_index')
+@mock.patch('iib.workers.tasks.utils._add_properties_to_index')
 def test_add_max_ocp_version_property_empty_index(mock_apti, mock_glb, mock_gbj, tmpdir):
     mock_glb.return_value = []
 
@@ -1564,6 +1965,49 @@ def test_add_max_ocp_version_property_empty_index(mock_apti, mock_glb, mock_gbj,
     mock_apti.assert_not_called()
 
 
+@mock.patch('iib.workers.tasks.utils.get_list_bundles')
+@mock.patch('iib.workers.tasks.utils._requires_max_ocp_version')
+def test_add_max_ocp_version_property(mock_rmov, mock_glb, tmpdir):
+    db_path = os.path.join(tmpdir, get_worker_config()['temp_index_db_path'])
+    os.makedirs(os.path.dirname(db_path))
+    con = sqlite3.connect(db_path)
+    con.executescript(
+        '''
+        CREATE TABLE operatorbundle (name TEXT PRIMARY KEY, bundlepath TEXT, version TEXT);
+        CREATE TABLE channel_entry (channel_name TEXT, package_name TEXT, operatorbundle_name TEXT);
+        CREATE TABLE properties (
+            type TEXT, value TEXT, operatorbundle_name TEXT, operatorbundle_version TEXT,
+            operatorbundle_path TEXT
+        );
+        INSERT INTO operatorbundle VALUES
+            ('foo.v1', 'quay.io/ns/foo-bundle@sha256:1', '1.0.0'),
+            ('foo.v2', 'quay.io/ns/foo-bundle@sha256:2', '2.0.0'),
+            ('bar.v1', 'quay.io/ns/bar-bundle@sha256:1', '1.0.0');
+        INSERT INTO channel_entry VALUES
+            ('stable', 'foo', 'foo.v1'), ('stable', 'foo', 'foo.v2'), ('stable', 'bar', 'bar.v1');
+        '''
+    )
+    con.commit()
+    con.close()
+    mock_rmov.side_effect = lambda bundle: bundle != 'quay.io/ns/foo-bundle@sha256:2'
+
+    utils.add_max_ocp_version_property(
+        ['quay.io/ns/foo-bundle@sha256:1', 'quay.io/ns/foo-bundle@sha256:2'], tmpdir
+    )
+
+    # Only the bundles of the request are read from the index database and validated
+    mock_glb.assert_not_called()
+    assert sorted(call.args[0] for call in mock_rmov.call_args_list) == [
+        'quay.io/ns/foo-bundle@sha256:1',
+        'quay.io/ns/foo-bundle@sha256:2',
+    ]
+    con = sqlite3.connect(db_path)
+    assert con.execute('SELECT * FROM properties').fetchall() == [
+        ('olm.maxOpenShiftVersion', '4.8', 'foo.v1', '1.0.0', 'quay.io/ns/foo-bundle@sha256:1')
+    ]
+    con.close()
+
+
 @mock.patch('os.path.expanduser')
 @mock.patch('os.remove')
 @mock.patch('os.path.exists')